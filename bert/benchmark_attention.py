@@ -0,0 +1,124 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+    Benchmark the full and the blocked attention of BertSelfAttention, forward and backward, for some sequence
+    lengths. Prints the step time, tokens per second, peak device memory when the runtime reports it, and the
+    largest difference between the outputs of both cells.
+    example:
+    python benchmark_attention.py --device_target=Ascend --seq_lengths=128,512,1024 --attention_block_size=128
+"""
+
+import argparse
+import time
+
+import numpy as np
+import mindspore as ms
+import mindspore.common.dtype as mstype
+import mindspore.nn as nn
+from mindspore import context, Tensor
+from mindspore.ops import composite as C
+from mindspore.train.serialization import load_param_into_net
+
+from src.bert_model import BertSelfAttention
+
+
+class ForwardBackward(nn.Cell):
+    """output and input gradients of a cell"""
+    def __init__(self, network):
+        super(ForwardBackward, self).__init__()
+        self.network = network
+        self.grad = C.GradOperation(get_all=True)
+
+    def construct(self, input_tensor, attention_mask):
+        return self.network(input_tensor, attention_mask), self.grad(self.network)(input_tensor, attention_mask)
+
+
+def _reset_peak_memory():
+    hal = getattr(ms, "hal", None)
+    if hal is not None and hasattr(hal, "reset_max_memory_allocated"):
+        hal.reset_max_memory_allocated()
+
+
+def _peak_memory():
+    """peak device memory in MB, None if the runtime does not report it"""
+    hal = getattr(ms, "hal", None)
+    if hal is None or not hasattr(hal, "max_memory_allocated"):
+        return None
+    return hal.max_memory_allocated() / 1024 / 1024
+
+
+def bench_cell(net, inputs, steps):
+    """seconds of one step and peak memory in MB"""
+    _reset_peak_memory()
+    # the first step compiles the graph
+    output = net(*inputs)
+    output[0].asnumpy()
+    start = time.time()
+    for _ in range(steps):
+        output = net(*inputs)
+    output[0].asnumpy()
+    return (time.time() - start) / steps, _peak_memory(), output[0].asnumpy()
+
+
+def main():
+    """compare both attention cells for every sequence length"""
+    parser = argparse.ArgumentParser(description="benchmark bert attention")
+    parser.add_argument("--device_target", type=str, default="Ascend", choices=["Ascend", "GPU", "CPU"])
+    parser.add_argument("--device_id", type=int, default=0)
+    parser.add_argument("--seq_lengths", type=str, default="128,512,1024", help="comma separated sequence lengths")
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--hidden_size", type=int, default=1024)
+    parser.add_argument("--num_attention_heads", type=int, default=16)
+    parser.add_argument("--attention_block_size", type=int, default=128)
+    parser.add_argument("--use_relative_positions", type=str, default="false", choices=["true", "false"])
+    parser.add_argument("--steps", type=int, default=20)
+    args = parser.parse_args()
+
+    context.set_context(mode=context.GRAPH_MODE, device_target=args.device_target, device_id=args.device_id)
+    compute_type = mstype.float32 if args.device_target == "CPU" else mstype.float16
+    use_relative_positions = args.use_relative_positions == "true"
+    rng = np.random.RandomState(0)
+    print("{:>8} {:>10} {:>12} {:>14} {:>12} {:>10}".format("seq_len", "attention", "step (ms)", "tokens/s",
+                                                           "peak (MB)", "max diff"))
+    for seq_length in [int(x) for x in args.seq_lengths.split(",")]:
+        hidden = rng.normal(size=(args.batch_size * seq_length, args.hidden_size)).astype(np.float32)
+        lengths = rng.randint(seq_length // 2, seq_length + 1, size=args.batch_size)
+        mask = (np.arange(seq_length)[None, :] < lengths[:, None]).astype(np.float32)
+        inputs = (Tensor(hidden, compute_type), Tensor(mask.reshape(args.batch_size, 1, seq_length)))
+        outputs = []
+        full_params = None
+        for name, block_size in (("full", 0), ("blocked", args.attention_block_size)):
+            cell = BertSelfAttention(hidden_size=args.hidden_size,
+                                     num_attention_heads=args.num_attention_heads,
+                                     attention_probs_dropout_prob=0.0,
+                                     hidden_dropout_prob=0.0,
+                                     use_relative_positions=use_relative_positions,
+                                     compute_type=compute_type,
+                                     attention_block_size=block_size)
+            if full_params is None:
+                full_params = cell.parameters_dict()
+            else:
+                load_param_into_net(cell, full_params)
+            cell.set_train(True)
+            step_time, peak, output = bench_cell(ForwardBackward(cell), inputs, args.steps)
+            outputs.append(output.astype(np.float32))
+            diff = float(np.abs(outputs[-1] - outputs[0]).max())
+            print("{:>8} {:>10} {:>12.2f} {:>14.0f} {:>12} {:>10.2e}".format(
+                seq_length, name, step_time * 1000, args.batch_size * seq_length / step_time,
+                "-" if peak is None else "{:.0f}".format(peak), diff))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+    Pack the sequences of bert pretraining TFRecords into MindRecord shards for use_packed training.
+    Sequences are bin packed with best fit decreasing on the histogram of their lengths, a pack holds at most
+    max_sequences_per_pack sequences. The packed columns carry the block diagonal attention metadata read by
+    BertModel when use_packed is set:
+        input_mask:              k + 1 on the tokens of the k-th sequence of the pack, 0 on padding
+        masked_lm_weights:       k + 1 on the predictions of the k-th sequence
+        next_sentence_positions: position of the [CLS] token of every sequence
+        next_sentence_labels:    next sentence label of every sequence
+        next_sentence_weights:   1 for every sequence, 0 for unused slots
+    example:
+    python pack_pretrain_data.py --input_dir=/data/tfrecord --output_dir=/data/packed --seq_length=512
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+COLUMNS = ["input_ids", "input_mask", "segment_ids", "next_sentence_labels", "masked_lm_positions",
+           "masked_lm_ids", "masked_lm_weights"]
+
+
+def pack_histogram(histogram, seq_length, max_sequences_per_pack):
+    """
+    Best fit decreasing over a length histogram: from the longest length down, sequences go to the open packs with
+    the least room left that still fits them, the rest open new packs. Packs with the same lengths are kept as one
+    strategy, so the cost does not depend on the number of sequences.
+
+    Args:
+        histogram (numpy.ndarray): Number of sequences of every length, [seq_length + 1].
+        seq_length (int): Tokens of one pack.
+        max_sequences_per_pack (int): Sequences of one pack.
+
+    Returns:
+        dict, lengths of the sequences of a pack -> number of such packs.
+    """
+    # open packs: room left -> {lengths: count}
+    open_packs = {}
+    strategies = {}
+
+    def close_or_open(lengths, count):
+        room = seq_length - sum(lengths)
+        if room == 0 or len(lengths) == max_sequences_per_pack:
+            strategies[lengths] = strategies.get(lengths, 0) + count
+        else:
+            group = open_packs.setdefault(room, {})
+            group[lengths] = group.get(lengths, 0) + count
+
+    for length in range(seq_length, 0, -1):
+        todo = int(histogram[length])
+        while todo > 0:
+            room = next((room for room in range(length, seq_length) if open_packs.get(room)), None)
+            if room is None:
+                close_or_open((length,), todo)
+                break
+            group = open_packs[room]
+            lengths, count = next(iter(group.items()))
+            num = min(todo, count)
+            if num == count:
+                del group[lengths]
+            else:
+                group[lengths] = count - num
+            close_or_open(lengths + (length,), num)
+            todo -= num
+    for group in open_packs.values():
+        for lengths, count in group.items():
+            strategies[lengths] = strategies.get(lengths, 0) + count
+    return strategies
+
+
+def assign_packs(lengths, seq_length, max_sequences_per_pack):
+    """
+    Returns:
+        pack (numpy.ndarray): Pack of every sequence, [N].
+        slot (numpy.ndarray): Position of every sequence in its pack, [N].
+        int, number of packs.
+
+    Raises:
+        ValueError: If a sequence is longer than seq_length.
+    """
+    if lengths.shape[0] and lengths.max() > seq_length:
+        raise ValueError("{} sequences are longer than seq_length {}, the longest has {} tokens.".format(
+            int(np.count_nonzero(lengths > seq_length)), seq_length, int(lengths.max())))
+    histogram = np.bincount(lengths, minlength=seq_length + 1)
+    strategies = pack_histogram(histogram, seq_length, max_sequences_per_pack)
+    # sequences of every length in input order
+    order = np.argsort(lengths, kind='stable')
+    starts = np.concatenate([[0], np.cumsum(histogram)])
+    taken = np.zeros(seq_length + 1, np.int64)
+    pack = np.full(lengths.shape[0], -1, np.int64)
+    slot = np.full(lengths.shape[0], -1, np.int64)
+    num_packs = 0
+    for strategy, count in strategies.items():
+        for k, length in enumerate(strategy):
+            begin = starts[length] + taken[length]
+            idx = order[begin:begin + count]
+            taken[length] += count
+            pack[idx] = np.arange(num_packs, num_packs + count)
+            slot[idx] = k
+        num_packs += count
+    assert (pack >= 0).all(), "sequences without a pack"
+    return pack, slot, num_packs
+
+
+def _scatter_rows(dst, rows, offsets, src, valid):
+    """dst[rows[i], offsets[i] + j] = src[i, j] for every valid[i, j], entries are packed to the left"""
+    i, j = np.nonzero(valid)
+    rank = np.cumsum(valid, axis=1)[i, j] - 1
+    dst[rows[i], offsets[i] + rank] = src[i, j]
+
+
+def pack_chunk(samples, seq_length, max_sequences_per_pack):
+    """
+    Args:
+        samples (dict): Unpacked columns, each [N, ...].
+
+    Returns:
+        dict, packed columns, each [number of packs, ...].
+    """
+    lengths = np.count_nonzero(samples["input_mask"], axis=1)
+    if not lengths.all():
+        samples = {name: value[lengths > 0] for name, value in samples.items()}
+        lengths = lengths[lengths > 0]
+    input_mask = samples["input_mask"]
+    pack, slot, num_packs = assign_packs(lengths, seq_length, max_sequences_per_pack)
+    # token offset of every sequence in its pack: lengths of the earlier slots of the same pack
+    order = np.lexsort((slot, pack))
+    ends = np.cumsum(lengths[order])
+    group_start = np.searchsorted(pack[order], pack[order], side='left')
+    offset = np.empty_like(lengths)
+    offset[order] = ends - lengths[order] - np.concatenate([[0], ends])[group_start]
+
+    num_predictions = samples["masked_lm_positions"].shape[1] * max_sequences_per_pack
+    weights = samples["masked_lm_weights"].reshape(lengths.shape[0], -1)
+    masked = weights > 0
+    # prediction offset of every sequence in its pack
+    num_masked = masked.sum(axis=1)
+    masked_ends = np.cumsum(num_masked[order])
+    masked_offset = np.empty_like(num_masked)
+    masked_offset[order] = masked_ends - num_masked[order] - np.concatenate([[0], masked_ends])[group_start]
+
+    packed = {
+        "input_ids": np.zeros((num_packs, seq_length), np.int64),
+        "input_mask": np.zeros((num_packs, seq_length), np.int64),
+        "segment_ids": np.zeros((num_packs, seq_length), np.int64),
+        "masked_lm_positions": np.zeros((num_packs, num_predictions), np.int64),
+        "masked_lm_ids": np.zeros((num_packs, num_predictions), np.int64),
+        "masked_lm_weights": np.zeros((num_packs, num_predictions), np.float32),
+        "next_sentence_positions": np.zeros((num_packs, max_sequences_per_pack), np.int64),
+        "next_sentence_labels": np.zeros((num_packs, max_sequences_per_pack), np.int64),
+        "next_sentence_weights": np.zeros((num_packs, max_sequences_per_pack), np.int64),
+    }
+    tokens = input_mask > 0
+    _scatter_rows(packed["input_ids"], pack, offset, samples["input_ids"], tokens)
+    _scatter_rows(packed["segment_ids"], pack, offset, samples["segment_ids"], tokens)
+    _scatter_rows(packed["input_mask"], pack, offset, np.broadcast_to((slot + 1)[:, None], tokens.shape), tokens)
+    positions = samples["masked_lm_positions"].reshape(weights.shape) + offset[:, None]
+    _scatter_rows(packed["masked_lm_positions"], pack, masked_offset, positions, masked)
+    _scatter_rows(packed["masked_lm_ids"], pack, masked_offset, samples["masked_lm_ids"].reshape(weights.shape),
+                  masked)
+    _scatter_rows(packed["masked_lm_weights"], pack, masked_offset,
+                  np.broadcast_to((slot + 1)[:, None], weights.shape).astype(np.float32), masked)
+    packed["next_sentence_positions"][pack, slot] = offset
+    packed["next_sentence_labels"][pack, slot] = samples["next_sentence_labels"].reshape(-1)
+    packed["next_sentence_weights"][pack, slot] = 1
+    return packed
+
+
+def read_chunks(input_dir, schema_dir, chunk_size):
+    """yield dicts of up to chunk_size unpacked samples of all TFRecords in input_dir"""
+    import mindspore.dataset as ds
+    data_files = sorted(os.path.join(input_dir, name) for name in os.listdir(input_dir) if "tfrecord" in name)
+    data_set = ds.TFRecordDataset(data_files, schema_dir if schema_dir else None, columns_list=COLUMNS,
+                                  shuffle=False)
+    rows = []
+    for row in data_set.create_tuple_iterator(output_numpy=True, num_epochs=1):
+        rows.append(row)
+        if len(rows) == chunk_size:
+            yield {name: np.stack([row[k] for row in rows]) for k, name in enumerate(COLUMNS)}
+            rows = []
+    if rows:
+        yield {name: np.stack([row[k] for row in rows]) for k, name in enumerate(COLUMNS)}
+
+
+def main():
+    """pack all TFRecords of input_dir"""
+    parser = argparse.ArgumentParser(description="pack bert pretraining data")
+    parser.add_argument("--input_dir", type=str, required=True, help="directory of the unpacked TFRecords")
+    parser.add_argument("--schema_dir", type=str, default="", help="schema of the TFRecords")
+    parser.add_argument("--output_dir", type=str, required=True, help="directory of the packed MindRecords")
+    parser.add_argument("--seq_length", type=int, default=512, help="tokens of one pack, default is 512")
+    parser.add_argument("--max_sequences_per_pack", type=int, default=3,
+                        help="sequences of one pack, default is 3")
+    parser.add_argument("--chunk_size", type=int, default=200000,
+                        help="sequences packed together, default is 200000")
+    parser.add_argument("--num_shards", type=int, default=8, help="output MindRecord files, default is 8")
+    args = parser.parse_args()
+
+    from mindspore.mindrecord import FileWriter
+    os.makedirs(args.output_dir, exist_ok=True)
+    writer = FileWriter(os.path.join(args.output_dir, "packed.mindrecord"), shard_num=args.num_shards,
+                        overwrite=True)
+    schema_written = False
+    total_sequences, total_packs, total_tokens = 0, 0, 0
+    for samples in read_chunks(args.input_dir, args.schema_dir, args.chunk_size):
+        packed = pack_chunk(samples, args.seq_length, args.max_sequences_per_pack)
+        if not schema_written:
+            schema = {name: {"type": "float32" if value.dtype == np.float32 else "int64", "shape": [-1]}
+                      for name, value in packed.items()}
+            writer.add_schema(schema, "bert packed pretraining data")
+            schema_written = True
+        num_packs = packed["input_ids"].shape[0]
+        writer.write_raw_data([{name: value[i] for name, value in packed.items()} for i in range(num_packs)])
+        total_sequences += samples["input_ids"].shape[0]
+        total_packs += num_packs
+        total_tokens += int(np.count_nonzero(samples["input_mask"]))
+        print("packed {} sequences into {} packs, {:.2%} real tokens".format(
+            total_sequences, total_packs, total_tokens / max(total_packs * args.seq_length, 1)))
+    writer.commit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+
+"""
+Bert inference server with its load generator: serves the pooled output of BertModel with length bucketing and
+request batching, and reports the latency and qps of an open loop load.
+"""
+
+import numpy as np
+import mindspore.nn as nn
+from mindspore import context
+from mindspore.train.serialization import load_checkpoint, load_param_into_net
+from src.bert_model import BertModel
+from src.inference_server import CharTokenizer, InferenceEngine, run_load
+from src.model_utils.config import config as cfg, bert_net_cfg
+
+
+class BertPooledOutput(nn.Cell):
+    """
+    Pooled output of BertModel.
+
+    Args:
+        config (Class): Configuration for BertModel.
+    """
+    def __init__(self, config):
+        super(BertPooledOutput, self).__init__()
+        self.bert = BertModel(config, False)
+
+    def construct(self, input_ids, input_mask, token_type_id):
+        _, pooled_output, _ = self.bert(input_ids, token_type_id, input_mask)
+        return pooled_output
+
+
+def load_bert_params(net, ckpt_file):
+    """load the parameters of net from a checkpoint whose names end with the names in net, e.g. a pretraining one"""
+    param_dict = load_checkpoint(ckpt_file)
+    matched = {}
+    for name in net.parameters_dict():
+        for ckpt_name, value in param_dict.items():
+            if ckpt_name == name or ckpt_name.endswith("." + name):
+                matched[name] = value
+                break
+    load_param_into_net(net, matched)
+    print("loaded {} of {} parameters from {}".format(len(matched), len(net.parameters_dict()), ckpt_file))
+
+
+def load_texts(text_file, tokenizer, num_texts=1000, seed=0):
+    """lines of text_file, or random texts of vocab characters of random length if text_file is empty"""
+    if text_file:
+        with open(text_file, "r", encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip()]
+    rng = np.random.RandomState(seed)
+    chars = [chr(code) for code in np.nonzero(tokenizer.table != tokenizer.unk_id)[0]
+             if not tokenizer.drop[code]]
+    lengths = rng.randint(1, max(cfg.infer_bucket_list), size=num_texts)
+    return ["".join(rng.choice(chars, size=length)) for length in lengths]
+
+
+def run_inference_server():
+    """serve the load and print the report"""
+    context.set_context(mode=context.GRAPH_MODE, device_target=cfg.device_target, device_id=cfg.device_id)
+    net = BertPooledOutput(bert_net_cfg)
+    net.set_train(False)
+    if cfg.eval_ckpt:
+        load_bert_params(net, cfg.eval_ckpt)
+    tokenizer = CharTokenizer(cfg.vocab_file, cfg.do_lower_case)
+    engine = InferenceEngine(net, tokenizer, cfg.infer_bucket_list, cfg.infer_batch_size, cfg.infer_max_latency_ms)
+    texts = load_texts(cfg.infer_text_file, tokenizer)
+    engine.start()
+    report = run_load(engine, texts, cfg.infer_qps, cfg.infer_num_requests)
+    engine.stop()
+    print("==============================================================")
+    for key, value in report.items():
+        print("{}: {}".format(key, value))
+    print("==============================================================")
+
+
+if __name__ == "__main__":
+    run_inference_server()
@@ -196,7 +196,7 @@ def run_pretrain():
     _check_accumulation_steps(cfg)
 
     ds = create_bert_dataset(device_num, rank, cfg.do_shuffle, cfg.data_dir, cfg.schema_dir, cfg.batch_size,
-                             cfg.bucket_list, cfg.use_packed)
+                             cfg.bucket_list, cfg.use_packed, cfg.bucket_token_budget)
     net_with_loss = BertNetworkWithLoss(bert_net_cfg, True)
 
     new_repeat_count = cfg.epoch_size * ds.get_dataset_size() // cfg.data_sink_steps
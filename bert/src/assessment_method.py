@@ -18,8 +18,8 @@ Bert evaluation assessment method script.
 '''
 import math
 import numpy as np
-from mindspore.nn.metrics import ConfusionMatrixMetric
 from .CRF import postprocess
+from .metrics import ConfusionMatrix, RankCorrelation
 
 class Accuracy():
     '''
@@ -36,22 +36,36 @@ class Accuracy():
         self.acc_num += np.sum(labels == logit_id)
         self.total_num += len(labels)
 
+    def merge(self, other):
+        '''add the counts of another shard of the evaluation'''
+        self.acc_num += other.acc_num
+        self.total_num += other.total_num
+        return self
+
 class F1():
     '''
     calculate F1 score
     '''
     def __init__(self, use_crf=False, num_labels=2, mode="Binary"):
-        self.TP = 0
-        self.FP = 0
-        self.FN = 0
         self.use_crf = use_crf
         self.num_labels = num_labels
         self.mode = mode
         if self.mode.lower() not in ("binary", "multilabel"):
             raise ValueError("Assessment mode not supported, support: [Binary, MultiLabel]")
-        if self.mode.lower() != "binary":
-            self.metric = ConfusionMatrixMetric(skip_channel=False, metric_name=("f1 score"),
-                                                calculation_method=False, decrease="mean")
+        self.confusion_matrix = ConfusionMatrix(num_labels)
+
+    @property
+    def TP(self):
+        '''predictions of any positive class on positive labels'''
+        return self.confusion_matrix.counts[1:, 1:].sum()
+
+    @property
+    def FP(self):
+        return self.confusion_matrix.counts[0, 1:].sum()
+
+    @property
+    def FN(self):
+        return self.confusion_matrix.counts[1:, 0].sum()
 
     def update(self, logits, labels):
         '''
@@ -62,31 +76,21 @@ class F1():
         if self.use_crf:
             backpointers, best_tag_id = logits
             best_path = postprocess(backpointers, best_tag_id)
-            logit_id = []
-            for ele in best_path:
-                logit_id.extend(ele)
+            logit_id = np.concatenate([np.asarray(ele, dtype=np.int64) for ele in best_path])
         else:
             logits = logits.asnumpy()
             logit_id = np.argmax(logits, axis=-1)
             logit_id = np.reshape(logit_id, -1)
+        self.confusion_matrix.update(logit_id, labels)
 
-        if self.mode.lower() == "binary":
-            pos_eva = np.isin(logit_id, [i for i in range(1, self.num_labels)])
-            pos_label = np.isin(labels, [i for i in range(1, self.num_labels)])
-            self.TP += np.sum(pos_eva&pos_label)
-            self.FP += np.sum(pos_eva&(~pos_label))
-            self.FN += np.sum((~pos_eva)&pos_label)
-        else:
-            target = np.zeros((len(labels), self.num_labels), dtype=np.int)
-            pred = np.zeros((len(logit_id), self.num_labels), dtype=np.int)
-            for i, label in enumerate(labels):
-                target[i][label] = 1
-            for i, label in enumerate(logit_id):
-                pred[i][label] = 1
-            self.metric.update(pred, target)
+    def merge(self, other):
+        '''add the counts of another shard of the evaluation'''
+        self.confusion_matrix.merge(other.confusion_matrix)
+        return self
 
     def eval(self):
-        return self.metric.eval()
+        '''mean F1 score over the labels, for MultiLabel mode'''
+        return self.confusion_matrix.macro_f1()
 
 
 class MCC():
@@ -94,31 +98,43 @@ class MCC():
     Calculate Matthews Correlation Coefficient
     '''
     def __init__(self):
-        self.TP = 0
-        self.FP = 0
-        self.FN = 0
-        self.TN = 0
+        self.confusion_matrix = ConfusionMatrix(2)
+
+    @property
+    def TP(self):
+        return self.confusion_matrix.counts[1, 1]
+
+    @property
+    def FP(self):
+        return self.confusion_matrix.counts[0, 1]
+
+    @property
+    def FN(self):
+        return self.confusion_matrix.counts[1, 0]
+
+    @property
+    def TN(self):
+        return self.confusion_matrix.counts[0, 0]
+
     def update(self, logits, labels):
         '''
         MCC update
         '''
         labels = labels.asnumpy()
-        labels = np.reshape(labels, -1)
-        labels = labels.astype(np.bool)
+        labels = np.reshape(labels, -1) != 0
         logits = logits.asnumpy()
         logit_id = np.argmax(logits, axis=-1)
-        logit_id = np.reshape(logit_id, -1)
-        logit_id = logit_id.astype(np.bool)
-        ornot = logit_id ^ labels
+        logit_id = np.reshape(logit_id, -1) != 0
+        self.confusion_matrix.update(logit_id, labels)
 
-        self.TP += (~ornot & labels).sum()
-        self.FP += (ornot & ~labels).sum()
-        self.FN += (ornot & labels).sum()
-        self.TN += (~ornot & ~labels).sum()
+    def merge(self, other):
+        '''add the counts of another shard of the evaluation'''
+        self.confusion_matrix.merge(other.confusion_matrix)
+        return self
 
     def cal(self):
-        mcc = (self.TP*self.TN - self.FP*self.FN)/math.sqrt((self.TP+self.FP)*(self.TP+self.FN) *
-                                                            (self.TN+self.FP)*(self.TN+self.FN))
+        tp, fp, fn, tn = (int(x) for x in (self.TP, self.FP, self.FN, self.TN))
+        mcc = (tp*tn - fp*fn)/math.sqrt((tp+fp)*(tp+fn)*(tn+fp)*(tn+fn))
         return mcc
 
 class Spearman_Correlation():
@@ -126,29 +142,20 @@ class Spearman_Correlation():
     Calculate Spearman Correlation Coefficient
     '''
     def __init__(self):
-        self.label = []
-        self.logit = []
+        self.correlation = RankCorrelation()
 
     def update(self, logits, labels):
         labels = labels.asnumpy()
-        labels = np.reshape(labels, -1)
         logits = logits.asnumpy()
-        logits = np.reshape(logits, -1)
-        self.label.append(labels)
-        self.logit.append(logits)
+        self.correlation.update(logits, labels)
+
+    def merge(self, other):
+        '''append the values of another shard of the evaluation'''
+        self.correlation.merge(other.correlation)
+        return self
 
     def cal(self):
         '''
         Calculate Spearman Correlation
         '''
-        label = np.concatenate(self.label)
-        logit = np.concatenate(self.logit)
-        sort_label = label.argsort()[::-1]
-        sort_logit = logit.argsort()[::-1]
-        n = len(label)
-        d_acc = 0
-        for i in range(n):
-            d = np.where(sort_label == i)[0] - np.where(sort_logit == i)[0]
-            d_acc += d**2
-        ps = 1 - 6*d_acc/n/(n**2-1)
-        return ps
+        return self.correlation.spearman()
@@ -54,6 +54,9 @@ class BertConfig:
         use_relative_positions (bool): Specifies whether to use relative positions. Default: False.
         dtype (:class:`mindspore.dtype`): Data type of the input. Default: mstype.float32.
         compute_type (:class:`mindspore.dtype`): Compute type in BertTransformer. Default: mstype.float32.
+        use_packed (bool): Specifies whether the inputs are packed sequences. Default: False.
+        attention_block_size (int): Keys of one block of the blocked attention, 0 uses the full attention matrix.
+                              Default: 0.
     """
     def __init__(self,
                  seq_length=128,
@@ -71,7 +74,8 @@ class BertConfig:
                  use_relative_positions=False,
                  dtype=mstype.float32,
                  compute_type=mstype.float32,
-                 use_packed=False):
+                 use_packed=False,
+                 attention_block_size=0):
         self.seq_length = seq_length
         self.vocab_size = vocab_size
         self.hidden_size = hidden_size
@@ -88,6 +92,7 @@ class BertConfig:
         self.dtype = dtype
         self.compute_type = compute_type
         self.use_packed = use_packed
+        self.attention_block_size = attention_block_size
 
 
 class EmbeddingLookup(nn.Cell):
@@ -357,6 +362,167 @@ class SaturateCast(nn.Cell):
         return self.cast(out, self.dst_type)
 
 
+class OnlineSoftmaxStep(nn.Cell):
+    """
+    Attend to one block of keys and update the online softmax state.
+
+    The state is the running max of the scores, the running sum of their exponentials and the unnormalized
+    context, all in float32. The step is recomputed in the backward pass, so only the state is kept between blocks.
+
+    Args:
+        num_attention_heads (int): Number of attention heads.
+        size_per_head (int): Size of each attention head.
+        attention_probs_dropout_prob (float): The dropout probability for the attention probabilities.
+        use_relative_positions (bool): Specifies whether to use relative positions. Default: False.
+        compute_type (:class:`mindspore.dtype`): Compute type of the matmuls. Default: mstype.float32.
+    """
+    def __init__(self,
+                 num_attention_heads,
+                 size_per_head,
+                 attention_probs_dropout_prob,
+                 use_relative_positions=False,
+                 compute_type=mstype.float32):
+        super(OnlineSoftmaxStep, self).__init__()
+        self.num_attention_heads = num_attention_heads
+        self.size_per_head = size_per_head
+        self.use_relative_positions = use_relative_positions
+        self.compute_type = compute_type
+        self.scores_mul = 1.0 / math.sqrt(float(size_per_head))
+        self.multiply_data = -10000.0
+
+        self.matmul_trans_b = P.BatchMatMul(transpose_b=True)
+        self.matmul = P.BatchMatMul()
+        self.transpose = P.Transpose()
+        self.reshape = P.Reshape()
+        self.cast = P.Cast()
+        self.expand_dims = P.ExpandDims()
+        self.maximum = P.Maximum()
+        self.exp = P.Exp()
+        self.reduce_max = P.ReduceMax(keep_dims=True)
+        self.reduce_sum = P.ReduceSum(keep_dims=True)
+        self.dropout = nn.Dropout(p=attention_probs_dropout_prob)
+        self.trans_shape_relative = (2, 0, 1, 3)
+        self.trans_shape_position = (1, 2, 0, 3)
+        self.recompute()
+
+    def construct(self, query_layer, key_block, value_block, mask_block, max_score, normalizer, context,
+                  query_layer_r=None, relations_keys=None, relations_values=None):
+        """
+        Args:
+            query_layer: [B, N, F, H] queries.
+            key_block, value_block: [B, N, T_b, H] keys and values of the block.
+            mask_block: [B, 1|F, T_b] attention mask of the block, 1 where attention is allowed.
+            max_score, normalizer: [B, N, F, 1] running max and exponential sum of the scores.
+            context: [B, N, F, H] running unnormalized context.
+            query_layer_r: [F, B * N, H] queries for the relative positions.
+            relations_keys, relations_values: [F, T_b, H] relative position embeddings of the block.
+
+        Returns:
+            The updated max_score, normalizer and context.
+        """
+        block_length = F.shape(key_block)[2]
+        shape_from = F.shape(query_layer)[2]
+        attention_scores = self.matmul_trans_b(query_layer, key_block)
+        if self.use_relative_positions:
+            # [F, B * N, T_b] -> [B, N, F, T_b]
+            key_position_scores = self.matmul_trans_b(query_layer_r, relations_keys)
+            key_position_scores = self.reshape(key_position_scores,
+                                               (shape_from, -1, self.num_attention_heads, block_length))
+            attention_scores = attention_scores + self.transpose(key_position_scores, self.trans_shape_position)
+        attention_scores = self.cast(attention_scores, mstype.float32) * self.scores_mul
+        # mask folded into the block scores
+        adder = (1.0 - self.cast(self.expand_dims(mask_block, 1), mstype.float32)) * self.multiply_data
+        attention_scores = attention_scores + adder
+
+        new_max = self.maximum(max_score, self.reduce_max(attention_scores, -1))
+        correction = self.exp(max_score - new_max)
+        attention_probs = self.exp(attention_scores - new_max)
+        normalizer = normalizer * correction + self.reduce_sum(attention_probs, -1)
+
+        attention_probs = self.cast(self.dropout(attention_probs), self.compute_type)
+        block_context = self.matmul(attention_probs, value_block)
+        if self.use_relative_positions:
+            # [F, B * N, T_b] x [F, T_b, H] -> [B, N, F, H]
+            attention_probs_r = self.reshape(self.transpose(attention_probs, self.trans_shape_relative),
+                                             (shape_from, -1, block_length))
+            value_position_scores = self.matmul(attention_probs_r, relations_values)
+            value_position_scores = self.reshape(value_position_scores,
+                                                 (shape_from, -1, self.num_attention_heads, self.size_per_head))
+            block_context = block_context + self.transpose(value_position_scores, self.trans_shape_position)
+        context = context * correction + self.cast(block_context, mstype.float32)
+        return new_max, normalizer, context
+
+
+class BlockedAttention(nn.Cell):
+    """
+    Multi-head attention that visits the keys in blocks with an online softmax.
+
+    The [B, N, F, T] scores and probabilities are never materialized, only one [B, N, F, block_size] block at a
+    time, and the attention mask is applied per block. Gives the same result as the softmax over all keys.
+
+    Args:
+        num_attention_heads (int): Number of attention heads.
+        size_per_head (int): Size of each attention head.
+        block_size (int): Number of keys of one block.
+        attention_probs_dropout_prob (float): The dropout probability for the attention probabilities. Default: 0.0.
+        use_relative_positions (bool): Specifies whether to use relative positions. Default: False.
+        compute_type (:class:`mindspore.dtype`): Compute type of the matmuls. Default: mstype.float32.
+    """
+    def __init__(self,
+                 num_attention_heads,
+                 size_per_head,
+                 block_size,
+                 attention_probs_dropout_prob=0.0,
+                 use_relative_positions=False,
+                 compute_type=mstype.float32):
+        super(BlockedAttention, self).__init__()
+        self.size_per_head = size_per_head
+        self.block_size = block_size
+        self.use_relative_positions = use_relative_positions
+        self.compute_type = compute_type
+        self.step = OnlineSoftmaxStep(num_attention_heads, size_per_head, attention_probs_dropout_prob,
+                                      use_relative_positions, compute_type)
+        self.transpose = P.Transpose()
+        self.reshape = P.Reshape()
+        self.cast = P.Cast()
+        self.trans_shape_relative = (2, 0, 1, 3)
+
+    def construct(self, query_layer, key_layer, value_layer, attention_mask, relations_keys=None,
+                  relations_values=None):
+        """
+        Args:
+            query_layer: [B, N, F, H] queries.
+            key_layer, value_layer: [B, N, T, H] keys and values.
+            attention_mask: [B, 1|F, T] attention mask, 1 where attention is allowed.
+            relations_keys, relations_values: [F, T, H] relative position embeddings.
+
+        Returns:
+            [B, N, F, H] context.
+        """
+        batch_size, num_heads, shape_from, _ = F.shape(query_layer)
+        shape_to = F.shape(key_layer)[2]
+        query_layer_r = None
+        if self.use_relative_positions:
+            query_layer_r = self.reshape(self.transpose(query_layer, self.trans_shape_relative),
+                                         (shape_from, -1, self.size_per_head))
+        max_score = F.fill(mstype.float32, (batch_size, num_heads, shape_from, 1), -1e9)
+        normalizer = F.fill(mstype.float32, (batch_size, num_heads, shape_from, 1), 0)
+        context = F.fill(mstype.float32, (batch_size, num_heads, shape_from, self.size_per_head), 0)
+        for start in range(0, shape_to, self.block_size):
+            end = min(start + self.block_size, shape_to)
+            relations_keys_block = None
+            relations_values_block = None
+            if self.use_relative_positions:
+                relations_keys_block = relations_keys[:, start:end, :]
+                relations_values_block = relations_values[:, start:end, :]
+            max_score, normalizer, context = self.step(query_layer, key_layer[:, :, start:end, :],
+                                                       value_layer[:, :, start:end, :],
+                                                       attention_mask[:, :, start:end], max_score, normalizer,
+                                                       context, query_layer_r, relations_keys_block,
+                                                       relations_values_block)
+        return self.cast(context / normalizer, self.compute_type)
+
+
 class BertAttention(nn.Cell):
     """
     Apply multi-headed attention from "from_tensor" to "to_tensor".
@@ -376,6 +542,8 @@ class BertAttention(nn.Cell):
         initializer_range (float): Initialization value of TruncatedNormal. Default: 0.02.
         use_relative_positions (bool): Specifies whether to use relative positions. Default: False.
         compute_type (:class:`mindspore.dtype`): Compute type in BertAttention. Default: mstype.float32.
+        attention_block_size (int): Keys of one block of the blocked attention, 0 uses the full attention matrix.
+                              Default: 0.
     """
     def __init__(self,
                  from_tensor_width,
@@ -390,7 +558,8 @@ class BertAttention(nn.Cell):
                  use_one_hot_embeddings=False,
                  initializer_range=0.02,
                  use_relative_positions=False,
-                 compute_type=mstype.float32):
+                 compute_type=mstype.float32,
+                 attention_block_size=0):
 
         super(BertAttention, self).__init__()
         self.num_attention_heads = num_attention_heads
@@ -445,6 +614,14 @@ class BertAttention(nn.Cell):
                                            max_relative_position=16,
                                            initializer_range=initializer_range,
                                            use_one_hot_embeddings=use_one_hot_embeddings)
+        self.use_blocked = attention_block_size > 0 and has_attention_mask
+        if self.use_blocked:
+            self.blocked_attention = BlockedAttention(num_attention_heads=num_attention_heads,
+                                                      size_per_head=size_per_head,
+                                                      block_size=attention_block_size,
+                                                      attention_probs_dropout_prob=attention_probs_dropout_prob,
+                                                      use_relative_positions=use_relative_positions,
+                                                      compute_type=compute_type)
 
     def construct(self, from_tensor, to_tensor, attention_mask):
         """reshape 2d/3d input tensors to 2d"""
@@ -460,6 +637,19 @@ class BertAttention(nn.Cell):
         query_layer = self.transpose(query_layer, self.trans_shape)
         key_layer = self.reshape(key_out, (-1, shape_from, self.num_attention_heads, self.size_per_head))
         key_layer = self.transpose(key_layer, self.trans_shape)
+        value_layer = self.reshape(value_out, (-1, shape_from, self.num_attention_heads, self.size_per_head))
+        value_layer = self.transpose(value_layer, self.trans_shape)
+
+        if self.use_blocked:
+            # keys and values share the relative position embeddings, as below
+            relations_embeddings = None
+            if self.use_relative_positions:
+                relations_embeddings = self.cast_compute_type(
+                    self._generate_relative_positions_embeddings(shape_from))
+            context_layer = self.blocked_attention(query_layer, key_layer, value_layer, attention_mask,
+                                                   relations_embeddings, relations_embeddings)
+            context_layer = self.transpose(context_layer, self.trans_shape)
+            return self.reshape(context_layer, self.shape_return)
 
         attention_scores = self.matmul_trans_b(query_layer, key_layer)
 
@@ -502,8 +692,6 @@ class BertAttention(nn.Cell):
         attention_probs = self.softmax(attention_scores)
         attention_probs = self.dropout(attention_probs)
 
-        value_layer = self.reshape(value_out, (-1, shape_from, self.num_attention_heads, self.size_per_head))
-        value_layer = self.transpose(value_layer, self.trans_shape)
         context_layer = self.matmul(attention_probs, value_layer)
 
         # use_relative_position, supplementary logic
@@ -553,6 +741,8 @@ class BertSelfAttention(nn.Cell):
         hidden_dropout_prob (float): The dropout probability for BertOutput. Default: 0.1.
         use_relative_positions (bool): Specifies whether to use relative positions. Default: False.
         compute_type (:class:`mindspore.dtype`): Compute type in BertSelfAttention. Default: mstype.float32.
+        attention_block_size (int): Keys of one block of the blocked attention, 0 uses the full attention matrix.
+                              Default: 0.
     """
     def __init__(self,
                  hidden_size,
@@ -562,7 +752,8 @@ class BertSelfAttention(nn.Cell):
                  initializer_range=0.02,
                  hidden_dropout_prob=0.1,
                  use_relative_positions=False,
-                 compute_type=mstype.float32):
+                 compute_type=mstype.float32,
+                 attention_block_size=0):
         super(BertSelfAttention, self).__init__()
         if hidden_size % num_attention_heads != 0:
             raise ValueError("The hidden size (%d) is not a multiple of the number "
@@ -580,7 +771,8 @@ class BertSelfAttention(nn.Cell):
             initializer_range=initializer_range,
             use_relative_positions=use_relative_positions,
             has_attention_mask=True,
-            compute_type=compute_type)
+            compute_type=compute_type,
+            attention_block_size=attention_block_size)
 
         self.output = BertOutput(in_channels=hidden_size,
                                  out_channels=hidden_size,
@@ -612,6 +804,8 @@ class BertEncoderCell(nn.Cell):
         use_relative_positions (bool): Specifies whether to use relative positions. Default: False.
         hidden_act (str): Activation function. Default: "gelu".
         compute_type (:class:`mindspore.dtype`): Compute type in attention. Default: mstype.float32.
+        attention_block_size (int): Keys of one block of the blocked attention, 0 uses the full attention matrix.
+                              Default: 0.
     """
     def __init__(self,
                  hidden_size=768,
@@ -623,7 +817,8 @@ class BertEncoderCell(nn.Cell):
                  hidden_dropout_prob=0.1,
                  use_relative_positions=False,
                  hidden_act="gelu",
-                 compute_type=mstype.float32):
+                 compute_type=mstype.float32,
+                 attention_block_size=0):
         super(BertEncoderCell, self).__init__()
         self.attention = BertSelfAttention(
             hidden_size=hidden_size,
@@ -633,7 +828,8 @@ class BertEncoderCell(nn.Cell):
             initializer_range=initializer_range,
             hidden_dropout_prob=hidden_dropout_prob,
             use_relative_positions=use_relative_positions,
-            compute_type=compute_type)
+            compute_type=compute_type,
+            attention_block_size=attention_block_size)
         self.intermediate = nn.Dense(in_channels=hidden_size,
                                      out_channels=intermediate_size,
                                      activation=hidden_act,
@@ -672,6 +868,8 @@ class BertTransformer(nn.Cell):
         hidden_act (str): Activation function used in the encoder cells. Default: "gelu".
         compute_type (:class:`mindspore.dtype`): Compute type in BertTransformer. Default: mstype.float32.
         return_all_encoders (bool): Specifies whether to return all encoders. Default: False.
+        attention_block_size (int): Keys of one block of the blocked attention, 0 uses the full attention matrix.
+                              Default: 0.
     """
     def __init__(self,
                  hidden_size,
@@ -685,7 +883,8 @@ class BertTransformer(nn.Cell):
                  use_relative_positions=False,
                  hidden_act="gelu",
                  compute_type=mstype.float32,
-                 return_all_encoders=False):
+                 return_all_encoders=False,
+                 attention_block_size=0):
         super(BertTransformer, self).__init__()
         self.return_all_encoders = return_all_encoders
 
@@ -700,7 +899,8 @@ class BertTransformer(nn.Cell):
                                     hidden_dropout_prob=hidden_dropout_prob,
                                     use_relative_positions=use_relative_positions,
                                     hidden_act=hidden_act,
-                                    compute_type=compute_type)
+                                    compute_type=compute_type,
+                                    attention_block_size=attention_block_size)
             layers.append(layer)
 
         self.layers = nn.CellList(layers)
@@ -816,7 +1016,8 @@ class BertModel(nn.Cell):
             use_relative_positions=config.use_relative_positions,
             hidden_act=config.hidden_act,
             compute_type=config.compute_type,
-            return_all_encoders=True)
+            return_all_encoders=True,
+            attention_block_size=config.attention_block_size)
 
         self.cast = P.Cast()
         self.dtype = config.dtype
@@ -850,11 +1051,13 @@ class BertModel(nn.Cell):
         # pooler
         batch_size = P.Shape()(input_ids)[0]
         if self.use_packed:
-            slices = []
-            for i in range(batch_size):
-                slices.append(sequence_output[i][next_sentence_starts[i]])
-            sequence_slice = F.stack(slices)
-            first_token = F.reshape(sequence_slice, (-1, self.hidden_size))
+            # one gather of the [CLS] tokens of all packed sentences from the flattened batch
+            seq_length = P.Shape()(input_ids)[1]
+            batch_offsets = self.cast(F.tuple_to_array(F.make_range(0, batch_size * seq_length, seq_length)),
+                                      mstype.int32)
+            flat_starts = F.reshape(self.cast(next_sentence_starts, mstype.int32) +
+                                    F.reshape(batch_offsets, (-1, 1)), (-1,))
+            first_token = self.gather(F.reshape(sequence_output, (-1, self.hidden_size)), flat_starts, 0)
         else:
             sequence_slice = self.slice(sequence_output,
                                         (0, 0, 0),
@@ -24,6 +24,24 @@ import mindspore.dataset.transforms as C
 from mindspore import log as logger
 
 
+def bucket_length_shares(dataset, bucket_list, num_rows=10000, mask_column=1):
+    """
+    Share of the sentences of every bucket among the first num_rows rows of dataset, a sentence belongs to the
+    shortest bucket it fits and sentences longer than every bucket are not counted.
+    """
+    bucket_array = np.array(sorted(bucket_list))
+    counts = np.zeros(len(bucket_array), np.int64)
+    for row, item in enumerate(dataset.create_tuple_iterator(num_epochs=1, output_numpy=True)):
+        if row == num_rows:
+            break
+        idx = int(np.searchsorted(bucket_array, np.count_nonzero(item[mask_column])))
+        if idx < len(bucket_array):
+            counts[idx] += 1
+    if not counts.sum():
+        counts[-1] = 1
+    return counts / counts.sum()
+
+
 class BucketDatasetGenerator:
     """
     Provide data distribution of different gears for the bert network.
@@ -32,93 +50,181 @@ class BucketDatasetGenerator:
         dataset (Dataset): The training dataset.
         batch_size (Int): The training batchsize.
         bucket_list (List): List of different sentence lengths, such as [128, 256, 512]. Default: None.
-        valid_dataset_len (Int): Prevent communication failure at the end of the dataset. Default: 0.35.
+        valid_dataset_len (Int): Kept for compatibility, the schedule follows the lengths of the data. Default: 0.35.
+        token_budget (Int): Tokens of one batch. A batch of the bucket of length L then holds token_budget // L
+            sentences and its sequence columns are cut to L, so every step carries about the same number of tokens
+            and each bucket has one fixed batch shape. 0 keeps batch_size full length sentences for every bucket.
+            Default: 0.
+        max_buffered (Int): Buffered sentences after which a bucket is filled up with shorter sentences, or the step
+            is served by a longer bucket, instead of waiting for sentences of its own length. Default: 0, 8 batches.
+        bucket_shares (List): Share of the sentences of every bucket, see bucket_length_shares. Default: None,
+            estimated from the first rows of dataset. Pass the same shares on all devices so that they run the same
+            number of steps.
     """
 
-    def __init__(self, dataset, batch_size, bucket_list=None, valid_dataset_len=0.35):
+    # input_ids, input_mask and segment_ids
+    seq_columns = 3
+
+    def __init__(self, dataset, batch_size, bucket_list=None, valid_dataset_len=0.35, token_budget=0,
+                 max_buffered=0, bucket_shares=None):
         self.dataset = dataset
         self.batch_size = batch_size
-        self.bucket_list = bucket_list
-        bucket_size = len(bucket_list)
-        self.random_list = np.random.binomial(n=(bucket_size - 1), p=0.55, size=self.__len__())
-        self.random_list = (self.random_list + 2) % bucket_size
-        self.random_list = [bucket_list[i] for i in self.random_list]
-        valid_dataset_len = int(valid_dataset_len * self.__len__())
-        self.random_list = self.random_list[:valid_dataset_len] + [bucket_list[-1]] * self.__len__()
+        self.bucket_list = sorted(bucket_list)
+        self.token_budget = token_budget
+        if token_budget:
+            self.bucket_batch_size = {bucket: max(token_budget // bucket, 1) for bucket in self.bucket_list}
+        else:
+            self.bucket_batch_size = {bucket: batch_size for bucket in self.bucket_list}
+        self.max_buffered = max_buffered or 8 * max(self.bucket_batch_size.values())
+        self._bucket_array = np.array(self.bucket_list)
+        if bucket_shares is None:
+            bucket_shares = bucket_length_shares(dataset, self.bucket_list)
+
+        # every bucket gets the steps its share of the sentences fills, in random order. The longest bucket has the
+        # smallest batch, the number of steps is capped so that it can serve every step
+        self.num_samples = self.dataset.get_dataset_size()
+        batch_sizes = np.array([self.bucket_batch_size[bucket] for bucket in self.bucket_list])
+        steps = np.asarray(bucket_shares, np.float64) * self.num_samples / batch_sizes
+        self.num_steps = min(int(steps.sum() + 1e-6), self.num_samples // int(batch_sizes[-1]))
+        steps = steps * self.num_steps / max(steps.sum(), 1e-6)
+        bucket_steps = np.floor(steps).astype(np.int64)
+        remainder = self.num_steps - int(bucket_steps.sum())
+        bucket_steps[np.argsort(bucket_steps - steps, kind='stable')[:remainder]] += 1
+        self.random_list = np.random.permutation(np.repeat(self.bucket_list, bucket_steps)).tolist()
+        self.stats = {bucket: np.zeros(4, np.int64) for bucket in self.bucket_list}
         self._init_variables()
 
     def _init_variables(self):
         self.data_bucket = {bucket: [] for bucket in self.bucket_list}
+        self.num_buffered = 0
+        self.num_dropped = 0
+        self.num_consumed = 0
+        self.exhausted = False
         self.iter = 0
-        self.remaining_data = []
-        self.remaining_data_size = 1
-        self.stage = 0
+
+    def _add(self, item):
+        """put a sentence into the shortest bucket it fits, its length is counted once"""
+        length = int(np.count_nonzero(item[1]))
+        idx = int(np.searchsorted(self._bucket_array, length))
+        if idx < len(self.bucket_list):
+            self.data_bucket[self.bucket_list[idx]].append((item, length))
+            self.num_buffered += 1
+        else:
+            self.num_dropped += 1
+
+    def _fits(self, key):
+        """whether the sentences of bucket key and of the shorter buckets fill a batch of key"""
+        buckets = self.bucket_list[:self.bucket_list.index(key) + 1]
+        return sum(len(self.data_bucket[bucket]) for bucket in buckets) >= self.bucket_batch_size[key]
+
+    def _serving_bucket(self, key):
+        """
+        Bucket serving a step scheduled for key: key itself, filled up with shorter sentences once the buffer is
+        full or the input is exhausted, else the next longer bucket holding sentences, else any longer bucket.
+        None while the buffer waits for more sentences of key, or at the end of the data.
+        """
+        if len(self.data_bucket[key]) >= self.bucket_batch_size[key]:
+            return key
+        if not self.exhausted and self.num_buffered < self.max_buffered:
+            return None
+        if self._fits(key):
+            return key
+        longer = self.bucket_list[self.bucket_list.index(key) + 1:]
+        for bucket in [bucket for bucket in longer if self.data_bucket[bucket]] + longer:
+            if self._fits(bucket):
+                return bucket
+        return None
+
+    def _take(self, key):
+        """a batch of bucket key: its own sentences first, then those of the next shorter buckets"""
+        batch_size = self.bucket_batch_size[key]
+        data = []
+        for bucket in self.bucket_list[self.bucket_list.index(key)::-1]:
+            need = batch_size - len(data)
+            data += self.data_bucket[bucket][:need]
+            del self.data_bucket[bucket][:need]
+        self.num_buffered -= batch_size
+        self.num_consumed += batch_size
+        return data
 
     def __next__(self):
-        if self.stage != 0:
-            return self._process_remaining_data()
-
-        for item in self.iterator:
-            for seq_length in self.bucket_list:
-                if np.sum(item[1]) <= seq_length:
-                    self.data_bucket[seq_length].append(item)
-                    break
-            for key in self.data_bucket.keys():
-                data = self.data_bucket[key]
-                if len(data) >= self.batch_size and self.random_list[self.iter] == key:
-                    self.data_bucket[key] = self.data_bucket[key][self.batch_size:]
-                    self.iter += 1
-                    return self._package_data(data, key)
-        self.stage = 1
-        return self._process_remaining_data()
+        if self.iter >= self.num_steps:
+            self._finish()
+        key = self.random_list[self.iter]
+        # keep the sentences the remaining steps need, the longest bucket serves a step with the fewest of them
+        longest = self.bucket_list[-1]
+        remaining = self.num_samples - self.num_dropped - self.num_consumed - self.bucket_batch_size[key]
+        if remaining < (self.num_steps - self.iter - 1) * self.bucket_batch_size[longest]:
+            key = longest
+        bucket = self._serving_bucket(key)
+        while bucket is None:
+            if self.exhausted:
+                # less than a batch of the longest bucket is left
+                self._finish()
+            item = next(self.iterator, None)
+            if item is None:
+                self.exhausted = True
+            else:
+                self._add(item)
+            bucket = self._serving_bucket(key)
+        self.iter += 1
+        return self._package_data(self._take(bucket), bucket)
+
+    def _finish(self):
+        logger.info(self.padding_report())
+        self._init_variables()
+        raise StopIteration
 
     def _package_data(self, data, key):
         """package a set of data."""
-        arr = data[0]
-        for i in range(1, self.batch_size):
-            current_data = data[i]
-            for j in range(len(current_data)):
-                arr[j] = np.concatenate((arr[j], current_data[j]))
+        batch_size = len(data)
+        lengths = np.array([length for _, length in data])
         res = ()
-        for label in arr:
-            newlabel = np.reshape(label, (self.batch_size, -1))
-            res += (newlabel,)
+        for j, column in enumerate(data[0][0]):
+            width = column.size
+            if self.token_budget and j < self.seq_columns:
+                width = key
+            arr = np.empty((batch_size, width), column.dtype)
+            np.stack([item[j].reshape(-1)[:width] for item, _ in data], out=arr)
+            res += (arr,)
         res += (np.array(key, np.int32),)
+        self.stats[key] += (1, batch_size, lengths.sum(), batch_size * key)
         return res
 
-    def _process_remaining_data(self):
-        """process remaining data."""
-        for key in self.data_bucket.keys():
-            data = self.data_bucket[key]
-            if len(data) >= self.batch_size:
-                self.data_bucket[key] = self.data_bucket[key][self.batch_size:]
-                self.iter += 1
-                return self._package_data(data, key)
-
-        for value in self.data_bucket.values():
-            self.remaining_data += list(value)
-        self.data_bucket = dict()
-
-        if self.batch_size > len(self.remaining_data) or self.iter >= self.__len__():
-            self._init_variables()
-            raise StopIteration
-
-        remaining_data = self.remaining_data[:self.batch_size]
-        self.remaining_data = self.remaining_data[self.batch_size:]
-        self.iter += 1
-        return self._package_data(remaining_data, self.bucket_list[-1])
+    def padding_report(self):
+        """steps, sentences and the share of real tokens among the computed tokens of every bucket"""
+        lines = ['bucket dataset padding efficiency:']
+        total = np.zeros(4, np.int64)
+        for bucket, (steps, sentences, tokens, slots) in self.stats.items():
+            total += (steps, sentences, tokens, slots)
+            lines.append('  bucket {}: {} steps, {} sentences, {:.2%} real tokens'.format(
+                bucket, steps, sentences, tokens / max(slots, 1)))
+        lines.append('  total: {} steps, {} sentences, {:.2%} real tokens'.format(
+            total[0], total[1], total[2] / max(total[3], 1)))
+        return '\n'.join(lines)
 
     def __iter__(self):
         self._init_variables()
+        self.stats = {bucket: np.zeros(4, np.int64) for bucket in self.bucket_list}
         self.iterator = self.dataset.create_tuple_iterator(output_numpy=True)
         return self
 
     def __len__(self):
-        return self.dataset.get_dataset_size() // self.batch_size
+        return self.num_steps
+
+
+def _pretrain_dataset(data_files, schema_dir, columns_list, **kwargs):
+    """TFRecordDataset of data_files, or MindDataset of the MindRecord shards written by pack_pretrain_data.py"""
+    mindrecord_files = [f for f in data_files if ".mindrecord" in os.path.basename(f) and not f.endswith(".db")]
+    if mindrecord_files:
+        kwargs.pop("shard_equal_rows", None)
+        return ds.MindDataset(sorted(mindrecord_files), columns_list=columns_list, **kwargs)
+    return ds.TFRecordDataset(data_files, schema_dir if schema_dir != "" else None, columns_list=columns_list,
+                              **kwargs)
 
 
 def create_bert_dataset(device_num=1, rank=0, do_shuffle="true", data_dir=None, schema_dir=None, batch_size=32,
-                        bucket_list=None, use_packed=False):
+                        bucket_list=None, use_packed=False, token_budget=0):
     """create train dataset"""
     # apply repeat operations
     files = os.listdir(data_dir)
@@ -130,12 +236,15 @@ def create_bert_dataset(device_num=1, rank=0, do_shuffle="true", data_dir=None,
                     "masked_lm_ids", "masked_lm_weights"]
     if use_packed:
         columns_list.extend(["next_sentence_positions", "next_sentence_weights"])
-    data_set = ds.TFRecordDataset(data_files, schema_dir if schema_dir != "" else None,
-                                  columns_list=columns_list,
-                                  shuffle=ds.Shuffle.FILES if do_shuffle == "true" else False,
-                                  num_shards=device_num, shard_id=rank, shard_equal_rows=True)
+    data_set = _pretrain_dataset(data_files, schema_dir, columns_list,
+                                 shuffle=ds.Shuffle.FILES if do_shuffle == "true" else False,
+                                 num_shards=device_num, shard_id=rank, shard_equal_rows=True)
     if bucket_list:
-        bucket_dataset = BucketDatasetGenerator(data_set, batch_size, bucket_list=bucket_list)
+        # the shares of the buckets come from the same rows on every device, so all of them run the same steps
+        length_set = _pretrain_dataset(sorted(data_files), schema_dir, ["input_mask"], shuffle=False)
+        bucket_shares = bucket_length_shares(length_set, bucket_list, mask_column=0)
+        bucket_dataset = BucketDatasetGenerator(data_set, batch_size, bucket_list=bucket_list,
+                                                token_budget=token_budget, bucket_shares=bucket_shares)
         data_set = ds.GeneratorDataset(bucket_dataset,
                                        column_names=["input_ids", "input_mask", "segment_ids", "next_sentence_labels",
                                                      "masked_lm_positions", "masked_lm_ids", "masked_lm_weights",
@@ -248,8 +357,7 @@ def create_eval_dataset(batchsize=32, device_num=1, rank=0, data_dir=None, schem
                     "masked_lm_positions", "masked_lm_ids", "masked_lm_weights"]
     if use_packed:
         columns_list.extend(["next_sentence_positions", "next_sentence_weights"])
-    data_set = ds.TFRecordDataset(data_files, schema_dir if schema_dir != "" else None,
-                                  columns_list=columns_list, shard_equal_rows=True)
+    data_set = _pretrain_dataset(data_files, schema_dir, columns_list, shard_equal_rows=True)
     ori_dataset_size = data_set.get_dataset_size()
     print("origin eval size: ", ori_dataset_size)
     dtypes = data_set.output_types()
@@ -274,9 +382,8 @@ def create_eval_dataset(batchsize=32, device_num=1, rank=0, data_dir=None, schem
         sampler = ds.DistributedSampler(num_shards=device_num, shard_id=rank, shuffle=False)
         eval_ds.use_sampler(sampler)
     else:
-        eval_ds = ds.TFRecordDataset(data_files, schema_dir if schema_dir != "" else None,
-                                     columns_list=columns_list, num_shards=device_num,
-                                     shard_id=rank, shard_equal_rows=True)
+        eval_ds = _pretrain_dataset(data_files, schema_dir, columns_list, num_shards=device_num,
+                                    shard_id=rank, shard_equal_rows=True)
 
     type_cast_op = C.TypeCast(mstype.int32)
     eval_ds = eval_ds.map(input_columns="masked_lm_ids", operations=type_cast_op)
@@ -0,0 +1,263 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+
+"""
+Batched Bert inference engine.
+
+Requests are raw texts. They are converted to ids when submitted and queued to a scheduler thread, which groups them
+by the smallest bucket length that holds them. A bucket runs once it has batch_size requests or its oldest request
+has waited max_latency_ms. Every bucket always runs with [batch_size, bucket] inputs, so the network is compiled
+once per bucket, at warmup, and never while serving.
+"""
+
+import collections
+import queue
+import threading
+import time
+import unicodedata
+from concurrent.futures import Future
+
+import numpy as np
+from mindspore.common.tensor import Tensor
+
+_STOP = object()
+
+
+class CharTokenizer:
+    """
+    Character level text to ids with one lookup table over all code points. Gives the ids process_one_example_p
+    gives with a Bert tokenizer fed one character at a time: whitespace and control characters are dropped, the
+    text is lower cased and its accents stripped if do_lower_case, characters missing from the vocab are [UNK].
+
+    Args:
+        vocab_file (str): Vocab file, one token per line.
+        do_lower_case (bool): Whether to lower case the text. Default: True.
+    """
+    def __init__(self, vocab_file, do_lower_case=True):
+        vocab = {}
+        with open(vocab_file, "r", encoding="utf-8") as f:
+            for index, line in enumerate(f):
+                vocab[line.strip()] = index
+        self.do_lower_case = do_lower_case
+        self.cls_id = vocab["[CLS]"]
+        self.sep_id = vocab["[SEP]"]
+        self.unk_id = vocab["[UNK]"]
+        self.table = np.full(0x110000, self.unk_id, dtype=np.int32)
+        for token, index in vocab.items():
+            if len(token) == 1:
+                self.table[ord(token)] = index
+        dropped = ("Zs", "Cc", "Cf", "Mn") if do_lower_case else ("Zs", "Cc", "Cf")
+        self.drop = np.array([unicodedata.category(chr(code)) in dropped for code in range(0x110000)])
+        self.drop[[0, 0xfffd]] = True
+
+    def encode(self, text, max_seq_len):
+        """
+        Returns:
+            numpy.ndarray, int32 ids of [CLS] text [SEP], at most max_seq_len.
+        """
+        if self.do_lower_case:
+            text = unicodedata.normalize("NFD", text.lower())
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+        codes = codes[~self.drop[codes]][:max_seq_len - 2]
+        ids = np.empty(codes.shape[0] + 2, dtype=np.int32)
+        ids[0] = self.cls_id
+        ids[1:-1] = self.table[codes]
+        ids[-1] = self.sep_id
+        return ids
+
+
+class InferenceEngine:
+    """
+    Long running inference over a queue of text requests.
+
+    Args:
+        network (Cell): Network in eval mode, called with int32 input_ids, input_mask and token_type_id of
+                        [batch_size, length]. The first axis of its outputs is the batch.
+        tokenizer (CharTokenizer): Text to ids.
+        bucket_list (list): Sequence lengths of the compiled graphs, a request runs in the smallest one that
+                            holds it and longer requests are cut to the largest.
+        batch_size (int): Requests of one batch. Default: 32.
+        max_latency_ms (float): Longest time a request waits for its batch to fill. Default: 10.
+    """
+    def __init__(self, network, tokenizer, bucket_list, batch_size=32, max_latency_ms=10.0):
+        self.network = network
+        self.tokenizer = tokenizer
+        self.bucket_list = sorted(bucket_list)
+        self.batch_size = batch_size
+        self.max_latency = max_latency_ms / 1000.0
+        self._requests = queue.Queue()
+        self._pending = {bucket: collections.deque() for bucket in self.bucket_list}
+        self._thread = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        """forget the requests served so far"""
+        self._arrivals = []
+        self._latencies = []
+        self._finish = 0.0
+        self._batch_fill = []
+
+    def warmup(self):
+        """compile the graph of every bucket"""
+        for bucket in self.bucket_list:
+            self._run(bucket, [])
+
+    def start(self):
+        """warm up and start the scheduler thread"""
+        self.warmup()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """serve the queued requests and stop the scheduler thread"""
+        self._requests.put(_STOP)
+        self._thread.join()
+        self._thread = None
+
+    def submit(self, text):
+        """
+        Returns:
+            Future, set to the outputs of the request. Outputs with a sequence axis of the bucket length are cut to
+            the request length.
+        """
+        future = Future()
+        ids = self.tokenizer.encode(text, self.bucket_list[-1])
+        self._requests.put((ids, time.perf_counter(), future))
+        return future
+
+    def predict(self, texts):
+        """outputs of all texts, batched together"""
+        futures = [self.submit(text) for text in texts]
+        return [future.result() for future in futures]
+
+    def report(self):
+        """
+        Returns:
+            dict, number of requests, qps from the first arrival to the last result, latency percentiles in ms and
+            the mean fraction of real requests in a batch.
+        """
+        if not self._latencies:
+            return {"requests": 0}
+        latencies = np.array(self._latencies) * 1000
+        return {"requests": len(self._latencies),
+                "qps": len(self._latencies) / max(self._finish - min(self._arrivals), 1e-9),
+                "p50_ms": float(np.percentile(latencies, 50)),
+                "p99_ms": float(np.percentile(latencies, 99)),
+                "mean_ms": float(latencies.mean()),
+                "batch_fill": float(np.mean(self._batch_fill))}
+
+    def _bucket(self, length):
+        for bucket in self.bucket_list:
+            if length <= bucket:
+                return bucket
+        return self.bucket_list[-1]
+
+    def _add(self, request):
+        self._pending[self._bucket(request[0].shape[0])].append(request)
+
+    def _dispatch(self, flush=False):
+        """run the full buckets and the buckets whose oldest request is due"""
+        now = time.perf_counter()
+        for bucket, pending in self._pending.items():
+            while len(pending) >= self.batch_size:
+                self._run(bucket, [pending.popleft() for _ in range(self.batch_size)])
+            if pending and (flush or now - pending[0][1] >= self.max_latency):
+                self._run(bucket, list(pending))
+                pending.clear()
+
+    def _timeout(self):
+        """seconds until the oldest pending request is due, None if nothing is pending"""
+        oldest = [pending[0][1] for pending in self._pending.values() if pending]
+        if not oldest:
+            return None
+        return max(min(oldest) + self.max_latency - time.perf_counter(), 0.0)
+
+    def _loop(self):
+        while True:
+            try:
+                request = self._requests.get(timeout=self._timeout())
+            except queue.Empty:
+                request = None
+            stop = request is _STOP
+            # drain everything that arrived meanwhile before deciding what to run
+            while request is not None and not stop:
+                self._add(request)
+                try:
+                    request = self._requests.get_nowait()
+                except queue.Empty:
+                    request = None
+                stop = request is _STOP
+            self._dispatch(flush=stop)
+            if stop:
+                return
+
+    def _run(self, bucket, requests):
+        """run one [batch_size, bucket] batch, the rows after the requests are padding"""
+        lengths = np.array([ids.shape[0] for ids, _, _ in requests], dtype=np.int64)
+        valid = np.arange(bucket)[None, :] < lengths[:, None]
+        input_ids = np.zeros((self.batch_size, bucket), dtype=np.int32)
+        input_mask = np.zeros((self.batch_size, bucket), dtype=np.int32)
+        if requests:
+            input_ids[:len(requests)][valid] = np.concatenate([ids for ids, _, _ in requests])
+            input_mask[:len(requests)][valid] = 1
+        token_type_id = np.zeros((self.batch_size, bucket), dtype=np.int32)
+        try:
+            outputs = self.network(Tensor(input_ids), Tensor(input_mask), Tensor(token_type_id))
+            is_tuple = isinstance(outputs, (tuple, list))
+            outputs = [x.asnumpy() for x in outputs] if is_tuple else [outputs.asnumpy()]
+        except Exception as e:  # pylint: disable=broad-except
+            # fail the requests of the batch, the scheduler keeps serving the others
+            if not requests:
+                raise
+            for _, _, future in requests:
+                future.set_exception(e)
+            return
+        finish = time.perf_counter()
+        # stats first, a caller may read the report as soon as its future is set
+        if requests:
+            self._arrivals.extend(arrival for _, arrival, _ in requests)
+            self._latencies.extend(finish - arrival for _, arrival, _ in requests)
+            self._finish = finish
+            self._batch_fill.append(len(requests) / self.batch_size)
+        for k, (_, _, future) in enumerate(requests):
+            result = []
+            for output in outputs:
+                row = output[k]
+                if row.ndim >= 1 and row.shape[0] == bucket:
+                    row = row[:lengths[k]]
+                result.append(row)
+            future.set_result(tuple(result) if is_tuple else result[0])
+
+
+def run_load(engine, texts, qps, num_requests, seed=0):
+    """
+    Open loop load: num_requests texts submitted with Poisson arrivals at qps, texts are used in turn.
+
+    Returns:
+        dict, the engine report of the run.
+    """
+    engine.reset_stats()
+    gaps = np.random.RandomState(seed).exponential(1.0 / qps, num_requests)
+    futures = []
+    due = time.perf_counter()
+    for k, gap in enumerate(gaps):
+        due += gap
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        futures.append(engine.submit(texts[k % len(texts)]))
+    for future in futures:
+        future.result()
+    return engine.report()
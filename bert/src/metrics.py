@@ -0,0 +1,122 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+
+"""
+Vectorized metric states for evaluation.
+
+Every state is updated batch by batch and can be merged with the state of another shard of the same evaluation,
+so evaluation can be split over workers and combined: merging the states of all shards gives the state of the
+whole dataset.
+"""
+
+import numpy as np
+
+
+class ConfusionMatrix:
+    """
+    Counts of (label, prediction) pairs, accumulated with one bincount per batch.
+
+    Args:
+        num_labels (int): Number of classes, labels and predictions are in [0, num_labels).
+    """
+    def __init__(self, num_labels):
+        self.num_labels = num_labels
+        self.counts = np.zeros((num_labels, num_labels), dtype=np.int64)
+
+    def update(self, predictions, labels):
+        """add the pairs of two arrays of class ids of the same size"""
+        predictions = np.reshape(predictions, -1).astype(np.int64)
+        labels = np.reshape(labels, -1).astype(np.int64)
+        self.counts += np.bincount(labels * self.num_labels + predictions,
+                                   minlength=self.num_labels * self.num_labels).reshape(self.counts.shape)
+
+    def merge(self, other):
+        """add the counts of another shard"""
+        self.counts += other.counts
+        return self
+
+    def true_positives(self):
+        return np.diag(self.counts)
+
+    def false_positives(self):
+        return self.counts.sum(axis=0) - np.diag(self.counts)
+
+    def false_negatives(self):
+        return self.counts.sum(axis=1) - np.diag(self.counts)
+
+    def f1_scores(self):
+        """
+        Returns:
+            numpy.ndarray, F1 score of every class, nan for classes neither predicted nor labeled.
+        """
+        tp = self.true_positives()
+        denominator = 2 * tp + self.false_positives() + self.false_negatives()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(denominator > 0, 2 * tp / np.maximum(denominator, 1), np.nan)
+
+    def macro_f1(self):
+        """mean F1 score of the classes that are predicted or labeled"""
+        scores = self.f1_scores()
+        return float(np.nanmean(scores)) if not np.isnan(scores).all() else 0.0
+
+
+def rankdata(values):
+    """
+    Ranks starting at 1 in O(n log n), tied values get the mean of their ranks.
+    """
+    values = np.reshape(values, -1)
+    order = np.argsort(values, kind="mergesort")
+    sorted_values = values[order]
+    # first position of every run of equal values
+    starts = np.concatenate([[True], sorted_values[1:] != sorted_values[:-1]])
+    run = np.cumsum(starts) - 1
+    run_starts = np.flatnonzero(starts)
+    run_ends = np.concatenate([run_starts[1:], [values.shape[0]]])
+    ranks = np.empty(values.shape[0], dtype=np.float64)
+    ranks[order] = (run_starts + run_ends + 1)[run] / 2.0
+    return ranks
+
+
+class RankCorrelation:
+    """
+    Spearman rank correlation. Ranks need all values, so the state keeps the values of every batch.
+    """
+    def __init__(self):
+        self.predictions = []
+        self.labels = []
+
+    def update(self, predictions, labels):
+        self.predictions.append(np.reshape(predictions, -1).astype(np.float64))
+        self.labels.append(np.reshape(labels, -1).astype(np.float64))
+
+    def merge(self, other):
+        """append the values of another shard"""
+        self.predictions.extend(other.predictions)
+        self.labels.extend(other.labels)
+        return self
+
+    def spearman(self):
+        """
+        Returns:
+            float, Pearson correlation of the ranks, 1 - 6 * sum(d ** 2) / (n * (n ** 2 - 1)) without ties.
+        """
+        prediction_ranks = rankdata(np.concatenate(self.predictions))
+        label_ranks = rankdata(np.concatenate(self.labels))
+        prediction_ranks -= prediction_ranks.mean()
+        label_ranks -= label_ranks.mean()
+        denominator = np.sqrt((prediction_ranks ** 2).sum() * (label_ranks ** 2).sum())
+        if denominator == 0:
+            return 0.0
+        return float((prediction_ranks * label_ranks).sum() / denominator)
@@ -158,6 +158,7 @@ def extra_operations(cfg):
         else:
             pass
         _bert_net_cfg.use_packed = cfg.use_packed
+        _bert_net_cfg.attention_block_size = cfg.attention_block_size
         cfg.bert_net_cfg = BertConfig(**_bert_net_cfg.__dict__)
     elif cfg.description == 'run_ner':
         cfg.optimizer_cfg.AdamWeightDecay.decay_filter = \
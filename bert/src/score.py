@@ -19,6 +19,21 @@ Calculate average F1 score among labels.
 
 import json
 
+def _count_label(pre_lines, gold_lines, label):
+    """TP, FP and FN of one label, from set operations on the entity keys of every line"""
+    TP = 0
+    FP = 0
+    FN = 0
+    for pre_line, gold_line in zip(pre_lines, gold_lines):
+        pre_entities = pre_line.get(label, {}).keys()
+        gold_entities = gold_line.get(label, {}).keys()
+        matched = len(pre_entities & gold_entities)
+        TP += matched
+        FP += len(pre_entities) - matched
+        FN += len(gold_entities) - matched
+    return TP, FP, FN
+
+
 def get_f1_score_for_each_label(pre_lines, gold_lines, label):
     """
     Get F1 score for each label.
@@ -30,26 +45,43 @@ def get_f1_score_for_each_label(pre_lines, gold_lines, label):
     Returns:
         F1 score for this label.
     """
-    TP = 0
-    FP = 0
-    FN = 0
-    index = 0
-    while index < len(pre_lines):
-        pre_line = pre_lines[index].get(label, {})
-        gold_line = gold_lines[index].get(label, {})
-        for sample in pre_line:
-            if sample in gold_line:
-                TP += 1
-            else:
-                FP += 1
-        for sample in gold_line:
-            if sample not in pre_line:
-                FN += 1
-        index += 1
+    TP, FP, FN = _count_label(pre_lines, gold_lines, label)
     f1 = 2 * TP / (2 * TP + FP + FN)
     return f1
 
 
+def merge_counts(counts, other):
+    """
+    Merge the per label counts of two shards of the prediction lines.
+    Args:
+        counts, other: dicts of label -> (TP, FP, FN), see count_labels.
+
+    Returns:
+        dict, label -> summed (TP, FP, FN).
+    """
+    merged = dict(counts)
+    for label, (TP, FP, FN) in other.items():
+        old_TP, old_FP, old_FN = merged.get(label, (0, 0, 0))
+        merged[label] = (old_TP + TP, old_FP + FP, old_FN + FN)
+    return merged
+
+
+def count_labels(labels, pre_lines, gold_lines):
+    """
+    Count TP, FP and FN of every label, the counts of shards of the lines can be merged with merge_counts.
+    Args:
+        labels: list of labels.
+        pre_lines: listed label info from pre_file.
+        gold_lines: listed label info from gold_file.
+
+    Returns:
+        dict, label -> (TP, FP, FN).
+    """
+    if len(pre_lines) != len(gold_lines):
+        raise ValueError("pre file and gold file have different line count.")
+    return {label: _count_label(pre_lines, gold_lines, label) for label in labels}
+
+
 def get_f1_score(labels, pre_file, gold_file):
     """
     Get F1 scores for each label.
@@ -61,13 +93,27 @@ def get_f1_score(labels, pre_file, gold_file):
     Returns:
         average F1 score on all labels.
     """
-    pre_lines = [json.loads(line.strip())['label'] for line in open(pre_file) if line.strip()]
-    gold_lines = [json.loads(line.strip())['label'] for line in open(gold_file) if line.strip()]
-    if len(pre_lines) != len(gold_lines):
-        raise ValueError("pre file and gold file have different line count.")
+    with open(pre_file) as f:
+        pre_lines = [json.loads(line.strip())['label'] for line in f if line.strip()]
+    with open(gold_file) as f:
+        gold_lines = [json.loads(line.strip())['label'] for line in f if line.strip()]
+    return get_f1_score_from_counts(labels, count_labels(labels, pre_lines, gold_lines))
+
+
+def get_f1_score_from_counts(labels, counts):
+    """
+    Average F1 score on all labels from merged counts.
+    Args:
+        labels: list of labels.
+        counts: dict of label -> (TP, FP, FN), see count_labels.
+
+    Returns:
+        average F1 score on all labels.
+    """
     f1_sum = 0
     for label in labels:
-        f1 = get_f1_score_for_each_label(pre_lines, gold_lines, label)
+        TP, FP, FN = counts.get(label, (0, 0, 0))
+        f1 = 2 * TP / (2 * TP + FP + FN)
         print('label: %s, F1: %.6f' % (label, f1))
         f1_sum += f1
 
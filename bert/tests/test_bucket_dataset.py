@@ -0,0 +1,83 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""batches of BucketDatasetGenerator"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip("mindspore")
+
+from src.dataset import BucketDatasetGenerator  # pylint: disable=wrong-import-position
+
+BUCKETS = [128, 256, 384, 512]
+
+
+class _LengthDataset:
+    """rows of input_ids, input_mask, segment_ids and a label with sentences of the given lengths"""
+
+    def __init__(self, lengths, seq_length=512):
+        self.lengths = lengths
+        self.seq_length = seq_length
+
+    def get_dataset_size(self):
+        return len(self.lengths)
+
+    def create_tuple_iterator(self, num_epochs=1, output_numpy=True):
+        for length in self.lengths:
+            mask = (np.arange(self.seq_length) < length).astype(np.int32)
+            yield mask * 7, mask, np.zeros(self.seq_length, np.int32), np.array([length], np.int32)
+
+
+def _lengths(distribution, num_samples=3000):
+    """sentence lengths with a share of short sentences, the others 400 to 512 tokens"""
+    rng = np.random.RandomState(0)
+    short_share = {"all_long": 0.0, "short_2": 0.02, "short_10": 0.1, "all_short": 1.0}[distribution]
+    short = rng.rand(num_samples) < short_share
+    return np.where(short, rng.randint(20, 100, num_samples), rng.randint(400, 513, num_samples))
+
+
+def _run_epoch(generator):
+    steps, sentences = {bucket: 0 for bucket in BUCKETS}, 0
+    for batch in generator:
+        key = int(batch[-1])
+        assert batch[0].shape[0] == generator.bucket_batch_size[key]
+        assert np.count_nonzero(batch[1], axis=1).max() <= key
+        steps[key] += 1
+        sentences += batch[0].shape[0]
+    return steps, sentences
+
+
+@pytest.mark.parametrize("token_budget", [0, 8192])
+@pytest.mark.parametrize("distribution", ["all_long", "short_2", "short_10", "all_short"])
+def test_every_step_is_served(distribution, token_budget):
+    """the epoch yields the len() steps whatever the lengths, in two epochs in a row"""
+    lengths = _lengths(distribution)
+    generator = BucketDatasetGenerator(_LengthDataset(lengths), 32, BUCKETS, token_budget=token_budget)
+    if not token_budget:
+        assert len(generator) == len(lengths) // 32
+    for _ in range(2):
+        steps, sentences = _run_epoch(generator)
+        assert sum(steps.values()) == len(generator)
+        assert 0.95 * len(lengths) < sentences <= len(lengths)
+
+
+def test_token_budget_follows_lengths():
+    """short sentences run in the short bucket instead of the padded longest one"""
+    lengths = _lengths("all_short")
+    generator = BucketDatasetGenerator(_LengthDataset(lengths), 32, BUCKETS, token_budget=8192)
+    steps, sentences = _run_epoch(generator)
+    assert steps[512] == 0
+    assert steps[128] == len(generator)
+    assert sentences == len(generator) * generator.bucket_batch_size[128]
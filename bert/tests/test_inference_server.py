@@ -0,0 +1,55 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""failures of the network in InferenceEngine"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip("mindspore")
+
+from src.inference_server import InferenceEngine  # pylint: disable=wrong-import-position
+
+
+class _Tokenizer:
+    def encode(self, text, max_seq_len):
+        return np.arange(1, min(len(text), max_seq_len) + 1, dtype=np.int32)
+
+
+class _Network:
+    """identity on input_ids, raises on the longest bucket once fail is set"""
+    def __init__(self):
+        self.fail = False
+
+    def __call__(self, input_ids, input_mask, token_type_id):
+        if self.fail and input_ids.shape[1] == 16:
+            raise RuntimeError("device error")
+        return input_ids
+
+
+def test_network_error_fails_its_batch_only():
+    network = _Network()
+    engine = InferenceEngine(network, _Tokenizer(), [8, 16], batch_size=2, max_latency_ms=1.0)
+    engine.start()
+    try:
+        network.fail = True
+        failing = engine.submit("a" * 12)
+        with pytest.raises(RuntimeError, match="device error"):
+            failing.result(timeout=10)
+        assert engine._thread.is_alive()  # pylint: disable=protected-access
+        assert engine.predict(["abc"])[0].tolist() == [1, 2, 3]
+        network.fail = False
+        assert engine.predict(["a" * 12])[0].shape == (12,)
+    finally:
+        engine.stop()
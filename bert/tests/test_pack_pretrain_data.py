@@ -0,0 +1,38 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""pack assignment of pack_pretrain_data.py"""
+
+import numpy as np
+import pytest
+
+from pack_pretrain_data import assign_packs
+
+
+@pytest.mark.parametrize("max_sequences_per_pack", [1, 2, 3])
+def test_every_sequence_fits_its_pack(max_sequences_per_pack):
+    lengths = np.random.RandomState(0).randint(1, 513, 5000)
+    pack, slot, num_packs = assign_packs(lengths, 512, max_sequences_per_pack)
+    assert pack.min() == 0 and pack.max() == num_packs - 1
+    assert np.bincount(pack, weights=lengths).max() <= 512
+    assert np.bincount(pack).max() <= max_sequences_per_pack
+    # the slots of a pack are 0 .. k - 1
+    order = np.lexsort((slot, pack))
+    first = np.searchsorted(pack[order], pack[order])
+    np.testing.assert_array_equal(slot[order], np.arange(len(lengths)) - first)
+
+
+def test_sequence_longer_than_pack_is_rejected():
+    with pytest.raises(ValueError):
+        assign_packs(np.array([100, 200, 60, 30]), 128, 3)
@@ -0,0 +1,454 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""micro benchmarks for the PointRCNN host side utilities"""
+
+import argparse
+import importlib.util
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+parser = argparse.ArgumentParser(description="PointRCNN micro benchmarks")
+parser.add_argument('--case',
+                    type=str,
+                    default='all',
+                    help='benchmark to run, "all" runs every benchmark')
+parser.add_argument('--repeat',
+                    type=int,
+                    default=20,
+                    help='number of timed repetitions')
+parser.add_argument('--batch_size',
+                    type=int,
+                    default=2,
+                    help='batch size of the synthetic point clouds')
+
+
+def timeit(func, repeat):
+    """return the median wall time of func in milliseconds"""
+    func()  # warm up
+    costs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        costs.append((time.perf_counter() - start) * 1000.0)
+    return float(np.median(costs))
+
+
+def bench_op_lookup(args):
+    """
+    Host overhead of resolving the custom ops used by one RPN forward step,
+    with an empty op cache (the behaviour before ops were cached) and with
+    a warm cache.
+    """
+    import mindspore as ms
+    from src.lib.config import cfg
+    from src.layer_utils import (get_func_from_so, clear_op_cache,
+                                 shape_of_input, fixed_tail_shape)
+
+    so_name = "pointnet2_cuda"
+    calls = []
+    for npoint, nsamples in zip(cfg.RPN.SA_CONFIG.NPOINTS,
+                                cfg.RPN.SA_CONFIG.NSAMPLE):
+        calls.append(("furthest_point_sampling_wrapper",
+                      fixed_tail_shape(3, 1, npoint), ms.int32))
+        calls.append(("gather_points_wrapper_fast",
+                      shape_of_input(4, 0, 1, (5, 1)), ms.float32))
+        for nsample in nsamples:
+            calls.append(("ball_query_wrapper_fast",
+                          fixed_tail_shape(5, 2, nsample), ms.int32))
+            calls.extend([("group_points_wrapper_fast",
+                           shape_of_input(5, 0, 1, (6, 1), (6, 2)),
+                           ms.float32)] * 2)
+    for _ in cfg.RPN.FP_MLPS:
+        calls.append(("three_interpolate_wrapper_fast",
+                      shape_of_input(4, 0, 1, (5, 1)), ms.float32))
+
+    def one_step(cold):
+        for func_name, out_shape, out_dtype in calls:
+            if cold:
+                clear_op_cache()
+            get_func_from_so(so_name,
+                             func_name,
+                             out_shape=out_shape,
+                             out_dtype=out_dtype)
+
+    cold = timeit(lambda: one_step(True), args.repeat)
+    warm = timeit(lambda: one_step(False), args.repeat)
+    print('op lookup per RPN step (%d ops): uncached %.3f ms, cached %.3f ms'
+          % (len(calls), cold, warm))
+
+
+def _random_scene(batch_size, num_points, seed=0):
+    """points spread like a KITTI front view in rect camera coords"""
+    rng = np.random.RandomState(seed)
+    low, high = np.array([-40, -1, 0]), np.array([40, 3, 70.4])
+    return (low + rng.rand(batch_size, num_points, 3) *
+            (high - low)).astype(np.float32)
+
+
+def _cuda_reference(cuda_func):
+    """run cuda_func with the compiled ops, None if they are not available"""
+    from src.lib.config import cfg
+    backend = cfg.OPS_BACKEND
+    cfg.OPS_BACKEND = 'cuda'
+    try:
+        return cuda_func()
+    except Exception:  # pylint: disable=broad-except
+        return None
+    finally:
+        cfg.OPS_BACKEND = backend
+
+
+def bench_cpu_ops(args):
+    """
+    Throughput of the NumPy kernels of the CPU backend on one RPN sized batch
+    against the MindSpore reference functions of pointnet2_utils, with parity
+    checks against the reference and, when they can be loaded, the CUDA ops.
+    """
+    import mindspore as ms
+    from mindspore import ops
+    import src.cpu_ops as cpu_ops
+    from src.lib.config import cfg
+    from src import layer_utils
+    sys.path.append(os.path.join(os.path.dirname(__file__),
+                                 'src/pointnet2_lib/src'))
+    import pointnet2_utils
+
+    xyz = _random_scene(args.batch_size, cfg.RPN.NUM_POINTS)
+    npoint = cfg.RPN.SA_CONFIG.NPOINTS[0]
+    radius = cfg.RPN.SA_CONFIG.RADIUS[0][0]
+    nsample = cfg.RPN.SA_CONFIG.NSAMPLE[0][0]
+    xyz_t = ms.Tensor(xyz)
+
+    fps_idx = cpu_ops.furthest_point_sample(xyz, npoint)
+    new_xyz = cpu_ops.gather_points(xyz.transpose(0, 2, 1),
+                                    fps_idx).transpose(0, 2, 1).copy()
+    new_xyz_t = ms.Tensor(new_xyz)
+    ball_idx = cpu_ops.ball_query(radius, nsample, xyz, new_xyz)
+
+    # parity: the reference keeps the largest indices of a ball, so compare
+    # the neighbor sets of the balls holding at most nsample points
+    ref_idx = pointnet2_utils.query_ball_point(radius, nsample, xyz_t,
+                                               new_xyz_t).asnumpy()
+    dist2 = cpu_ops.pairwise_dist2(new_xyz[0], xyz[0])
+    small = np.nonzero((dist2 < np.float32(radius)**2).sum(1) <= nsample)[0]
+    mismatch = sum(
+        set(ball_idx[0, i]) != set(ref_idx[0, i]) for i in small)
+    print('ball_query parity vs query_ball_point: %d / %d balls differ'
+          % (mismatch, len(small)))
+
+    _, ref_nn = ops.TopK(sorted=True)(-pointnet2_utils.square_distance(
+        xyz_t, new_xyz_t), 3)
+    _, nn_idx = cpu_ops.three_nn(xyz, new_xyz)
+    print('three_nn parity vs square_distance: %.4f%% indices differ'
+          % (100.0 * np.mean(nn_idx != ref_nn.asnumpy())))
+
+    cuda_idx = _cuda_reference(
+        lambda: layer_utils.BallQuery()(radius, nsample, xyz_t,
+                                        new_xyz_t).asnumpy())
+    if cuda_idx is None:
+        print('CUDA ops not available, skip parity against the kernels')
+    else:
+        print('ball_query parity vs CUDA: %d indices differ'
+              % np.sum(cuda_idx != ball_idx))
+
+    def bench(name, func, ref=None):
+        cost = timeit(func, args.repeat)
+        line = '%-18s numpy %9.2f ms  %8.1f samples/s' % (
+            name, cost, args.batch_size * 1000.0 / cost)
+        if ref is not None:
+            ref_cost = timeit(ref, args.repeat)
+            line += '  | reference %9.2f ms (x%.2f)' % (ref_cost,
+                                                       ref_cost / cost)
+        print(line)
+
+    features = np.random.rand(args.batch_size, 64,
+                              xyz.shape[1]).astype(np.float32)
+    _, nn_idx = cpu_ops.three_nn(new_xyz, xyz)
+    weight = np.full(nn_idx.shape, 1.0 / 3, np.float32)
+    bench('furthest_point', lambda: cpu_ops.furthest_point_sample(xyz, npoint))
+    bench('ball_query',
+          lambda: cpu_ops.ball_query(radius, nsample, xyz, new_xyz),
+          lambda: pointnet2_utils.query_ball_point(radius, nsample, xyz_t,
+                                                   new_xyz_t).asnumpy())
+    bench('group_points', lambda: cpu_ops.group_points(features, ball_idx),
+          lambda: pointnet2_utils.index_points(
+              xyz_t, ms.Tensor(ball_idx)).asnumpy())
+    bench('three_nn', lambda: cpu_ops.three_nn(xyz, new_xyz),
+          lambda: ops.TopK(sorted=True)(-pointnet2_utils.square_distance(
+              xyz_t, new_xyz_t), 3)[1].asnumpy())
+    bench('three_interpolate',
+          lambda: cpu_ops.three_interpolate(features, nn_idx, weight))
+
+    rng = np.random.RandomState(1)
+    centers = rng.uniform(-30, 30, (512, 2))
+    size = rng.uniform(1.5, 4.5, (512, 2))
+    boxes = np.concatenate([centers - size / 2, centers + size / 2,
+                            rng.uniform(-np.pi, np.pi, (512, 1))],
+                           axis=1).astype(np.float32)
+    scores = rng.rand(512).astype(np.float32)
+    bench('boxes_iou_bev', lambda: cpu_ops.boxes_iou_bev(boxes, boxes[:50]))
+    bench('nms', lambda: cpu_ops.nms(boxes, scores, 0.8))
+    boxes3d = np.concatenate([
+        rng.uniform(-30, 30, (64, 1)), rng.uniform(0, 2, (64, 1)),
+        rng.uniform(5, 60, (64, 1)), rng.uniform(1.4, 1.8, (64, 1)),
+        rng.uniform(1.5, 2, (64, 1)), rng.uniform(3, 5, (64, 1)),
+        rng.uniform(-np.pi, np.pi, (64, 1))], axis=1).astype(np.float32)
+    bench('roipool3d',
+          lambda: cpu_ops.roipool3d(xyz[0], features[0].T, boxes3d,
+                                    cfg.RCNN.NUM_POINTS))
+
+
+def _peak_mb(func):
+    """peak memory allocated by func in MB"""
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 2**20
+
+
+def bench_ball_query_grid(args):
+    """
+    Latency and peak memory of the ball queries of the first RPN SA layer
+    (every radius of the layer) by point count: brute force ball_query per
+    radius against one voxel hashed neighborhood shared by the radii. The
+    B x npoint x N matrix of square_distance is listed for reference.
+    """
+    import src.cpu_ops as cpu_ops
+    from src.lib.config import cfg
+
+    radii = cfg.RPN.SA_CONFIG.RADIUS[0]
+    nsamples = cfg.RPN.SA_CONFIG.NSAMPLE[0]
+    print('radii %s, nsample %s, npoint = N / 4' % (radii, nsamples))
+    for num_points in (4096, 16384, 65536):
+        xyz = _random_scene(args.batch_size, num_points)
+        npoint = num_points // 4
+        new_xyz = cpu_ops.gather_points(
+            xyz.transpose(0, 2, 1),
+            cpu_ops.furthest_point_sample(xyz, npoint)).transpose(0, 2,
+                                                                  1).copy()
+
+        def brute():
+            return [cpu_ops.ball_query(r, n, xyz, new_xyz)
+                    for r, n in zip(radii, nsamples)]
+
+        def grid():
+            neighborhoods = cpu_ops.build_neighborhoods(xyz, new_xyz,
+                                                        max(radii))
+            return [cpu_ops.ball_query_neighborhoods(neighborhoods, r, n)
+                    for r, n in zip(radii, nsamples)]
+
+        same = all((a == b).all() for a, b in zip(brute(), grid()))
+        repeat = max(1, args.repeat // 4)
+        brute_ms, grid_ms = timeit(brute, repeat), timeit(grid, repeat)
+        print('N %6d: brute %9.2f ms %8.1f MB | grid %8.2f ms %7.1f MB | '
+              'square_distance %8.1f MB | x%.1f, identical %s'
+              % (num_points, brute_ms, _peak_mb(brute), grid_ms,
+                 _peak_mb(grid), args.batch_size * npoint * num_points * 4 /
+                 2**20, brute_ms / grid_ms, same))
+
+
+def _random_boxes3d(num_boxes, seed=0):
+    """(M, 7) car sized boxes scattered over the scene of _random_scene"""
+    rng = np.random.RandomState(seed)
+    return np.concatenate([
+        rng.uniform(-35, 35, (num_boxes, 1)), rng.uniform(1, 2, (num_boxes, 1)),
+        rng.uniform(5, 65, (num_boxes, 1)), rng.uniform(1.4, 1.8, (num_boxes, 1)),
+        rng.uniform(1.5, 2, (num_boxes, 1)), rng.uniform(3, 5, (num_boxes, 1)),
+        rng.uniform(-np.pi, np.pi, (num_boxes, 1))], axis=1).astype(np.float32)
+
+
+def bench_points_in_boxes(args):
+    """
+    Points-in-boxes masks of a KITTI sized scene: one Delaunay in_hull per
+    box against the batched oriented box test of pts_in_boxes3d.
+    """
+    import src.lib.utils.kitti_utils as kitti_utils
+
+    num_points = 16384 * 4
+    pts = _random_scene(1, num_points)[0]
+    for num_boxes in (50, 100, 200):
+        boxes3d = _random_boxes3d(num_boxes)
+        # sample points inside the boxes so that the masks are not empty
+        pts[:num_boxes * 64] = np.repeat(boxes3d[:, 0:3], 64, axis=0) + \
+            np.random.RandomState(1).uniform(-1, 1, (num_boxes * 64, 3)) * \
+            np.array([2, 0.8, 2], np.float32)
+        corners = kitti_utils.boxes3d_to_corners3d(boxes3d, rotate=True)
+
+        def hull():
+            return np.stack([kitti_utils.in_hull(pts, box_corners)
+                             for box_corners in corners])
+
+        def batched():
+            return kitti_utils.pts_in_boxes3d(pts, boxes3d)
+
+        # points on the faces may fall either way in the triangulation
+        diff = np.sum(hull() != batched())
+        repeat = max(1, args.repeat // 4)
+        hull_ms, batched_ms = timeit(hull, repeat), timeit(batched, repeat)
+        print('N %d, M %3d: in_hull %9.2f ms | pts_in_boxes3d %8.2f ms | '
+              'x%.1f, %d / %d flags differ (%d inside)'
+              % (num_points, num_boxes, hull_ms, batched_ms,
+                 hull_ms / batched_ms, diff, num_boxes * num_points,
+                 batched().sum()))
+
+
+def bench_iou3d(args):
+    """
+    3D / BEV IoU of proposals against 50 gt boxes: the shapely double loop
+    of the former get_iou3d (timed once, when shapely is installed) against
+    the batched polygon clipping of get_iou3d_bev.
+    """
+    import src.lib.utils.kitti_utils as kitti_utils
+
+    gt_boxes3d = _random_boxes3d(50)
+    gt_corners = kitti_utils.boxes3d_to_corners3d(gt_boxes3d)
+    rng = np.random.RandomState(2)
+    for num_rois in (512, 9000):
+        # proposals jittered around the gt boxes, as in recall evaluation
+        rois = gt_boxes3d[rng.randint(0, 50, num_rois)].copy()
+        rois[:, 0:3] += rng.normal(0, 0.5, (num_rois, 3))
+        rois[:, 3:6] *= rng.uniform(0.8, 1.2, (num_rois, 3))
+        rois[:, 6] += rng.normal(0, 0.3, num_rois)
+        roi_corners = kitti_utils.boxes3d_to_corners3d(rois.astype(np.float32))
+
+        def batched():
+            return kitti_utils.get_iou3d_bev(roi_corners, gt_corners)
+
+        cost = timeit(batched, max(1, args.repeat // 4))
+        line = '%5d x 50: batched %8.2f ms' % (num_rois, cost)
+        if importlib.util.find_spec('shapely') is None:
+            print(line + ' | shapely not installed')
+            continue
+        start = time.perf_counter()
+        ref = _shapely_iou3d(roi_corners, gt_corners)
+        ref_cost = (time.perf_counter() - start) * 1000.0
+        iou3d, iou_bev = batched()
+        print(line + ' | shapely %9.2f ms | x%.1f, max abs diff 3d %.2e '
+              'bev %.2e' % (ref_cost, ref_cost / cost,
+                            np.abs(iou3d - ref[0]).max(),
+                            np.abs(iou_bev - ref[1]).max()))
+
+
+def _shapely_iou3d(corners_a, corners_b):
+    """reference IoU of every pair with shapely polygons"""
+    from shapely.geometry import Polygon
+    iou3d = np.zeros((corners_a.shape[0], corners_b.shape[0]), np.float32)
+    iou_bev = np.zeros_like(iou3d)
+    polys_b = [Polygon(c[0:4, [0, 2]]) for c in corners_b]
+    for i, corners in enumerate(corners_a):
+        poly_a = Polygon(corners[0:4, [0, 2]])
+        height_a = corners[0, 1] - corners[4, 1]
+        for j, poly_b in enumerate(polys_b):
+            overlap = poly_a.intersection(poly_b).area
+            if overlap <= 0:
+                continue
+            height_b = corners_b[j, 0, 1] - corners_b[j, 4, 1]
+            h_overlap = max(0.0, min(corners[0, 1], corners_b[j, 0, 1]) -
+                            max(corners[4, 1], corners_b[j, 4, 1]))
+            iou_bev[i, j] = overlap / (poly_a.area + poly_b.area - overlap)
+            iou3d[i, j] = overlap * h_overlap / (
+                poly_a.area * height_a + poly_b.area * height_b -
+                overlap * h_overlap)
+    return iou3d, iou_bev
+
+
+def _concat_collate(cols, columns, pad_cols):
+    """collation of the former batchpad: concatenate and a padding loop"""
+    ans = []
+    batch_size = len(columns[0])
+    for col, values in zip(cols, columns):
+        if col in pad_cols:
+            max_gt = max(1, max(len(x) for x in values))
+            boxes = np.zeros((batch_size, max_gt, 7), dtype=np.float32)
+            for k in range(batch_size):
+                boxes[k, :len(values[k]), :] = values[k]
+            ans.append(boxes)
+            continue
+        ans.append(np.concatenate([x[np.newaxis, ...] for x in values],
+                                  axis=0))
+    return ans
+
+
+def bench_collate(args):
+    """
+    Collation of RPN training batches: the former concatenate and padding
+    loop against BatchCollator, time and memory allocated per batch. The
+    last batches are kept alive as in the prefetch queue of the loader.
+    """
+    from collections import deque
+    from src.lib.datasets.batch_collator import BatchCollator
+
+    cols = ['sample_id', 'pts_input', 'pts_rect', 'pts_features',
+            'rpn_cls_label', 'rpn_reg_label', 'gt_boxes3d']
+    rng = np.random.RandomState(3)
+    for batch_size in (4, 16):
+        scenes = _random_scene(batch_size, 16384)
+        columns = [[np.int32(k) for k in range(batch_size)],
+                   list(scenes), list(scenes), [x[:, 0:1] for x in scenes],
+                   [rng.randint(-1, 2, 16384).astype(np.int32)
+                    for _ in range(batch_size)],
+                   [rng.rand(16384, 7).astype(np.float32)
+                    for _ in range(batch_size)],
+                   [_random_boxes3d(rng.randint(0, 30), seed=k)
+                    for k in range(batch_size)], None]
+        collator = BatchCollator(cols, pad_cols=['gt_boxes3d'], min_pad=1)
+        queue = deque(maxlen=collator.num_slots)
+
+        def concat():
+            batch = _concat_collate(cols, columns, ['gt_boxes3d'])
+            queue.append(batch)
+            return batch
+
+        def ring():
+            batch = collator(*columns)
+            queue.append(batch)
+            return batch
+
+        diff = max(np.abs(a.astype(np.float64) - b).max()
+                   for a, b in zip(concat(), ring()))
+        concat_ms, ring_ms = timeit(concat, args.repeat), \
+            timeit(ring, args.repeat)
+        print('B %2d: concatenate %7.2f ms %7.2f MB | collator %7.2f ms '
+              '%7.2f MB | max abs diff %.1e'
+              % (batch_size, concat_ms, _peak_mb(concat), ring_ms,
+                 _peak_mb(ring), diff))
+
+
+BENCHMARKS = {
+    'op_lookup': bench_op_lookup,
+    'cpu_ops': bench_cpu_ops,
+    'ball_query_grid': bench_ball_query_grid,
+    'points_in_boxes': bench_points_in_boxes,
+    'iou3d': bench_iou3d,
+    'collate': bench_collate,
+}
+
+
+def main():
+    """run the selected benchmarks"""
+    args = parser.parse_args()
+    names = list(BENCHMARKS) if args.case == 'all' else args.case.split(',')
+    for name in names:
+        print('==> %s' % name)
+        BENCHMARKS[name](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -28,6 +28,7 @@ from mindspore import ops
 
 from src.lib.net.point_rcnn import PointRCNN
 from src.lib.datasets.kitti_rcnn_dataset import KittiRCNNDataset
+from src.lib.datasets.rpn_feature_store import is_rpn_feature_store
 from src.datautil import batchpad
 import src.train_utils.train_utils as train_utils
 from src.lib.utils.bbox_transform import decode_bbox_target
@@ -36,6 +37,8 @@ from src.kitti_object_eval_python.evaluate import evaluate as kitti_evaluate
 from src.lib.config import cfg, cfg_from_file, save_config_to_file, cfg_from_list
 import src.lib.utils.kitti_utils as kitti_utils
 import src.lib.utils.iou3d.iou3d_utils as iou3d_utils
+from src.lib.utils.eval_writer import (AsyncWriter, RecallMeter, SumMeter,
+                                       FrameRate, to_numpy)
 
 np.random.seed(1024)  # set the same seed
 
@@ -121,8 +124,21 @@ parser.add_argument(
     type=str,
     default=None,
     help=
-    'specify the saved features for rcnn evaluation when using rcnn_offline mode'
+    'specify the saved features or feature store for rcnn evaluation when using rcnn_offline mode'
 )
+parser.add_argument(
+    "--sample_store_dir",
+    type=str,
+    default=None,
+    help='read the split from a store packed by src/generate_sample_store.py')
+parser.add_argument('--writer_workers',
+                    type=int,
+                    default=4,
+                    help='threads writing results and metrics, 0 writes inline')
+parser.add_argument('--writer_queue',
+                    type=int,
+                    default=64,
+                    help='max number of result jobs waiting for a writer')
 parser.add_argument('--set',
                     dest='set_cfgs',
                     default=None,
@@ -178,6 +194,20 @@ def save_kitti_format(sample_id, calib, bbox3d, kitti_output_dir, scores,
                 file=f)
 
 
+def save_kitti_sample(dataset, sample_id, bbox3d, kitti_output_dir, scores):
+    """save kitti format, run by the result writer"""
+    calib = dataset.get_calib(sample_id)
+    image_shape = dataset.get_image_shape(sample_id)
+    save_kitti_format(sample_id, calib, to_numpy(bbox3d), kitti_output_dir,
+                      to_numpy(scores), image_shape)
+
+
+def make_writer():
+    """result writer configured by the command line"""
+    return AsyncWriter(num_workers=args.writer_workers,
+                       max_pending=args.writer_queue)
+
+
 def save_rpn_features(seg_result, rpn_scores_raw, pts_features, backbone_xyz,
                       backbone_features, kitti_features_dir, sample_id):
     """save rpn features"""
@@ -265,9 +295,12 @@ def eval_one_epoch_rpn(model, dataloader, epoch_id, result_dir, logger):
     logger.info('---- EPOCH %s RPN EVALUATION ----' % epoch_id)
 
     thresh_list = [0.1, 0.3, 0.5, 0.7, 0.9]
-    total_recalled_bbox_list, total_gt_bbox = [0] * 5, 0
+    recall_meter = RecallMeter(thresh_list)
+    iou_meter = SumMeter('rpn_iou')
     dataset = dataloader.dataset
-    cnt = max_num = rpn_iou_avg = 0
+    cnt = max_num = 0
+    frame_rate = FrameRate()
+    writer = make_writer()
 
     progress_bar = tqdm.tqdm(total=len(dataloader), leave=True, desc='eval')
 
@@ -291,7 +324,7 @@ def eval_one_epoch_rpn(model, dataloader, epoch_id, result_dir, logger):
             cur_seg_result = seg_result[bs_idx]
             cur_pts_rect = pts_rect[bs_idx]
 
-            # calculate recall
+            # calculate recall, the host side of the metrics runs on the writer
             if not args.test:
                 cur_rpn_cls_label = rpn_cls_label[bs_idx]
                 cur_gt_boxes3d = gt_boxes3d[bs_idx]
@@ -305,11 +338,7 @@ def eval_one_epoch_rpn(model, dataloader, epoch_id, result_dir, logger):
                     iou3d = iou3d_utils.boxes_iou3d_gpu(
                         cur_boxes3d, cur_gt_boxes3d[:, 0:7])
                     gt_max_iou, _ = iou3d.max(axis=0)
-
-                    for idx, thresh in enumerate(thresh_list):
-                        total_recalled_bbox_list[idx] += (
-                            gt_max_iou > thresh).sum().asnumpy().item()
-                    total_gt_bbox += len(cur_gt_boxes3d)
+                    writer.submit(recall_meter.update, gt_max_iou)
 
                 fg_mask = cur_rpn_cls_label > 0
                 correct = ((cur_seg_result == cur_rpn_cls_label)
@@ -319,12 +348,13 @@ def eval_one_epoch_rpn(model, dataloader, epoch_id, result_dir, logger):
 
                 rpn_iou = correct / ops.clip_by_value(
                     union, min=ms.Tensor(1.0, ms.float32))
-                rpn_iou_avg += rpn_iou.asnumpy().asnumpy().item()
+                writer.submit(iou_meter.add, rpn_iou=rpn_iou)
 
             # save result
             if args.save_rpn_feature:
                 # save features to file
-                save_rpn_features(
+                writer.submit(
+                    save_rpn_features,
                     seg_result[bs_idx].astype(ms.float32).asnumpy(),
                     rpn_scores_raw[bs_idx].astype(ms.float32).asnumpy(),
                     pts_features[bs_idx], backbone_xyz[bs_idx].asnumpy(),
@@ -346,35 +376,37 @@ def eval_one_epoch_rpn(model, dataloader, epoch_id, result_dir, logger):
                         -1, 3), cur_pred_cls.reshape(-1, 1)),
                                                  axis=1)
 
-                np.save(output_file, output_data.astype(np.float16))
+                writer.submit(np.save, output_file,
+                              output_data.astype(np.float16))
 
                 # save as kitti format
-                calib = dataset.get_calib(cur_sample_id)
-                cur_boxes3d = cur_boxes3d.asnumpy()
-                image_shape = dataset.get_image_shape(cur_sample_id)
-                save_kitti_format(cur_sample_id, calib, cur_boxes3d,
-                                  kitti_output_dir, cur_scores_raw,
-                                  image_shape)
+                writer.submit(save_kitti_sample, dataset, cur_sample_id,
+                              cur_boxes3d, kitti_output_dir, cur_scores_raw)
 
+        frame_rate.update(len(sample_id_list))
         disp_dict = {
             'mode': mode,
-            'recall': '%d/%d' % (total_recalled_bbox_list[3], total_gt_bbox),
-            'rpn_iou': rpn_iou_avg / max(cnt, 1.0)
+            'recall': '%d/%d' % (recall_meter.recalled[3],
+                                 recall_meter.total_gt),
+            'rpn_iou': iou_meter['rpn_iou'] / max(cnt, 1.0),
+            'fps': '%.1f' % frame_rate.fps()
         }
         progress_bar.set_postfix(disp_dict)
         progress_bar.update()
 
+    writer.close()
     progress_bar.close()
     res_info = {
         'max_num': max_num,
-        'rpn_iou_avg': rpn_iou_avg,
+        'rpn_iou_avg': iou_meter['rpn_iou'],
         'cnt': cnt,
-        'total_gt_bbox': total_gt_bbox,
-        'result_dir': result_dir
+        'total_gt_bbox': recall_meter.total_gt,
+        'result_dir': result_dir,
+        'fps': frame_rate.fps()
     }
 
     ret_dict = show_log(logger, epoch_id, thresh_list,
-                        total_recalled_bbox_list, res_info)
+                        recall_meter.recalled, res_info)
 
     return ret_dict
 
@@ -390,10 +422,12 @@ def show_log(logger, epoch_id, thresh_list, total_recalled_bbox_list,
     logger.info('max number of objects: %d' % res_info['max_num'])
     logger.info('rpn iou avg: %f' %
                 (res_info['rpn_iou_avg'] / max(res_info['cnt'], 1.0)))
+    logger.info('eval speed: %.2f frames/s' % res_info['fps'])
 
     ret_dict = {
         'max_obj_num': res_info['max_num'],
-        'rpn_iou': res_info['rpn_iou_avg'] / res_info['cnt']
+        'rpn_iou': res_info['rpn_iou_avg'] / res_info['cnt'],
+        'fps': res_info['fps']
     }
 
     for idx, thresh in enumerate(thresh_list):
@@ -408,6 +442,23 @@ def show_log(logger, epoch_id, thresh_list, total_recalled_bbox_list,
     return ret_dict
 
 
+def log_recall(logger, ret_dict, roi_recall_meter, recall_meter):
+    """log roi and refined recall, add them to ret_dict"""
+    for idx, thresh in enumerate(roi_recall_meter.thresh_list):
+        logger.info('total roi bbox recall(thresh=%.3f): %d / %d = %f' %
+                    (thresh, roi_recall_meter.recalled[idx],
+                     roi_recall_meter.total_gt, roi_recall_meter.recall(idx)))
+        ret_dict['rpn_recall(thresh=%.2f)' %
+                 thresh] = roi_recall_meter.recall(idx)
+
+    for idx, thresh in enumerate(recall_meter.thresh_list):
+        logger.info('total bbox recall(thresh=%.3f): %d / %d = %f' %
+                    (thresh, recall_meter.recalled[idx],
+                     recall_meter.total_gt, recall_meter.recall(idx)))
+        ret_dict['rcnn_recall(thresh=%.2f)' % thresh] = recall_meter.recall(
+            idx)
+
+
 def eval_one_epoch_rcnn(model, dataloader, dataset, epoch_id, result_dir,
                         logger):
     """eval one epoch for rcnn"""
@@ -428,10 +479,13 @@ def eval_one_epoch_rcnn(model, dataloader, dataset, epoch_id, result_dir,
     model.eval()
 
     thresh_list = [0.1, 0.3, 0.5, 0.7, 0.9]
-    total_recalled_bbox_list, total_gt_bbox = [0] * 5, 0
-    total_roi_recalled_bbox_list = [0] * 5
-    cnt = final_total = total_cls_acc = total_cls_acc_refined = 0
+    recall_meter = RecallMeter(thresh_list)
+    roi_recall_meter = RecallMeter(thresh_list)
+    acc_meter = SumMeter('cls_acc', 'cls_acc_refined')
+    cnt = final_total = 0
     dataloader: ms.dataset.BatchDataset = dataloader
+    frame_rate = FrameRate()
+    writer = make_writer()
 
     progress_bar = tqdm.tqdm(total=dataloader.get_dataset_size(),
                              leave=True,
@@ -507,18 +561,11 @@ def eval_one_epoch_rcnn(model, dataloader, dataset, epoch_id, result_dir,
             if gt_num > 0:
                 iou3d = iou3d_utils.boxes_iou3d_gpu(pred_boxes3d, gt_boxes3d)
                 gt_max_iou, _ = iou3d.max(axis=0)
-
-                for idx, thresh in enumerate(thresh_list):
-                    total_recalled_bbox_list[idx] += (
-                        gt_max_iou > thresh).sum().asnumpy().item()
-                total_gt_bbox += gt_num
+                writer.submit(recall_meter.update, gt_max_iou)
 
                 iou3d_in = iou3d_utils.boxes_iou3d_gpu(roi_boxes3d, gt_boxes3d)
                 gt_max_iou_in, _ = iou3d_in.max(axis=0)
-
-                for idx, thresh in enumerate(thresh_list):
-                    total_roi_recalled_bbox_list[idx] += (
-                        gt_max_iou_in > thresh).sum().asnumpy().item()
+                writer.submit(roi_recall_meter.update, gt_max_iou_in)
 
             # classification accuracy
             cls_label = (gt_iou > cfg.RCNN.CLS_FG_THRESH).astype(ms.float32)
@@ -535,29 +582,26 @@ def eval_one_epoch_rcnn(model, dataloader, dataset, epoch_id, result_dir,
                 ms.int32)).astype(ms.float32).sum() / max(
                     cls_label_refined.shape[0], 1.0)
 
-            total_cls_acc += cls_acc.asnumpy().item()
-            total_cls_acc_refined += cls_acc_refined.asnumpy().item()
+            writer.submit(acc_meter.add,
+                          cls_acc=cls_acc,
+                          cls_acc_refined=cls_acc_refined)
 
-            disp_dict['recall'] = '%d/%d' % (total_recalled_bbox_list[3],
-                                             total_gt_bbox)
-            disp_dict['cls_acc_refined'] = '%.2f' % cls_acc_refined.asnumpy(
-            ).item()
+            disp_dict['recall'] = '%d/%d' % (recall_meter.recalled[3],
+                                             recall_meter.total_gt)
+            disp_dict['cls_acc_refined'] = '%.2f' % (
+                acc_meter['cls_acc_refined'] / max(cnt, 1.0))
 
+        frame_rate.update(1)
+        disp_dict['fps'] = '%.1f' % frame_rate.fps()
         progress_bar.set_postfix(disp_dict)
         progress_bar.update()
 
-        image_shape = dataset.get_image_shape(sample_id)
         if args.save_result:
             # save roi and refine results
-            roi_boxes3d_np = roi_boxes3d.asnumpy()
-            pred_boxes3d_np = pred_boxes3d.asnumpy()
-            calib = dataset.get_calib(sample_id)
-
-            save_kitti_format(sample_id, calib, roi_boxes3d_np, roi_output_dir,
-                              roi_scores, image_shape)
-            save_kitti_format(sample_id, calib,
-                              pred_boxes3d_np, refine_output_dir,
-                              raw_scores.asnumpy(), image_shape)
+            writer.submit(save_kitti_sample, dataset, sample_id, roi_boxes3d,
+                          roi_output_dir, roi_scores)
+            writer.submit(save_kitti_sample, dataset, sample_id, pred_boxes3d,
+                          refine_output_dir, raw_scores)
 
         # NMS and scoring
         # scores thresh
@@ -576,14 +620,14 @@ def eval_one_epoch_rcnn(model, dataloader, dataset, epoch_id, result_dir,
         pred_boxes3d_selected = pred_boxes3d_selected[keep_idx]
 
         scores_selected = raw_scores_selected[keep_idx]
-        pred_boxes3d_selected, scores_selected = pred_boxes3d_selected.asnumpy(
-        ), scores_selected.asnumpy()
 
-        calib = dataset.get_calib(sample_id)
         final_total += pred_boxes3d_selected.shape[0]
-        save_kitti_format(sample_id, calib, pred_boxes3d_selected,
-                          final_output_dir, scores_selected, image_shape)
+        writer.submit(save_kitti_sample, dataset, sample_id,
+                      pred_boxes3d_selected, final_output_dir,
+                      scores_selected)
 
+    # every detection file has to exist before the empty files are counted
+    writer.close()
     progress_bar.close()
 
     # dump empty files
@@ -606,30 +650,19 @@ def eval_one_epoch_rcnn(model, dataloader, dataset, epoch_id, result_dir,
         epoch_id)
     logger.info(str(datetime.now()))
 
-    avg_cls_acc = (total_cls_acc / max(cnt, 1.0))
-    avg_cls_acc_refined = (total_cls_acc_refined / max(cnt, 1.0))
+    avg_cls_acc = (acc_meter['cls_acc'] / max(cnt, 1.0))
+    avg_cls_acc_refined = (acc_meter['cls_acc_refined'] / max(cnt, 1.0))
     avg_det_num = (final_total / max(cnt, 1.0))
+    logger.info('eval speed: %.2f frames/s' % frame_rate.fps())
     logger.info('final average detections: %.3f' % avg_det_num)
     logger.info('final average cls acc: %.3f' % avg_cls_acc)
     logger.info('final average cls acc refined: %.3f' % avg_cls_acc_refined)
     ret_dict['rcnn_cls_acc'] = avg_cls_acc
     ret_dict['rcnn_cls_acc_refined'] = avg_cls_acc_refined
     ret_dict['rcnn_avg_num'] = avg_det_num
+    ret_dict['fps'] = frame_rate.fps()
 
-    for idx, thresh in enumerate(thresh_list):
-        cur_roi_recall = total_roi_recalled_bbox_list[idx] / max(
-            total_gt_bbox, 1.0)
-        logger.info('total roi bbox recall(thresh=%.3f): %d / %d = %f' %
-                    (thresh, total_roi_recalled_bbox_list[idx], total_gt_bbox,
-                     cur_roi_recall))
-        ret_dict['rpn_recall(thresh=%.2f)' % thresh] = cur_roi_recall
-
-    for idx, thresh in enumerate(thresh_list):
-        cur_recall = total_recalled_bbox_list[idx] / max(total_gt_bbox, 1.0)
-        logger.info(
-            'total bbox recall(thresh=%.3f): %d / %d = %f' %
-            (thresh, total_recalled_bbox_list[idx], total_gt_bbox, cur_recall))
-        ret_dict['rcnn_recall(thresh=%.2f)' % thresh] = cur_recall
+    log_recall(logger, ret_dict, roi_recall_meter, recall_meter)
 
     if cfg.TEST.SPLIT != 'test':
         logger.info('Averate Precision:')
@@ -668,10 +701,13 @@ def eval_one_epoch_joint(model, dataloader, dataset, epoch_id, result_dir,
     logger.info('==> Output file: %s' % result_dir)
 
     thresh_list = [0.1, 0.3, 0.5, 0.7, 0.9]
-    total_recalled_bbox_list, total_gt_bbox = [0] * 5, 0
-    total_roi_recalled_bbox_list = [0] * 5
-    cnt = final_total = total_cls_acc = total_cls_acc_refined = total_rpn_iou = 0
+    recall_meter = RecallMeter(thresh_list)
+    roi_recall_meter = RecallMeter(thresh_list)
+    acc_meter = SumMeter('cls_acc', 'cls_acc_refined', 'rpn_iou')
+    cnt = final_total = 0
     dataloader: ms.dataset.BatchDataset = dataloader
+    frame_rate = FrameRate()
+    writer = make_writer()
 
     progress_bar = tqdm.tqdm(total=dataloader.get_dataset_size(),
                              leave=True,
@@ -729,7 +765,6 @@ def eval_one_epoch_joint(model, dataloader, dataset, epoch_id, result_dir,
             norm_scores = cls_norm_scores[:, pred_classes]
 
         # evaluation
-        recalled_num = gt_num = rpn_iou = 0
         if not args.test:
             if not cfg.RPN.FIXED:
                 rpn_cls_label, _ = data['rpn_cls_label'], data['rpn_reg_label']
@@ -752,24 +787,14 @@ def eval_one_epoch_joint(model, dataloader, dataset, epoch_id, result_dir,
                     cur_gt_boxes3d = cur_gt_boxes3d.astype(ms.float32)
                     iou3d = iou3d_utils.boxes_iou3d_gpu(
                         pred_boxes3d[k], cur_gt_boxes3d)
-                    ops.ArgMaxWithValue(0)(iou3d)
                     _, gt_max_iou = ops.ArgMaxWithValue(0)(iou3d)
-
-                    for idx, thresh in enumerate(thresh_list):
-                        total_recalled_bbox_list[idx] += (
-                            gt_max_iou > thresh).sum().asnumpy().item()
-                    recalled_num += (gt_max_iou > 0.7).sum().asnumpy().item()
-                    gt_num += cur_gt_boxes3d.shape[0]
-                    total_gt_bbox += cur_gt_boxes3d.shape[0]
+                    writer.submit(recall_meter.update, gt_max_iou)
 
                     # original recall
                     iou3d_in = iou3d_utils.boxes_iou3d_gpu(
                         roi_boxes3d[k], cur_gt_boxes3d)
                     _, gt_max_iou_in = ops.ArgMaxWithValue(0)(iou3d_in)
-
-                    for idx, thresh in enumerate(thresh_list):
-                        total_roi_recalled_bbox_list[idx] += (
-                            gt_max_iou_in > thresh).sum().asnumpy().item()
+                    writer.submit(roi_recall_meter.update, gt_max_iou_in)
 
                 if not cfg.RPN.FIXED:
                     fg_mask = rpn_cls_label > 0
@@ -779,11 +804,14 @@ def eval_one_epoch_joint(model, dataloader, dataset, epoch_id, result_dir,
                         seg_result > 0).sum().astype(ms.float32) - correct
                     rpn_iou = correct / ops.clip_by_value(
                         union, min=ms.Tensor(1.0, ms.float32))
-                    total_rpn_iou += rpn_iou.asnumpy().item()
+                    writer.submit(acc_meter.add, rpn_iou=rpn_iou)
 
+        frame_rate.update(batch_size)
         disp_dict = {
             'mode': mode,
-            'recall': '%d/%d' % (total_recalled_bbox_list[3], total_gt_bbox)
+            'recall': '%d/%d' % (recall_meter.recalled[3],
+                                 recall_meter.total_gt),
+            'fps': '%.1f' % frame_rate.fps()
         }
         progress_bar.set_postfix(disp_dict)
         progress_bar.update()
@@ -805,18 +833,17 @@ def eval_one_epoch_joint(model, dataloader, dataset, epoch_id, result_dir,
 
             for k in range(batch_size):
                 cur_sample_id = sample_id[k]
-                calib = dataset.get_calib(cur_sample_id)
-                image_shape = dataset.get_image_shape(cur_sample_id)
-                save_kitti_format(cur_sample_id, calib, roi_boxes3d_np[k],
-                                  roi_output_dir, roi_scores_raw_np[k],
-                                  image_shape)
-                save_kitti_format(cur_sample_id, calib, pred_boxes3d_np[k],
-                                  refine_output_dir, raw_scores_np[k],
-                                  image_shape)
+                writer.submit(save_kitti_sample, dataset, cur_sample_id,
+                              roi_boxes3d_np[k], roi_output_dir,
+                              roi_scores_raw_np[k])
+                writer.submit(save_kitti_sample, dataset, cur_sample_id,
+                              pred_boxes3d_np[k], refine_output_dir,
+                              raw_scores_np[k])
 
                 output_file = os.path.join(rpn_output_dir,
                                            '%06d.npy' % cur_sample_id)
-                np.save(output_file, output_data.astype(np.float32))
+                writer.submit(np.save, output_file,
+                              output_data.astype(np.float32))
 
         # scores thresh
         inds = norm_scores > cfg.RCNN.SCORE_THRESH
@@ -847,16 +874,15 @@ def eval_one_epoch_joint(model, dataloader, dataset, epoch_id, result_dir,
                                            cfg.RCNN.NMS_THRESH).view(-1)
             pred_boxes3d_selected = pred_boxes3d_selected[keep_idx]
             scores_selected = raw_scores_selected[keep_idx]
-            pred_boxes3d_selected, scores_selected = pred_boxes3d_selected.asnumpy(
-            ), scores_selected.asnumpy()
 
             cur_sample_id = sample_id[k]
-            calib = dataset.get_calib(cur_sample_id)
             final_total += pred_boxes3d_selected.shape[0]
-            image_shape = dataset.get_image_shape(cur_sample_id)
-            save_kitti_format(cur_sample_id, calib, pred_boxes3d_selected,
-                              final_output_dir, scores_selected, image_shape)
+            writer.submit(save_kitti_sample, dataset, cur_sample_id,
+                          pred_boxes3d_selected, final_output_dir,
+                          scores_selected)
 
+    # every detection file has to exist before the empty files are counted
+    writer.close()
     progress_bar.close()
     # dump empty files
     split_file = os.path.join(dataset.imageset_dir, '..', '..', 'ImageSets',
@@ -879,10 +905,11 @@ def eval_one_epoch_joint(model, dataloader, dataset, epoch_id, result_dir,
         epoch_id)
     logger.info(str(datetime.now()))
 
-    avg_rpn_iou = (total_rpn_iou / max(cnt, 1.0))
-    avg_cls_acc = (total_cls_acc / max(cnt, 1.0))
-    avg_cls_acc_refined = (total_cls_acc_refined / max(cnt, 1.0))
+    avg_rpn_iou = (acc_meter['rpn_iou'] / max(cnt, 1.0))
+    avg_cls_acc = (acc_meter['cls_acc'] / max(cnt, 1.0))
+    avg_cls_acc_refined = (acc_meter['cls_acc_refined'] / max(cnt, 1.0))
     avg_det_num = (final_total / max(len(dataset), 1.0))
+    logger.info('eval speed: %.2f frames/s' % frame_rate.fps())
     logger.info('final average detections: %.3f' % avg_det_num)
     logger.info('final average rpn_iou refined: %.3f' % avg_rpn_iou)
     logger.info('final average cls acc: %.3f' % avg_cls_acc)
@@ -891,21 +918,9 @@ def eval_one_epoch_joint(model, dataloader, dataset, epoch_id, result_dir,
     ret_dict['rcnn_cls_acc'] = avg_cls_acc
     ret_dict['rcnn_cls_acc_refined'] = avg_cls_acc_refined
     ret_dict['rcnn_avg_num'] = avg_det_num
+    ret_dict['fps'] = frame_rate.fps()
 
-    for idx, thresh in enumerate(thresh_list):
-        cur_roi_recall = total_roi_recalled_bbox_list[idx] / max(
-            total_gt_bbox, 1.0)
-        logger.info('total roi bbox recall(thresh=%.3f): %d / %d = %f' %
-                    (thresh, total_roi_recalled_bbox_list[idx], total_gt_bbox,
-                     cur_roi_recall))
-        ret_dict['rpn_recall(thresh=%.2f)' % thresh] = cur_roi_recall
-
-    for idx, thresh in enumerate(thresh_list):
-        cur_recall = total_recalled_bbox_list[idx] / max(total_gt_bbox, 1.0)
-        logger.info(
-            'total bbox recall(thresh=%.3f): %d / %d = %f' %
-            (thresh, total_recalled_bbox_list[idx], total_gt_bbox, cur_recall))
-        ret_dict['rcnn_recall(thresh=%.2f)' % thresh] = cur_recall
+    log_recall(logger, ret_dict, roi_recall_meter, recall_meter)
 
     if cfg.TEST.SPLIT != 'test':
         logger.info('Averate Precision:')
@@ -1029,7 +1044,8 @@ def create_dataloader(logger):
         rcnn_eval_roi_dir=args.rcnn_eval_roi_dir,
         rcnn_eval_feature_dir=args.rcnn_eval_feature_dir,
         classes=cfg.CLASSES,
-        logger=logger)
+        logger=logger,
+        sample_store_dir=args.sample_store_dir)
     cols = test_set.getitem_cols(0)
     test_loader = ms.dataset.GeneratorDataset(test_set,
                                               num_parallel_workers=1,
@@ -1067,7 +1083,10 @@ if __name__ == "__main__":
         cfg.RPN.ENABLED = False
         root_result_dir = os.path.join('output', 'rcnn', cfg.TAG)
         ckpt_dir = os.path.join('output', 'rcnn', cfg.TAG, 'ckpt')
-        assert args.rcnn_eval_roi_dir is not None and args.rcnn_eval_feature_dir is not None
+        assert args.rcnn_eval_feature_dir is not None
+        # a packed feature store also holds the rois
+        assert args.rcnn_eval_roi_dir is not None or is_rpn_feature_store(
+            args.rcnn_eval_feature_dir)
     else:
         raise NotImplementedError
 
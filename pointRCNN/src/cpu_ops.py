@@ -0,0 +1,734 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+NumPy implementations of the pointnet2, iou3d and roipool3d custom kernels.
+
+Every function follows the semantics of the matching CUDA kernel (index
+order, padding of empty balls, tie breaking) so that the CPU backend can be
+swapped in for the compiled ops. Batched kernels run one thread per sample,
+NumPy releases the GIL inside the vectorized loops.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# rows of a pairwise block (queries x points) evaluated at once
+CHUNK_ELEMS = 1 << 22
+MARGIN = 1e-5
+EPS = 1e-8
+
+_pool = None
+
+
+def _executor():
+    """lazily created pool shared by all batched kernels"""
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+    return _pool
+
+
+def map_batch(func, *arrays):
+    """
+    Apply func to every sample of the batched arrays in parallel and stack
+    the results (tuples of results are stacked element-wise).
+    """
+    batch_size = arrays[0].shape[0]
+    if batch_size == 1:
+        outs = [func(*[a[0] for a in arrays])]
+    else:
+        outs = list(
+            _executor().map(lambda b: func(*[a[b] for a in arrays]),
+                            range(batch_size)))
+    if isinstance(outs[0], tuple):
+        return tuple(np.stack(o) for o in zip(*outs))
+    return np.stack(outs)
+
+
+def _chunks(n_rows, n_cols):
+    """
+    row slices of a (n_rows, n_cols) block bounded by CHUNK_ELEMS, at least
+    one (possibly empty) slice
+    """
+    step = max(1, CHUNK_ELEMS // max(n_cols, 1))
+    for start in range(0, max(n_rows, 1), step):
+        yield slice(start, min(start + step, n_rows))
+
+
+def pairwise_dist2(a, b):
+    """
+    :param a: (N, 3)
+    :param b: (M, 3)
+    :return: (N, M) squared distances, summed per axis like the kernels do
+    """
+    d = a[:, None, :] - b[None, :, :]
+    d *= d
+    return d[..., 0] + d[..., 1] + d[..., 2]
+
+
+def _first_hits(mask, nsample, pad_first):
+    """
+    Indices of the first nsample True columns of every row of mask.
+
+    :return:
+        idx: (N, nsample) int32, rows with fewer hits are padded with the first
+            hit (pad_first) or cycle over their hits, empty rows are zero
+        cnt: (N) number of hits, clipped to nsample
+    """
+    rank = np.cumsum(mask, axis=1, dtype=np.int32)
+    cnt = np.minimum(rank[:, -1], nsample) if mask.shape[1] else \
+        np.zeros(mask.shape[0], np.int32)
+    rows, cols = np.nonzero(mask & (rank <= nsample))
+    idx = np.zeros((mask.shape[0], nsample), np.int32)
+    idx[rows, rank[rows, cols] - 1] = cols
+    slots = np.arange(nsample)[None, :]
+    valid = np.maximum(cnt, 1)[:, None]
+    if pad_first:
+        src = np.where(slots < valid, slots, 0)
+    else:
+        src = slots % valid
+    return np.take_along_axis(idx, src, axis=1), cnt
+
+
+# --------------------------------- pointnet2 ---------------------------------
+def _fps_single(xyz, npoint):
+    xyz = xyz.astype(np.float32, copy=False)
+    temp = np.full(xyz.shape[0], 1e10, np.float32)
+    idx = np.zeros(npoint, np.int32)
+    old = 0
+    for j in range(1, npoint):
+        d = xyz - xyz[old]
+        d *= d
+        np.minimum(temp, d[:, 0] + d[:, 1] + d[:, 2], out=temp)
+        old = int(np.argmax(temp))
+        idx[j] = old
+    return idx
+
+
+def furthest_point_sample(xyz, npoint):
+    """
+    :param xyz: (B, N, 3)
+    :param npoint: int
+    :return: (B, npoint) int32, the first sample is always point 0
+    """
+    return map_batch(lambda x: _fps_single(x, npoint), xyz)
+
+
+def _ball_query_single(radius, nsample, xyz, new_xyz):
+    radius2 = np.float32(radius)**2
+    idx = np.zeros((new_xyz.shape[0], nsample), np.int32)
+    for rows in _chunks(new_xyz.shape[0], xyz.shape[0]):
+        mask = pairwise_dist2(new_xyz[rows], xyz) < radius2
+        idx[rows] = _first_hits(mask, nsample, pad_first=True)[0]
+    return idx
+
+
+def ball_query(radius, nsample, xyz, new_xyz):
+    """
+    :param radius: float
+    :param nsample: int
+    :param xyz: (B, N, 3)
+    :param new_xyz: (B, npoint, 3)
+    :return: (B, npoint, nsample) int32, the first nsample points inside the
+        ball in index order, padded with the first one
+    """
+    xyz = xyz.astype(np.float32, copy=False)
+    new_xyz = new_xyz.astype(np.float32, copy=False)
+    return map_batch(lambda x, q: _ball_query_single(radius, nsample, x, q),
+                     xyz, new_xyz)
+
+
+_NEIGHBOR_CELLS = np.stack(
+    np.meshgrid([-1, 0, 1], [-1, 0, 1], [-1, 0, 1], indexing='ij'),
+    axis=-1).reshape(27, 3)
+
+
+class BallNeighborhood:
+    """
+    Points of xyz within max_radius of every query of new_xyz, found through a
+    voxel hash with cells slightly larger than max_radius so that only the 27
+    cells around a query have to be scanned.
+
+    It is built once per SA layer, ball queries of every radius up to
+    max_radius are answered from the stored (query, point, dist2) triples,
+    which are kept sorted by query and point index.
+    """
+
+    def __init__(self, xyz, new_xyz, max_radius):
+        """
+        :param xyz: (N, 3)
+        :param new_xyz: (M, 3)
+        :param max_radius: float, largest radius queried later on
+        """
+        if max_radius <= 0:
+            raise ValueError('max_radius must be positive, got %s' % max_radius)
+        self.xyz = xyz.astype(np.float32, copy=False)
+        self.new_xyz = new_xyz.astype(np.float32, copy=False)
+        self.max_radius = max_radius
+        self.num_queries = self.new_xyz.shape[0]
+        if self.xyz.shape[0] == 0:
+            # no point, every neighborhood is empty and queries return zeros
+            self.dims = np.ones(3, np.int64)
+            self.order = np.zeros(0, np.int32)
+            self.cell_keys = np.zeros(0, np.int64)
+            self.cell_start = np.zeros(0, np.int64)
+            self.cell_count = np.zeros(0, np.int64)
+            self.qid = np.zeros(0, np.int64)
+            self.pid = np.zeros(0, np.int32)
+            self.d2 = np.zeros(0, np.float32)
+            return
+
+        # float64 cell coordinates, the margin covers rounding at cell borders
+        cell_size = max_radius * 1.001
+        origin = self.xyz.min(axis=0).astype(np.float64)
+        coords = np.floor((self.xyz - origin) / cell_size).astype(np.int64) + 1
+        self.dims = coords.max(axis=0) + 2
+        keys = self._keys(coords)
+        self.order = np.argsort(keys, kind='stable').astype(np.int32)
+        self.cell_keys, self.cell_start, self.cell_count = np.unique(
+            keys[self.order], return_index=True, return_counts=True)
+
+        query_coords = np.floor(
+            (self.new_xyz - origin) / cell_size).astype(np.int64) + 1
+        qids, pids, dists = [], [], []
+        for rows in _chunks(self.num_queries, 27 * 64):
+            qid, pid, d2 = self._scan(query_coords[rows], rows.start)
+            qids.append(qid)
+            pids.append(pid)
+            dists.append(d2)
+        self.qid = np.concatenate(qids)
+        self.pid = np.concatenate(pids)
+        self.d2 = np.concatenate(dists)
+
+    def _keys(self, coords):
+        return (coords[..., 0] * self.dims[1] +
+                coords[..., 1]) * self.dims[2] + coords[..., 2]
+
+    def _scan(self, query_coords, offset):
+        """candidate points of the 27 neighbor cells of a chunk of queries"""
+        cells = query_coords[:, None, :] + _NEIGHBOR_CELLS[None]
+        inside = np.all((cells >= 0) & (cells < self.dims), axis=-1)
+        keys = self._keys(cells)
+        pos = np.minimum(np.searchsorted(self.cell_keys, keys),
+                         len(self.cell_keys) - 1)
+        found = inside & (self.cell_keys[pos] == keys)
+        count = np.where(found, self.cell_count[pos], 0).ravel()
+        start = self.cell_start[pos].ravel()
+
+        cell_id = np.repeat(np.arange(count.shape[0]), count)
+        within = np.arange(cell_id.shape[0]) - np.repeat(
+            np.cumsum(count) - count, count)
+        pid = self.order[start[cell_id] + within]
+        qid = cell_id // 27 + offset
+
+        d = self.new_xyz[qid] - self.xyz[pid]
+        d *= d
+        d2 = d[:, 0] + d[:, 1] + d[:, 2]
+        near = d2 < np.float32(self.max_radius)**2
+        qid, pid, d2 = qid[near], pid[near], d2[near]
+        # cells are visited in key order, restore the point index order
+        sort = np.lexsort((pid, qid))
+        return qid[sort], pid[sort], d2[sort]
+
+    def ball_query(self, radius, nsample):
+        """
+        :param radius: float, at most max_radius
+        :param nsample: int
+        :return: (M, nsample) int32, same result as ball_query on the points
+        """
+        if radius > self.max_radius:
+            raise ValueError('radius %s exceeds the max_radius %s of the '
+                             'neighborhood' % (radius, self.max_radius))
+        hit = self.d2 < np.float32(radius)**2
+        qid, pid = self.qid[hit], self.pid[hit]
+        counts = np.bincount(qid, minlength=self.num_queries)
+        rank = np.arange(qid.shape[0]) - (np.cumsum(counts) - counts)[qid]
+        sel = rank < nsample
+        idx = np.zeros((self.num_queries, nsample), np.int32)
+        idx[qid[sel], rank[sel]] = pid[sel]
+        # pad with the first hit like the kernel does
+        slots = np.arange(nsample)[None, :]
+        return np.where(slots < counts[:, None], idx, idx[:, :1])
+
+    def nbytes(self):
+        """memory held by the hash and the neighbor lists"""
+        return sum(a.nbytes for a in (self.order, self.cell_keys,
+                                      self.cell_start, self.cell_count,
+                                      self.qid, self.pid, self.d2))
+
+
+def build_neighborhoods(xyz, new_xyz, max_radius):
+    """
+    :param xyz: (B, N, 3)
+    :param new_xyz: (B, M, 3)
+    :param max_radius: float
+    :return: list of B BallNeighborhood, built in parallel
+    """
+    if xyz.shape[0] == 1:
+        return [BallNeighborhood(xyz[0], new_xyz[0], max_radius)]
+    return list(_executor().map(
+        lambda b: BallNeighborhood(xyz[b], new_xyz[b], max_radius),
+        range(xyz.shape[0])))
+
+
+def ball_query_neighborhoods(neighborhoods, radius, nsample):
+    """
+    :param neighborhoods: list of B BallNeighborhood
+    :return: (B, M, nsample) int32
+    """
+    if len(neighborhoods) == 1:
+        return neighborhoods[0].ball_query(radius, nsample)[None]
+    return np.stack(list(_executor().map(
+        lambda n: n.ball_query(radius, nsample), neighborhoods)))
+
+
+def gather_points(features, idx):
+    """
+    :param features: (B, C, N)
+    :param idx: (B, npoint)
+    :return: (B, C, npoint)
+    """
+    return map_batch(lambda f, i: f[:, i], features, idx)
+
+
+def group_points(features, idx):
+    """
+    :param features: (B, C, N)
+    :param idx: (B, npoint, nsample)
+    :return: (B, C, npoint, nsample)
+    """
+    return map_batch(lambda f, i: f[:, i], features, idx)
+
+
+def _three_nn_single(unknown, known):
+    dist = np.empty((unknown.shape[0], 3), np.float32)
+    idx = np.zeros((unknown.shape[0], 3), np.int32)
+    for rows in _chunks(unknown.shape[0], known.shape[0]):
+        d2 = pairwise_dist2(unknown[rows], known)
+        ar = np.arange(d2.shape[0])
+        for k in range(min(3, d2.shape[1])):
+            # argmin keeps the smallest index among ties, like the kernel
+            best = np.argmin(d2, axis=1)
+            idx[rows, k] = best
+            dist[rows, k] = d2[ar, best]
+            d2[ar, best] = np.inf
+        if d2.shape[1] < 3:
+            dist[rows, d2.shape[1]:] = 1e40
+    return dist, idx
+
+
+def three_nn(unknown, known):
+    """
+    :param unknown: (B, N, 3)
+    :param known: (B, M, 3)
+    :return:
+        dist2: (B, N, 3) squared distance to the three nearest neighbors
+        idx: (B, N, 3) int32
+    """
+    unknown = unknown.astype(np.float32, copy=False)
+    known = known.astype(np.float32, copy=False)
+    return map_batch(_three_nn_single, unknown, known)
+
+
+def three_interpolate(features, idx, weight):
+    """
+    :param features: (B, C, M)
+    :param idx: (B, N, 3)
+    :param weight: (B, N, 3)
+    :return: (B, C, N)
+    """
+
+    def interpolate(f, i, w):
+        out = f[:, i[:, 0]] * w[:, 0]
+        out += f[:, i[:, 1]] * w[:, 1]
+        out += f[:, i[:, 2]] * w[:, 2]
+        return out
+
+    return map_batch(interpolate, features, idx, weight)
+
+
+# ---------------------------------- iou3d ------------------------------------
+def _bev_corners(boxes):
+    """
+    :param boxes: (N, 5) [x1, y1, x2, y2, ry]
+    :return: (N, 4, 2) corners rotated around the box center
+    """
+    x1, y1, x2, y2, angle = boxes.T
+    cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+    xs = np.stack([x1, x2, x2, x1], axis=1) - cx[:, None]
+    ys = np.stack([y1, y1, y2, y2], axis=1) - cy[:, None]
+    cosa, sina = np.cos(angle)[:, None], np.sin(angle)[:, None]
+    return np.stack([xs * cosa + ys * sina + cx[:, None],
+                     -xs * sina + ys * cosa + cy[:, None]], axis=-1)
+
+
+def _check_in_box2d(boxes, pts):
+    """
+    :param boxes: (..., 5) [x1, y1, x2, y2, ry], broadcast against pts
+    :param pts: (..., 2)
+    """
+    cx = (boxes[..., 0] + boxes[..., 2]) / 2
+    cy = (boxes[..., 1] + boxes[..., 3]) / 2
+    cosa, sina = np.cos(-boxes[..., 4]), np.sin(-boxes[..., 4])
+    dx, dy = pts[..., 0] - cx, pts[..., 1] - cy
+    rot_x = dx * cosa + dy * sina + cx
+    rot_y = -dx * sina + dy * cosa + cy
+    return (rot_x > boxes[..., 0] - MARGIN) & (rot_x < boxes[..., 2] + MARGIN) & \
+        (rot_y > boxes[..., 1] - MARGIN) & (rot_y < boxes[..., 3] + MARGIN)
+
+
+def _cross3(p1, p2, p0):
+    return (p1[..., 0] - p0[..., 0]) * (p2[..., 1] - p0[..., 1]) - \
+        (p2[..., 0] - p0[..., 0]) * (p1[..., 1] - p0[..., 1])
+
+
+def _edge_intersections(ca, cb):
+    """
+    :param ca: (P, 4, 2) corners of the first box of every pair
+    :param cb: (P, 4, 2) corners of the second box of every pair
+    :return: points (P, 16, 2) and flags (P, 16) of the 4 x 4 edge crossings
+    """
+    p0 = ca[:, :, None, :]
+    p1 = np.roll(ca, -1, axis=1)[:, :, None, :]
+    q0 = cb[:, None, :, :]
+    q1 = np.roll(cb, -1, axis=1)[:, None, :, :]
+
+    flag = (np.minimum(p0[..., 0], p1[..., 0]) <= np.maximum(q0[..., 0], q1[..., 0])) & \
+        (np.minimum(q0[..., 0], q1[..., 0]) <= np.maximum(p0[..., 0], p1[..., 0])) & \
+        (np.minimum(p0[..., 1], p1[..., 1]) <= np.maximum(q0[..., 1], q1[..., 1])) & \
+        (np.minimum(q0[..., 1], q1[..., 1]) <= np.maximum(p0[..., 1], p1[..., 1]))
+    s1 = _cross3(q0, p1, p0)
+    s2 = _cross3(p1, q1, p0)
+    s3 = _cross3(p0, q1, q0)
+    s4 = _cross3(q1, p1, q0)
+    flag &= (s1 * s2 > 0) & (s3 * s4 > 0)
+
+    s5 = _cross3(q1, p1, p0)
+    denom = s5 - s1
+    parallel = np.abs(denom) <= EPS
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ans = (s5[..., None] * q0 - s1[..., None] * q1) / denom[..., None]
+        if parallel.any():
+            a0, b0 = p0[..., 1] - p1[..., 1], p1[..., 0] - p0[..., 0]
+            c0 = p0[..., 0] * p1[..., 1] - p1[..., 0] * p0[..., 1]
+            a1, b1 = q0[..., 1] - q1[..., 1], q1[..., 0] - q0[..., 0]
+            c1 = q0[..., 0] * q1[..., 1] - q1[..., 0] * q0[..., 1]
+            d = a0 * b1 - a1 * b0
+            line = np.stack([(b0 * c1 - b1 * c0) / d, (a1 * c0 - a0 * c1) / d],
+                            axis=-1)
+            ans = np.where(parallel[..., None], line, ans)
+    num = ca.shape[0]
+    return ans.reshape(num, 16, 2), flag.reshape(num, 16)
+
+
+def _pair_overlap(boxes_a, boxes_b, corners_a, corners_b):
+    """overlap area of the aligned pairs boxes_a[i], boxes_b[i]"""
+    cross_pts, cross_flag = _edge_intersections(corners_a, corners_b)
+    in_a = _check_in_box2d(boxes_a[:, None, :], corners_b)
+    in_b = _check_in_box2d(boxes_b[:, None, :], corners_a)
+    # same candidate order as the kernel: crossings, then b/a corners
+    pts = np.concatenate(
+        [cross_pts,
+         np.stack([corners_b, corners_a], axis=2).reshape(-1, 8, 2)], axis=1)
+    flags = np.concatenate(
+        [cross_flag, np.stack([in_a, in_b], axis=2).reshape(-1, 8)], axis=1)
+    pts = np.where(flags[..., None], pts, 0)
+
+    cnt = flags.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        center = (pts * flags[..., None]).sum(axis=1) / cnt[:, None]
+    angle = np.arctan2(pts[..., 1] - center[:, None, 1],
+                       pts[..., 0] - center[:, None, 0])
+    angle = np.where(flags, angle, np.inf)
+    order = np.argsort(angle, axis=1, kind='stable')
+    pts = np.take_along_axis(pts, order[..., None], axis=1)
+    valid = np.take_along_axis(flags, order, axis=1)
+
+    rel = pts - pts[:, :1, :]
+    tri = rel[:, :-1, 0] * rel[:, 1:, 1] - rel[:, :-1, 1] * rel[:, 1:, 0]
+    area = np.where(valid[:, 1:], tri, 0).sum(axis=1)
+    return np.abs(area) / 2.0
+
+
+def _candidate_pairs(boxes_a, boxes_b, upper=False):
+    """
+    Pairs (ia, ib) whose bounding circles touch, all other pairs have no
+    overlap. With upper only pairs ia < ib are returned.
+    """
+    center_a = (boxes_a[:, 0:2] + boxes_a[:, 2:4]) / 2
+    center_b = (boxes_b[:, 0:2] + boxes_b[:, 2:4]) / 2
+    radius_a = np.linalg.norm(boxes_a[:, 2:4] - boxes_a[:, 0:2], axis=1) / 2
+    radius_b = np.linalg.norm(boxes_b[:, 2:4] - boxes_b[:, 0:2], axis=1) / 2
+    ia, ib = [], []
+    for rows in _chunks(boxes_a.shape[0], boxes_b.shape[0]):
+        d = center_a[rows, None, :] - center_b[None, :, :]
+        reach = radius_a[rows, None] + radius_b[None, :] + MARGIN
+        touch = d[..., 0] * d[..., 0] + d[..., 1] * d[..., 1] <= reach * reach
+        if upper:
+            touch &= np.arange(rows.start, rows.stop)[:, None] < \
+                np.arange(boxes_b.shape[0])[None, :]
+        a, b = np.nonzero(touch)
+        ia.append(a + rows.start)
+        ib.append(b)
+    return np.concatenate(ia), np.concatenate(ib)
+
+
+def _pairs_overlap(boxes_a, boxes_b, ia, ib):
+    """overlap area of boxes_a[ia] and boxes_b[ib]"""
+    overlap = np.zeros(ia.shape[0], np.float32)
+    corners_a, corners_b = _bev_corners(boxes_a), _bev_corners(boxes_b)
+    step = max(1, CHUNK_ELEMS // 256)
+    for start in range(0, ia.shape[0], step):
+        a, b = ia[start:start + step], ib[start:start + step]
+        overlap[start:start + step] = _pair_overlap(boxes_a[a], boxes_b[b],
+                                                    corners_a[a],
+                                                    corners_b[b])
+    return overlap
+
+
+def boxes_overlap_bev(boxes_a, boxes_b):
+    """
+    :param boxes_a: (M, 5) [x1, y1, x2, y2, ry]
+    :param boxes_b: (N, 5)
+    :return: (M, N) float32 overlap area of the rotated boxes
+    """
+    boxes_a = np.asarray(boxes_a, np.float32).reshape(-1, 5)
+    boxes_b = np.asarray(boxes_b, np.float32).reshape(-1, 5)
+    overlap = np.zeros((boxes_a.shape[0], boxes_b.shape[0]), np.float32)
+    if overlap.size == 0:
+        return overlap
+    ia, ib = _candidate_pairs(boxes_a, boxes_b)
+    overlap[ia, ib] = _pairs_overlap(boxes_a, boxes_b, ia, ib)
+    return overlap
+
+
+def _bev_area(boxes):
+    return (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+
+def boxes_iou_bev(boxes_a, boxes_b):
+    """
+    :param boxes_a: (M, 5) [x1, y1, x2, y2, ry]
+    :param boxes_b: (N, 5)
+    :return: (M, N) float32 bird's eye view IoU
+    """
+    boxes_a = np.asarray(boxes_a, np.float32).reshape(-1, 5)
+    boxes_b = np.asarray(boxes_b, np.float32).reshape(-1, 5)
+    overlap = boxes_overlap_bev(boxes_a, boxes_b)
+    union = _bev_area(boxes_a)[:, None] + _bev_area(boxes_b)[None, :] - overlap
+    return overlap / np.maximum(union, np.float32(EPS))
+
+
+def iou_normal(boxes_a, boxes_b):
+    """axis aligned IoU of (M, 5) and (N, 5) boxes, rotation is ignored"""
+    left = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    right = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    top = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    bottom = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    inter = np.maximum(right - left, 0) * np.maximum(bottom - top, 0)
+    union = _bev_area(boxes_a)[:, None] + _bev_area(boxes_b)[None, :] - inter
+    return inter / np.maximum(union, np.float32(EPS))
+
+
+def _greedy_nms(num, ia, ib):
+    """
+    Same pass as the host side of the NMS kernels: walk the boxes in score
+    order and let every kept box i remove the boxes ib of its pairs (i, ib).
+    ia must be sorted, returns the kept positions (int64).
+    """
+    starts = np.searchsorted(ia, np.arange(num + 1))
+    removed = np.zeros(num, bool)
+    keep = []
+    for i in range(num):
+        if removed[i]:
+            continue
+        keep.append(i)
+        removed[ib[starts[i]:starts[i + 1]]] = True
+    return np.array(keep, np.int64)
+
+
+def nms(boxes, scores, thresh):
+    """
+    rotated NMS in bird's eye view
+    :param boxes: (N, 5) [x1, y1, x2, y2, ry]
+    :param scores: (N)
+    :param thresh: float
+    :return: indices of the kept boxes in descending score order
+    """
+    order = np.argsort(-np.asarray(scores), kind='stable')
+    boxes = np.asarray(boxes, np.float32).reshape(-1, 5)[order]
+    ia, ib = _candidate_pairs(boxes, boxes, upper=True)
+    overlap = _pairs_overlap(boxes, boxes, ia, ib)
+    area = _bev_area(boxes)
+    iou = overlap / np.maximum(area[ia] + area[ib] - overlap, np.float32(EPS))
+    suppress = iou > thresh
+    return order[_greedy_nms(boxes.shape[0], ia[suppress], ib[suppress])]
+
+
+def nms_normal(boxes, scores, thresh):
+    """
+    axis aligned NMS in bird's eye view
+    :param boxes: (N, 5) [x1, y1, x2, y2, ry]
+    :param scores: (N)
+    :param thresh: float
+    :return: indices of the kept boxes in descending score order
+    """
+    order = np.argsort(-np.asarray(scores), kind='stable')
+    boxes = np.asarray(boxes, np.float32).reshape(-1, 5)[order]
+    num = boxes.shape[0]
+    ia, ib = [], []
+    for rows in _chunks(num, num):
+        iou = iou_normal(boxes[rows], boxes)
+        a, b = np.nonzero((iou > thresh) & (
+            np.arange(rows.start, rows.stop)[:, None] < np.arange(num)[None]))
+        ia.append(a + rows.start)
+        ib.append(b)
+    return order[_greedy_nms(num, np.concatenate(ia), np.concatenate(ib))]
+
+
+def batched_nms(boxes, scores, thresh, normal=False):
+    """
+    independent NMS of every group of boxes
+    :param boxes: (G, K, 5) [x1, y1, x2, y2, ry]
+    :param scores: (G, K)
+    :param thresh: float
+    :param normal: axis aligned NMS instead of rotated NMS
+    :return: (G, K) bool, True for the kept boxes
+    """
+    nms_func = nms_normal if normal else nms
+
+    def keep_single(group_boxes, group_scores):
+        keep = np.zeros(group_scores.shape[0], dtype=np.bool_)
+        keep[nms_func(group_boxes, group_scores, thresh)] = True
+        return keep
+
+    return map_batch(keep_single, np.asarray(boxes, np.float32),
+                     np.asarray(scores))
+
+
+# -------------------------------- roipool3d ----------------------------------
+def pts_in_boxes3d(pts, boxes3d, max_dis=10.0, chunk_elems=CHUNK_ELEMS):
+    """
+    Oriented box membership of every point for every box, with the tests of
+    the roipool3d kernels. Points are sorted by x once, so each box only
+    visits the points of the x strip covered by its bounding circle. Those in
+    the z strip too are rotated into the box frame and checked against the
+    half sizes.
+    :param pts: (N, 3) in rect-camera coords, further columns are ignored
+    :param boxes3d: (M, 7) [x, y, z, h, w, l, ry], y is the bottom center
+    :param max_dis: points farther than max_dis from the center along x or z
+        are outside like in the kernels, None for no limit
+    :param chunk_elems: max candidate (box, point) pairs handled at once
+    :return: (M, N) bool mask
+    """
+    pts = np.asarray(pts, dtype=np.float32)[:, 0:3]
+    boxes3d = np.asarray(boxes3d, dtype=np.float32).reshape(-1, 7)
+    mask = np.zeros((boxes3d.shape[0], pts.shape[0]), dtype=np.bool_)
+    if mask.size == 0:
+        return mask
+
+    order = np.argsort(pts[:, 0], kind='stable')
+    sorted_x = pts[order, 0]
+    radius = np.sqrt(boxes3d[:, 4]**2 + boxes3d[:, 5]**2) / 2.0 + 1e-3
+    if max_dis is not None:
+        radius = np.minimum(radius, max_dis)
+    low = np.searchsorted(sorted_x, boxes3d[:, 0] - radius, side='left')
+    high = np.searchsorted(sorted_x, boxes3d[:, 0] + radius, side='right')
+    cnt = high - low
+    cum_cnt = np.cumsum(cnt)
+    cos_ry, sin_ry = np.cos(boxes3d[:, 6]), np.sin(boxes3d[:, 6])
+    start = 0
+    while start < boxes3d.shape[0]:
+        # boxes of one chunk, always at least one
+        end = max(
+            start + 1,
+            np.searchsorted(cum_cnt, cum_cnt[start] - cnt[start] + chunk_elems,
+                            side='right'))
+        box_cnt = cnt[start:end]
+        box_idx = np.repeat(np.arange(start, end), box_cnt)
+        offset = np.arange(box_idx.shape[0]) - np.repeat(
+            np.cumsum(box_cnt) - box_cnt, box_cnt)
+        pt_idx = order[np.repeat(low[start:end], box_cnt) + offset]
+
+        # z strip of the bounding circle first, it drops most pairs
+        near = np.abs(pts[pt_idx, 2] - boxes3d[box_idx, 2]) <= radius[box_idx]
+        box_idx, pt_idx = box_idx[near], pt_idx[near]
+
+        cx, bottom_y, cz, h, w, l, _ = boxes3d[box_idx].T
+        cur_pts = pts[pt_idx]
+        dx = cur_pts[:, 0] - cx
+        dz = cur_pts[:, 2] - cz
+        cosa, sina = cos_ry[box_idx], sin_ry[box_idx]
+        flag = (np.abs(cur_pts[:, 1] - (bottom_y - h / 2.0)) <= h / 2.0) & \
+            (np.abs(dx * cosa - dz * sina) <= l / 2.0) & \
+            (np.abs(dx * sina + dz * cosa) <= w / 2.0)
+        mask[box_idx[flag], pt_idx[flag]] = True
+        start = end
+    return mask
+
+
+def roipool3d_idx(pts, boxes3d, sampled_pt_num):
+    """
+    :param pts: (N, 3)
+    :param boxes3d: (M, 7)
+    :param sampled_pt_num: int
+    :return:
+        idx: (M, sampled_pt_num) first in-box points in index order, repeated
+            cyclically when the box holds fewer points
+        empty_flag: (M) int, 1 for boxes without any point
+    """
+    mask = pts_in_boxes3d(pts, boxes3d)
+    idx, cnt = _first_hits(mask, sampled_pt_num, pad_first=False)
+    return idx, (cnt == 0).astype(np.int32)
+
+
+def roipool3d(pts, pts_feature, boxes3d, sampled_pt_num):
+    """
+    :param pts: (N, 3)
+    :param pts_feature: (N, C)
+    :param boxes3d: (M, 7)
+    :param sampled_pt_num: int
+    :return:
+        pooled_pts: (M, sampled_pt_num, 3)
+        pooled_features: (M, sampled_pt_num, C)
+        pooled_empty_flag: (M) int64, pooled values of empty boxes are zero
+    """
+    idx, empty_flag = roipool3d_idx(pts, boxes3d, sampled_pt_num)
+    non_empty = (empty_flag == 0)[:, None, None]
+    pooled_pts = np.where(non_empty, pts[idx], 0).astype(np.float32)
+    pooled_features = np.where(non_empty, pts_feature[idx],
+                               0).astype(np.float32)
+    return pooled_pts, pooled_features, empty_flag.astype(np.int64)
+
+
+def roipool3d_batch(pts, pts_feature, boxes3d, sampled_pt_num):
+    """
+    :param pts: (B, N, 3)
+    :param pts_feature: (B, N, C)
+    :param boxes3d: (B, M, 7)
+    :param sampled_pt_num: int
+    :return:
+        pooled_features: (B, M, sampled_pt_num, 3 + C)
+        pooled_empty_flag: (B, M) int32
+    """
+
+    def pool(p, f, b):
+        idx, empty_flag = roipool3d_idx(p, b, sampled_pt_num)
+        pooled = np.concatenate([p, f], axis=1)[idx]
+        pooled[empty_flag > 0] = 0
+        return pooled.astype(np.float32), empty_flag
+
+    return map_batch(pool, pts, pts_feature, boxes3d)
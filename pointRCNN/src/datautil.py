@@ -20,51 +20,20 @@ import numpy as np
 import mindspore as ms
 from mindspore.context import set_context, PYNATIVE_MODE
 from src.lib.datasets.kitti_rcnn_dataset import KittiRCNNDataset
+from src.lib.datasets.batch_collator import BatchCollator
 from src.lib.config import cfg
 
 set_context(mode=PYNATIVE_MODE)
 
 
-class batchpad():
-    """batchpad"""
+class batchpad(BatchCollator):
+    """per_batch_map padding the box columns of the current config"""
     def __init__(self, cols):
-        self.cols = cols
-
-    def __call__(self, *c):
-        ans = []
-        assert len(self.cols) == len(c) - 1
-        batch_size = len(c[0])
-        # assert batch_size > 1
-        for ii, key in enumerate(self.cols):
-            if cfg.RPN.ENABLED and key == 'gt_boxes3d' or \
-                    (cfg.RCNN.ENABLED and cfg.RCNN.ROI_SAMPLE_JIT and key in ['gt_boxes3d', 'roi_boxes3d']):
-                max_gt = 1
-                for k in range(batch_size):
-                    max_gt = max(max_gt, c[ii][k].__len__())
-                batch_gt_boxes3d = np.zeros((batch_size, max_gt, 7),
-                                            dtype=np.float32)
-                for i in range(batch_size):
-                    batch_gt_boxes3d[i, :c[ii][i].__len__(), :] = c[ii][i]
-                ans.append(batch_gt_boxes3d)
-                continue
-            if isinstance(c[ii], np.ndarray):
-                if batch_size == 1:
-                    ans.append(c[ii][np.newaxis, ...])
-                else:
-                    ans.append(
-                        np.concatenate([
-                            c[ii][k][np.newaxis, ...]
-                            for k in range(batch_size)
-                        ],
-                                       axis=0))
-            else:
-                temp = [c[ii][k] for k in range(batch_size)]
-                if isinstance(c[ii][0], int):
-                    temp = np.array(temp, dtype=np.int32)
-                elif isinstance(c[ii][0], float):
-                    temp = np.array(temp, dtype=np.float32)
-                ans.append(temp)
-        return tuple(ans)
+        # a batch of a thread stays alive while it waits in the prefetch queue
+        super().__init__(cols,
+                         pad_cols=KittiRCNNDataset.box_pad_cols(cols),
+                         min_pad=1,
+                         num_slots=ms.dataset.config.get_prefetch_size() + 2)
 
 
 def get_cols(mode="TRAIN"):
@@ -117,6 +86,7 @@ def create_dataloader(logger, args):
     train_batch_loader = train_loader.batch(args.batch_size,
                                             drop_remainder=True,
                                             num_parallel_workers=4,
+                                            per_batch_map=batchpad(cols=cols),
                                             python_multiprocessing=True)
 
     if args.train_with_eval:
@@ -154,7 +124,7 @@ def create_dataloader_debug(logger):
         classes=cfg.CLASSES,
         rcnn_training_roi_dir=None,
         rcnn_training_feature_dir=None,
-        gt_database_dir='src/gt_database/train_gt_database_3level_Car.pkl')
+        gt_database_dir='src/gt_database/train_gt_database_3level_Car')
     num_class = train_set.num_class
 
     cols = train_set.getitem_cols(0)
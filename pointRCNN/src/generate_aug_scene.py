@@ -15,18 +15,14 @@
 # This file was copied from project [sshaoshuai][https://github.com/sshaoshuai/PointRCNN]
 """generate aug scene"""
 import os
-import pickle
 import argparse
 import numpy as np
-import mindspore as ms
 
 import src.lib.utils.kitti_utils as kitti_utils
-import src.lib.utils.roipool3d.roipool3d_utils as roipool3d_utils
-import src.lib.utils.iou3d.iou3d_utils as iou3d_utils
 from src.lib.datasets.kitti_dataset import KittiDataset
-
-
-np.random.seed(1024)
+from src.lib.datasets.gt_database import load_gt_database
+from src.lib.utils.shard_checkpoint import ShardCheckpoint, run_shards, \
+    split_shards
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--mode', type=str, default='generator')
@@ -37,9 +33,22 @@ parser.add_argument('--save_dir',
 parser.add_argument('--split', type=str, default='train')
 parser.add_argument('--gt_database_dir',
                     type=str,
-                    default='gt_database/train_gt_database_3level_Car.pkl')
+                    default='gt_database/train_gt_database_3level_Car')
 parser.add_argument('--include_similar', action='store_true', default=False)
 parser.add_argument('--aug_times', type=int, default=4)
+parser.add_argument('--seed',
+                    type=int,
+                    default=1024,
+                    help='every scene is augmented with its own seed')
+parser.add_argument('--workers', type=int, default=8)
+parser.add_argument('--shard_scenes',
+                    type=int,
+                    default=200,
+                    help='scenes of one checkpointed job shard')
+parser.add_argument('--restart',
+                    action='store_true',
+                    default=False,
+                    help='discard the checkpoint of an interrupted run')
 args = parser.parse_args()
 
 PC_REDUCE_BY_RANGE = True
@@ -184,15 +193,16 @@ class AugSceneGenerator(KittiDataset):
         return False
 
     def aug_one_scene(self, sample_id, pts_rect, pts_intensity,
-                      all_gt_boxes3d):
+                      all_gt_boxes3d, rng=np.random):
         """
         :param pts_rect: (N, 3)
         :param gt_boxes3d: (M1, 7)
         :param all_gt_boxex3d: (M2, 7)
+        :param rng: np.random.RandomState of this scene
         :return:
         """
         assert self.gt_database is not None
-        extra_gt_num = np.random.randint(10, 15)
+        extra_gt_num = rng.randint(10, 15)
         try_times = 50
         cnt = 0
         cur_gt_boxes3d = all_gt_boxes3d.copy()
@@ -211,7 +221,7 @@ class AugSceneGenerator(KittiDataset):
         while try_times > 0:
             try_times -= 1
 
-            rand_idx = np.random.randint(0, len(self.gt_database) - 1)
+            rand_idx = rng.randint(0, len(self.gt_database) - 1)
 
             new_gt_dict = self.gt_database[rand_idx]
             new_gt_box3d = new_gt_dict['gt_box3d'].copy()
@@ -234,21 +244,20 @@ class AugSceneGenerator(KittiDataset):
 
             cnt += 1
 
-            iou3d = iou3d_utils.boxes_iou3d_gpu(
-                ms.Tensor.from_numpy(new_gt_box3d.reshape(1, 7)),
-                ms.Tensor.from_numpy(cur_gt_boxes3d)).asnumpy()
+            # numpy iou, the workers do not share a device
+            iou3d = kitti_utils.get_iou3d(
+                kitti_utils.boxes3d_to_corners3d(new_gt_box3d.reshape(1, 7)),
+                kitti_utils.boxes3d_to_corners3d(cur_gt_boxes3d))
 
-            valid_flag = iou3d.max() < 1e-8
+            valid_flag = iou3d.size == 0 or iou3d.max() < 1e-8
             if not valid_flag:
                 continue
 
             enlarged_box3d = new_gt_box3d.copy()
             enlarged_box3d[
                 3] += 2  # remove the points above and below the object
-            boxes_pts_mask_list = roipool3d_utils.pts_in_boxes3d_cpu(
-                ms.Tensor.from_numpy(pts_rect),
-                ms.Tensor.from_numpy(enlarged_box3d.reshape(1, 7)))
-            pt_mask_flag = (boxes_pts_mask_list[0].numpy() == 1)
+            pt_mask_flag = kitti_utils.pts_in_boxes3d(
+                pts_rect, enlarged_box3d.reshape(1, 7))[0]
             src_pts_flag[
                 pt_mask_flag] = 0  # remove the original points which are inside the new box
 
@@ -278,95 +287,118 @@ class AugSceneGenerator(KittiDataset):
 
         return True, pts_rect, pts_intensity, extra_gt_boxes3d, extra_gt_obj_list
 
-    def aug_one_epoch_scene(self,
-                            base_id,
-                            data_save_dir,
-                            label_save_dir,
-                            split_list,
-                            log_fp_=None):
-        """aug_one_epoch_scene"""
-        for _, sample_id in enumerate(self.image_idx_list):
-            sample_id = int(sample_id)
-            print('process gt sample (%s, id=%06d)' % (args.split, sample_id))
-
-            pts_lidar = self.get_lidar(sample_id)
-            calib = self.get_calib(sample_id)
-            pts_rect = calib.lidar_to_rect(pts_lidar[:, 0:3])
-            pts_img, pts_rect_depth = calib.rect_to_img(pts_rect)
-            img_shape = self.get_image_shape(sample_id)
-
-            pts_valid_flag = self.get_valid_flag(pts_rect, pts_img,
-                                                 pts_rect_depth, img_shape)
-            pts_rect = pts_rect[pts_valid_flag][:, 0:3]
-            pts_intensity = pts_lidar[pts_valid_flag][:, 3]
-
-            # all labels for checking overlapping
-            all_obj_list = self.filtrate_dc_objects(self.get_label(sample_id))
-            all_gt_boxes3d = np.zeros((len(all_obj_list), 7),
-                                      dtype=np.float32)
-            for k, obj in enumerate(all_obj_list):
-                all_gt_boxes3d[k, 0:3], all_gt_boxes3d[k, 3], all_gt_boxes3d[k, 4], all_gt_boxes3d[k, 5], \
-                all_gt_boxes3d[k, 6] = obj.pos, obj.h, obj.w, obj.l, obj.ry
-
-            # gt_boxes3d of current label
-            obj_list = self.filtrate_objects(self.get_label(sample_id))
-            if args.class_name != 'Car' and not obj_list:
-                continue
-
-            # augment one scene
-            aug_flag, pts_rect, pts_intensity, extra_gt_boxes3d, extra_gt_obj_list = \
-                self.aug_one_scene(sample_id, pts_rect, pts_intensity, all_gt_boxes3d)
-
-            # save augment result to file
-            pts_info = np.concatenate((pts_rect, pts_intensity.reshape(-1, 1)),
-                                      axis=1)
-            bin_file = os.path.join(data_save_dir,
-                                    '%06d.bin' % (base_id + sample_id))
-            pts_info.astype(np.float32).tofile(bin_file)
-
-            # save filtered original gt_boxes3d
-            label_save_file = os.path.join(label_save_dir,
-                                           '%06d.txt' % (base_id + sample_id))
-            with open(label_save_file, 'w') as f:
-                for obj in obj_list:
-                    print(obj.to_kitti_format(), file=f)
-
-                if aug_flag:
-                    # augment successfully
-                    save_kitti_format(calib,
-                                      extra_gt_boxes3d,
-                                      extra_gt_obj_list,
-                                      img_shape=img_shape,
-                                      save_fp=f)
-                else:
-                    extra_gt_boxes3d = np.zeros((0, 7), dtype=np.float32)
-            log_print('Save to file (new_obj: %s): %s' %
-                      (len(extra_gt_boxes3d), label_save_file),
-                      fp=log_fp_)
-            split_list.append('%06d' % (base_id + sample_id))
-
-    def generate_aug_scene(self, aug_times, log_fp_=None):
-        """generate_aug_scene"""
+    def aug_sample(self, base_id, sample_id, data_save_dir, label_save_dir,
+                   seed):
+        """
+        Augment and save one scene, the random state only depends on seed
+        and the id of the new sample.
+        :return: id of the new sample or None if the scene is skipped, log
+        """
+        pts_lidar = self.get_lidar(sample_id)
+        calib = self.get_calib(sample_id)
+        pts_rect = calib.lidar_to_rect(pts_lidar[:, 0:3])
+        pts_img, pts_rect_depth = calib.rect_to_img(pts_rect)
+        img_shape = self.get_image_shape(sample_id)
+
+        pts_valid_flag = self.get_valid_flag(pts_rect, pts_img,
+                                             pts_rect_depth, img_shape)
+        pts_rect = pts_rect[pts_valid_flag][:, 0:3]
+        pts_intensity = pts_lidar[pts_valid_flag][:, 3]
+
+        # all labels for checking overlapping
+        all_obj_list = self.filtrate_dc_objects(self.get_label(sample_id))
+        all_gt_boxes3d = np.zeros((len(all_obj_list), 7), dtype=np.float32)
+        for k, obj in enumerate(all_obj_list):
+            all_gt_boxes3d[k, 0:3], all_gt_boxes3d[k, 3], all_gt_boxes3d[k, 4], all_gt_boxes3d[k, 5], \
+            all_gt_boxes3d[k, 6] = obj.pos, obj.h, obj.w, obj.l, obj.ry
+
+        # gt_boxes3d of current label
+        obj_list = self.filtrate_objects(self.get_label(sample_id))
+        if args.class_name != 'Car' and not obj_list:
+            return None, 'No gt object (%s, id=%06d)' % (args.split, sample_id)
+
+        # augment one scene
+        rng = np.random.RandomState([seed, base_id + sample_id])
+        aug_flag, pts_rect, pts_intensity, extra_gt_boxes3d, extra_gt_obj_list = \
+            self.aug_one_scene(sample_id, pts_rect, pts_intensity,
+                               all_gt_boxes3d, rng=rng)
+
+        # save augment result to file
+        pts_info = np.concatenate((pts_rect, pts_intensity.reshape(-1, 1)),
+                                  axis=1)
+        bin_file = os.path.join(data_save_dir,
+                                '%06d.bin' % (base_id + sample_id))
+        pts_info.astype(np.float32).tofile(bin_file)
+
+        # save filtered original gt_boxes3d
+        label_save_file = os.path.join(label_save_dir,
+                                       '%06d.txt' % (base_id + sample_id))
+        with open(label_save_file, 'w') as f:
+            for obj in obj_list:
+                print(obj.to_kitti_format(), file=f)
+
+            if aug_flag:
+                # augment successfully
+                save_kitti_format(calib,
+                                  extra_gt_boxes3d,
+                                  extra_gt_obj_list,
+                                  img_shape=img_shape,
+                                  save_fp=f)
+            else:
+                extra_gt_boxes3d = np.zeros((0, 7), dtype=np.float32)
+        info = 'Save to file (new_obj: %s): %s' % (len(extra_gt_boxes3d),
+                                                   label_save_file)
+        return '%06d' % (base_id + sample_id), info
+
+    def aug_shard(self, jobs):
+        """aug_sample of every (base_id, sample_id, dirs, seed) of a shard"""
+        return [self.aug_sample(*job) for job in jobs]
+
+    def generate_aug_scene(self, aug_times, log_fp_=None, workers=8,
+                           shard_scenes=200, seed=1024, restart=False):
+        """
+        Augment every scene aug_times times. The scenes of all epochs are
+        split into shards that run in parallel and are checkpointed in
+        save_dir, an interrupted run resumes with the unfinished shards.
+        The split file is merged in epoch and scene order.
+        """
         data_save_dir = os.path.join(args.save_dir, 'rectified_data')
         label_save_dir = os.path.join(args.save_dir, 'aug_label')
         os.makedirs(data_save_dir, exist_ok=True)
         os.makedirs(label_save_dir, exist_ok=True)
 
+        jobs = [((epoch + 1) * 10000, int(sample_id), data_save_dir,
+                 label_save_dir, seed) for epoch in range(aug_times)
+                for sample_id in self.image_idx_list]
+        shards = split_shards(jobs, shard_scenes)
+        config = {
+            'jobs': jobs,
+            'shard_scenes': shard_scenes,
+            'class_name': args.class_name,
+            'include_similar': args.include_similar,
+            'gt_database_dir': args.gt_database_dir
+        }
+        ckpt = ShardCheckpoint(os.path.join(args.save_dir,
+                                            '%s_aug.ckpt' % args.split),
+                               config,
+                               restart=restart)
+        run_shards(AugSceneGenerator.aug_shard, self, shards, ckpt,
+                   workers=workers)
+
         split_file = os.path.join(args.save_dir, '%s_aug.txt' % args.split)
         split_list = self.image_idx_list.copy()
-        for epoch in range(aug_times):
-            base_id = (epoch + 1) * 10000
-            self.aug_one_epoch_scene(base_id,
-                                     data_save_dir,
-                                     label_save_dir,
-                                     split_list,
-                                     log_fp_=log_fp_)
+        for results in ckpt.iter_results(len(shards)):
+            for new_id, info in results:
+                log_print(info, fp=log_fp_)
+                if new_id is not None:
+                    split_list.append(new_id)
 
         with open(split_file, 'w') as f:
             for idx, sample_id in enumerate(split_list):
                 print(sample_id, file=f, end='')
                 if idx != len(split_list) - 1:
                     print('', file=f)
+        ckpt.clear()
         log_print('Save split file to %s' % split_file, fp=log_fp_)
         target_dir = '../data/KITTI/ImageSets/'
         os.system('cp %s %s' % (split_file, target_dir))
@@ -381,7 +413,7 @@ if __name__ == '__main__':
     if args.mode == 'generator':
         log_fp = open(info_file, 'w')
 
-        gt_database = pickle.load(open(args.gt_database_dir, 'rb'))
+        gt_database = load_gt_database(args.gt_database_dir)
         log_print('Loading gt_database(%d) from %s' %
                   (len(gt_database), args.gt_database_dir),
                   fp=log_fp)
@@ -389,7 +421,12 @@ if __name__ == '__main__':
         dataset = AugSceneGenerator(root_dir='../data',
                                     gt_database_=gt_database,
                                     split=args.split)
-        dataset.generate_aug_scene(aug_times=args.aug_times, log_fp_=log_fp)
+        dataset.generate_aug_scene(aug_times=args.aug_times,
+                                   log_fp_=log_fp,
+                                   workers=args.workers,
+                                   shard_scenes=args.shard_scenes,
+                                   seed=args.seed,
+                                   restart=args.restart)
 
         log_fp.close()
 
@@ -16,18 +16,35 @@
 """generate groundtruth database"""
 import os
 import argparse
-import pickle
 import numpy as np
-import torch
 
-import src.lib.utils.roipool3d.roipool3d_utils as roipool3d_utils
+import src.lib.utils.kitti_utils as kitti_utils
 from src.lib.datasets.kitti_dataset import KittiDataset
+from src.lib.datasets.gt_database import GTDatabaseWriter
+from src.lib.utils.shard_checkpoint import ShardCheckpoint, run_shards, \
+    split_shards
 
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--save_dir', type=str, default='./gt_database')
 parser.add_argument('--class_name', type=str, default='Car')
 parser.add_argument('--split', type=str, default='train')
+parser.add_argument('--workers',
+                    type=int,
+                    default=8,
+                    help='processes reading and cropping the scenes')
+parser.add_argument('--shard_points',
+                    type=int,
+                    default=1 << 24,
+                    help='max points of one shard of the database')
+parser.add_argument('--shard_scenes',
+                    type=int,
+                    default=200,
+                    help='scenes of one checkpointed job shard')
+parser.add_argument('--restart',
+                    action='store_true',
+                    default=False,
+                    help='discard the checkpoint of an interrupted run')
 args = parser.parse_args()
 
 
@@ -65,59 +82,75 @@ class GTDatabaseGenerator(KittiDataset):
 
         return valid_obj_list
 
-    def generate_gt_database(self):
-        """generate groundtruth database"""
-        gt_database = []
-        for _, sample_id in enumerate(self.image_idx_list):
-            sample_id = int(sample_id)
-            print('process gt sample (id=%06d)' % sample_id)
-
-            pts_lidar = self.get_lidar(sample_id)
-            calib = self.get_calib(sample_id)
-            pts_rect = calib.lidar_to_rect(pts_lidar[:, 0:3])
-            pts_intensity = pts_lidar[:, 3]
-
-            obj_list = self.filtrate_objects(self.get_label(sample_id))
-
-            gt_boxes3d = np.zeros((len(obj_list), 7), dtype=np.float32)
-            for k, obj in enumerate(obj_list):
-                gt_boxes3d[k, 0:3], gt_boxes3d[k, 3], gt_boxes3d[k, 4], gt_boxes3d[k, 5], gt_boxes3d[k, 6] \
-                    = obj.pos, obj.h, obj.w, obj.l, obj.ry
-
-            if not gt_boxes3d:
-                print('No gt object')
-                continue
-
-            boxes_pts_mask_list = roipool3d_utils.pts_in_boxes3d_cpu(
-                torch.from_numpy(pts_rect), torch.from_numpy(gt_boxes3d))
-
-            for k in range(len(boxes_pts_mask_list)):
-                pt_mask_flag = (boxes_pts_mask_list[k].numpy() == 1)
-                cur_pts = pts_rect[pt_mask_flag].astype(np.float32)
-                cur_pts_intensity = pts_intensity[pt_mask_flag].astype(
-                    np.float32)
-                sample_dict = {
-                    'sample_id': sample_id,
-                    'cls_type': obj_list[k].cls_type,
-                    'gt_box3d': gt_boxes3d[k],
-                    'points': cur_pts,
-                    'intensity': cur_pts_intensity,
-                    'obj': obj_list[k]
-                }
-                gt_database.append(sample_dict)
-
-        save_file_name = os.path.join(
-            args.save_dir,
-            '%s_gt_database_3level_%s.pkl' % (args.split, self.classes[-1]))
-        with open(save_file_name, 'wb') as f:
-            pickle.dump(gt_database, f)
-
-        self.gt_database = gt_database
-        print('Save refine training sample info file to %s' % save_file_name)
+    def crop_scene(self, sample_id):
+        """
+        :return: objects, gt boxes (M, 7) and the (n, 4) rect xyz + intensity
+            points inside every box of one scene
+        """
+        pts_lidar = self.get_lidar(sample_id)
+        calib = self.get_calib(sample_id)
+        pts_rect = calib.lidar_to_rect(pts_lidar[:, 0:3])
+        pts = np.concatenate([pts_rect, pts_lidar[:, 3:4]],
+                             axis=1).astype(np.float32)
+
+        obj_list = self.filtrate_objects(self.get_label(sample_id))
+
+        gt_boxes3d = np.zeros((len(obj_list), 7), dtype=np.float32)
+        for k, obj in enumerate(obj_list):
+            gt_boxes3d[k, 0:3], gt_boxes3d[k, 3], gt_boxes3d[k, 4], gt_boxes3d[k, 5], gt_boxes3d[k, 6] \
+                = obj.pos, obj.h, obj.w, obj.l, obj.ry
+
+        boxes_pts_mask = kitti_utils.pts_in_boxes3d(pts_rect, gt_boxes3d)
+        points_list = [pts[pt_mask_flag] for pt_mask_flag in boxes_pts_mask]
+        return sample_id, obj_list, gt_boxes3d, points_list
+
+    def crop_shard(self, sample_ids):
+        """crop_scene of every scene of one job shard"""
+        return [self.crop_scene(sample_id) for sample_id in sample_ids]
+
+    def generate_gt_database(self, save_dir, workers=8, shard_points=1 << 24,
+                             shard_scenes=200, restart=False):
+        """
+        Generate the sharded groundtruth database. Scenes are cropped in
+        parallel shards that are checkpointed next to save_dir, so an
+        interrupted run resumes with the unfinished shards, then all shards
+        are merged in scene order.
+        """
+        sample_ids = [int(sample_id) for sample_id in self.image_idx_list]
+        shards = split_shards(sample_ids, shard_scenes)
+        config = {
+            'imageset_dir': os.path.realpath(self.imageset_dir),
+            'split': self.split,
+            'classes': self.classes,
+            'sample_ids': sample_ids,
+            'shard_scenes': shard_scenes
+        }
+        ckpt = ShardCheckpoint(save_dir.rstrip('/') + '.ckpt', config,
+                               restart=restart)
+        run_shards(GTDatabaseGenerator.crop_shard, self, shards, ckpt,
+                   workers=workers)
+
+        writer = GTDatabaseWriter(save_dir, shard_points=shard_points)
+        for scenes in ckpt.iter_results(len(shards)):
+            for sample_id, obj_list, gt_boxes3d, points_list in scenes:
+                if not obj_list:
+                    print('No gt object (id=%06d)' % sample_id)
+                    continue
+                writer.add_scene(sample_id, obj_list, gt_boxes3d, points_list)
+        num = writer.close()
+        ckpt.clear()
+        print('Save %d gt objects to %s' % (num, save_dir))
 
 
 if __name__ == '__main__':
     dataset = GTDatabaseGenerator(root_dir='../data/', split=args.split)
     os.makedirs(args.save_dir, exist_ok=True)
 
-    dataset.generate_gt_database()
+    dataset.generate_gt_database(
+        os.path.join(args.save_dir,
+                     '%s_gt_database_3level_%s' %
+                     (args.split, dataset.classes[-1])),
+        workers=args.workers,
+        shard_points=args.shard_points,
+        shard_scenes=args.shard_scenes,
+        restart=args.restart)
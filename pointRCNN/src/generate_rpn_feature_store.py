@@ -0,0 +1,48 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""pack saved rpn features and rois into a memory-mapped feature store"""
+import os
+import argparse
+
+from src.lib.datasets.rpn_feature_store import pack_rpn_features
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--result_dir',
+                    type=str,
+                    required=True,
+                    help='eval.py output of a --save_rpn_feature run')
+parser.add_argument('--feature_dir',
+                    type=str,
+                    default=None,
+                    help='default <result_dir>/features')
+parser.add_argument('--roi_dir',
+                    type=str,
+                    default=None,
+                    help='default <result_dir>/detections/data')
+parser.add_argument('--save_dir',
+                    type=str,
+                    default=None,
+                    help='default <result_dir>/feature_store')
+args = parser.parse_args()
+
+if __name__ == '__main__':
+    feature_dir = args.feature_dir or os.path.join(args.result_dir,
+                                                   'features')
+    roi_dir = args.roi_dir or os.path.join(args.result_dir, 'detections',
+                                           'data')
+    save_dir = args.save_dir or os.path.join(args.result_dir,
+                                             'feature_store')
+    num = pack_rpn_features(feature_dir, roi_dir, save_dir)
+    print('Save rpn features of %d samples to %s' % (num, save_dir))
@@ -0,0 +1,38 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""pack a kitti split into a memory-mapped sample store"""
+import os
+import argparse
+
+from src.lib.datasets.kitti_dataset import KittiDataset
+from src.lib.datasets.kitti_sample_store import pack_kitti_samples
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--root_dir', type=str, default='../data/')
+parser.add_argument('--save_dir', type=str, default='./sample_store')
+parser.add_argument('--split', type=str, default='train')
+args = parser.parse_args()
+
+if __name__ == '__main__':
+    dataset = KittiDataset(root_dir=args.root_dir, split=args.split)
+    # augmented scenes (id >= 10000) live outside the KITTI tree and are
+    # still read from their files
+    sample_ids = [
+        int(x) for x in dataset.image_idx_list if int(x) < 10000
+    ]
+    save_dir = os.path.join(args.save_dir, args.split)
+    os.makedirs(args.save_dir, exist_ok=True)
+    num = pack_kitti_samples(dataset, save_dir, sample_ids)
+    print('Save %d samples of split %s to %s' % (num, args.split, save_dir))
@@ -14,20 +14,27 @@
 # ============================================================================
 """layer utils"""
 import sys
+from functools import lru_cache
 from pathlib import Path
 from typing import List, Tuple
 import mindspore as ms
 from mindspore import nn, ops, Tensor
 
+import src.cpu_ops as cpu_ops
+from src.lib.config import cfg
+
 sys.path.append("../")
 sys.path.append("../../")
 sys.path.append("../../pointnet2_lib/src")
 
-tt = open("log.txt", "a")
+tt = None
 
 
 def log_to_file(s: str):
-    """log to file"""
+    """log to file, log.txt is only created by the first log"""
+    global tt
+    if tt is None:
+        tt = open("log.txt", "a")
     tt.write(str(s))
     tt.write('\n')
     tt.flush()
@@ -36,6 +43,57 @@ def log_to_file(s: str):
 op_map = {}
 
 
+@lru_cache(maxsize=None)
+def find_so(so_name: str) -> Path:
+    """
+    Locate a compiled extension under the project tree. The filesystem is
+    walked once per so_name and the resolved path is reused afterwards.
+    """
+    sos: List[Path] = list(Path(__file__).parent.parent.glob("**/*.so"))
+    for so in sos:
+        if so_name in so.name:
+            return so.absolute()
+    raise Exception(f"Can't find {so_name} in {sos}")
+
+
+@lru_cache(maxsize=None)
+def shape_of_input(input_n: int, *dims):
+    """
+    Shape inference function for ops.Custom: the output has the shape of the
+    input_n-th input, optionally restricted to the given dims. An int in dims
+    selects that axis of the input shape, a tuple (j, axis) selects an axis of
+    the j-th input instead. The returned function is cached so that it can be
+    used as a stable key of op_map.
+    """
+
+    def infer(*shapes):
+        if not dims:
+            return shapes[input_n]
+        out = []
+        for d in dims:
+            if isinstance(d, tuple):
+                out.append(shapes[d[0]][d[1]])
+            else:
+                out.append(shapes[input_n][d])
+        return tuple(out)
+
+    return infer
+
+
+@lru_cache(maxsize=None)
+def fixed_tail_shape(input_n: int, n_lead: int, *tail):
+    """
+    Shape inference function for ops.Custom: the first n_lead axes are taken
+    from the input_n-th input and the constant tail is appended, e.g.
+    (B, npoint) for furthest point sampling where npoint is not a shape.
+    """
+
+    def infer(*shapes):
+        return tuple(shapes[input_n][:n_lead]) + tail
+
+    return infer
+
+
 def get_func_from_so(so_name: str,
                      func_name: str,
                      output_n=-1,
@@ -43,31 +101,47 @@ def get_func_from_so(so_name: str,
                      out_shape=None,
                      out_dtype=None,
                      in_type=None):
-    """get function from so"""
+    """
+    get function from so
+
+    Ops are cached in op_map by their signature, so repeated calls (e.g. from
+    construct) return the already built ops.Custom. Pass a shape inference
+    function built by shape_of_input/fixed_tail_shape as out_shape to get one
+    op that serves every batch size and point count.
+    """
     if not func_name.startswith("ms_"):
         func_name = "ms_" + func_name
-    k = hash((func_name, out_shape, out_dtype, CPU_opt, output_n, in_type))
-
-    sos: List[Path] = list(Path(__file__).parent.parent.glob("**/*.so"))
-    for so in sos:
-        if so_name in so.name:
-            name = f"{so.absolute()}:{func_name}"
-            t = lambda *x: x[output_n]
-            if out_shape and out_dtype:
-                op = ops.Custom(name,
-                                out_shape=out_shape,
-                                out_dtype=out_dtype,
-                                func_type="aot")
-            else:
-                op = ops.Custom(name,
-                                out_shape=t,
-                                out_dtype=t,
-                                func_type="aot")
-            if CPU_opt is True:
-                op.add_prim_attr("primitive_target", "CPU")
-            op_map[k] = op
-            return op
-    raise Exception(f"Can't find {so_name} in {sos}")
+    k = (so_name, func_name, out_shape, out_dtype, CPU_opt, output_n, in_type)
+    op = op_map.get(k)
+    if op is not None:
+        return op
+
+    name = f"{find_so(so_name)}:{func_name}"
+    t = lambda *x: x[output_n]
+    if out_shape and out_dtype:
+        op = ops.Custom(name,
+                        out_shape=out_shape,
+                        out_dtype=out_dtype,
+                        func_type="aot")
+    else:
+        op = ops.Custom(name, out_shape=t, out_dtype=t, func_type="aot")
+    if CPU_opt is True:
+        op.add_prim_attr("primitive_target", "CPU")
+    op_map[k] = op
+    return op
+
+
+def clear_op_cache():
+    """drop all cached ops and resolved shared libraries"""
+    op_map.clear()
+    find_so.cache_clear()
+
+
+def use_cpu_ops() -> bool:
+    """whether the NumPy kernels replace the compiled custom ops"""
+    if cfg.OPS_BACKEND not in ('cuda', 'cpu'):
+        raise Exception(f"Unknown OPS_BACKEND {cfg.OPS_BACKEND}")
+    return cfg.OPS_BACKEND == 'cpu'
 
 
 class _ConvBase(nn.Cell):
@@ -261,9 +335,12 @@ class GatherOperation(nn.Cell):
 
         log_to_file("GatherOperation")
         log_to_file((B, C, npoint))
+        if use_cpu_ops():
+            return Tensor(
+                cpu_ops.gather_points(features.asnumpy(), idx.asnumpy()))
         op = get_func_from_so(so_name=self.so_name,
                               func_name=self.func_name,
-                              out_shape=(B, C, npoint),
+                              out_shape=shape_of_input(4, 0, 1, (5, 1)),
                               out_dtype=ms.float32)
         _B = Tensor(B, ms.dtype.int32)
         _C = Tensor(C, ms.dtype.int32)
@@ -297,9 +374,13 @@ class GroupingOperation(nn.Cell):
 
         log_to_file("GroupingOperation")
         log_to_file((B, C, npoint, nsample))
+        if use_cpu_ops():
+            return Tensor(
+                cpu_ops.group_points(features.asnumpy(), idx.asnumpy()))
         op = get_func_from_so(so_name=self.so_name,
                               func_name=self.func_name,
-                              out_shape=(B, C, npoint, nsample),
+                              out_shape=shape_of_input(5, 0, 1, (6, 1),
+                                                       (6, 2)),
                               out_dtype=ms.float32)
         _B = ms.Tensor(B, ms.int32)
         _C = ms.Tensor(C, ms.int32)
@@ -319,13 +400,19 @@ class BallQuery(nn.Cell):
     """BallQuery"""
 
 
-    def construct(self, radius: float, nsample: int, xyz: ms.Tensor,
-                  new_xyz: ms.Tensor) -> ms.Tensor:
+    def construct(self,
+                  radius: float,
+                  nsample: int,
+                  xyz: ms.Tensor,
+                  new_xyz: ms.Tensor,
+                  neighborhoods=None) -> ms.Tensor:
         """
         :param radius: float, radius of the balls
         :param nsample: int, maximum number of features in the balls
         :param xyz: (B, N, 3) xyz coordinates of the features
         :param new_xyz: (B, npoint, 3) centers of the ball query
+        :param neighborhoods: list of cpu_ops.BallNeighborhood of xyz and
+            new_xyz shared by the radii of one SA layer, CPU backend only
         :return:
             idx: (B, npoint, nsample) tensor with the indices of the features that form the query balls
         """
@@ -333,10 +420,19 @@ class BallQuery(nn.Cell):
         B, N, _ = xyz.shape
         npoint = new_xyz.shape[1]
 
-        ball_query_wrapper = get_func_from_so("pointnet2_cuda",
-                                              "ball_query_wrapper_fast",
-                                              out_shape=(B, npoint, nsample),
-                                              out_dtype=ms.int32)
+        if neighborhoods is not None:
+            return Tensor(
+                cpu_ops.ball_query_neighborhoods(neighborhoods, radius,
+                                                 nsample))
+        if use_cpu_ops():
+            return Tensor(
+                cpu_ops.ball_query(radius, nsample, xyz.asnumpy(),
+                                   new_xyz.asnumpy()))
+        ball_query_wrapper = get_func_from_so(
+            "pointnet2_cuda",
+            "ball_query_wrapper_fast",
+            out_shape=fixed_tail_shape(5, 2, nsample),
+            out_dtype=ms.int32)
 
         idx = ball_query_wrapper(B, N, npoint, radius, nsample, new_xyz, xyz)
         return idx
@@ -360,17 +456,20 @@ class QueryAndGroup(nn.Cell):
     def construct(self,
                   xyz: ms.Tensor,
                   new_xyz: ms.Tensor,
-                  features: ms.Tensor = None) -> Tuple[ms.Tensor]:
+                  features: ms.Tensor = None,
+                  neighborhoods=None) -> Tuple[ms.Tensor]:
         """
         :param xyz: (B, N, 3) xyz coordinates of the features
         :param new_xyz: (B, npoint, 3) centroids
         :param features: (B, C, N) descriptors of the features
+        :param neighborhoods: see BallQuery
         :return:
             new_features: (B, 3 + C, npoint, nsample)
         """
         assert new_xyz.shape[2] == 3
         ball_query_ = BallQuery()
-        idx = ball_query_(self.radius, self.nsample, xyz, new_xyz)
+        idx = ball_query_(self.radius, self.nsample, xyz, new_xyz,
+                          neighborhoods)
 
         xyz_trans = xyz.swapaxes(1, 2)
         grouped_xyz = grouping_operation(xyz_trans,
@@ -409,13 +508,15 @@ class FurthestPointSampling(nn.Cell):
 
         B, N, _ = xyz.shape
 
+        if use_cpu_ops():
+            return Tensor(cpu_ops.furthest_point_sample(xyz.asnumpy(), npoint))
         temp = ms.numpy.full((B, N), 1e10)
         log_to_file("FurthestPointSampling")
         log_to_file((B, npoint))
         furthest_point_sampling_wrapper = get_func_from_so(
             "pointnet2_cuda",
             "furthest_point_sampling_wrapper",
-            out_shape=(B, npoint),
+            out_shape=fixed_tail_shape(3, 1, npoint),
             out_dtype=ms.int32)
         _B = ms.Tensor(B, ms.int32)
         _N = ms.Tensor(N, ms.int32)
@@ -460,10 +561,18 @@ class _PointnetSAModuleBase(nn.Cell):
                 xyz_flipped, furthest_point_sample(xyz, self.npoint)).swapaxes(
                     1, 2) if self.npoint is not None else None
 
+        # the voxel hash of the CPU backend is built once for all radii
+        neighborhoods = None
+        if use_cpu_ops() and self.npoint is not None:
+            neighborhoods = cpu_ops.build_neighborhoods(
+                xyz.asnumpy(), new_xyz.asnumpy(),
+                max(grouper.radius for grouper in self.groupers))
+
         for i in range(len(self.groupers)):
 
             new_features = self.groupers[i](
-                xyz, new_xyz, features)  # (B, C, npoint, nsample)
+                xyz, new_xyz, features,
+                neighborhoods)  # (B, C, npoint, nsample)
             new_features = self.mlps[i](
                 new_features)  # (B, mlp[-1], npoint, nsample)
             if self.pool_method == 'max_pool':
@@ -493,11 +602,13 @@ class GroupAll(nn.Cell):
     def construct(self,
                   xyz: ms.Tensor,
                   new_xyz: ms.Tensor,
-                  features: ms.Tensor = None):
+                  features: ms.Tensor = None,
+                  neighborhoods=None):
         """
         :param xyz: (B, N, 3) xyz coordinates of the features
         :param new_xyz: ignored
         :param features: (B, C, N) descriptors of the features
+        :param neighborhoods: ignored
         :return:
             new_features: (B, C + 3, 1, N)
         """
@@ -595,6 +706,11 @@ class PointnetSAModule(PointnetSAModuleMSG):
                          instance_norm=instance_norm)
 
 
+def _three_nn_out_shape(*shapes):
+    """dist2 and idx of three_nn both follow unknown: (B, N, 3)"""
+    return shapes[3], shapes[3]
+
+
 class ThreeNN(nn.Cell):
     """ThreeNN"""
 
@@ -612,10 +728,13 @@ class ThreeNN(nn.Cell):
 
         B, N, _ = unknown.shape
         m = known.shape[1]
+        if use_cpu_ops():
+            dist2, idx = cpu_ops.three_nn(unknown.asnumpy(), known.asnumpy())
+            return ops.sqrt(Tensor(dist2)), Tensor(idx)
         three_nn_wrapper = get_func_from_so(
             "pointnet2_cuda.cpython-39-x86_64-linux-gnu.so",
             "three_nn_wrapper_fast",
-            out_shape=((B, N, 3), (B, N, 3)),
+            out_shape=_three_nn_out_shape,
             out_dtype=(ms.float32, ms.int32))
 
         _B = ms.Tensor(B, ms.int32)
@@ -648,10 +767,14 @@ class ThreeInterpolate(nn.Cell):
         n = idx.shape[1]
         log_to_file("ThreeInterpolate")
         log_to_file((B, c, n))
+        if use_cpu_ops():
+            return Tensor(
+                cpu_ops.three_interpolate(features.asnumpy(), idx.asnumpy(),
+                                          weight.asnumpy()))
         three_interpolate_wrapper = get_func_from_so(
             self.so_name,
             "three_interpolate_wrapper_fast",
-            out_shape=(B, c, n),
+            out_shape=shape_of_input(4, 0, 1, (5, 1)),
             out_dtype=ms.float32)
         _B = ms.Tensor(B, ms.int32)
         _c = ms.Tensor(c, ms.int32)
@@ -46,6 +46,10 @@ __C.PC_AREA_SCOPE = np.array([[-40, 40], [-1, 3],
 
 __C.CLS_MEAN_SIZE = np.array([[1.52, 1.63, 3.88]], dtype=np.float32)
 
+# backend of the pointnet2 / iou3d / roipool3d kernels: 'cuda' runs the
+# compiled custom ops, 'cpu' runs the NumPy kernels in src/cpu_ops.py
+__C.OPS_BACKEND = 'cuda'
+
 # 1. config of rpn network
 __C.RPN = edict()
 __C.RPN.ENABLED = True
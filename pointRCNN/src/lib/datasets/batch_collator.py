@@ -0,0 +1,131 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+batch collation into preallocated buffers
+
+Every column owns a ring of num_slots flat buffers per thread. A batch of
+the per_batch_map is a contiguous view at the front of the next buffer of
+the ring of its thread: samples are stacked straight into it and padded
+columns are filled with one masked scatter. Buffers only grow, so after the
+first few batches collation allocates nothing. A batch stays valid until its
+thread collates num_slots more batches, so num_slots has to cover the
+batches waiting in the prefetch queue. collate returns fresh arrays.
+"""
+import threading
+
+import numpy as np
+
+
+class BatchCollator:
+    """
+    :param cols: column names in the order of the per_batch_map inputs
+    :param pad_cols: columns of (M, C) arrays of varying M, padded with
+        zeros to (B, max M, C)
+    :param min_pad: smallest padded length
+    :param num_slots: buffers in the ring of every column and thread, more
+        than the batches of a thread the loader holds at once
+    """
+
+    def __init__(self, cols, pad_cols=(), min_pad=0, num_slots=2):
+        self.cols = list(cols)
+        self.pad_cols = set(pad_cols)
+        self.min_pad = min_pad
+        self.num_slots = max(num_slots, 1)
+        self._local = threading.local()
+
+    def __getstate__(self):
+        # workers allocate their own buffers
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _buffer(self, col, shape, dtype, reuse):
+        """
+        contiguous view of shape at the front of the next buffer of col in
+        the ring of this thread, a new array if not reuse
+        """
+        if not reuse:
+            return np.empty(shape, dtype=dtype)
+        rings = getattr(self._local, 'rings', None)
+        if rings is None:
+            rings = self._local.rings = {}
+        if col not in rings:
+            rings[col] = [[None] * self.num_slots, 0]
+        ring = rings[col]
+        slots, slot = ring
+        ring[1] = (slot + 1) % self.num_slots
+        size = 1
+        for dim in shape:
+            size *= dim
+        buf = slots[slot]
+        if buf is None or buf.dtype != dtype or buf.shape[0] < size:
+            capacity = size if buf is None or buf.dtype != dtype \
+                else max(size, 2 * buf.shape[0])
+            buf = slots[slot] = np.empty(capacity, dtype=dtype)
+        return buf[:size].reshape(shape)
+
+    def _pad(self, col, values, reuse):
+        values = [np.asarray(x, dtype=np.float32) for x in values]
+        lengths = np.array([x.shape[0] for x in values], dtype=np.int64)
+        max_len = max(int(lengths.max()), self.min_pad)
+        out = self._buffer(col, (len(values), max_len) + values[0].shape[1:],
+                           np.float32, reuse)
+        mask = np.arange(max_len)[None, :] < lengths[:, None]
+        out[mask] = np.concatenate(values, axis=0)
+        out[~mask] = 0
+        return out
+
+    def collate_column(self, col, values, reuse=False):
+        """
+        :param col: column name
+        :param values: list of the B values of one column
+        :param reuse: collate into the ring of this thread
+        :return: (B, ...) array, or the list for non numeric values
+        """
+        if col in self.pad_cols:
+            return self._pad(col, values, reuse)
+        first = values[0]
+        if isinstance(first, str) or not isinstance(
+                first, (bool, int, float, np.ndarray, np.generic)):
+            return list(values)
+        if isinstance(first, (bool, int)):
+            dtype = np.int32
+        elif isinstance(first, float):
+            dtype = np.float32
+        else:
+            dtype = np.asarray(first).dtype
+        out = self._buffer(col, (len(values),) + np.shape(first), dtype, reuse)
+        for k, value in enumerate(values):
+            out[k] = value
+        return out
+
+    def collate(self, samples):
+        """collate a list of sample dicts into a dict of new batched columns"""
+        return {
+            col: self.collate_column(col, [sample[col] for sample in samples])
+            for col in samples[0].keys()
+        }
+
+    def __call__(self, *columns):
+        """per_batch_map of GeneratorDataset.batch, the last input is the
+        BatchInfo"""
+        assert len(self.cols) == len(columns) - 1
+        return tuple(
+            self.collate_column(col, values, reuse=True)
+            for col, values in zip(self.cols, columns))
@@ -0,0 +1,209 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+sharded gt database
+
+The points of all gt objects are appended to a few shard files that are
+opened with mmap, so every dataloader worker shares the page cache and only
+the sampled objects are ever read. The index is a set of small .npy columns,
+one row per object:
+    sample_ids:    (O) int32
+    cls_types:     (O) str
+    levels:        (O) int8, Object3d.level (1 easy, 2 moderate, 3 hard)
+    gt_boxes3d:    (O, 7) float32
+    obj_records:   (O, 15) float64, see Object3d.to_record
+    shards:        (O) int32, shard holding the points
+    point_offsets: (O) int64, first row of the object in its shard
+    num_points:    (O) int64
+Shard k is points_%03d.npy, (P, 4) float32 rect xyz and intensity.
+"""
+import os
+import pickle
+import shutil
+
+import numpy as np
+
+from src.lib.datasets.kitti_sample_store import RECORD_LEN
+from src.lib.utils.object3d import Object3d
+
+INDEX_COLUMNS = ('sample_ids', 'cls_types', 'levels', 'gt_boxes3d',
+                 'obj_records', 'shards', 'point_offsets', 'num_points')
+SHARD_NAME = 'points_%03d.npy'
+
+
+class GTDatabase:
+    """
+    Read only view of a sharded gt database. Indexing returns the same dict
+    as an entry of the former pickled list, with points and intensity as
+    read only mmap slices.
+    """
+
+    def __init__(self, db_dir):
+        for name in INDEX_COLUMNS:
+            path = os.path.join(db_dir, name + '.npy')
+            if not os.path.exists(path):
+                raise FileNotFoundError('incomplete gt database, missing %s' %
+                                        path)
+            setattr(self, name, np.load(path))
+        self.db_dir = db_dir
+        self._shard_files = {}
+
+    def __getstate__(self):
+        # workers reopen the index and map the shards themselves instead of
+        # receiving a pickled copy of the buffers
+        return {'db_dir': self.db_dir}
+
+    def __setstate__(self, state):
+        self.__init__(state['db_dir'])
+
+    def __len__(self):
+        return self.sample_ids.shape[0]
+
+    def _shard(self, shard):
+        if shard not in self._shard_files:
+            path = os.path.join(self.db_dir, SHARD_NAME % shard)
+            self._shard_files[shard] = np.load(path, mmap_mode='r')
+        return self._shard_files[shard]
+
+    def get_points(self, idx):
+        """(n, 4) mmap view of xyz and intensity of object idx"""
+        start = self.point_offsets[idx]
+        return self._shard(int(self.shards[idx]))[start:start +
+                                                  self.num_points[idx]]
+
+    def __getitem__(self, idx):
+        points = self.get_points(idx)
+        cls_type = str(self.cls_types[idx])
+        return {
+            'sample_id': int(self.sample_ids[idx]),
+            'cls_type': cls_type,
+            'gt_box3d': self.gt_boxes3d[idx],
+            'points': points[:, 0:3],
+            'intensity': points[:, 3],
+            'obj': Object3d.from_record(cls_type, self.obj_records[idx])
+        }
+
+    def select(self, cls_types=None, levels=None, min_points=0,
+               max_points=None):
+        """
+        :param cls_types: classes to keep, default all
+        :param levels: object levels to keep, default all
+        :param min_points: keep objects with more points than this
+        :param max_points: keep objects with at most this many points
+        :return: (K) int64 indices into the database
+        """
+        flag = self.num_points > min_points
+        if max_points is not None:
+            flag &= self.num_points <= max_points
+        if cls_types is not None:
+            flag &= np.isin(self.cls_types, list(cls_types))
+        if levels is not None:
+            flag &= np.isin(self.levels, list(levels))
+        return np.nonzero(flag)[0]
+
+
+def load_gt_database(path):
+    """GTDatabase for a database directory, list for a legacy .pkl file"""
+    if os.path.isdir(path):
+        return GTDatabase(path)
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def database_num_points(gt_database):
+    """(O) number of points of every object of a GTDatabase or list"""
+    if isinstance(gt_database, GTDatabase):
+        return gt_database.num_points
+    return np.array([obj['points'].shape[0] for obj in gt_database],
+                    dtype=np.int64)
+
+
+def database_boxes3d(gt_database):
+    """(O, 7) gt box of every object of a GTDatabase or list"""
+    if isinstance(gt_database, GTDatabase):
+        return gt_database.gt_boxes3d
+    return np.array([obj['gt_box3d'] for obj in gt_database],
+                    dtype=np.float32).reshape(-1, 7)
+
+
+class GTDatabaseWriter:
+    """
+    Append the objects of one scene at a time, points go to the current
+    shard until it holds shard_points rows. The database is written to a
+    temporary directory that replaces save_dir in close().
+    """
+
+    def __init__(self, save_dir, shard_points=1 << 24):
+        self.save_dir = save_dir.rstrip('/')
+        self.tmp_dir = self.save_dir + '.tmp'
+        self.shard_points = shard_points
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        os.makedirs(self.tmp_dir)
+        self.index = {name: [] for name in INDEX_COLUMNS}
+        self.shard, self.shard_rows, self.pending = 0, 0, []
+
+    def _flush_shard(self):
+        points = np.concatenate(self.pending, axis=0) if self.pending else \
+            np.zeros((0, 4), dtype=np.float32)
+        np.save(os.path.join(self.tmp_dir, SHARD_NAME % self.shard), points)
+        self.shard, self.shard_rows, self.pending = self.shard + 1, 0, []
+
+    def add_scene(self, sample_id, obj_list, gt_boxes3d, points_list):
+        """
+        :param sample_id: int
+        :param obj_list: list of Object3d
+        :param gt_boxes3d: (M, 7)
+        :param points_list: list of M (n, 4) float32 arrays
+        """
+        for obj, box3d, points in zip(obj_list, gt_boxes3d, points_list):
+            if self.shard_rows > 0 and \
+                    self.shard_rows + points.shape[0] > self.shard_points:
+                self._flush_shard()
+            self.index['sample_ids'].append(sample_id)
+            self.index['cls_types'].append(obj.cls_type)
+            self.index['levels'].append(obj.level)
+            self.index['gt_boxes3d'].append(box3d)
+            self.index['obj_records'].append(obj.to_record())
+            self.index['shards'].append(self.shard)
+            self.index['point_offsets'].append(self.shard_rows)
+            self.index['num_points'].append(points.shape[0])
+            self.pending.append(points.astype(np.float32))
+            self.shard_rows += points.shape[0]
+
+    def close(self):
+        """write the last shard and the index, return the number of objects"""
+        if self.pending or self.shard == 0:
+            self._flush_shard()
+        dtypes = {
+            'sample_ids': np.int32,
+            'cls_types': np.str_,
+            'levels': np.int8,
+            'gt_boxes3d': np.float32,
+            'obj_records': np.float64,
+            'shards': np.int32,
+            'point_offsets': np.int64,
+            'num_points': np.int64
+        }
+        num = len(self.index['sample_ids'])
+        for name in INDEX_COLUMNS:
+            column = np.array(self.index[name], dtype=dtypes[name])
+            if name == 'gt_boxes3d':
+                column = column.reshape(num, 7)
+            elif name == 'obj_records':
+                column = column.reshape(num, RECORD_LEN)
+            np.save(os.path.join(self.tmp_dir, name + '.npy'), column)
+        shutil.rmtree(self.save_dir, ignore_errors=True)
+        os.rename(self.tmp_dir, self.save_dir)
+        return num
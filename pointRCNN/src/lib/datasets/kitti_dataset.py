@@ -20,13 +20,14 @@ import torch.utils.data as torch_data
 from PIL import Image
 import src.lib.utils.calibration as calibration
 import src.lib.utils.kitti_utils as kitti_utils
+from src.lib.datasets.kitti_sample_store import KittiSampleStore
 
 
 class KittiDataset(torch_data.Dataset):
     """
     Kitti Dataset Process
     """
-    def __init__(self, root_dir, split='train'):
+    def __init__(self, root_dir, split='train', sample_store_dir=None):
         self.split = split
         is_test = self.split == 'test'
         self.imageset_dir = os.path.join(root_dir, 'KITTI', 'object',
@@ -42,10 +43,21 @@ class KittiDataset(torch_data.Dataset):
         self.label_dir = os.path.join(self.imageset_dir, 'label_2')
         self.plane_dir = os.path.join(self.imageset_dir, 'planes')
 
+        # samples packed by generate_sample_store.py are read from mmap,
+        # the others fall back to the KITTI files
+        self.sample_store = KittiSampleStore(
+            sample_store_dir) if sample_store_dir else None
+
+    def in_store(self, idx):
+        """whether idx can be read from the sample store"""
+        return self.sample_store is not None and idx in self.sample_store
+
     def get_image_shape(self, idx):
         """
         get shape of image
         """
+        if self.in_store(idx):
+            return self.sample_store.get_image_shape(idx)
         img_file = os.path.join(self.image_dir, '%06d.png' % idx)
         assert os.path.exists(img_file)
         im = Image.open(img_file)
@@ -56,6 +68,8 @@ class KittiDataset(torch_data.Dataset):
         """
         get lidar
         """
+        if self.in_store(idx):
+            return self.sample_store.get_lidar(idx)
         lidar_file = os.path.join(self.lidar_dir, '%06d.bin' % idx)
         assert os.path.exists(lidar_file)
         return np.fromfile(lidar_file, dtype=np.float32).reshape(-1, 4)
@@ -64,18 +78,27 @@ class KittiDataset(torch_data.Dataset):
         """
         get calibration
         """
+        if self.in_store(idx):
+            return calibration.Calibration(
+                self.sample_store.get_calib_dict(idx))
         calib_file = os.path.join(self.calib_dir, '%06d.txt' % idx)
         assert os.path.exists(calib_file)
         return calibration.Calibration(calib_file)
 
     def get_label(self, idx):
         """get label"""
+        if self.in_store(idx):
+            return self.sample_store.get_label(idx)
         label_file = os.path.join(self.label_dir, '%06d.txt' % idx)
         assert os.path.exists(label_file)
         return kitti_utils.get_objects_from_label(label_file)
 
     def get_road_plane(self, idx):
         """get road plane"""
+        if self.in_store(idx):
+            plane = self.sample_store.get_road_plane(idx)
+            if plane is not None:
+                return plane
         plane_file = os.path.join(self.plane_dir, '%06d.txt' % idx)
         with open(plane_file, 'r') as f:
             lines = f.readlines()
@@ -15,13 +15,18 @@
 # This file was copied from project [sshaoshuai][https://github.com/sshaoshuai/PointRCNN]
 """kitti rcnn dataset"""
 import os
-import pickle
+import copy
 import pdb
 import numpy as np
 
 import mindspore as ms
-from mindspore import Tensor
 from src.lib.datasets.kitti_dataset import KittiDataset
+from src.lib.datasets.batch_collator import BatchCollator
+from src.lib.datasets.gt_database import (GTDatabase, load_gt_database,
+                                          database_num_points,
+                                          database_boxes3d)
+from src.lib.datasets.rpn_feature_store import (RPNFeatureStore,
+                                                is_rpn_feature_store)
 import src.lib.utils.kitti_utils as kitti_utils
 import src.lib.utils.roipool3d.roipool3d_utils as roipool3d_utils
 from src.lib.config import cfg
@@ -42,8 +47,11 @@ class KittiRCNNDataset(KittiDataset):
                  rcnn_training_feature_dir=None,
                  rcnn_eval_roi_dir=None,
                  rcnn_eval_feature_dir=None,
-                 gt_database_dir=None):
-        super().__init__(root_dir=root_dir, split=split)
+                 gt_database_dir=None,
+                 sample_store_dir=None):
+        super().__init__(root_dir=root_dir,
+                         split=split,
+                         sample_store_dir=sample_store_dir)
         if classes == 'Car':
             self.classes = ('Background', 'Car')
             aug_scene_root_dir = os.path.join(root_dir, 'KITTI', 'aug_scene')
@@ -80,7 +88,6 @@ class KittiRCNNDataset(KittiDataset):
 
         # for rcnn training
         self.rcnn_training_bbox_list = []
-        self.rpn_feature_list = {}
         self.pos_bbox_list = []
         self.neg_bbox_list = []
         self.far_neg_bbox_list = []
@@ -88,34 +95,54 @@ class KittiRCNNDataset(KittiDataset):
         self.rcnn_eval_feature_dir = rcnn_eval_feature_dir
         self.rcnn_training_roi_dir = rcnn_training_roi_dir
         self.rcnn_training_feature_dir = rcnn_training_feature_dir
+        # packed stores replace the per sample feature and roi files
+        self.rpn_feature_stores = {
+            feature_dir: RPNFeatureStore(feature_dir)
+            for feature_dir in (rcnn_training_feature_dir,
+                                rcnn_eval_feature_dir)
+            if is_rpn_feature_store(feature_dir)
+        }
 
         self.gt_database = None
+        self.gt_aug_pools = None
+        self.gt_database_num_points = None
+        self.gt_database_boxes3d = None
 
         if not self.random_select:
             self.logger.warning('random select is False')
 
         assert mode in ['TRAIN', 'EVAL', 'TEST'], 'Invalid mode: %s' % mode
         self.mode = mode
+        self.collator = None
 
         if cfg.RPN.ENABLED:
             if gt_database_dir is not None:
-                self.gt_database = pickle.load(open(gt_database_dir, 'rb'))
+                self.gt_database = load_gt_database(gt_database_dir)
+                if isinstance(self.gt_database, GTDatabase):
+                    candidates = self.gt_database.select(
+                        cls_types=self.classes[1:])
+                else:
+                    candidates = np.arange(len(self.gt_database))
+                # read once so that rejected samples never touch their points
+                self.gt_database_num_points = database_num_points(
+                    self.gt_database)
+                self.gt_database_boxes3d = database_boxes3d(self.gt_database)
+                num_points = self.gt_database_num_points[candidates]
 
                 if cfg.GT_AUG_HARD_RATIO > 0:
-                    easy_list, hard_list = [], []
-                    for k in range(self.gt_database.__len__()):
-                        obj = self.gt_database[k]
-                        if obj['points'].shape[0] > 100:
-                            easy_list.append(obj)
-                        else:
-                            hard_list.append(obj)
-                    self.gt_database = [easy_list, hard_list]
+                    # sampling pools of the database indices, easy then hard
+                    self.gt_aug_pools = [
+                        candidates[num_points > 100],
+                        candidates[num_points <= 100]
+                    ]
                     logger.info(
                         'Loading gt_database(easy(pt_num>100): %d, hard(pt_num<=100): %d) from %s'
-                        % (len(easy_list), len(hard_list), gt_database_dir))
+                        % (len(self.gt_aug_pools[0]), len(
+                            self.gt_aug_pools[1]), gt_database_dir))
                 else:
+                    self.gt_aug_pools = [candidates]
                     logger.info('Loading gt_database(%d) from %s' %
-                                (len(self.gt_database), gt_database_dir))
+                                (len(candidates), gt_database_dir))
 
             if mode == 'TRAIN':
                 self.preprocess_rpn_training_data()
@@ -159,6 +186,8 @@ class KittiRCNNDataset(KittiDataset):
 
     def get_label(self, idx):
         """get label"""
+        if self.in_store(idx):
+            return self.sample_store.get_label(idx)
         if idx < 10000:
             label_file = os.path.join(self.label_dir, '%06d.txt' % idx)
         else:
@@ -183,9 +212,11 @@ class KittiRCNNDataset(KittiDataset):
         """get road plane"""
         return super().get_road_plane(idx % 10000)
 
-    @staticmethod
-    def get_rpn_features(rpn_feature_dir, idx):
+    def get_rpn_features(self, rpn_feature_dir, idx):
         """get rpn features"""
+        if rpn_feature_dir in self.rpn_feature_stores:
+            return self.rpn_feature_stores[rpn_feature_dir].get_rpn_features(
+                idx, cfg.RCNN.USE_SEG_SCORE)
         rpn_feature_file = os.path.join(rpn_feature_dir, '%06d.npy' % idx)
         rpn_xyz_file = os.path.join(rpn_feature_dir, '%06d_xyz.npy' % idx)
         rpn_intensity_file = os.path.join(rpn_feature_dir,
@@ -202,6 +233,15 @@ class KittiRCNNDataset(KittiDataset):
         return np.load(rpn_xyz_file), np.load(rpn_feature_file), np.load(
             rpn_intensity_file).reshape(-1), rpn_seg_score
 
+    def get_rois(self, roi_dir, rpn_feature_dir, idx):
+        """roi boxes (M, 7) and scores (M), from the feature store if packed"""
+        if rpn_feature_dir in self.rpn_feature_stores:
+            return self.rpn_feature_stores[rpn_feature_dir].get_rois(idx)
+        roi_obj_list = kitti_utils.get_objects_from_label(
+            os.path.join(roi_dir, '%06d.txt' % idx))
+        return kitti_utils.objs_to_boxes3d(
+            roi_obj_list), kitti_utils.objs_to_scores(roi_obj_list)
+
     def filtrate_objects(self, obj_list):
         """
         Discard objects which are not in self.classes (or its similar classes)
@@ -453,38 +493,48 @@ class KittiRCNNDataset(KittiDataset):
         cls_label = np.zeros((pts_rect.shape[0]), dtype=np.int32)
         reg_label = np.zeros((pts_rect.shape[0], 7),
                              dtype=np.float32)  # dx, dy, dz, ry, h, w, l
-        gt_corners = kitti_utils.boxes3d_to_corners3d(gt_boxes3d, rotate=True)
+        fg_mask = kitti_utils.pts_in_boxes3d(pts_rect, gt_boxes3d)
+        # enlarge the bbox3d, ignore nearby points
         extend_gt_boxes3d = kitti_utils.enlarge_box3d(gt_boxes3d,
                                                       extra_width=0.2)
-        extend_gt_corners = kitti_utils.boxes3d_to_corners3d(extend_gt_boxes3d,
-                                                             rotate=True)
-        for k in range(gt_boxes3d.shape[0]):
-            box_corners = gt_corners[k]
-            fg_pt_flag = kitti_utils.in_hull(pts_rect, box_corners)
-            fg_pts_rect = pts_rect[fg_pt_flag]
-            cls_label[fg_pt_flag] = 1
-
-            # enlarge the bbox3d, ignore nearby points
-            extend_box_corners = extend_gt_corners[k]
-            fg_enlarge_flag = kitti_utils.in_hull(pts_rect, extend_box_corners)
-            ignore_flag = np.logical_xor(fg_pt_flag, fg_enlarge_flag)
-            cls_label[ignore_flag] = -1
-
-            # pixel offset of object center
-            center3d = gt_boxes3d[k][0:3].copy()  # (x, y, z)
-            center3d[1] -= gt_boxes3d[k][3] / 2
-            reg_label[
-                fg_pt_flag, 0:
-                3] = center3d - fg_pts_rect  # Now y is the true center of 3d box 20180928
-
-            # size and angle encoding
-            reg_label[fg_pt_flag, 3] = gt_boxes3d[k][3]  # h
-            reg_label[fg_pt_flag, 4] = gt_boxes3d[k][4]  # w
-            reg_label[fg_pt_flag, 5] = gt_boxes3d[k][5]  # l
-            reg_label[fg_pt_flag, 6] = gt_boxes3d[k][6]  # ry
+        enlarge_mask = kitti_utils.pts_in_boxes3d(pts_rect, extend_gt_boxes3d)
+
+        # the last box touching a point decides its class, 1 inside the box
+        # and -1 inside the enlarged border only
+        touch_idx = kitti_utils.pts_box_assignment(fg_mask | enlarge_mask)
+        touched = np.nonzero(touch_idx >= 0)[0]
+        inside = fg_mask[touch_idx[touched], touched] & \
+            enlarge_mask[touch_idx[touched], touched]
+        cls_label[touched] = np.where(inside, 1, -1)
+
+        box_idx = kitti_utils.pts_box_assignment(fg_mask)
+        fg_pt_flag = box_idx >= 0
+        fg_boxes3d = gt_boxes3d[box_idx[fg_pt_flag]]
+        # pixel offset of object center, y is the true center of 3d box
+        center3d = fg_boxes3d[:, 0:3].copy()
+        center3d[:, 1] -= fg_boxes3d[:, 3] / 2
+        reg_label[fg_pt_flag, 0:3] = center3d - pts_rect[fg_pt_flag]
+        # size and angle encoding: h, w, l, ry
+        reg_label[fg_pt_flag, 3:7] = fg_boxes3d[:, 3:7]
 
         return cls_label, reg_label
 
+    @staticmethod
+    def rotate_boxes3d_along_y(boxes3d, rot_angle):
+        """
+        :param boxes3d: (K, B, 7), rotated in place keeping the alpha
+        :param rot_angle: (K)
+        :return: boxes3d
+        """
+        old_beta = np.arctan2(boxes3d[:, :, 2], boxes3d[:, :, 0])
+        alpha = -np.sign(old_beta) * np.pi / 2 + old_beta + boxes3d[:, :, 6]
+
+        kitti_utils.rotate_pc_along_y_batch(boxes3d, rot_angle)
+        new_beta = np.arctan2(boxes3d[:, :, 2], boxes3d[:, :, 0])
+        boxes3d[:, :, 6] = np.sign(new_beta) * np.pi / 2 + alpha - new_beta
+
+        return boxes3d
+
     def rotate_box3d_along_y(self, box3d, rot_angle):
         """rotate box3d along y"""
         old_x, old_z, ry = box3d[0], box3d[2], box3d[6]
@@ -502,6 +552,9 @@ class KittiRCNNDataset(KittiDataset):
     def apply_gt_aug_to_one_scene(self, sample_id, pts_rect, pts_intensity,
                                   all_gt_boxes3d):
         """
+        Draw all candidates of the scene at once, check their collisions
+        with the existing boxes and with each other in one IoU pass, and
+        accept them greedily in draw order.
         :param pts_rect: (N, 3)
         :param all_gt_boxex3d: (M2, 7)
         :return:
@@ -512,102 +565,89 @@ class KittiRCNNDataset(KittiDataset):
         else:
             extra_gt_num = cfg.GT_EXTRA_NUM
         try_times = 100
-        cnt = 0
-        cur_gt_boxes3d = all_gt_boxes3d.copy()
-        cur_gt_boxes3d[:, 4] += 0.5
-        cur_gt_boxes3d[:,
-                       5] += 0.5  # enlarge new added box to avoid too nearby boxes
-        cur_gt_corners = kitti_utils.boxes3d_to_corners3d(cur_gt_boxes3d)
-
-        extra_gt_obj_list = []
-        extra_gt_boxes3d_list = []
-        new_pts_list, new_pts_intensity_list = [], []
-        src_pts_flag = np.ones(pts_rect.shape[0], dtype=np.int32)
-
-        road_plane = self.get_road_plane(sample_id)
-        a, b, c, d = road_plane
 
-        while try_times > 0:
-            if cnt > extra_gt_num:
-                break
-
-            try_times -= 1
-            if cfg.GT_AUG_HARD_RATIO > 0:
-                p = np.random.rand()
-                if p > cfg.GT_AUG_HARD_RATIO:
-                    # use easy sample
-                    rand_idx = np.random.randint(0, len(self.gt_database[0]))
-                    new_gt_dict = self.gt_database[0][rand_idx]
-                else:
-                    # use hard sample
-                    rand_idx = np.random.randint(0, len(self.gt_database[1]))
-                    new_gt_dict = self.gt_database[1][rand_idx]
-            else:
-                rand_idx = np.random.randint(0, len(self.gt_database))
-                new_gt_dict = self.gt_database[rand_idx]
-
-            new_gt_box3d = new_gt_dict['gt_box3d'].copy()
-            new_gt_points = new_gt_dict['points'].copy()
-            new_gt_intensity = new_gt_dict['intensity'].copy()
-            new_gt_obj = new_gt_dict['obj']
-            center = new_gt_box3d[0:3]
-            if cfg.PC_REDUCE_BY_RANGE and (self.check_pc_range(center) is
-                                           False):
-                continue
-
-            if len(new_gt_points) < 5:  # too few points
-                continue
+        # draw every try at once
+        if cfg.GT_AUG_HARD_RATIO > 0:
+            # use easy sample, else hard sample
+            pool_of_try = np.where(
+                np.random.rand(try_times) > cfg.GT_AUG_HARD_RATIO, 0, 1)
+        else:
+            pool_of_try = np.zeros(try_times, dtype=np.int64)
+        db_idx = np.zeros(try_times, dtype=np.int64)
+        for k, pool in enumerate(self.gt_aug_pools):
+            tries = pool_of_try == k
+            if tries.any():
+                db_idx[tries] = pool[np.random.randint(0, len(pool),
+                                                       tries.sum())]
+
+        new_gt_boxes3d = self.gt_database_boxes3d[db_idx].copy()
+        valid = self.gt_database_num_points[db_idx] >= 5  # too few points
+        if cfg.PC_REDUCE_BY_RANGE:
+            scope = np.asarray(cfg.PC_AREA_SCOPE)
+            valid &= np.all((new_gt_boxes3d[:, 0:3] >= scope[:, 0]) &
+                            (new_gt_boxes3d[:, 0:3] <= scope[:, 1]),
+                            axis=1)
+        # the first extra_gt_num + 1 valid draws are checked for collisions
+        db_idx = db_idx[valid][:extra_gt_num + 1]
+        new_gt_boxes3d = new_gt_boxes3d[valid][:extra_gt_num + 1]
+        if db_idx.shape[0] == 0:
+            return False, pts_rect, pts_intensity, None, None
 
-            # put it on the road plane
-            cur_height = (-d - a * center[0] - c * center[2]) / b
-            move_height = new_gt_box3d[1] - cur_height
-            new_gt_box3d[1] -= move_height
-            new_gt_points[:, 1] -= move_height
-            new_gt_obj.pos[1] -= move_height
-
-            new_enlarged_box3d = new_gt_box3d.copy()
-            new_enlarged_box3d[4] += 0.5
-            new_enlarged_box3d[
-                5] += 0.5  # enlarge new added box to avoid too nearby boxes
-
-            cnt += 1
-            new_corners = kitti_utils.boxes3d_to_corners3d(
-                new_enlarged_box3d.reshape(1, 7))
-            iou3d = kitti_utils.get_iou3d(new_corners, cur_gt_corners)
-            valid_flag = iou3d.max() < 1e-8
-            if not valid_flag:
-                continue
+        # put them on the road plane
+        a, b, c, d = self.get_road_plane(sample_id)
+        cur_height = (-d - a * new_gt_boxes3d[:, 0] -
+                      c * new_gt_boxes3d[:, 2]) / b
+        move_height = new_gt_boxes3d[:, 1] - cur_height
+        new_gt_boxes3d[:, 1] -= move_height
 
-            enlarged_box3d = new_gt_box3d.copy()
-            enlarged_box3d[
-                3] += 2  # remove the points above and below the object
-            boxes_pts_mask_list = roipool3d_utils.pts_in_boxes3d_cpu(
-                Tensor.from_numpy(pts_rect),
-                Tensor.from_numpy(enlarged_box3d.reshape(1, 7)))
-            pt_mask_flag = (boxes_pts_mask_list[0].asnumpy() == 1)
-            src_pts_flag[
-                pt_mask_flag] = 0  # remove the original points which are inside the new box
+        # enlarge the boxes to avoid too nearby boxes
+        cur_gt_boxes3d = all_gt_boxes3d.copy()
+        new_enlarged_boxes3d = new_gt_boxes3d.copy()
+        for boxes3d in (cur_gt_boxes3d, new_enlarged_boxes3d):
+            boxes3d[:, 4] += 0.5
+            boxes3d[:, 5] += 0.5
+        new_corners = kitti_utils.boxes3d_to_corners3d(new_enlarged_boxes3d)
+        collide = np.zeros((new_corners.shape[0], 0), dtype=np.bool_)
+        if cur_gt_boxes3d.shape[0] > 0:
+            iou3d, _ = kitti_utils.get_iou3d_bev(
+                new_corners, kitti_utils.boxes3d_to_corners3d(cur_gt_boxes3d))
+            collide = iou3d >= 1e-8
+        new_iou3d, _ = kitti_utils.get_iou3d_bev(new_corners, new_corners)
+        new_collide = new_iou3d >= 1e-8
+
+        accept = ~collide.any(axis=1)
+        for k in range(db_idx.shape[0]):
+            if accept[k]:
+                # later draws may not hit an accepted box
+                accept[k + 1:] &= ~new_collide[k, k + 1:]
+        if not accept.any():
+            return False, pts_rect, pts_intensity, None, None
 
+        extra_gt_boxes3d = new_gt_boxes3d[accept]
+        new_pts_list, new_pts_intensity_list, extra_gt_obj_list = [], [], []
+        for idx, move in zip(db_idx[accept], move_height[accept]):
+            new_gt_dict = self.gt_database[idx]
+            new_gt_points = np.array(new_gt_dict['points'], dtype=np.float32)
+            new_gt_points[:, 1] -= move
+            new_gt_obj = copy.copy(new_gt_dict['obj'])
+            new_gt_obj.pos = new_gt_obj.pos.copy()
+            new_gt_obj.pos[1] -= move
             new_pts_list.append(new_gt_points)
-            new_pts_intensity_list.append(new_gt_intensity)
-            cur_gt_boxes3d = np.concatenate(
-                (cur_gt_boxes3d, new_enlarged_box3d.reshape(1, 7)), axis=0)
-            cur_gt_corners = np.concatenate((cur_gt_corners, new_corners),
-                                            axis=0)
-            extra_gt_boxes3d_list.append(new_gt_box3d.reshape(1, 7))
+            new_pts_intensity_list.append(new_gt_dict['intensity'])
             extra_gt_obj_list.append(new_gt_obj)
 
-        if not new_pts_list:
-            return False, pts_rect, pts_intensity, None, None
+        # remove the original points which are inside the new boxes, and the
+        # points above and below the objects
+        remove_boxes3d = extra_gt_boxes3d.copy()
+        remove_boxes3d[:, 3] += 2
+        src_pts_flag = ~kitti_utils.pts_in_boxes3d(pts_rect,
+                                                   remove_boxes3d).any(axis=0)
 
-        extra_gt_boxes3d = np.concatenate(extra_gt_boxes3d_list, axis=0)
         # remove original points and add new points
-        pts_rect = pts_rect[src_pts_flag == 1]
-        pts_intensity = pts_intensity[src_pts_flag == 1]
-        new_pts_rect = np.concatenate(new_pts_list, axis=0)
-        new_pts_intensity = np.concatenate(new_pts_intensity_list, axis=0)
-        pts_rect = np.concatenate((pts_rect, new_pts_rect), axis=0)
-        pts_intensity = np.concatenate((pts_intensity, new_pts_intensity),
+        pts_rect = np.concatenate([pts_rect[src_pts_flag]] + new_pts_list,
+                                  axis=0)
+        pts_intensity = np.concatenate([pts_intensity[src_pts_flag]] +
+                                       new_pts_intensity_list,
                                        axis=0)
 
         return True, pts_rect, pts_intensity, extra_gt_boxes3d, extra_gt_obj_list
@@ -684,140 +724,44 @@ class KittiRCNNDataset(KittiDataset):
 
         return aug_pts_rect, aug_gt_boxes3d, aug_method
 
-    def get_rcnn_sample_info(self, roi_info):
-        """get rcnn sample info"""
-        sample_id, gt_box3d = roi_info['sample_id'], roi_info['gt_box3d']
-        rpn_xyz, rpn_features, rpn_intensity, seg_mask = self.rpn_feature_list[
-            sample_id]
-
-        # augmentation original roi by adding noise
-        roi_box3d = self.aug_roi_by_noise(roi_info)
-
-        # point cloud pooling based on roi_box3d
-        pooled_boxes3d = kitti_utils.enlarge_box3d(roi_box3d.reshape(1, 7),
-                                                   cfg.RCNN.POOL_EXTRA_WIDTH)
-
-        boxes_pts_mask_list = roipool3d_utils.pts_in_boxes3d_cpu(
-            Tensor.from_numpy(rpn_xyz), Tensor.from_numpy(pooled_boxes3d))
-        pt_mask_flag = (boxes_pts_mask_list[0].asnumpy() == 1)
-        cur_pts = rpn_xyz[pt_mask_flag].astype(np.float32)
+    def get_rcnn_sample_info(self, sample_id, rpn_data, rois, gt_of_rois,
+                             iou_of_rois):
+        """
+        Pool, augment and label all sampled rois of a scene at once
+        :param rpn_data: rpn xyz, features, intensity and seg of the scene
+        :param rois: (K, 7) sampled rois
+        :param gt_of_rois: (K, 7) gt box assigned to every roi
+        :param iou_of_rois: (K)
+        :return: sample info with the K samples stacked
+        """
+        rpn_xyz, rpn_features, rpn_intensity, seg_mask = rpn_data
 
-        # data augmentation
-        aug_pts = cur_pts.copy()
-        aug_gt_box3d = gt_box3d.copy().astype(np.float32)
-        aug_roi_box3d = roi_box3d.copy()
-        if cfg.AUG_DATA and self.mode == 'TRAIN':
-            # calculate alpha by ry
-            temp_boxes3d = np.concatenate(
-                [aug_roi_box3d.reshape(1, 7),
-                 aug_gt_box3d.reshape(1, 7)],
-                axis=0)
-            temp_x, temp_z, temp_ry = temp_boxes3d[:,
-                                                   0], temp_boxes3d[:,
-                                                                    2], temp_boxes3d[:,
-                                                                                     6]
-            temp_beta = np.arctan2(temp_z, temp_x).astype(np.float64)
-            temp_alpha = -np.sign(temp_beta) * np.pi / 2 + temp_beta + temp_ry
-
-            # data augmentation
-            aug_pts, aug_boxes3d, _ = self.data_augmentation(aug_pts,
-                                                             temp_boxes3d,
-                                                             temp_alpha,
-                                                             mustaug=True,
-                                                             stage=2)
-            aug_roi_box3d, aug_gt_box3d = aug_boxes3d[0], aug_boxes3d[1]
-            aug_gt_box3d = aug_gt_box3d.astype(gt_box3d.dtype)
-
-        # Pool input points
-        valid_mask = 1  # whether the input is valid
-
-        if aug_pts.shape[0] == 0:
-            pts_features = np.zeros((1, 128), dtype=np.float32)
-            input_channel = 3 + int(cfg.RCNN.USE_INTENSITY) + int(
-                cfg.RCNN.USE_MASK) + int(cfg.RCNN.USE_DEPTH)
-            pts_input = np.zeros((1, input_channel), dtype=np.float32)
-            valid_mask = 0
+        # collect extra features for point cloud pooling
+        if cfg.RCNN.USE_INTENSITY:
+            pts_extra_input_list = [
+                rpn_intensity.reshape(-1, 1),
+                seg_mask.reshape(-1, 1)
+            ]
         else:
-            pts_features = rpn_features[pt_mask_flag].astype(np.float32)
-            pts_intensity = rpn_intensity[pt_mask_flag].astype(np.float32)
-
-            pts_input_list = [aug_pts, pts_intensity.reshape(-1, 1)]
-            if cfg.RCNN.USE_INTENSITY:
-                pts_input_list = [aug_pts, pts_intensity.reshape(-1, 1)]
-            else:
-                pts_input_list = [aug_pts]
-
-            if cfg.RCNN.USE_MASK:
-                if cfg.RCNN.MASK_TYPE == 'seg':
-                    pts_mask = seg_mask[pt_mask_flag].astype(np.float32)
-                elif cfg.RCNN.MASK_TYPE == 'roi':
-                    pts_mask = roipool3d_utils.pts_in_boxes3d_cpu(
-                        Tensor.from_numpy(aug_pts),
-                        Tensor.from_numpy(aug_roi_box3d.reshape(1, 7)))
-                    pts_mask = (pts_mask[0].asnumpy() == 1).astype(np.float32)
-                else:
-                    raise NotImplementedError
-
-                pts_input_list.append(pts_mask.reshape(-1, 1))
-
-            if cfg.RCNN.USE_DEPTH:
-                pts_depth = np.linalg.norm(aug_pts, axis=1, ord=2)
-                pts_depth_norm = (pts_depth / 70.0) - 0.5
-                pts_input_list.append(pts_depth_norm.reshape(-1, 1))
-
-            pts_input = np.concatenate(pts_input_list, axis=1)  # (N, C)
-
-        aug_gt_corners = kitti_utils.boxes3d_to_corners3d(
-            aug_gt_box3d.reshape(-1, 7))
-        aug_roi_corners = kitti_utils.boxes3d_to_corners3d(
-            aug_roi_box3d.reshape(-1, 7))
-        iou3d = kitti_utils.get_iou3d(aug_roi_corners, aug_gt_corners)
-        cur_iou = iou3d[0][0]
-
-        # regression valid mask
-        reg_valid_mask = 1 if cur_iou >= cfg.RCNN.REG_FG_THRESH and valid_mask == 1 else 0
-
-        # classification label
-        cls_label = 1 if cur_iou > cfg.RCNN.CLS_FG_THRESH else 0
-        if cfg.RCNN.CLS_BG_THRESH < cur_iou < cfg.RCNN.CLS_FG_THRESH or valid_mask == 0:
-            cls_label = -1
-
-        # canonical transform and sampling
-        pts_input_ct, gt_box3d_ct = self.canonical_transform(
-            pts_input, aug_roi_box3d, aug_gt_box3d)
-        pts_input_ct, pts_features = self.rcnn_input_sample(
-            pts_input_ct, pts_features)
-
-        sample_info = {
-            'sample_id': sample_id,
-            'pts_input': pts_input_ct,
-            'pts_features': pts_features,
-            'cls_label': cls_label,
-            'reg_valid_mask': reg_valid_mask,
-            'gt_boxes3d_ct': gt_box3d_ct,
-            'roi_boxes3d': aug_roi_box3d,
-            'roi_size': aug_roi_box3d[3:6],
-            'gt_boxes3d': aug_gt_box3d
-        }
+            pts_extra_input_list = [seg_mask.reshape(-1, 1)]
 
-        return sample_info
+        if cfg.RCNN.USE_DEPTH:
+            pts_depth = (np.linalg.norm(rpn_xyz, ord=2, axis=1) / 70.0) - 0.5
+            pts_extra_input_list.append(pts_depth.reshape(-1, 1))
+        pts_extra_input = np.concatenate(pts_extra_input_list, axis=1)
 
-    @staticmethod
-    def canonical_transform(pts_input, roi_box3d, gt_box3d):
-        """canonical_transform"""
-        roi_ry = roi_box3d[6] % (2 * np.pi)  # 0 ~ 2pi
-        roi_center = roi_box3d[0:3]
-        # shift to center
-        pts_input[:, [0, 1, 2]] = pts_input[:, [0, 1, 2]] - roi_center
-        gt_box3d_ct = np.copy(gt_box3d)
-        gt_box3d_ct[0:3] = gt_box3d_ct[0:3] - roi_center
-        # rotate to the direction of head
-        gt_box3d_ct = kitti_utils.rotate_pc_along_y(gt_box3d_ct.reshape(1, 7),
-                                                    roi_ry).reshape(7)
-        gt_box3d_ct[6] = gt_box3d_ct[6] - roi_ry
-        pts_input = kitti_utils.rotate_pc_along_y(pts_input, roi_ry)
+        # one points in boxes pass pools the points of all rois
+        pts_input, pts_features, pts_empty_flag = roipool3d_utils.roipool3d_cpu(
+            rois,
+            rpn_xyz,
+            rpn_features,
+            pts_extra_input,
+            cfg.RCNN.POOL_EXTRA_WIDTH,
+            sampled_pt_num=cfg.RCNN.NUM_POINTS,
+            canonical_transform=False)
 
-        return pts_input, gt_box3d_ct
+        return self.data_aug(rois, pts_input, gt_of_rois, pts_empty_flag,
+                             iou_of_rois, sample_id, pts_features)
 
     @staticmethod
     def canonical_transform_batch(pts_input, roi_boxes3d, gt_boxes3d):
@@ -830,144 +774,93 @@ class KittiRCNNDataset(KittiDataset):
         roi_ry = roi_boxes3d[:, 6] % (2 * np.pi)  # 0 ~ 2pi
         roi_center = roi_boxes3d[:, 0:3]
         # shift to center
-        pts_input[:, :,
-                  [0, 1, 2]] = pts_input[:, :, [0, 1, 2]] - roi_center.reshape(
-                      -1, 1, 3)
+        pts_input[:, :, 0:3] = pts_input[:, :, 0:3] - roi_center.reshape(
+            -1, 1, 3)
         gt_boxes3d_ct = np.copy(gt_boxes3d)
         gt_boxes3d_ct[:, 0:3] = gt_boxes3d_ct[:, 0:3] - roi_center
-        # rotate to the direction of head
-        gt_boxes3d_ct = kitti_utils.rotate_pc_along_y_torch(
-            Tensor.from_numpy(gt_boxes3d_ct.reshape(-1, 1, 7)),
-            Tensor.from_numpy(roi_ry)).asnumpy().reshape(-1, 7)
+        # rotate to the direction of head, one rotation for all rois
+        gt_boxes3d_ct = kitti_utils.rotate_pc_along_y_batch(
+            gt_boxes3d_ct.reshape(-1, 1, 7), roi_ry).reshape(-1, 7)
         gt_boxes3d_ct[:, 6] = gt_boxes3d_ct[:, 6] - roi_ry
-        pts_input = kitti_utils.rotate_pc_along_y_torch(
-            Tensor.from_numpy(pts_input), Tensor.from_numpy(roi_ry)).asnumpy()
+        pts_input = kitti_utils.rotate_pc_along_y_batch(pts_input, roi_ry)
 
         return pts_input, gt_boxes3d_ct
 
     @staticmethod
-    def rcnn_input_sample(pts_input, pts_features):
-        """rcnn_input_sample"""
-        choice = np.random.choice(pts_input.shape[0],
-                                  cfg.RCNN.NUM_POINTS,
-                                  replace=True)
-
-        if pts_input.shape[0] < cfg.RCNN.NUM_POINTS:
-            choice[:pts_input.shape[0]] = np.arange(pts_input.shape[0])
-            np.random.shuffle(choice)
-        pts_input = pts_input[choice]
-        pts_features = pts_features[choice]
-
-        return pts_input, pts_features
-
-    def aug_roi_by_noise(self, roi_info):
+    def random_aug_box3d(box3d):
         """
-        add noise to original roi to get aug_box3d
-        :param roi_info:
-        :return:
+        :param box3d: (7) [x, y, z, h, w, l, ry]
+        random shift, scale, orientation
         """
-        roi_box3d, gt_box3d = roi_info['roi_box3d'], roi_info['gt_box3d']
-        original_iou = roi_info['iou3d']
-        temp_iou = cnt = 0
-        pos_thresh = min(cfg.RCNN.REG_FG_THRESH, cfg.RCNN.CLS_FG_THRESH)
-        gt_corners = kitti_utils.boxes3d_to_corners3d(gt_box3d.reshape(-1, 7))
-        aug_box3d = roi_box3d
-        while temp_iou < pos_thresh and cnt < 10:
-            if roi_info['type'] == 'gt':
-                aug_box3d = self.random_aug_box3d(roi_box3d)  # GT, must random
-            else:
-                if np.random.rand() < 0.2:
-                    aug_box3d = roi_box3d  # p=0.2 to keep the original roi box
-                else:
-                    aug_box3d = self.random_aug_box3d(roi_box3d)
-            aug_corners = kitti_utils.boxes3d_to_corners3d(
-                aug_box3d.reshape(-1, 7))
-            iou3d = kitti_utils.get_iou3d(aug_corners, gt_corners)
-            temp_iou = iou3d[0][0]
-            cnt += 1
-            if original_iou < pos_thresh:  # original bg, break
-                break
-        return aug_box3d
+        return KittiRCNNDataset.random_aug_boxes3d(box3d.reshape(1, 7))[0]
 
     @staticmethod
-    def random_aug_box3d(box3d):
+    def random_aug_boxes3d(boxes3d):
         """
-        :param box3d: (7) [x, y, z, h, w, l, ry]
-        random shift, scale, orientation
+        :param boxes3d: (K, 7) [x, y, z, h, w, l, ry]
+        random shift, scale, orientation drawn for every box
         """
+        num = boxes3d.shape[0]
         if cfg.RCNN.REG_AUG_METHOD == 'single':
-            pos_shift = (np.random.rand(3) - 0.5)  # [-0.5 ~ 0.5]
-            hwl_scale = (np.random.rand(3) - 0.5) / (0.5 / 0.15) + 1.0  #
-            angle_rot = (np.random.rand(1) - 0.5) / (0.5 / (np.pi / 12)
-                                                     )  # [-pi/12 ~ pi/12]
-
-            aug_box3d = np.concatenate([
-                box3d[0:3] + pos_shift, box3d[3:6] * hwl_scale,
-                box3d[6:7] + angle_rot
-            ])
-            return aug_box3d
+            pos_shift = (np.random.rand(num, 3) - 0.5)  # [-0.5 ~ 0.5]
+            hwl_scale = (np.random.rand(num, 3) - 0.5) / (0.5 / 0.15) + 1.0  #
+            angle_rot = (np.random.rand(num, 1) - 0.5) / (0.5 / (np.pi / 12)
+                                                          )  # [-pi/12 ~ pi/12]
+
+            aug_boxes3d = np.concatenate([
+                boxes3d[:, 0:3] + pos_shift, boxes3d[:, 3:6] * hwl_scale,
+                boxes3d[:, 6:7] + angle_rot
+            ],
+                                         axis=1)
+            return aug_boxes3d
         if cfg.RCNN.REG_AUG_METHOD == 'multiple':
             # pos_range, hwl_range, angle_range, mean_iou
-            range_config = [[0.2, 0.1, np.pi / 12, 0.7],
-                            [0.3, 0.15, np.pi / 12, 0.6],
-                            [0.5, 0.15, np.pi / 9, 0.5],
-                            [0.8, 0.15, np.pi / 6, 0.3],
-                            [1.0, 0.15, np.pi / 3, 0.2]]
-            idx = np.random.randint(len(range_config))
-
-            pos_shift = (
-                (np.random.rand(3) - 0.5) / 0.5) * range_config[idx][0]
-            hwl_scale = (
-                (np.random.rand(3) - 0.5) / 0.5) * range_config[idx][1] + 1.0
-            angle_rot = (
-                (np.random.rand(1) - 0.5) / 0.5) * range_config[idx][2]
-
-            aug_box3d = np.concatenate([
-                box3d[0:3] + pos_shift, box3d[3:6] * hwl_scale,
-                box3d[6:7] + angle_rot
-            ])
-            return aug_box3d
+            range_config = np.array([[0.2, 0.1, np.pi / 12, 0.7],
+                                     [0.3, 0.15, np.pi / 12, 0.6],
+                                     [0.5, 0.15, np.pi / 9, 0.5],
+                                     [0.8, 0.15, np.pi / 6, 0.3],
+                                     [1.0, 0.15, np.pi / 3, 0.2]])
+            cur_range = range_config[np.random.randint(len(range_config),
+                                                       size=num)]
+
+            pos_shift = ((np.random.rand(num, 3) - 0.5) /
+                         0.5) * cur_range[:, 0:1]
+            hwl_scale = ((np.random.rand(num, 3) - 0.5) /
+                         0.5) * cur_range[:, 1:2] + 1.0
+            angle_rot = ((np.random.rand(num, 1) - 0.5) /
+                         0.5) * cur_range[:, 2:3]
+
+            aug_boxes3d = np.concatenate([
+                boxes3d[:, 0:3] + pos_shift, boxes3d[:, 3:6] * hwl_scale,
+                boxes3d[:, 6:7] + angle_rot
+            ],
+                                         axis=1)
+            return aug_boxes3d
         if cfg.RCNN.REG_AUG_METHOD == 'normal':
-            x_shift = np.random.normal(loc=0, scale=0.3)
-            y_shift = np.random.normal(loc=0, scale=0.2)
-            z_shift = np.random.normal(loc=0, scale=0.3)
-            h_shift = np.random.normal(loc=0, scale=0.25)
-            w_shift = np.random.normal(loc=0, scale=0.15)
-            l_shift = np.random.normal(loc=0, scale=0.5)
-            ry_shift = ((np.random.rand() - 0.5) / 0.5) * np.pi / 12
-
-            aug_box3d = np.array([
-                box3d[0] + x_shift, box3d[1] + y_shift, box3d[2] + z_shift,
-                box3d[3] + h_shift, box3d[4] + w_shift, box3d[5] + l_shift,
-                box3d[6] + ry_shift
-            ])
-            return aug_box3d
+            # x, y, z, h, w, l shifts
+            shift = np.random.normal(loc=0,
+                                     scale=[0.3, 0.2, 0.3, 0.25, 0.15, 0.5],
+                                     size=(num, 6))
+            ry_shift = ((np.random.rand(num) - 0.5) / 0.5) * np.pi / 12
+
+            aug_boxes3d = np.array(boxes3d, dtype=np.float64)
+            aug_boxes3d[:, 0:6] += shift
+            aug_boxes3d[:, 6] += ry_shift
+            return aug_boxes3d
 
         raise NotImplementedError
 
     def get_proposal_from_file(self, index):
         """get proposal from file"""
         sample_id = int(self.image_idx_list[index])
-        proposal_file = os.path.join(self.rcnn_eval_roi_dir,
-                                     '%06d.txt' % sample_id)
-        roi_obj_list = kitti_utils.get_objects_from_label(proposal_file)
+        roi_boxes3d, roi_scores = self.get_rois(self.rcnn_eval_roi_dir,
+                                                self.rcnn_eval_feature_dir,
+                                                sample_id)  # (N, 7), (N)
 
         rpn_xyz, rpn_features, rpn_intensity, seg_mask = self.get_rpn_features(
             self.rcnn_eval_feature_dir, sample_id)
         pts_rect, pts_rpn_features, pts_intensity = rpn_xyz, rpn_features, rpn_intensity
 
-        roi_box3d_list, roi_scores = [], []
-        for obj in roi_obj_list:
-            box3d = np.array([
-                obj.pos[0], obj.pos[1], obj.pos[2], obj.h, obj.w, obj.l, obj.ry
-            ],
-                             dtype=np.float32)
-            roi_box3d_list.append(box3d.reshape(1, 7))
-            roi_scores.append(obj.score)
-
-        roi_boxes3d = np.concatenate(roi_box3d_list, axis=0)  # (N, 7)
-        roi_scores = np.array(roi_scores, dtype=np.float32)  # (N)
-
         if cfg.RCNN.ROI_SAMPLE_JIT:
             sample_dict = {
                 'sample_id': sample_id,
@@ -1055,10 +948,9 @@ class KittiRCNNDataset(KittiDataset):
             self.get_rpn_features(self.rcnn_training_feature_dir, sample_id)
 
         # load rois and gt_boxes3d for this sample
-        roi_file = os.path.join(self.rcnn_training_roi_dir,
-                                '%06d.txt' % sample_id)
-        roi_obj_list = kitti_utils.get_objects_from_label(roi_file)
-        roi_boxes3d = kitti_utils.objs_to_boxes3d(roi_obj_list)
+        roi_boxes3d, _ = self.get_rois(self.rcnn_training_roi_dir,
+                                       self.rcnn_training_feature_dir,
+                                       sample_id)
 
         gt_obj_list = self.filtrate_objects(self.get_label(sample_id))
         gt_boxes3d = kitti_utils.objs_to_boxes3d(gt_obj_list)
@@ -1102,9 +994,8 @@ class KittiRCNNDataset(KittiDataset):
         elif fg_num_rois > 0 and bg_num_rois == 0:
             # sampling fg
             rand_num = np.floor(
-                np.random.rand(cfg.RCNN.ROI_PER_IMAGE) * fg_num_rois)
-            rand_num = ms.Tensor.from_numpy(rand_num).type_as(
-                gt_boxes3d).astype(ms.int32)
+                np.random.rand(cfg.RCNN.ROI_PER_IMAGE) * fg_num_rois).astype(
+                    np.int32)
             fg_inds = fg_inds[rand_num]
             fg_rois_per_this_image = cfg.RCNN.ROI_PER_IMAGE
             bg_rois_per_this_image = 0
@@ -1144,68 +1035,42 @@ class KittiRCNNDataset(KittiDataset):
         iou_of_rois = np.concatenate(roi_iou_list, axis=0)
         gt_of_rois = np.concatenate(roi_gt_list, axis=0)
 
-        # collect extra features for point cloud pooling
-        if cfg.RCNN.USE_INTENSITY:
-            pts_extra_input_list = [
-                rpn_intensity.reshape(-1, 1),
-                seg_mask.reshape(-1, 1)
-            ]
-        else:
-            pts_extra_input_list = [seg_mask.reshape(-1, 1)]
-
-        if cfg.RCNN.USE_DEPTH:
-            pts_depth = (np.linalg.norm(rpn_xyz, ord=2, axis=1) / 70.0) - 0.5
-            pts_extra_input_list.append(pts_depth.reshape(-1, 1))
-        pts_extra_input = np.concatenate(pts_extra_input_list, axis=1)
-
-        pts_input, pts_features, pts_empty_flag = roipool3d_utils.roipool3d_cpu(
-            rois,
-            rpn_xyz,
-            rpn_features,
-            pts_extra_input,
-            cfg.RCNN.POOL_EXTRA_WIDTH,
-            sampled_pt_num=cfg.RCNN.NUM_POINTS,
-            canonical_transform=False)
-
-        sample_info = self.data_aug(rois, pts_input, gt_of_rois,
-                                    pts_empty_flag, iou_of_rois, sample_id,
-                                    pts_features)
-        return sample_info
+        return self.get_rcnn_sample_info(
+            sample_id, (rpn_xyz, rpn_features, rpn_intensity, seg_mask),
+            rois, gt_of_rois, iou_of_rois)
 
     def data_aug(self, rois, pts_input, gt_of_rois, pts_empty_flag,
                  iou_of_rois, sample_id, pts_features):
         """data augmentation"""
-        # data augmentation
+        # data augmentation, every roi has its own rotation, scaling and flip
         if cfg.AUG_DATA and self.mode == 'TRAIN':
-            for k in range(len(rois)):
-                aug_pts = pts_input[k, :, 0:3].copy()
-                aug_gt_box3d = gt_of_rois[k].copy()
-                aug_roi_box3d = rois[k].copy()
-
-                # calculate alpha by ry
-                temp_boxes3d = np.concatenate(
-                    [aug_roi_box3d.reshape(1, 7),
-                     aug_gt_box3d.reshape(1, 7)],
-                    axis=0)
-                temp_x, temp_z, temp_ry = temp_boxes3d[:,
-                                                       0], temp_boxes3d[:,
-                                                                        2], temp_boxes3d[:,
-                                                                                         6]
-                temp_beta = np.arctan2(temp_z, temp_x).astype(np.float64)
-                temp_alpha = -np.sign(
-                    temp_beta) * np.pi / 2 + temp_beta + temp_ry
-
-                # data augmentation
-                aug_pts, aug_boxes3d, _ = self.data_augmentation(aug_pts,
-                                                                 temp_boxes3d,
-                                                                 temp_alpha,
-                                                                 mustaug=True,
-                                                                 stage=2)
-
-                # assign to original data
-                pts_input[k, :, 0:3] = aug_pts
-                rois[k] = aug_boxes3d[0]
-                gt_of_rois[k] = aug_boxes3d[1]
+            num = rois.shape[0]
+            aug_list = cfg.AUG_METHOD_LIST
+            aug_pts = pts_input[:, :, 0:3]
+            aug_boxes3d = np.stack([rois, gt_of_rois], axis=1)  # (K, 2, 7)
+            if 'rotation' in aug_list:
+                angle = np.random.uniform(-np.pi / cfg.AUG_ROT_RANGE,
+                                          np.pi / cfg.AUG_ROT_RANGE,
+                                          size=num)
+                kitti_utils.rotate_pc_along_y_batch(aug_pts, angle)
+                self.rotate_boxes3d_along_y(aug_boxes3d, angle)
+
+            if 'scaling' in aug_list:
+                scale = np.random.uniform(0.95, 1.05, size=num)
+                aug_pts *= scale.reshape(-1, 1, 1)
+                aug_boxes3d[:, :, 0:6] *= scale.reshape(-1, 1, 1)
+
+            if 'flip' in aug_list:
+                flip = (1 - np.random.rand(num)) < cfg.AUG_METHOD_PROB[2]
+                aug_pts[flip, :, 0] = -aug_pts[flip, :, 0]
+                aug_boxes3d[flip, :, 0] = -aug_boxes3d[flip, :, 0]
+                # flip orientation: ry > 0: pi - ry, ry < 0: -pi - ry
+                aug_boxes3d[flip, :, 6] = np.sign(
+                    aug_boxes3d[flip, :, 6]) * np.pi - aug_boxes3d[flip, :, 6]
+
+            # assign to original data
+            rois[:] = aug_boxes3d[:, 0]
+            gt_of_rois[:] = aug_boxes3d[:, 1]
 
         valid_mask = (pts_empty_flag == 0).astype(np.int32)
 
@@ -1282,27 +1147,25 @@ class KittiRCNNDataset(KittiDataset):
         :param gt_boxes3d: (N, 7)
         :return:
         """
+        pos_thresh = min(cfg.RCNN.REG_FG_THRESH, cfg.RCNN.CLS_FG_THRESH)
+        gt_corners = kitti_utils.boxes3d_to_corners3d(gt_boxes3d)
+        aug_boxes3d = roi_boxes3d.copy()
         iou_of_rois = np.zeros(roi_boxes3d.shape[0], dtype=np.float32)
-        for k in range(len(roi_boxes3d)):
-            temp_iou = cnt = 0
-            roi_box3d = roi_boxes3d[k]
-            gt_box3d = gt_boxes3d[k]
-            pos_thresh = min(cfg.RCNN.REG_FG_THRESH, cfg.RCNN.CLS_FG_THRESH)
-            gt_corners = kitti_utils.boxes3d_to_corners3d(
-                gt_box3d.reshape(1, 7))
-            aug_box3d = roi_box3d
-            while temp_iou < pos_thresh and cnt < aug_times:
-                if np.random.rand() < 0.2:
-                    aug_box3d = roi_box3d  # p=0.2 to keep the original roi box
-                else:
-                    aug_box3d = self.random_aug_box3d(roi_box3d)
-                aug_corners = kitti_utils.boxes3d_to_corners3d(
-                    aug_box3d.reshape(1, 7))
-                iou3d = kitti_utils.get_iou3d(aug_corners, gt_corners)
-                temp_iou = iou3d[0][0]
-                cnt += 1
-            roi_boxes3d[k] = aug_box3d
-            iou_of_rois[k] = temp_iou
+        # every roi draws noise until it reaches pos_thresh or aug_times,
+        # the rois still trying share one iou pass per round
+        todo = np.arange(roi_boxes3d.shape[0])
+        for _ in range(aug_times):
+            if todo.size == 0:
+                break
+            cur_boxes3d = self.random_aug_boxes3d(roi_boxes3d[todo])
+            keep = np.random.rand(todo.size) < 0.2
+            cur_boxes3d[keep] = roi_boxes3d[todo[keep]]  # keep the original
+            aug_boxes3d[todo] = cur_boxes3d
+            iou_of_rois[todo] = kitti_utils.get_iou3d_paired(
+                kitti_utils.boxes3d_to_corners3d(cur_boxes3d),
+                gt_corners[todo])
+            todo = todo[iou_of_rois[todo] < pos_thresh]
+        roi_boxes3d[:] = aug_boxes3d
         return roi_boxes3d, iou_of_rois
 
     def get_rcnn_sample_jit(self, index):
@@ -1312,10 +1175,9 @@ class KittiRCNNDataset(KittiDataset):
             self.get_rpn_features(self.rcnn_training_feature_dir, sample_id)
 
         # load rois and gt_boxes3d for this sample
-        roi_file = os.path.join(self.rcnn_training_roi_dir,
-                                '%06d.txt' % sample_id)
-        roi_obj_list = kitti_utils.get_objects_from_label(roi_file)
-        roi_boxes3d = kitti_utils.objs_to_boxes3d(roi_obj_list)
+        roi_boxes3d, _ = self.get_rois(self.rcnn_training_roi_dir,
+                                       self.rcnn_training_feature_dir,
+                                       sample_id)
 
         gt_obj_list = self.filtrate_objects(self.get_label(sample_id))
         gt_boxes3d = kitti_utils.objs_to_boxes3d(gt_obj_list)
@@ -1333,43 +1195,25 @@ class KittiRCNNDataset(KittiDataset):
 
         return sample_info
 
+    @staticmethod
+    def box_pad_cols(cols):
+        """columns of per sample box lists that are zero padded in a batch"""
+        if cfg.RPN.ENABLED:
+            return [col for col in cols if col == 'gt_boxes3d']
+        if cfg.RCNN.ENABLED and cfg.RCNN.ROI_SAMPLE_JIT:
+            return [
+                col for col in cols if col in ['gt_boxes3d', 'roi_boxes3d']
+            ]
+        return []
+
     def collate_batch(self, batch):
         """collate batch"""
         if self.mode != 'TRAIN' and cfg.RCNN.ENABLED and not cfg.RPN.ENABLED:
             assert len(batch) == 1
             return batch[0]
 
-        batch_size = len(batch)
-        ans_dict = {}
-
-        for key in batch[0].keys():
-            if cfg.RPN.ENABLED and key == 'gt_boxes3d' or \
-                    (cfg.RCNN.ENABLED and cfg.RCNN.ROI_SAMPLE_JIT and key in ['gt_boxes3d', 'roi_boxes3d']):
-                max_gt = 0
-                for k in range(batch_size):
-                    max_gt = max(max_gt, len(batch[k][key]))
-                batch_gt_boxes3d = np.zeros((batch_size, max_gt, 7),
-                                            dtype=np.float32)
-                for i in range(batch_size):
-                    batch_gt_boxes3d[i, :len(batch[i][key]), :] = batch[i][key]
-                ans_dict[key] = batch_gt_boxes3d
-                continue
-
-            if isinstance(batch[0][key], np.ndarray):
-                if batch_size == 1:
-                    ans_dict[key] = batch[0][key][np.newaxis, ...]
-                else:
-                    ans_dict[key] = np.concatenate([
-                        batch[k][key][np.newaxis, ...]
-                        for k in range(batch_size)
-                    ],
-                                                   axis=0)
-
-            else:
-                ans_dict[key] = [batch[k][key] for k in range(batch_size)]
-                if isinstance(batch[0][key], int):
-                    ans_dict[key] = np.array(ans_dict[key], dtype=np.int32)
-                elif isinstance(batch[0][key], float):
-                    ans_dict[key] = np.array(ans_dict[key], dtype=np.float32)
-
-        return ans_dict
+        if self.collator is None:
+            cols = list(batch[0].keys())
+            self.collator = BatchCollator(cols,
+                                          pad_cols=self.box_pad_cols(cols))
+        return self.collator.collate(batch)
@@ -0,0 +1,186 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+pre-decoded kitti sample store
+
+One directory of .npy columns per split, opened with mmap so that every
+reader (and every dataloader worker) shares the page cache instead of
+re-opening and re-parsing the KITTI files:
+    sample_ids:    (S) int32, sorted
+    points:        (P, 4) float32 lidar points of all samples
+    point_offsets: (S + 1) int64, rows of points of each sample
+    calib:         (S, 45) float32, P2 | P3 | R0 | Tr_velo2cam
+    image_shape:   (S, 3) int32
+    planes:        (S, 4) float64 normalized road planes, nan if missing
+    label_types:   (O) str, class of every object
+    label_records: (O, 15) float64, see Object3d.to_record
+    label_offsets: (S + 1) int64, rows of labels of each sample
+"""
+import os
+import shutil
+
+import numpy as np
+
+import src.lib.utils.calibration as calibration
+from src.lib.utils.object3d import Object3d
+
+COLUMNS = ('sample_ids', 'points', 'point_offsets', 'calib', 'image_shape',
+           'planes', 'label_types', 'label_records', 'label_offsets')
+CALIB_KEYS = (('P2', (3, 4)), ('P3', (3, 4)), ('R0', (3, 3)),
+              ('Tr_velo2cam', (3, 4)))
+CALIB_LEN = 45
+RECORD_LEN = 15
+
+
+class KittiSampleStore:
+    """read only view of a packed split, all getters return mmap slices"""
+
+    def __init__(self, store_dir):
+        for name in COLUMNS:
+            path = os.path.join(store_dir, name + '.npy')
+            if not os.path.exists(path):
+                raise FileNotFoundError('incomplete sample store, missing %s'
+                                        % path)
+            setattr(self, name, np.load(path, mmap_mode='r'))
+        self.store_dir = store_dir
+        self.row_of = {
+            int(sample_id): row
+            for row, sample_id in enumerate(self.sample_ids)
+        }
+
+    def __getstate__(self):
+        # workers map the columns themselves instead of receiving a copy
+        return {'store_dir': self.store_dir}
+
+    def __setstate__(self, state):
+        self.__init__(state['store_dir'])
+
+    def __len__(self):
+        return len(self.row_of)
+
+    def __contains__(self, sample_id):
+        return sample_id in self.row_of
+
+    def get_lidar(self, sample_id):
+        """(N, 4) view of the lidar points"""
+        row = self.row_of[sample_id]
+        return self.points[self.point_offsets[row]:self.point_offsets[row +
+                                                                      1]]
+
+    def get_calib_dict(self, sample_id):
+        """calibration dict accepted by calibration.Calibration"""
+        flat = self.calib[self.row_of[sample_id]]
+        calib, start = {}, 0
+        for key, shape in CALIB_KEYS:
+            size = shape[0] * shape[1]
+            calib[key] = flat[start:start + size].reshape(shape)
+            start += size
+        return calib
+
+    def get_label(self, sample_id):
+        """list of Object3d rebuilt from the parsed records"""
+        row = self.row_of[sample_id]
+        start, end = self.label_offsets[row], self.label_offsets[row + 1]
+        return [
+            Object3d.from_record(str(cls_type), record) for cls_type, record in
+            zip(self.label_types[start:end], self.label_records[start:end])
+        ]
+
+    def get_image_shape(self, sample_id):
+        """(height, width, 3)"""
+        return tuple(int(x) for x in self.image_shape[self.row_of[sample_id]])
+
+    def get_road_plane(self, sample_id):
+        """normalized road plane, None if the split has no plane file"""
+        plane = self.planes[self.row_of[sample_id]]
+        if np.isnan(plane).any():
+            return None
+        return np.array(plane)
+
+
+def pack_kitti_samples(dataset, save_dir, sample_ids=None):
+    """
+    Decode the samples of a KittiDataset once and write them as a store.
+    Columns are written to a temporary directory that replaces save_dir only
+    when packing has finished.
+    :param dataset: KittiDataset, read through its file based getters
+    :param save_dir: output directory
+    :param sample_ids: ids to pack, default all ids of the split
+    :return: number of packed samples
+    """
+    if sample_ids is None:
+        sample_ids = [int(x) for x in dataset.image_idx_list]
+    sample_ids = np.array(sorted(set(sample_ids)), dtype=np.int32)
+    num = sample_ids.shape[0]
+    tmp_dir = save_dir.rstrip('/') + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    def column(name, shape, dtype):
+        return np.lib.format.open_memmap(os.path.join(tmp_dir, name + '.npy'),
+                                         mode='w+',
+                                         dtype=dtype,
+                                         shape=shape)
+
+    # points are sized from the .bin files so they can be streamed to disk
+    point_counts = [
+        os.path.getsize(os.path.join(dataset.lidar_dir, '%06d.bin' %
+                                     sample_id)) // 16
+        for sample_id in sample_ids
+    ]
+    point_offsets = np.zeros(num + 1, dtype=np.int64)
+    point_offsets[1:] = np.cumsum(point_counts)
+    points = column('points', (int(point_offsets[-1]), 4), np.float32)
+    calib = column('calib', (num, CALIB_LEN), np.float32)
+    image_shape = column('image_shape', (num, 3), np.int32)
+    planes = column('planes', (num, 4), np.float64)
+
+    label_types, label_records = [], []
+    label_offsets = np.zeros(num + 1, dtype=np.int64)
+    for row, sample_id in enumerate(sample_ids):
+        sample_id = int(sample_id)
+        points[point_offsets[row]:point_offsets[row + 1]] = \
+            dataset.get_lidar(sample_id)
+        calib_dict = calibration.get_calib_from_file(
+            os.path.join(dataset.calib_dir, '%06d.txt' % sample_id))
+        calib[row] = np.concatenate(
+            [calib_dict[key].reshape(-1) for key, _ in CALIB_KEYS])
+        image_shape[row] = dataset.get_image_shape(sample_id)
+        if os.path.exists(
+                os.path.join(dataset.plane_dir, '%06d.txt' % sample_id)):
+            planes[row] = dataset.get_road_plane(sample_id)
+        else:
+            planes[row] = np.nan
+        obj_list = dataset.get_label(sample_id)
+        label_types.extend(obj.cls_type for obj in obj_list)
+        label_records.extend(obj.to_record() for obj in obj_list)
+        label_offsets[row + 1] = label_offsets[row] + len(obj_list)
+        if row % 500 == 0:
+            print('pack sample store: %d / %d' % (row, num))
+
+    for arr in (points, calib, image_shape, planes):
+        arr.flush()
+    del points, calib, image_shape, planes
+    np.save(os.path.join(tmp_dir, 'sample_ids.npy'), sample_ids)
+    np.save(os.path.join(tmp_dir, 'point_offsets.npy'), point_offsets)
+    np.save(os.path.join(tmp_dir, 'label_offsets.npy'), label_offsets)
+    np.save(os.path.join(tmp_dir, 'label_types.npy'),
+            np.array(label_types, dtype=np.str_).reshape(-1))
+    np.save(os.path.join(tmp_dir, 'label_records.npy'),
+            np.array(label_records, dtype=np.float64).reshape(-1, RECORD_LEN))
+
+    shutil.rmtree(save_dir, ignore_errors=True)
+    os.rename(tmp_dir, save_dir)
+    return num
@@ -0,0 +1,188 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+packed rpn feature store
+
+The per sample files written by eval.py --save_rpn_feature (features, _xyz,
+_intensity, _rawscore, _seg) and the roi text files of the same run are
+packed into one directory of .npy columns that is opened with mmap:
+    sample_ids:    (S) int32, sorted
+    xyz:           (P, 3) float32 backbone points of all samples
+    features:      (P, C) float32 backbone features
+    intensity:     (P) float32
+    seg_scores:    (P) float32, sigmoid of the raw rpn scores
+    seg_masks:     (P) float32, thresholded rpn segmentation
+    point_offsets: (S + 1) int64, rows of points of each sample
+    rois:          (R, 7) float32 roi boxes
+    roi_scores:    (R) float32
+    roi_offsets:   (S + 1) int64, rows of rois of each sample
+"""
+import os
+import re
+import shutil
+
+import numpy as np
+
+import src.lib.utils.kitti_utils as kitti_utils
+
+COLUMNS = ('sample_ids', 'xyz', 'features', 'intensity', 'seg_scores',
+           'seg_masks', 'point_offsets', 'rois', 'roi_scores', 'roi_offsets')
+
+
+class RPNFeatureStore:
+    """read only view of packed rpn features, getters return mmap slices"""
+
+    def __init__(self, store_dir):
+        for name in COLUMNS:
+            path = os.path.join(store_dir, name + '.npy')
+            if not os.path.exists(path):
+                raise FileNotFoundError(
+                    'incomplete rpn feature store, missing %s' % path)
+            setattr(self, name, np.load(path, mmap_mode='r'))
+        self.store_dir = store_dir
+        self.row_of = {
+            int(sample_id): row
+            for row, sample_id in enumerate(self.sample_ids)
+        }
+
+    def __getstate__(self):
+        # workers map the columns themselves instead of receiving a copy
+        return {'store_dir': self.store_dir}
+
+    def __setstate__(self, state):
+        self.__init__(state['store_dir'])
+
+    def __len__(self):
+        return len(self.row_of)
+
+    def __contains__(self, sample_id):
+        return sample_id in self.row_of
+
+    def get_rpn_features(self, sample_id, use_seg_score):
+        """
+        :return: xyz (N, 3), features (N, C), intensity (N) and seg (N),
+            the rpn scores if use_seg_score else the segmentation mask
+        """
+        row = self.row_of[sample_id]
+        start, end = self.point_offsets[row], self.point_offsets[row + 1]
+        seg = self.seg_scores if use_seg_score else self.seg_masks
+        return self.xyz[start:end], self.features[start:end], \
+            self.intensity[start:end], seg[start:end]
+
+    def get_rois(self, sample_id):
+        """roi boxes (M, 7) and scores (M)"""
+        row = self.row_of[sample_id]
+        start, end = self.roi_offsets[row], self.roi_offsets[row + 1]
+        return self.rois[start:end], self.roi_scores[start:end]
+
+
+def is_rpn_feature_store(path):
+    """True if path is a directory packed by pack_rpn_features"""
+    return path is not None and os.path.exists(
+        os.path.join(path, 'seg_scores.npy'))
+
+
+def list_feature_samples(feature_dir):
+    """sample ids of all features saved in feature_dir"""
+    pattern = re.compile(r'^(\d{6})\.npy$')
+    return sorted(
+        int(match.group(1))
+        for match in map(pattern.match, os.listdir(feature_dir)) if match)
+
+
+def pack_rpn_features(feature_dir, roi_dir, save_dir, sample_ids=None):
+    """
+    Read the saved rpn features and rois once and write them as a store.
+    Columns are written to a temporary directory that replaces save_dir only
+    when packing has finished.
+    :param feature_dir: features saved by eval.py --save_rpn_feature
+    :param roi_dir: roi text files of the same run
+    :param save_dir: output directory
+    :param sample_ids: ids to pack, default all ids found in feature_dir
+    :return: number of packed samples
+    """
+    if sample_ids is None:
+        sample_ids = list_feature_samples(feature_dir)
+    sample_ids = np.array(sorted(set(sample_ids)), dtype=np.int32)
+    num = sample_ids.shape[0]
+    tmp_dir = save_dir.rstrip('/') + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    def feature_file(sample_id, suffix=''):
+        return os.path.join(feature_dir, '%06d%s.npy' % (sample_id, suffix))
+
+    def column(name, shape, dtype):
+        return np.lib.format.open_memmap(os.path.join(tmp_dir, name + '.npy'),
+                                         mode='w+',
+                                         dtype=dtype,
+                                         shape=shape)
+
+    # points are sized from the .npy headers so they can be streamed to disk
+    point_offsets = np.zeros(num + 1, dtype=np.int64)
+    num_channels = 0
+    for row, sample_id in enumerate(sample_ids):
+        shape = np.load(feature_file(sample_id), mmap_mode='r').shape
+        point_offsets[row + 1] = point_offsets[row] + shape[0]
+        num_channels = shape[1]
+    num_points = int(point_offsets[-1])
+    xyz = column('xyz', (num_points, 3), np.float32)
+    features = column('features', (num_points, num_channels), np.float32)
+    intensity = column('intensity', (num_points,), np.float32)
+    seg_scores = column('seg_scores', (num_points,), np.float32)
+    seg_masks = column('seg_masks', (num_points,), np.float32)
+
+    rois, roi_scores = [], []
+    roi_offsets = np.zeros(num + 1, dtype=np.int64)
+    for row, sample_id in enumerate(sample_ids):
+        sample_id = int(sample_id)
+        start, end = point_offsets[row], point_offsets[row + 1]
+        features[start:end] = np.load(feature_file(sample_id))
+        xyz[start:end] = np.load(feature_file(sample_id, '_xyz'))
+        intensity[start:end] = np.load(feature_file(sample_id,
+                                                    '_intensity')).reshape(-1)
+        raw_score = np.load(feature_file(sample_id,
+                                         '_rawscore')).reshape(-1).astype(
+                                             np.float32)
+        seg_scores[start:end] = 1.0 / (1.0 + np.exp(-raw_score))
+        seg_masks[start:end] = np.load(feature_file(sample_id,
+                                                    '_seg')).reshape(-1)
+
+        roi_obj_list = kitti_utils.get_objects_from_label(
+            os.path.join(roi_dir, '%06d.txt' % sample_id))
+        rois.append(kitti_utils.objs_to_boxes3d(roi_obj_list))
+        roi_scores.append(kitti_utils.objs_to_scores(roi_obj_list))
+        roi_offsets[row + 1] = roi_offsets[row] + len(roi_obj_list)
+        if row % 500 == 0:
+            print('pack rpn features: %d / %d' % (row, num))
+
+    for arr in (xyz, features, intensity, seg_scores, seg_masks):
+        arr.flush()
+    del xyz, features, intensity, seg_scores, seg_masks
+    np.save(os.path.join(tmp_dir, 'sample_ids.npy'), sample_ids)
+    np.save(os.path.join(tmp_dir, 'point_offsets.npy'), point_offsets)
+    np.save(os.path.join(tmp_dir, 'roi_offsets.npy'), roi_offsets)
+    np.save(
+        os.path.join(tmp_dir, 'rois.npy'),
+        np.concatenate(rois, axis=0).astype(np.float32)
+        if rois else np.zeros((0, 7), dtype=np.float32))
+    np.save(
+        os.path.join(tmp_dir, 'roi_scores.npy'),
+        np.concatenate(roi_scores, axis=0).astype(np.float32)
+        if roi_scores else np.zeros((0,), dtype=np.float32))
+
+    shutil.rmtree(save_dir, ignore_errors=True)
+    os.rename(tmp_dir, save_dir)
+    return num
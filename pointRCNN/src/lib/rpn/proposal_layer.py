@@ -22,6 +22,9 @@ from src.lib.config import cfg
 import src.lib.utils.kitti_utils as kitti_utils
 import src.lib.utils.iou3d.iou3d_utils as iou3d_utils
 
+# score of the padded candidates, below any real rpn score
+MIN_SCORE = -1e10
+
 
 class ProposalLayer(nn.Cell):
     """ProposalLayer class"""
@@ -51,40 +54,118 @@ class ProposalLayer(nn.Cell):
         proposals[:, 1] += proposals[:, 3] / 2  # set y as the center of bottom
         proposals = proposals.view(batch_size, -1, 7)
 
-        scores = rpn_scores
-        sort = ops.Sort(axis=1, descending=True)
-        _, sorted_idxs = sort(scores)
+        if cfg.TEST.RPN_DISTANCE_BASED_PROPOSE:
+            return self.distance_based_proposal(rpn_scores, proposals)
+        return self.score_based_proposal(rpn_scores, proposals)
 
+    @staticmethod
+    def range_top_k(scores, dist, dist_range, k):
+        """
+        :param scores: (B, N)
+        :param dist: (B, N)
+        :param dist_range: (low, high], None for all proposals
+        :param k: int
+        :return: idx (B, k) of the top k scores inside the range and the
+            flags (B, k) of the entries which really are inside the range
+        """
+        if dist_range is not None:
+            in_range = ops.logical_and(dist > dist_range[0],
+                                       dist <= dist_range[1])
+            scores = ops.select(in_range, scores,
+                                ops.fill(scores.dtype, scores.shape, MIN_SCORE))
+        top_scores, idx = ops.TopK(sorted=True)(scores, min(k, scores.shape[1]))
+        return idx, top_scores > MIN_SCORE
+
+    def batched_nms_proposal(self, scores, proposals, candidates,
+                             post_top_n_list, normal):
+        """
+        NMS of the candidates of every sample and range in one call, the kept
+        boxes of the ranges are packed one after another into fixed size
+        outputs padded with zeros.
+        :param scores: (B, N)
+        :param proposals: (B, N, 7)
+        :param candidates: list of (idx, valid) of every range, (B, K_i) each
+        :param post_top_n_list: post nms top n of every range
+        :param normal: axis aligned NMS instead of rotated NMS
+        :return bbox3d: (B, sum(post_top_n_list), 7), scores (B, sum(...))
+        """
         batch_size = scores.shape[0]
-
-        ret_bbox3d = ms.numpy.zeros(
-            (batch_size, cfg[self.mode].RPN_POST_NMS_TOP_N, 7), scores.dtype)
-        ret_scores = ms.numpy.zeros(
-            (batch_size, cfg[self.mode].RPN_POST_NMS_TOP_N), scores.dtype)
-        for k in range(batch_size):
-            scores_single = scores[k]
-            proposals_single = proposals[k]
-            order_single = sorted_idxs[k]
-
-            if cfg.TEST.RPN_DISTANCE_BASED_PROPOSE:
-                scores_single, proposals_single = self.distance_based_proposal(
-                    scores_single, proposals_single, order_single)
-            else:
-                scores_single, proposals_single = self.score_based_proposal(
-                    scores_single, proposals_single, order_single)
-
-            proposals_tot = proposals_single.shape[0]
-            ret_bbox3d[k, :proposals_tot] = proposals_single
-            ret_scores[k, :proposals_tot] = scores_single
-
+        idx = ops.concat([cand[0] for cand in candidates], axis=1)
+        valid = ops.concat([cand[1] for cand in candidates], axis=1)
+        cand_scores = ops.gather_elements(scores, 1, idx)
+        cand_proposals = ops.gather_elements(
+            proposals, 1,
+            ops.broadcast_to(idx.expand_dims(2), idx.shape + (7,)))
+        num_cand = idx.shape[1]
+
+        # padded candidates rank last, they never suppress a valid box
+        boxes_bev = kitti_utils.boxes3d_to_bev_torch(
+            cand_proposals.view(-1, 7)).view(batch_size, num_cand, 5)
+        nms_scores = ops.select(valid, cand_scores,
+                                ops.fill(scores.dtype, valid.shape, MIN_SCORE))
+        # one NMS per sample and range, like the per-sample loop did
+        keep, start = [], 0
+        for cand in candidates:
+            end = start + cand[0].shape[1]
+            keep.append(
+                iou3d_utils.batched_nms_mask(boxes_bev[:, start:end],
+                                             nms_scores[:, start:end],
+                                             cfg[self.mode].RPN_NMS_THRESH,
+                                             normal=normal))
+            start = end
+        keep = ops.logical_and(ops.concat(keep, axis=1), valid)
+
+        # output slot of every kept candidate: rank inside its range after
+        # the kept boxes of the previous ranges
+        slots, selected, start, base = [], [], 0, 0
+        for cand, post_top_n in zip(candidates, post_top_n_list):
+            cur_keep = keep[:, start:start + cand[0].shape[1]].astype(ms.int32)
+            rank = ops.CumSum()(cur_keep, 1) - 1
+            cur_selected = ops.logical_and(cur_keep > 0, rank < post_top_n)
+            slots.append(rank + base)
+            selected.append(cur_selected)
+            base = base + cur_selected.astype(ms.int32).sum(axis=1,
+                                                            keepdims=True)
+            start += cand[0].shape[1]
+        slots, selected = ops.concat(slots, axis=1), ops.concat(selected,
+                                                                axis=1)
+
+        # move the selected candidates to their slots, a fixed shape top k
+        post_tot_top_n = sum(post_top_n_list)
+        slot_key = ops.select(
+            selected, slots,
+            ms.numpy.arange(num_cand, dtype=ms.int32).view(1, -1) +
+            post_tot_top_n)
+        _, order = ops.TopK(sorted=True)(-slot_key.astype(ms.float32),
+                                         min(post_tot_top_n, num_cand))
+        out_flag = ops.gather_elements(selected, 1, order)
+        ret_scores = ops.gather_elements(cand_scores, 1, order) * \
+            out_flag.astype(scores.dtype)
+        ret_bbox3d = ops.gather_elements(
+            cand_proposals, 1,
+            ops.broadcast_to(order.expand_dims(2), order.shape + (7,))) * \
+            out_flag.astype(scores.dtype).expand_dims(2)
+        if order.shape[1] < post_tot_top_n:
+            pad = post_tot_top_n - order.shape[1]
+            ret_bbox3d = ops.concat([
+                ret_bbox3d,
+                ms.numpy.zeros((batch_size, pad, 7), ret_bbox3d.dtype)
+            ], axis=1)
+            ret_scores = ops.concat([
+                ret_scores,
+                ms.numpy.zeros((batch_size, pad), ret_scores.dtype)
+            ], axis=1)
         return ret_bbox3d, ret_scores
 
-    def distance_based_proposal(self, scores, proposals, order):
+    def distance_based_proposal(self, scores, proposals):
         """
          propose rois in two area based on the distance
-        :param scores: (N)
-        :param proposals: (N, 7)
-        :param order: (N)
+         Only proposals inside a range are candidates of that range. The
+         per-sample loop this replaces filled a range with fewer proposals
+         than its pre nms top n with proposals of other ranges, in the
+         arbitrary order of a sort of the range mask.
+        :param scores: (B, N)
+        :param proposals: (B, N, 7)
         """
         nms_range_list = [0, 40.0, 80.0]
         pre_tot_top_n = cfg[self.mode].RPN_PRE_NMS_TOP_N  #9000
@@ -99,89 +180,49 @@ class ProposalLayer(nn.Cell):
             post_tot_top_n - int(post_tot_top_n * 0.7)
         ]
 
-        scores_single_list, proposals_single_list = [], []
-
-        # sort by score
-        scores_ordered = scores[order]
-        proposals_ordered = proposals[order]
-
-        dist = proposals_ordered[:, 2]
-        first_mask = ops.logical_and((dist > nms_range_list[0]),
-                                     (dist <= nms_range_list[1]))
-        for i in range(1, len(nms_range_list)):
-            # get proposal distance mask
-
-            dist_mask: ms.Tensor = ops.logical_and(
-                (dist > nms_range_list[i - 1]), (dist <= nms_range_list[i]))
-            if dist_mask.sum() != 0:  #True
-                # this area has points
-                # reduce by mask
-
-                _, idx = ops.Sort(descending=True)(dist_mask.astype(
-                    ms.float32))
-                # fetch pre nms top K
-                cur_scores = scores_ordered[idx]
-                cur_proposals = proposals_ordered[idx]
-
-                cur_scores = cur_scores[:pre_top_n_list[i]]
-                cur_proposals = cur_proposals[:pre_top_n_list[i]]
-
-            else:
-                assert i == 2, '%d' % i
-                # this area doesn't have any points, so use rois of first area
-
-                _, idx = ops.Sort(descending=True)(first_mask.astype(
-                    ms.float32))
-                cur_scores = scores_ordered[idx]
-                cur_proposals = proposals_ordered[idx]
-
-                # fetch top K of first area
-                cur_scores = cur_scores[pre_top_n_list[i -
-                                                       1]:][:pre_top_n_list[i]]
-                cur_proposals = cur_proposals[
-                    pre_top_n_list[i - 1]:][:pre_top_n_list[i]]
-
-            # oriented nms
-            boxes_bev = kitti_utils.boxes3d_to_bev_torch(cur_proposals)
-            if cfg.RPN.NMS_TYPE == 'rotate':  #False
-                keep_idx = iou3d_utils.nms_gpu(boxes_bev, cur_scores,
-                                               cfg[self.mode].RPN_NMS_THRESH)
-            elif cfg.RPN.NMS_TYPE == 'normal':  #True
-                keep_idx = iou3d_utils.nms_normal_gpu(
-                    boxes_bev, cur_scores, cfg[self.mode].RPN_NMS_THRESH)
-            else:
-                raise NotImplementedError
-
-            # Fetch post nms top k
-            keep_idx = keep_idx[:post_top_n_list[i]]
-
-            scores_single_list.append(cur_scores[keep_idx])
-            proposals_single_list.append(cur_proposals[keep_idx])
-        cat = ops.Concat(axis=0)
-        scores_single = cat(scores_single_list)
-        proposals_single = cat(proposals_single_list)
-        return scores_single, proposals_single
-
-    def score_based_proposal(self, scores, proposals, order):
+        dist = proposals[:, :, 2]
+        # the near area also provides the rois of the far area when no
+        # proposal is far away, so fetch both top k at once
+        near_idx, near_valid = self.range_top_k(
+            scores, dist, nms_range_list[0:2],
+            pre_top_n_list[1] + pre_top_n_list[2])
+        far_idx, far_valid = self.range_top_k(scores, dist,
+                                              nms_range_list[1:3],
+                                              pre_top_n_list[2])
+        near_rest_idx = near_idx[:, pre_top_n_list[1]:]
+        near_rest_valid = near_valid[:, pre_top_n_list[1]:]
+        pad = far_idx.shape[1] - near_rest_idx.shape[1]
+        if pad > 0:
+            # fewer points than pre_tot_top_n
+            near_rest_idx = ops.concat(
+                [near_rest_idx, ops.zeros_like(far_idx[:, :pad])], axis=1)
+            near_rest_valid = ops.concat(
+                [near_rest_valid,
+                 ops.zeros_like(far_valid[:, :pad])], axis=1)
+        has_far = ops.broadcast_to(far_valid.any(axis=1, keep_dims=True),
+                                   far_idx.shape)
+        far_idx = ops.select(has_far, far_idx, near_rest_idx)
+        far_valid = ops.select(has_far, far_valid, near_rest_valid)
+        candidates = [(near_idx[:, :pre_top_n_list[1]],
+                       near_valid[:, :pre_top_n_list[1]]),
+                      (far_idx, far_valid)]
+        if cfg.RPN.NMS_TYPE not in ('rotate', 'normal'):
+            raise NotImplementedError
+        return self.batched_nms_proposal(scores, proposals, candidates,
+                                         post_top_n_list[1:],
+                                         cfg.RPN.NMS_TYPE == 'normal')
+
+    def score_based_proposal(self, scores, proposals):
         """
-         propose rois in two area based on the distance
-        :param scores: (N)
-        :param proposals: (N, 7)
-        :param order: (N)
+         propose rois by score only
+        :param scores: (B, N)
+        :param proposals: (B, N, 7)
         """
-        # sort by score
-        scores_ordered = scores[order]
-        proposals_ordered = proposals[order]
-
         # pre nms top K
-        cur_scores = scores_ordered[:cfg[self.mode].RPN_PRE_NMS_TOP_N]
-        cur_proposals = proposals_ordered[:cfg[self.mode].RPN_PRE_NMS_TOP_N]
-
-        boxes_bev = kitti_utils.boxes3d_to_bev_torch(cur_proposals)
-        keep_idx = iou3d_utils.nms_gpu(boxes_bev, cur_scores,
-                                       cfg[self.mode].RPN_NMS_THRESH)
-
-        # Fetch post nms top k
-        keep_idx = keep_idx[:cfg[self.mode].RPN_POST_NMS_TOP_N]
-
-        return cur_scores[keep_idx], cur_proposals[keep_idx]
+        candidates = [
+            self.range_top_k(scores, None, None,
+                             cfg[self.mode].RPN_PRE_NMS_TOP_N)
+        ]
+        return self.batched_nms_proposal(scores, proposals, candidates,
+                                         [cfg[self.mode].RPN_POST_NMS_TOP_N],
+                                         normal=False)
@@ -0,0 +1,145 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+asynchronous result writing and streaming metrics for evaluation
+
+The evaluation loop only runs the network and hands everything that reads
+results back to the host (metric updates, KITTI text files, .npy dumps) to
+an AsyncWriter. Metrics are running sums, so memory does not depend on the
+size of the split.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def to_numpy(x):
+    """numpy array of a Tensor or array like"""
+    return x.asnumpy() if hasattr(x, 'asnumpy') else np.asarray(x)
+
+
+class AsyncWriter:
+    """
+    Run jobs on a thread pool with at most max_pending jobs in flight,
+    submit() blocks beyond that so a fast model cannot queue up results.
+    The first exception raised by a job is re-raised by the next submit()
+    or by close(). num_workers=0 runs every job inline.
+    """
+
+    def __init__(self, num_workers=4, max_pending=64):
+        self.num_workers = num_workers
+        self._slots = threading.BoundedSemaphore(max(max_pending, 1))
+        self._error = None
+        self._pool = ThreadPoolExecutor(
+            max_workers=num_workers) if num_workers > 0 else None
+
+    def _done(self, future):
+        self._slots.release()
+        if future.exception() is not None and self._error is None:
+            self._error = future.exception()
+
+    def submit(self, func, *args, **kwargs):
+        """queue func(*args, **kwargs)"""
+        if self._error is not None:
+            raise self._error
+        if self._pool is None:
+            func(*args, **kwargs)
+            return
+        self._slots.acquire()
+        try:
+            future = self._pool.submit(func, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(self._done)
+
+    def close(self):
+        """wait for all queued jobs"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        elif self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+
+class RecallMeter:
+    """running count of gt boxes recalled at each iou threshold"""
+
+    def __init__(self, thresh_list):
+        self.thresh_list = list(thresh_list)
+        self._thresh = np.array(thresh_list, dtype=np.float32).reshape(-1, 1)
+        self.recalled = [0] * len(self.thresh_list)
+        self.total_gt = 0
+        self._lock = threading.Lock()
+
+    def update(self, gt_max_iou):
+        """
+        :param gt_max_iou: (M) best iou of every gt box, Tensor or array
+        """
+        gt_max_iou = to_numpy(gt_max_iou).reshape(1, -1)
+        recalled = (gt_max_iou > self._thresh).sum(axis=1)
+        with self._lock:
+            for idx, num in enumerate(recalled):
+                self.recalled[idx] += int(num)
+            self.total_gt += gt_max_iou.shape[1]
+
+    def recall(self, idx):
+        return self.recalled[idx] / max(self.total_gt, 1.0)
+
+
+class SumMeter:
+    """running sums of scalar metrics, values may be device scalars"""
+
+    def __init__(self, *names):
+        self.sums = {name: 0.0 for name in names}
+        self._lock = threading.Lock()
+
+    def add(self, **values):
+        values = {
+            name: float(to_numpy(value).reshape(-1)[0])
+            for name, value in values.items()
+        }
+        with self._lock:
+            for name, value in values.items():
+                self.sums[name] += value
+
+    def __getitem__(self, name):
+        return self.sums[name]
+
+
+class FrameRate:
+    """frames per second since construction"""
+
+    def __init__(self):
+        self.start = time.time()
+        self.frames = 0
+
+    def update(self, frames):
+        self.frames += frames
+
+    def fps(self):
+        return self.frames / max(time.time() - self.start, 1e-6)
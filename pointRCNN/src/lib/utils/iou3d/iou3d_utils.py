@@ -19,8 +19,9 @@ from pathlib import Path
 import mindspore as ms
 from mindspore import ops
 
+import src.cpu_ops as cpu_ops
 import src.lib.utils.kitti_utils as kitti_utils
-from src.layer_utils import get_func_from_so
+from src.layer_utils import get_func_from_so, shape_of_input, use_cpu_ops
 
 sys.path.insert(0,
                 Path(__file__).absolute().parent.parent.parent.parent.parent)
@@ -37,12 +38,14 @@ def boxes_iou_bev(boxes_a, boxes_b):
         ans_iou: (M, N)
     """
 
-    ans_iou = ms.numpy.zeros((boxes_a.shape[0], boxes_b.shape[0]))
+    if use_cpu_ops():
+        return ms.Tensor(
+            cpu_ops.boxes_iou_bev(boxes_a.asnumpy(), boxes_b.asnumpy()))
 
     op_boxes_iou_bev_gpu = get_func_from_so(so_name,
                                             "boxes_iou_bev_gpu",
-                                            out_shape=(boxes_a.shape[0],
-                                                       boxes_b.shape[0]),
+                                            out_shape=shape_of_input(
+                                                0, 0, (1, 0)),
                                             out_dtype=ms.float32)
     ans_iou = op_boxes_iou_bev_gpu(boxes_a, boxes_b)
 
@@ -60,12 +63,17 @@ def boxes_iou3d_gpu(boxes_a, boxes_b):
     boxes_b_bev = kitti_utils.boxes3d_to_bev_torch(boxes_b)
 
     # bev overlap
-    boxes_overlap_bev_gpu_op = get_func_from_so(so_name,
-                                                "boxes_overlap_bev_gpu",
-                                                out_shape=(boxes_a.shape[0],
-                                                           boxes_b.shape[0]),
-                                                out_dtype=ms.float32)
-    overlaps_bev = boxes_overlap_bev_gpu_op(boxes_a_bev, boxes_b_bev)
+    if use_cpu_ops():
+        overlaps_bev = ms.Tensor(
+            cpu_ops.boxes_overlap_bev(boxes_a_bev.asnumpy(),
+                                      boxes_b_bev.asnumpy()))
+    else:
+        boxes_overlap_bev_gpu_op = get_func_from_so(
+            so_name,
+            "boxes_overlap_bev_gpu",
+            out_shape=shape_of_input(0, 0, (1, 0)),
+            out_dtype=ms.float32)
+        overlaps_bev = boxes_overlap_bev_gpu_op(boxes_a_bev, boxes_b_bev)
     # height overlap
     boxes_a_height_min = (boxes_a[:, 1] - boxes_a[:, 3]).view(-1, 1)
     boxes_a_height_max = boxes_a[:, 1].view(-1, 1)
@@ -96,6 +104,9 @@ def nms_gpu(boxes, scores, thresh):
     :param thresh:
     :return:
     """
+    if use_cpu_ops():
+        return ms.Tensor(
+            cpu_ops.nms(boxes.asnumpy(), scores.asnumpy(), thresh))
     order = ops.Sort(axis=0, descending=True)(scores)[1]
 
     boxes = boxes[order]
@@ -120,6 +131,9 @@ def nms_normal_gpu(boxes, scores, thresh):
     """
     assert boxes.shape[1] == 5
     assert boxes.shape[0] == scores.shape[0]
+    if use_cpu_ops():
+        return ms.Tensor(
+            cpu_ops.nms_normal(boxes.asnumpy(), scores.asnumpy(), thresh))
     order = ops.Sort(axis=0, descending=True)(scores)[1]
 
     boxes = boxes[order]
@@ -136,3 +150,48 @@ def nms_normal_gpu(boxes, scores, thresh):
     num_out = nms_normal_gpu_op(boxes, keep, thresh)
     num = num_out.asnumpy().item()
     return order[keep[:num]]
+
+
+def batched_nms_mask(boxes, scores, thresh, normal=False):
+    """
+    Independent NMS of every group (e.g. the samples of a batch) with one
+    kernel call per group, so the cost grows with the number of groups and not
+    with its square. The output has a fixed shape and the number of kept boxes
+    never leaves the device.
+    :param boxes: (G, K, 5) [x1, y1, x2, y2, ry]
+    :param scores: (G, K)
+    :param thresh: float
+    :param normal: axis aligned NMS instead of rotated NMS
+    :return: (G, K) bool, True for the kept boxes
+    """
+    assert boxes.shape[2] == 5
+    assert boxes.shape[:2] == scores.shape
+    if use_cpu_ops():
+        return ms.Tensor(
+            cpu_ops.batched_nms(boxes.asnumpy(), scores.asnumpy(), thresh,
+                                normal))
+    num = boxes.shape[1]
+    if normal:
+        thresh = ms.Tensor(thresh, ms.float32)
+        in_type = ((num, 5), (num,), thresh.shape)
+        nms_op = get_func_from_so(so_name,
+                                  "nms_normal_gpu",
+                                  out_shape=(1,),
+                                  out_dtype=ms.int32,
+                                  in_type=in_type)
+    else:
+        nms_op = get_func_from_so(so_name,
+                                  "nms_gpu",
+                                  out_shape=(1,),
+                                  out_dtype=ms.int32)
+    keep_list = []
+    for k in range(boxes.shape[0]):
+        order = ops.Sort(axis=0, descending=True)(scores[k])[1]
+        keep = ms.numpy.zeros((num), ms.int64)
+        num_out = nms_op(boxes[k][order], keep, thresh)
+        # the first num_out entries of keep index the kept boxes of the sorted
+        # list, the rest are padding and scatter zeros
+        kept = (ms.numpy.arange(num) < num_out).astype(ms.int32)
+        kept_idx = order[keep.astype(ms.int32)].view(-1, 1)
+        keep_list.append(ops.ScatterNd()(kept_idx, kept, (num,)) > 0)
+    return ops.stack(keep_list)
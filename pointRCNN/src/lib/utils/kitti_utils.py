@@ -20,6 +20,7 @@ from mindspore import ops, Tensor
 import numpy as np
 from scipy.spatial import Delaunay
 import scipy
+import src.cpu_ops as cpu_ops
 import src.lib.utils.object3d as object3d
 
 
@@ -61,6 +62,20 @@ def rotate_pc_along_y(pc, rot_angle):
     return pc
 
 
+def rotate_pc_along_y_batch(pc, rot_angle):
+    """
+    :param pc: (K, N, 3 + C), XYZ of every set is rotated in place
+    :param rot_angle: (K) rad
+    :return: pc
+    """
+    cosa = np.cos(rot_angle).reshape(-1, 1)
+    sina = np.sin(rot_angle).reshape(-1, 1)
+    pc_x, pc_z = pc[:, :, 0].copy(), pc[:, :, 2].copy()
+    pc[:, :, 0] = pc_x * cosa - pc_z * sina
+    pc[:, :, 2] = pc_x * sina + pc_z * cosa
+    return pc
+
+
 def rotate_pc_along_y_torch(pc, rot_angle):
     """
     :param pc: (N, 512, 3 + C)
@@ -224,6 +239,29 @@ def in_hull(p, hull):
     return flag
 
 
+def pts_in_boxes3d(pts, boxes3d):
+    """
+    :param pts: (N, 3) in rect-camera coords
+    :param boxes3d: (M, 7) [x, y, z, h, w, l, ry], y is the bottom center
+    :return: (M, N) bool, see cpu_ops.pts_in_boxes3d, without a distance limit
+    """
+    return cpu_ops.pts_in_boxes3d(pts, boxes3d, max_dis=None)
+
+
+def pts_box_assignment(box_pts_mask):
+    """
+    :param box_pts_mask: (M, N) bool, see pts_in_boxes3d
+    :return: (N) int64 index of the box holding each point, -1 for background.
+        Points of overlapping boxes go to the last box, as if the labels were
+        written box by box.
+    """
+    num_boxes = box_pts_mask.shape[0]
+    if num_boxes == 0:
+        return np.full(box_pts_mask.shape[1], -1, dtype=np.int64)
+    last = num_boxes - 1 - np.argmax(box_pts_mask[::-1], axis=0)
+    return np.where(box_pts_mask.any(axis=0), last, -1).astype(np.int64)
+
+
 def objs_to_boxes3d(obj_list):
     """objects to boxes3d"""
     boxes3d = np.zeros((obj_list.__len__(), 7), dtype=np.float32)
@@ -241,49 +279,167 @@ def objs_to_scores(obj_list):
     return scores
 
 
-def get_iou3d(corners3d, query_corners3d, need_bev=False):
+def _cross2(u, v):
+    return u[..., 0] * v[..., 1] - u[..., 1] * v[..., 0]
+
+
+def _polygon_area(poly, cnt):
+    """
+    :param poly: (P, K, 2) vertices, only the first cnt of each row are used
+    :param cnt: (P) number of vertices
+    :return: (P) unsigned shoelace area
+    """
+    idx = np.arange(poly.shape[1])[None, :]
+    nxt = np.where(idx + 1 < cnt[:, None], idx + 1, 0)
+    nxt_poly = np.take_along_axis(poly, nxt[..., None], axis=1)
+    tri = np.where(idx < cnt[:, None], _cross2(poly, nxt_poly), 0)
+    return np.abs(tri.sum(axis=1)) / 2.0
+
+
+def _clip_half_plane(poly, cnt, edge_start, edge_end, sign):
+    """
+    One Sutherland-Hodgman step for P polygons at once: keep the part of
+    every polygon on the inner side of its clipping edge.
+    :param poly: (P, K, 2), cnt: (P)
+    :param edge_start, edge_end: (P, 2) clipping edge
+    :param sign: (P) orientation of the clipping polygon, +1 ccw, -1 cw
+    :return: clipped polygons (P, K', 2) and their vertex counts (P)
     """
+    idx = np.arange(poly.shape[1])[None, :]
+    valid = idx < cnt[:, None]
+    nxt = np.where(idx + 1 < cnt[:, None], idx + 1, 0)
+    side = sign[:, None] * _cross2((edge_end - edge_start)[:, None, :],
+                                   poly - edge_start[:, None, :])
+    nxt_side = np.take_along_axis(side, nxt, axis=1)
+    nxt_poly = np.take_along_axis(poly, nxt[..., None], axis=1)
+    inside, nxt_inside = side >= 0, nxt_side >= 0
+
+    keep = valid & inside
+    crossing = valid & (inside != nxt_inside)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(crossing, side / (side - nxt_side), 0)
+    cross_pts = poly + ratio[..., None] * (nxt_poly - poly)
+
+    # each vertex emits itself when inside, then the crossing of its edge
+    cand = np.stack([poly, cross_pts], axis=2).reshape(poly.shape[0], -1, 2)
+    flag = np.stack([keep, crossing], axis=2).reshape(poly.shape[0], -1)
+    new_cnt = flag.sum(axis=1)
+    out = np.zeros((poly.shape[0], max(int(new_cnt.max()), 1), 2))
+    rows, cols = np.nonzero(flag)
+    out[rows, np.cumsum(flag, axis=1)[rows, cols] - 1] = cand[rows, cols]
+    return out, new_cnt
+
+
+def convex_overlap_bev(poly_a, poly_b):
+    """
+    Intersection area of aligned pairs of convex quadrilaterals, clipping
+    poly_a by the four edges of poly_b.
+    :param poly_a: (P, 4, 2)
+    :param poly_b: (P, 4, 2), either orientation
+    :return: (P) float64
+    """
+    poly = np.asarray(poly_a, dtype=np.float64)
+    poly_b = np.asarray(poly_b, dtype=np.float64)
+    cnt = np.full(poly.shape[0], 4)
+    sign = np.where(
+        _cross2(poly_b[:, 1] - poly_b[:, 0], poly_b[:, 2] - poly_b[:, 0]) >= 0,
+        1.0, -1.0)
+    for k in range(4):
+        poly, cnt = _clip_half_plane(poly, cnt, poly_b[:, k],
+                                     poly_b[:, (k + 1) % 4], sign)
+    return _polygon_area(poly, cnt)
+
+
+def _pair_iou3d_bev(A, B, ia, ib, chunk_pairs):
+    """iou3d and iou_bev of the pairs (A[ia], B[ib]), float64 corners"""
+    bev_a, bev_b = A[ia, 0:4][..., [0, 2]], B[ib, 0:4][..., [0, 2]]
+    overlap = np.zeros(ia.shape[0])
+    for start in range(0, ia.shape[0], chunk_pairs):
+        overlap[start:start + chunk_pairs] = convex_overlap_bev(
+            bev_a[start:start + chunk_pairs], bev_b[start:start + chunk_pairs])
+
+    # for height overlap, since y face down, use the negative y
+    min_h_a, max_h_a = -A[ia, 0:4, 1].mean(axis=1), -A[ia, 4:8, 1].mean(axis=1)
+    min_h_b, max_h_b = -B[ib, 0:4, 1].mean(axis=1), -B[ib, 4:8, 1].mean(axis=1)
+    h_overlap = np.maximum(
+        np.minimum(max_h_a, max_h_b) - np.maximum(min_h_a, min_h_b), 0)
+
+    area_a = _polygon_area(bev_a, np.full(ia.shape[0], 4))
+    area_b = _polygon_area(bev_b, np.full(ib.shape[0], 4))
+    overlap3d = overlap * h_overlap
+    union3d = area_a * (max_h_a - min_h_a) + area_b * (max_h_b -
+                                                        min_h_b) - overlap3d
+    union_bev = area_a + area_b - overlap
+    with np.errstate(divide='ignore', invalid='ignore'):
+        iou3d = np.where(overlap3d > 0, overlap3d / union3d, 0)
+        iou_bev = np.where(overlap > 0, overlap / union_bev, 0)
+    return iou3d, iou_bev
+
+
+def _bev_circles(corners):
+    """center (N, 2) and radius (N) of the bev bounding circles"""
+    bev = corners[:, 0:4][..., [0, 2]]
+    center = bev.mean(axis=1)
+    return center, np.linalg.norm(bev - center[:, None], axis=2).max(axis=1)
+
+
+def get_iou3d_bev(corners3d, query_corners3d, chunk_pairs=1 << 16):
+    """
+    Batched rotated box IoU: the bottom faces of the pairs whose bounding
+    circles touch are clipped against each other in one vectorized pass.
     :param corners3d: (N, 8, 3) in rect coords
     :param query_corners3d: (M, 8, 3)
-    :return:
+    :param chunk_pairs: max pairs clipped at once
+    :return: iou3d (N, M), iou_bev (N, M) float32
     """
-    from shapely.geometry import Polygon
-    A, B = corners3d, query_corners3d
+    A = np.asarray(corners3d, dtype=np.float64).reshape(-1, 8, 3)
+    B = np.asarray(query_corners3d, dtype=np.float64).reshape(-1, 8, 3)
     N, M = A.shape[0], B.shape[0]
     iou3d = np.zeros((N, M), dtype=np.float32)
     iou_bev = np.zeros((N, M), dtype=np.float32)
+    if N == 0 or M == 0:
+        return iou3d, iou_bev
+
+    center_a, radius_a = _bev_circles(A)
+    center_b, radius_b = _bev_circles(B)
+    dist = np.linalg.norm(center_a[:, None] - center_b[None, :], axis=2)
+    ia, ib = np.nonzero(dist <= radius_a[:, None] + radius_b[None, :] + 1e-6)
+    iou3d[ia, ib], iou_bev[ia, ib] = _pair_iou3d_bev(A, B, ia, ib,
+                                                     chunk_pairs)
+    return iou3d, iou_bev
+
+
+def get_iou3d_paired(corners3d, query_corners3d, chunk_pairs=1 << 16):
+    """
+    :param corners3d: (N, 8, 3) in rect coords
+    :param query_corners3d: (N, 8, 3)
+    :return: iou3d (N) float32 of box k with query box k
+    """
+    A = np.asarray(corners3d, dtype=np.float64).reshape(-1, 8, 3)
+    B = np.asarray(query_corners3d, dtype=np.float64).reshape(-1, 8, 3)
+    assert A.shape[0] == B.shape[0]
+    iou3d = np.zeros(A.shape[0], dtype=np.float32)
+    if A.shape[0] == 0:
+        return iou3d
+
+    center_a, radius_a = _bev_circles(A)
+    center_b, radius_b = _bev_circles(B)
+    dist = np.linalg.norm(center_a - center_b, axis=1)
+    idx = np.nonzero(dist <= radius_a + radius_b + 1e-6)[0]
+    iou3d[idx] = _pair_iou3d_bev(A, B, idx, idx, chunk_pairs)[0]
+    return iou3d
 
-    # for height overlap, since y face down, use the negative y
-    min_h_a = -A[:, 0:4, 1].sum(axis=1) / 4.0
-    max_h_a = -A[:, 4:8, 1].sum(axis=1) / 4.0
-    min_h_b = -B[:, 0:4, 1].sum(axis=1) / 4.0
-    max_h_b = -B[:, 4:8, 1].sum(axis=1) / 4.0
-
-    for i in range(N):
-        for j in range(M):
-            max_of_min = np.max([min_h_a[i], min_h_b[j]])
-            min_of_max = np.min([max_h_a[i], max_h_b[j]])
-            h_overlap = np.max([0, min_of_max - max_of_min])
-            if h_overlap == 0:
-                continue
-
-            bottom_a, bottom_b = Polygon(A[i, 0:4,
-                                           [0, 2]].T), Polygon(B[j, 0:4,
-                                                                 [0, 2]].T)
-            if bottom_a.is_valid and bottom_b.is_valid:
-                # check is valid,  A valid Polygon may not possess any overlapping exterior or interior rings.
-                bottom_overlap = bottom_a.intersection(bottom_b).area
-            else:
-                bottom_overlap = 0.
-            overlap3d = bottom_overlap * h_overlap
-            union3d = bottom_a.area * (max_h_a[i] -
-                                       min_h_a[i]) + bottom_b.area * (
-                                           max_h_b[j] - min_h_b[j]) - overlap3d
-            iou3d[i][j] = overlap3d / union3d
-            iou_bev[i][j] = bottom_overlap / (bottom_a.area + bottom_b.area -
-                                              bottom_overlap)
 
+def get_iou3d(corners3d, query_corners3d, need_bev=False):
+    """
+    :param corners3d: (N, 8, 3) in rect coords
+    :param query_corners3d: (M, 8, 3)
+    :return: iou3d (N, M), with need_bev also iou_bev (N, M) which, as
+        before, is only filled for pairs overlapping in height
+    """
+    iou3d, iou_bev = get_iou3d_bev(corners3d, query_corners3d)
     if need_bev:
+        iou_bev[iou3d <= 0] = 0
         return iou3d, iou_bev
 
     return iou3d
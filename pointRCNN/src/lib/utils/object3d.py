@@ -52,6 +52,34 @@ class Object3d:
         self.level_str = None
         self.level = self.get_obj_level()
 
+    def to_record(self):
+        """numeric fields of the label as a float64 array, see from_record"""
+        return np.array([
+            self.trucation, self.occlusion, self.alpha, *self.box2d, self.h,
+            self.w, self.l, *self.pos, self.ry, self.score
+        ], dtype=np.float64)
+
+    @classmethod
+    def from_record(cls, cls_type, record):
+        """build an object from to_record output without parsing a line"""
+        obj = cls.__new__(cls)
+        obj.src = None
+        obj.cls_type = cls_type
+        obj.cls_id = cls_type_to_id(cls_type)
+        obj.trucation = float(record[0])
+        obj.occlusion = float(record[1])
+        obj.alpha = float(record[2])
+        obj.box2d = np.array(record[3:7], dtype=np.float32)
+        obj.h, obj.w, obj.l = float(record[7]), float(record[8]), float(
+            record[9])
+        obj.pos = np.array(record[10:13], dtype=np.float32)
+        obj.dis_to_cam = np.linalg.norm(obj.pos)
+        obj.ry = float(record[13])
+        obj.score = float(record[14])
+        obj.level_str = None
+        obj.level = obj.get_obj_level()
+        return obj
+
     def get_obj_level(self):
         """get object level"""
         height = float(self.box2d[3]) - float(self.box2d[1]) + 1
@@ -15,6 +15,7 @@
 # This file was copied from project [sshaoshuai][https://github.com/sshaoshuai/PointRCNN]
 
 """roipool3d utils"""
+from functools import lru_cache
 from pathlib import Path
 import sys
 import numpy as np
@@ -22,8 +23,9 @@ import numpy as np
 import mindspore as ms
 
 
+import src.cpu_ops as cpu_ops
 import src.lib.utils.kitti_utils as kitti_utils
-from src.layer_utils import get_func_from_so
+from src.layer_utils import get_func_from_so, use_cpu_ops
 sys.path.insert(
     0,
     Path(__file__).absolute().parent.parent.parent.parent.parent.absolute())
@@ -32,6 +34,37 @@ sys.path.insert(
 so_name = "roipool3d_cuda.cpython-39-x86_64-linux-gnu.so"
 
 
+@lru_cache(maxsize=None)
+def roipool3d_gpu_out_shape(sampled_pt_num):
+    """
+    pts: (B, N, 3), boxes3d: (B, M, 7), pts_feature: (B, N, C)
+    -> pooled_features: (B, M, sampled_pt_num, 3 + C), pooled_empty_flag: (B, M)
+    """
+
+    def infer(_, boxes3d, pts_feature):
+        batch_size, boxes_num = boxes3d[0], boxes3d[1]
+        return ((batch_size, boxes_num, sampled_pt_num, 3 + pts_feature[2]),
+                (batch_size, boxes_num))
+
+    return infer
+
+
+@lru_cache(maxsize=None)
+def roipool3d_cpu_out_shape(sampled_pt_num):
+    """
+    pts: (N, 3), boxes3d: (M, 7), pts_feature: (N, C)
+    -> pooled_pts: (M, sampled_pt_num, 3),
+       pooled_features: (M, sampled_pt_num, C), pooled_empty_flag: (M)
+    """
+
+    def infer(_, boxes3d, pts_feature):
+        boxes_num = boxes3d[0]
+        return ((boxes_num, sampled_pt_num, 3),
+                (boxes_num, sampled_pt_num, pts_feature[1]), (boxes_num,))
+
+    return infer
+
+
 def roipool3d_gpu(pts,
                   pts_feature,
                   boxes3d,
@@ -47,28 +80,29 @@ def roipool3d_gpu(pts,
         pooled_features: (B, M, 512, 3 + C)
         pooled_empty_flag: (B, M)
     """
-    batch_size, boxes_num, feature_len = pts.shape[0], boxes3d.shape[
-        1], pts_feature.shape[2]
+    batch_size = pts.shape[0]
     pooled_boxes3d = kitti_utils.enlarge_box3d(boxes3d.view(-1, 7),
                                                pool_extra_width).view(
                                                    batch_size, -1, 7)
 
+    if use_cpu_ops():
+        pooled_features, pooled_empty_flag = cpu_ops.roipool3d_batch(
+            pts.asnumpy(), pts_feature.asnumpy(), pooled_boxes3d.asnumpy(),
+            sampled_pt_num)
+        return ms.Tensor(pooled_features), ms.Tensor(pooled_empty_flag)
     forward = get_func_from_so(so_name,
                                "roipool3d_gpu",
-                               out_shape=((batch_size, boxes_num,
-                                           sampled_pt_num, 3 + feature_len),
-                                          (batch_size, boxes_num)),
+                               out_shape=roipool3d_gpu_out_shape(
+                                   sampled_pt_num),
                                out_dtype=(ms.float32, ms.int32))
     pooled_features, pooled_empty_flag = forward(pts, pooled_boxes3d,
                                                  pts_feature)
     return pooled_features, pooled_empty_flag
 
 
-boxes3d_op = get_func_from_so(so_name,
-                              "pts_in_boxes3d_cpu",
-                              out_shape=lambda *x: x[0],
-                              out_dtype=ms.int64,
-                              CPU_opt=True)
+def _flag_shape(*shapes):
+    """pts_flag: (M, N) is passed in as the first input"""
+    return shapes[0]
 
 
 def pts_in_boxes3d_cpu(pts: ms.Tensor, boxes3d: ms.Tensor):
@@ -77,11 +111,19 @@ def pts_in_boxes3d_cpu(pts: ms.Tensor, boxes3d: ms.Tensor):
     :param boxes3d: (M, 7)
     :return: boxes_pts_mask_list: (M), list with [(N), (N), ..]
     """
+    if use_cpu_ops():
+        pts_flag = cpu_ops.pts_in_boxes3d(pts.asnumpy(), boxes3d.asnumpy())
+        return [ms.Tensor(mask) for mask in pts_flag]
     pts = pts.astype(ms.float32)
     boxes3d = boxes3d.astype(ms.float32)
     _pts_flag = ms.numpy.zeros((boxes3d.shape[0], pts.shape[0]),
                                dtype=ms.numpy.int64)
 
+    boxes3d_op = get_func_from_so(so_name,
+                                  "pts_in_boxes3d_cpu",
+                                  out_shape=_flag_shape,
+                                  out_dtype=ms.int64,
+                                  CPU_opt=True)
     pts_flag = boxes3d_op(_pts_flag, pts, boxes3d)
     boxes_pts_mask_list = []
     for k in range(0, boxes3d.shape[0]):
@@ -106,13 +148,16 @@ def roipool_pc_cpu(pts, pts_feature, boxes3d, sampled_pt_num):
         1] == 3, '%s %s' % (pts.shape, pts_feature.shape)
     # assert pts.is_cuda is False
 
-    out1 = (boxes3d.shape[0], sampled_pt_num, 3)
-    out2 = (boxes3d.shape[0], sampled_pt_num, pts_feature.shape[1])
-
-    out3 = boxes3d.shape[0]
+    if use_cpu_ops():
+        pooled_pts, pooled_features, pooled_empty_flag = cpu_ops.roipool3d(
+            pts.asnumpy(), pts_feature.asnumpy(), boxes3d.asnumpy(),
+            sampled_pt_num)
+        return (ms.Tensor(pooled_pts), ms.Tensor(pooled_features),
+                ms.Tensor(pooled_empty_flag))
     roipool3d_cpu_op = get_func_from_so(so_name,
                                         "roipool3d_cpu",
-                                        out_shape=(out1, out2, out3),
+                                        out_shape=roipool3d_cpu_out_shape(
+                                            sampled_pt_num),
                                         out_dtype=(ms.float32, ms.float32,
                                                    ms.int64))
     pooled_pts, pooled_features, pooled_empty_flag = roipool3d_cpu_op(
@@ -162,9 +207,8 @@ def roipool3d_cpu(boxes3d,
                           0:3] = sampled_pts_input[:, :, 0:
                                                    3] - roi_center[:, np.
                                                                    newaxis, :]
-        for k in range(sampled_pts_input.shape[0]):
-            sampled_pts_input[k] = kitti_utils.rotate_pc_along_y(
-                sampled_pts_input[k], roi_ry[k])
+        sampled_pts_input = kitti_utils.rotate_pc_along_y_batch(
+            sampled_pts_input, roi_ry)
 
         return sampled_pts_input, sampled_pts_feature
 
@@ -0,0 +1,124 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+resumable sharded jobs
+
+A job over the scenes of a split is cut into shards of a fixed number of
+scenes. Shards run on a process pool and the result of every finished shard
+is pickled to a checkpoint directory, so a killed job only redoes the shards
+that were in flight. Shard boundaries depend on the shard size only, never on
+the number of workers, and results are merged in shard order.
+"""
+import json
+import os
+import pickle
+import shutil
+from multiprocessing import Pool
+
+_context = None
+
+
+def _init_worker(context):
+    global _context
+    _context = context
+
+
+def _run_shard(job):
+    func, key, items = job
+    return key, func(_context, items)
+
+
+def split_shards(items, shard_size):
+    """consecutive lists of at most shard_size items"""
+    shard_size = max(shard_size, 1)
+    return [
+        items[k:k + shard_size] for k in range(0, len(items), shard_size)
+    ]
+
+
+class ShardCheckpoint:
+    """
+    Finished shard results of one job. config holds everything the results
+    depend on, a checkpoint written with another config is discarded.
+    """
+
+    def __init__(self, ckpt_dir, config, restart=False):
+        self.ckpt_dir = ckpt_dir.rstrip('/')
+        # compare as json so tuples and lists are the same
+        config = json.loads(json.dumps(config))
+        meta_file = os.path.join(self.ckpt_dir, 'meta.json')
+        meta = None
+        if not restart and os.path.exists(meta_file):
+            with open(meta_file, 'r') as f:
+                meta = json.load(f)
+        if meta != config:
+            shutil.rmtree(self.ckpt_dir, ignore_errors=True)
+            os.makedirs(self.ckpt_dir)
+            with open(meta_file, 'w') as f:
+                json.dump(config, f)
+
+    def _path(self, key):
+        return os.path.join(self.ckpt_dir, 'shard_%05d.pkl' % key)
+
+    def done(self, key):
+        return os.path.exists(self._path(key))
+
+    def save(self, key, result):
+        """write to a temporary file first, a shard is done once renamed"""
+        path = self._path(key)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    def load(self, key):
+        with open(self._path(key), 'rb') as f:
+            return pickle.load(f)
+
+    def iter_results(self, num_shards):
+        """results of shards 0 .. num_shards - 1, one at a time"""
+        for key in range(num_shards):
+            yield self.load(key)
+
+    def clear(self):
+        shutil.rmtree(self.ckpt_dir, ignore_errors=True)
+
+
+def run_shards(func, context, shards, ckpt, workers=8):
+    """
+    Run the shards that are not in the checkpoint yet.
+    :param func: picklable func(context, items), e.g. an unbound method,
+        returning the picklable result of one shard
+    :param context: object sent once to every worker
+    :param shards: list of item lists, see split_shards
+    :param ckpt: ShardCheckpoint
+    :param workers: number of processes, 0 runs the shards inline
+    """
+    todo = [key for key in range(len(shards)) if not ckpt.done(key)]
+    print('%d / %d shards done, %d to run' %
+          (len(shards) - len(todo), len(shards), len(todo)))
+    jobs = [(func, key, shards[key]) for key in todo]
+    if workers > 0:
+        with Pool(workers, initializer=_init_worker,
+                  initargs=(context,)) as pool:
+            for k, (key, result) in enumerate(
+                    pool.imap_unordered(_run_shard, jobs)):
+                ckpt.save(key, result)
+                print('finish shard %d (%d / %d)' % (key, k + 1, len(jobs)))
+    else:
+        _init_worker(context)
+        for k, job in enumerate(jobs):
+            key, result = _run_shard(job)
+            ckpt.save(key, result)
+            print('finish shard %d (%d / %d)' % (key, k + 1, len(jobs)))
@@ -16,7 +16,7 @@
 """data preprocessing"""
 
 import os
-import pickle
+from multiprocessing import Pool
 
 import numpy as np
 
@@ -30,6 +30,39 @@ def pc_normalize(pc):
     return pc
 
 
+def farthest_point_sample_batch(point, npoint, start=None):
+    """
+    Input:
+        point: pointcloud data of B clouds, [B, N, D]
+        npoint: number of samples
+        start: index of the first sample of every cloud, [B], default random
+    Return:
+        point: sampled pointcloud data, [B, npoint, D]
+    """
+    B, N, _ = point.shape
+    # one contiguous [B, N] plane per axis, reductions over a length 3 axis are slow
+    x, y, z = [np.ascontiguousarray(point[:, :, k], dtype=np.float32) for k in range(3)]
+    if start is None:
+        start = np.random.randint(0, N, B)
+    batch_idx = np.arange(B)
+    centroids = np.zeros((B, npoint), dtype=np.int64)
+    distance = np.full((B, N), 1e10, dtype=np.float32)
+    dist = np.empty((B, N), dtype=np.float32)
+    tmp = np.empty((B, N), dtype=np.float32)
+    farthest = np.asarray(start, dtype=np.int64).reshape(B)
+    for i in range(npoint):
+        centroids[:, i] = farthest
+        np.subtract(x, x[batch_idx, farthest][:, None], out=dist)
+        np.square(dist, out=dist)
+        for axis in (y, z):
+            np.subtract(axis, axis[batch_idx, farthest][:, None], out=tmp)
+            np.square(tmp, out=tmp)
+            dist += tmp
+        np.minimum(distance, dist, out=distance)
+        farthest = np.argmax(distance, -1)
+    return point[batch_idx[:, None], centroids]
+
+
 def farthest_point_sample(point, npoint):
     """
     Input:
@@ -38,26 +71,42 @@ def farthest_point_sample(point, npoint):
     Return:
         centroids: sampled pointcloud index, [npoint, D]
     """
-    N, _ = point.shape
-    xyz = point[:, :3]
-    centroids = np.zeros((npoint,))
-    distance = np.ones((N,)) * 1e10
-    farthest = np.random.randint(0, N)
-    for i in range(npoint):
-        centroids[i] = farthest
-        centroid = xyz[farthest, :]
-        dist = np.sum((xyz - centroid) ** 2, -1)
-        mask = dist < distance
-        distance[mask] = dist[mask]
-        farthest = np.argmax(distance, -1)
-    point = point[centroids.astype(np.int32)]
-    return point
+    start = [np.random.randint(0, point.shape[0])]
+    return farthest_point_sample_batch(point[None], npoint, start=start)[0]
+
+
+def load_shape(path):
+    """ModelNet .txt of comma separated rows, [N, C] float32"""
+    return np.loadtxt(path, delimiter=',').astype(np.float32)
+
+
+def preprocess_shapes(job):
+    """
+    Load and sample one chunk of shapes, the first fps sample of shape k is
+    drawn with seed k so the cache does not depend on the number of workers
+    Input:
+        job: (shape indices, paths, npoints, uniform)
+    Return:
+        first index, sampled points [K, npoints, C]
+    """
+    indices, paths, npoints, uniform = job
+    point_sets = [load_shape(path) for path in paths]
+    if not uniform:
+        return indices[0], np.stack([point_set[0:npoints, :] for point_set in point_sets])
+    out = np.empty((len(paths), npoints, point_sets[0].shape[1]), dtype=np.float32)
+    # clouds of the same size are sampled together
+    sizes = np.array([point_set.shape[0] for point_set in point_sets])
+    for size in np.unique(sizes):
+        rows = np.nonzero(sizes == size)[0]
+        start = [np.random.RandomState(indices[k]).randint(0, size) for k in rows]
+        out[rows] = farthest_point_sample_batch(np.stack([point_sets[k] for k in rows]), npoints, start=start)
+    return indices[0], out
 
 
 class DatasetGenerator:
     """DatasetGenerator"""
 
-    def __init__(self, root, args, split='train', process_data=False):
+    def __init__(self, root, args, split='train', process_data=False, num_workers=8):
         self.root = root
         self.npoints = args.num_point
         self.process_data = process_data
@@ -89,36 +138,54 @@ class DatasetGenerator:
 
         if self.uniform:
             self.save_path = os.path.join(root,
-                                          'modelnet%d_%s_%dpts_fps.dat' % (self.num_category, split, self.npoints))
+                                          'modelnet%d_%s_%dpts_fps.npy' % (self.num_category, split, self.npoints))
         else:
-            self.save_path = os.path.join(root, 'modelnet%d_%s_%dpts.dat' % (self.num_category, split, self.npoints))
+            self.save_path = os.path.join(root, 'modelnet%d_%s_%dpts.npy' % (self.num_category, split, self.npoints))
 
         if self.process_data:
             if not os.path.exists(self.save_path):
                 print('Processing data %s (only running in the first time)...' % self.save_path)
-                self.list_of_points = [None] * len(self.datapath)
-                self.list_of_labels = [None] * len(self.datapath)
-
-                for index in range(len(self.datapath)):
-                    fn = self.datapath[index]
-                    cls = self.classes[self.datapath[index][0]]
-                    cls = np.array([cls]).astype(np.int32)
-                    point_set = np.loadtxt(fn[1], delimiter=',').astype(np.float32)
-
-                    if self.uniform:
-                        point_set = farthest_point_sample(point_set, self.npoints)
-                    else:
-                        point_set = point_set[0:self.npoints, :]
-
-                    self.list_of_points[index] = point_set
-                    self.list_of_labels[index] = cls
-
-                with open(self.save_path, 'wb') as f:
-                    pickle.dump([self.list_of_points, self.list_of_labels], f)
+                self.build_cache(num_workers)
             else:
                 print('Load processed data from %s...' % self.save_path)
-                with open(self.save_path, 'rb') as f:
-                    self.list_of_points, self.list_of_labels = pickle.load(f)
+            # read only and shared by the page cache of all workers
+            self.points = np.load(self.save_path, mmap_mode='r')
+            self.labels = np.array([self.classes[name] for name, _ in self.datapath], dtype=np.int32)
+
+    def build_cache(self, num_workers=8, chunk_size=64):
+        """
+        Sample every shape once on a process pool and write the [num_shapes, npoints, C] cache, first to a temporary
+        file that is renamed when all chunks are written
+        """
+        paths = [path for _, path in self.datapath]
+        jobs = [(list(range(k, min(k + chunk_size, len(paths)))), paths[k:k + chunk_size], self.npoints, self.uniform)
+                for k in range(0, len(paths), chunk_size)]
+        num_channels = load_shape(paths[0]).shape[1]
+        tmp_path = self.save_path + '.tmp.npy'
+        cache = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+                                          shape=(len(paths), self.npoints, num_channels))
+        if num_workers > 0:
+            with Pool(num_workers) as pool:
+                for k, (start, points) in enumerate(pool.imap_unordered(preprocess_shapes, jobs)):
+                    cache[start:start + points.shape[0]] = points
+                    print('Processing data %d / %d' % (k + 1, len(jobs)))
+        else:
+            for start, points in map(preprocess_shapes, jobs):
+                cache[start:start + points.shape[0]] = points
+        cache.flush()
+        del cache
+        os.replace(tmp_path, self.save_path)
+
+    def __getstate__(self):
+        # workers map the cache themselves instead of receiving a copy
+        state = self.__dict__.copy()
+        state.pop('points', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.process_data:
+            self.points = np.load(self.save_path, mmap_mode='r')
 
     def __len__(self):
         return len(self.datapath)
@@ -126,13 +193,13 @@ class DatasetGenerator:
     def __getitem__(self, index):
         """get item"""
         if self.process_data:
-            point_set, label = self.list_of_points[index], self.list_of_labels[index]
+            point_set, label = np.array(self.points[index]), self.labels[index:index + 1]
             point_set[:, 0:3] = pc_normalize(point_set[:, 0:3])
         else:
             fn = self.datapath[index]
             cls = self.classes[self.datapath[index][0]]
             label = np.array([cls]).astype(np.int32)
-            point_set = np.loadtxt(fn[1], delimiter=',').astype(np.float32)
+            point_set = load_shape(fn[1])
 
             if self.uniform:
                 point_set = farthest_point_sample(point_set, self.npoints)
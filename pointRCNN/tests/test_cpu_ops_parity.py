@@ -0,0 +1,167 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+parity of the NumPy kernels of the CPU backend with the compiled CUDA ops, every wrapper is run once with
+OPS_BACKEND cpu and once with cuda on the same inputs. Run from the pointRCNN directory on a GPU host with the
+compiled extensions, the tests are skipped without them.
+"""
+
+import numpy as np
+import pytest
+
+ms = pytest.importorskip("mindspore")
+
+# pylint: disable=wrong-import-position
+from src import layer_utils
+from src.lib.config import cfg
+from src.lib.utils.iou3d import iou3d_utils
+from src.lib.utils.roipool3d import roipool3d_utils
+
+
+def _has_so(so_name):
+    try:
+        layer_utils.find_so(so_name)
+    except Exception:  # pylint: disable=broad-except
+        return False
+    return True
+
+
+needs_pointnet2 = pytest.mark.skipif(not _has_so("pointnet2_cuda"), reason="pointnet2_cuda is not compiled")
+needs_iou3d = pytest.mark.skipif(not _has_so("iou3d_cuda"), reason="iou3d_cuda is not compiled")
+needs_roipool3d = pytest.mark.skipif(not _has_so("roipool3d_cuda"), reason="roipool3d_cuda is not compiled")
+
+
+@pytest.fixture(scope="module", autouse=True)
+def gpu_context():
+    ms.set_context(mode=ms.PYNATIVE_MODE, device_target="GPU")
+    backend = cfg.OPS_BACKEND
+    yield
+    cfg.OPS_BACKEND = backend
+
+
+def _on_both(func):
+    """outputs of func with the cpu and the cuda backend, as numpy arrays"""
+    outs = []
+    for backend in ("cpu", "cuda"):
+        cfg.OPS_BACKEND = backend
+        out = func()
+        if isinstance(out, (tuple, list)):
+            outs.append([o.asnumpy() for o in out])
+        else:
+            outs.append(out.asnumpy())
+    return outs
+
+
+def _scene(batch_size=2, num_points=4096, seed=0):
+    """points spread like a KITTI front view in rect camera coords"""
+    rng = np.random.RandomState(seed)
+    low, high = np.array([-40, -1, 0]), np.array([40, 3, 70.4])
+    return (low + rng.rand(batch_size, num_points, 3) * (high - low)).astype(np.float32)
+
+
+def _sampled(xyz, npoint):
+    cfg.OPS_BACKEND = "cpu"
+    idx = layer_utils.FurthestPointSampling()(ms.Tensor(xyz), npoint)
+    return layer_utils.GatherOperation()(ms.Tensor(xyz).swapaxes(1, 2), idx).swapaxes(1, 2).asnumpy().copy()
+
+
+def _boxes_bev(num=256, seed=1):
+    rng = np.random.RandomState(seed)
+    centers = rng.uniform(-30, 30, (num, 2))
+    size = rng.uniform(1.5, 4.5, (num, 2))
+    return np.concatenate([centers - size / 2, centers + size / 2, rng.uniform(-np.pi, np.pi, (num, 1))],
+                          axis=1).astype(np.float32)
+
+
+def _boxes3d(num=64, seed=2):
+    rng = np.random.RandomState(seed)
+    return np.concatenate([rng.uniform(-30, 30, (num, 1)), rng.uniform(0, 2, (num, 1)), rng.uniform(5, 60, (num, 1)),
+                           rng.uniform(1.4, 1.8, (num, 1)), rng.uniform(1.5, 2, (num, 1)),
+                           rng.uniform(3, 5, (num, 1)), rng.uniform(-np.pi, np.pi, (num, 1))],
+                          axis=1).astype(np.float32)
+
+
+@needs_pointnet2
+def test_furthest_point_sample():
+    xyz = ms.Tensor(_scene())
+    cpu, cuda = _on_both(lambda: layer_utils.FurthestPointSampling()(xyz, 1024))
+    np.testing.assert_array_equal(cpu, cuda)
+
+
+@needs_pointnet2
+@pytest.mark.parametrize("radius, nsample", [(0.8, 16), (2.0, 32), (4.0, 64)])
+def test_ball_query(radius, nsample):
+    """every ball, including the ones holding more than nsample points"""
+    xyz = _scene()
+    new_xyz = _sampled(xyz, 1024)
+    cpu, cuda = _on_both(lambda: layer_utils.BallQuery()(radius, nsample, ms.Tensor(xyz), ms.Tensor(new_xyz)))
+    np.testing.assert_array_equal(cpu, cuda)
+
+
+@needs_pointnet2
+def test_gather_and_group_points():
+    xyz = _scene()
+    features = ms.Tensor(np.random.RandomState(3).rand(2, 16, xyz.shape[1]).astype(np.float32))
+    fps_idx = ms.Tensor(np.random.RandomState(4).randint(0, xyz.shape[1], (2, 512)).astype(np.int32))
+    ball_idx = ms.Tensor(np.random.RandomState(5).randint(0, xyz.shape[1], (2, 512, 32)).astype(np.int32))
+    cpu, cuda = _on_both(lambda: layer_utils.GatherOperation()(features, fps_idx))
+    np.testing.assert_array_equal(cpu, cuda)
+    cpu, cuda = _on_both(lambda: layer_utils.GroupingOperation()(features, ball_idx))
+    np.testing.assert_array_equal(cpu, cuda)
+
+
+@needs_pointnet2
+def test_three_nn_and_interpolate():
+    known = _scene(num_points=1024, seed=6)
+    unknown = _scene(num_points=4096, seed=7)
+    (cpu_dist, cpu_idx), (cuda_dist, cuda_idx) = _on_both(
+        lambda: layer_utils.ThreeNN()(ms.Tensor(unknown), ms.Tensor(known)))
+    np.testing.assert_array_equal(cpu_idx, cuda_idx)
+    np.testing.assert_allclose(cpu_dist, cuda_dist, rtol=1e-5, atol=1e-5)
+
+    features = ms.Tensor(np.random.RandomState(8).rand(2, 16, known.shape[1]).astype(np.float32))
+    weight = 1.0 / (cpu_dist + 1e-8)
+    weight = ms.Tensor((weight / weight.sum(axis=2, keepdims=True)).astype(np.float32))
+    cpu, cuda = _on_both(lambda: layer_utils.ThreeInterpolate()(features, ms.Tensor(cpu_idx), weight))
+    np.testing.assert_allclose(cpu, cuda, rtol=1e-5, atol=1e-5)
+
+
+@needs_roipool3d
+def test_roipool3d():
+    pts = _scene(num_points=16384)
+    pts_feature = np.random.RandomState(9).rand(2, pts.shape[1], 8).astype(np.float32)
+    boxes3d = np.stack([_boxes3d(seed=10), _boxes3d(seed=11)])
+    (cpu_pooled, cpu_empty), (cuda_pooled, cuda_empty) = _on_both(
+        lambda: roipool3d_utils.roipool3d_gpu(ms.Tensor(pts), ms.Tensor(pts_feature), ms.Tensor(boxes3d), 1.0,
+                                              sampled_pt_num=512))
+    np.testing.assert_array_equal(cpu_empty, cuda_empty)
+    np.testing.assert_allclose(cpu_pooled, cuda_pooled, rtol=1e-6, atol=1e-6)
+
+
+@needs_iou3d
+def test_boxes_iou_bev():
+    boxes = _boxes_bev()
+    cpu, cuda = _on_both(lambda: iou3d_utils.boxes_iou_bev(ms.Tensor(boxes), ms.Tensor(boxes[:64])))
+    np.testing.assert_allclose(cpu, cuda, rtol=1e-4, atol=1e-4)
+
+
+@needs_iou3d
+@pytest.mark.parametrize("nms_func", ["nms_gpu", "nms_normal_gpu"])
+def test_nms(nms_func):
+    boxes = _boxes_bev(num=1024)
+    scores = np.random.RandomState(12).rand(1024).astype(np.float32)
+    func = getattr(iou3d_utils, nms_func)
+    cpu, cuda = _on_both(lambda: func(ms.Tensor(boxes), ms.Tensor(scores), 0.3))
+    np.testing.assert_array_equal(cpu, cuda)
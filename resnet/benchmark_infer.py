@@ -0,0 +1,208 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+    Benchmark the inference of the resnet networks for every combination of network, batch size, precision, layout
+    and data source. Synthetic data measures the network alone, real data also runs the eval pipeline of
+    src/dataset.py and measures the time waiting for the loader apart from the time of the network. Writes images/s
+    and the latency percentiles of every combination to a json file, combinations the device does not support are
+    written with their error.
+    The options are the bench_* keys of the yaml config, real data is read from eval_dataset_path if set.
+    example:
+    python benchmark_infer.py --config_path=./config/resnet50_imagenet2012_Boost_config.yaml --device_target=CPU \
+        --bench_net_names=resnet18,resnet50 --bench_batch_sizes=1,32 --eval_dataset_path=/path/to/imagenet/val
+"""
+
+import json
+import time
+
+import numpy as np
+import mindspore as ms
+import mindspore.common.dtype as mstype
+from mindspore import Tensor
+
+from src import resnet_gpu_benchmark
+from src.model_utils.config import config
+from src.resnet import resnet18, resnet34, resnet50, resnet101, resnet152, se_resnet50
+
+NETWORKS = {"resnet18": resnet18, "resnet34": resnet34, "resnet50": resnet50, "resnet101": resnet101,
+            "resnet152": resnet152, "se-resnet50": se_resnet50}
+
+
+def build_net(net_name, dtype, layout, class_num):
+    """
+    Network in eval mode and the number of input channels. NHWC is only built by the resnet50 of
+    src/resnet_gpu_benchmark.py, whose first convolution takes 4 channels.
+    """
+    if layout == "NHWC":
+        if net_name != "resnet50":
+            raise ValueError("NHWC is only available for resnet50.")
+        net = resnet_gpu_benchmark.resnet50(class_num=class_num, data_format="NHWC")
+        channels = 4
+    else:
+        net = NETWORKS[net_name](class_num=class_num)
+        channels = 3
+    if dtype == "fp16":
+        net.to_float(mstype.float16)
+    net.set_train(False)
+    return net, channels
+
+
+def create_eval_dataset(net_name, dataset, data_path, batch_size, image_size, target):
+    """the eval pipeline eval.py uses for net_name"""
+    if net_name == "resnet101":
+        from src.dataset import create_dataset3 as create_dataset
+    elif net_name == "se-resnet50":
+        from src.dataset import create_dataset4 as create_dataset
+    elif dataset == "cifar10":
+        from src.dataset import create_dataset1 as create_dataset
+    else:
+        from src.dataset import create_dataset2 as create_dataset
+    return create_dataset(dataset_path=data_path, do_train=False, batch_size=batch_size,
+                          eval_image_size=image_size, target=target)
+
+
+def to_layout(images, layout, channels, np_dtype):
+    """NCHW float32 batch of the pipeline to the input of the network"""
+    if layout == "NHWC":
+        images = np.transpose(images, (0, 2, 3, 1))
+        images = np.pad(images, ((0, 0), (0, 0), (0, 0), (0, channels - images.shape[3])))
+    return np.ascontiguousarray(images, dtype=np_dtype)
+
+
+def synthetic_batches(batch_size, image_size, layout, channels, np_dtype, num_batches):
+    """the same random batch num_batches times, already in the input layout"""
+    shape = (batch_size, image_size, image_size, channels) if layout == "NHWC" else \
+        (batch_size, channels, image_size, image_size)
+    images = np.random.RandomState(0).normal(size=shape).astype(np_dtype)
+    for _ in range(num_batches):
+        yield images
+
+
+def real_batches(data_set, layout, channels, np_dtype, num_batches):
+    """batches of the pipeline in the input layout, repeated if the dataset is shorter than num_batches"""
+    if data_set.get_dataset_size() == 0:
+        raise ValueError("the dataset has no complete batch.")
+    count = 0
+    while count < num_batches:
+        for images, _ in data_set.create_tuple_iterator(num_epochs=1, output_numpy=True):
+            yield to_layout(images, layout, channels, np_dtype)
+            count += 1
+            if count == num_batches:
+                return
+
+
+def percentiles(values_ms):
+    values_ms = np.asarray(values_ms)
+    return {"p50": float(np.percentile(values_ms, 50)),
+            "p99": float(np.percentile(values_ms, 99)),
+            "mean": float(values_ms.mean())}
+
+
+def run_case(net, batches, batch_size, warmup_steps):
+    """
+    Time every batch after the warmup ones, which include the graph compilation.
+
+    Returns:
+        dict, images/s of the whole loop and of the network alone, the latency of a batch through the network and
+        the time waiting for the loader, in ms.
+    """
+    loader_ms, compute_ms = [], []
+    start = None
+    step = 0
+    fetch_start = time.perf_counter()
+    for images in batches:
+        fetch_end = time.perf_counter()
+        if step == warmup_steps:
+            start = fetch_start
+        # asnumpy waits for the device
+        net(Tensor(images)).asnumpy()
+        compute_end = time.perf_counter()
+        if step >= warmup_steps:
+            loader_ms.append((fetch_end - fetch_start) * 1000)
+            compute_ms.append((compute_end - fetch_end) * 1000)
+        step += 1
+        fetch_start = time.perf_counter()
+    if not compute_ms:
+        raise ValueError("no batch after the {} warmup steps.".format(warmup_steps))
+    total = time.perf_counter() - start
+    return {"steps": len(compute_ms),
+            "images_per_sec": len(compute_ms) * batch_size / total,
+            "compute_images_per_sec": len(compute_ms) * batch_size * 1000 / sum(compute_ms),
+            "latency_ms": percentiles(compute_ms),
+            "loader_ms": percentiles(loader_ms),
+            "loader_fraction": sum(loader_ms) / (total * 1000)}
+
+
+def benchmark(net, channels, case):
+    """run_case of one combination on its data"""
+    np_dtype = np.float16 if case["dtype"] == "fp16" else np.float32
+    num_batches = config.bench_warmup_steps + config.bench_steps
+    if case["data"] == "real":
+        data_set = create_eval_dataset(case["net_name"], config.dataset, config.eval_dataset_path, case["batch_size"],
+                                       config.eval_image_size, config.device_target)
+        batches = real_batches(data_set, case["layout"], channels, np_dtype, num_batches)
+    else:
+        batches = synthetic_batches(case["batch_size"], config.eval_image_size, case["layout"], channels, np_dtype,
+                                    num_batches)
+    return run_case(net, batches, case["batch_size"], config.bench_warmup_steps)
+
+
+def parse_list(value):
+    return [x.strip() for x in value.split(",") if x.strip()]
+
+
+def main():
+    """run every combination and write the json report"""
+    ms.set_context(mode=ms.GRAPH_MODE, device_target=config.device_target, device_id=config.device_id)
+    sources = ["synthetic", "real"] if config.eval_dataset_path else ["synthetic"]
+    results = []
+    for net_name in parse_list(config.bench_net_names):
+        for dtype in parse_list(config.bench_dtypes):
+            for layout in parse_list(config.bench_layouts):
+                try:
+                    net, channels = build_net(net_name, dtype, layout, config.class_num)
+                    error = None
+                except (ValueError, RuntimeError, TypeError) as e:
+                    net, channels, error = None, 0, e
+                for batch_size in [int(x) for x in parse_list(str(config.bench_batch_sizes))]:
+                    for source in sources:
+                        case = {"net_name": net_name, "batch_size": batch_size, "dtype": dtype, "layout": layout,
+                                "data": source}
+                        try:
+                            if error is not None:
+                                raise error
+                            case.update(benchmark(net, channels, case))
+                            print("{net_name:>12} {dtype} {layout} {data:>9} batch {batch_size:>4}: "
+                                  "{images_per_sec:10.1f} images/s, p50 {p50:8.2f} ms, p99 {p99:8.2f} ms, "
+                                  "loader {loader_fraction:.0%}".format(**case, **case["latency_ms"]), flush=True)
+                        except (ValueError, RuntimeError, TypeError) as e:
+                            # e.g. a kernel the device does not have for this dtype or layout
+                            message = str(e).strip()
+                            case["error"] = message.splitlines()[0] if message else repr(e)
+                            print("{net_name:>12} {dtype} {layout} {data:>9} batch {batch_size:>4}: "
+                                  "skipped, {error}".format(**case), flush=True)
+                        results.append(case)
+    report = {"device_target": config.device_target,
+              "mindspore_version": ms.__version__,
+              "image_size": config.eval_image_size,
+              "warmup_steps": config.bench_warmup_steps,
+              "results": results}
+    with open(config.bench_output_file, "w") as f:
+        json.dump(report, f, indent=2)
+    print("results written to {}".format(config.bench_output_file))
+
+
+if __name__ == "__main__":
+    main()
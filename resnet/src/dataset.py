@@ -20,8 +20,13 @@ import mindspore as ms
 import mindspore.dataset as ds
 from mindspore.communication.management import init, get_rank, get_group_size
 
+# worker counts and prefetch size replacing the defaults of the create functions, see set_pipeline_plan
+_pipeline_plan = {"workers": {}, "prefetch_size": None}
+_pipeline_stages = []
+
 def create_dataset1(dataset_path, do_train, batch_size=32, train_image_size=224, eval_image_size=224,
-                    target="Ascend", distribute=False, enable_cache=False, cache_session_id=None):
+                    target="Ascend", distribute=False, enable_cache=False, cache_session_id=None,
+                    decoded_cache=None):
     """
     create a train or evaluate cifar10 dataset for resnet50
     Args:
@@ -33,17 +38,19 @@ def create_dataset1(dataset_path, do_train, batch_size=32, train_image_size=224,
         distribute(bool): data for distribute or not. Default: False
         enable_cache(bool): whether tensor caching service is used for eval. Default: False
         cache_session_id(int): If enable_cache, cache session_id need to be provided. Default: None
+        decoded_cache(DecodedImageCache): unused, the cifar10 images are stored decoded. Default: None
 
     Returns:
         dataset
     """
     device_num, rank_id = _get_rank_info(distribute)
-    ds.config.set_prefetch_size(64)
+    _set_prefetch_size(64)
     if device_num == 1:
-        data_set = ds.Cifar10Dataset(dataset_path, num_parallel_workers=get_num_parallel_workers(12), shuffle=True)
+        data_set = ds.Cifar10Dataset(dataset_path, num_parallel_workers=get_num_parallel_workers(12, "read"),
+                                     shuffle=True)
     else:
-        data_set = ds.Cifar10Dataset(dataset_path, num_parallel_workers=get_num_parallel_workers(12), shuffle=True,
-                                     num_shards=device_num, shard_id=rank_id)
+        data_set = ds.Cifar10Dataset(dataset_path, num_parallel_workers=get_num_parallel_workers(12, "read"),
+                                     shuffle=True, num_shards=device_num, shard_id=rank_id)
 
     # define map operations
     trans = []
@@ -63,7 +70,7 @@ def create_dataset1(dataset_path, do_train, batch_size=32, train_image_size=224,
     type_cast_op = ds.transforms.transforms.TypeCast(ms.int32)
 
     data_set = data_set.map(operations=type_cast_op, input_columns="label",
-                            num_parallel_workers=get_num_parallel_workers(8))
+                            num_parallel_workers=get_num_parallel_workers(8, "label"))
     # only enable cache for eval
     if do_train:
         enable_cache = False
@@ -72,10 +79,10 @@ def create_dataset1(dataset_path, do_train, batch_size=32, train_image_size=224,
             raise ValueError("A cache session_id must be provided to use cache.")
         eval_cache = ds.DatasetCache(session_id=int(cache_session_id), size=0)
         data_set = data_set.map(operations=trans, input_columns="image",
-                                num_parallel_workers=get_num_parallel_workers(8), cache=eval_cache)
+                                num_parallel_workers=get_num_parallel_workers(8, "image"), cache=eval_cache)
     else:
         data_set = data_set.map(operations=trans, input_columns="image",
-                                num_parallel_workers=get_num_parallel_workers(8))
+                                num_parallel_workers=get_num_parallel_workers(8, "image"))
 
     # apply batch operations
     data_set = data_set.batch(batch_size, drop_remainder=True)
@@ -83,7 +90,8 @@ def create_dataset1(dataset_path, do_train, batch_size=32, train_image_size=224,
     return data_set
 
 def create_dataset2(dataset_path, do_train, batch_size=32, train_image_size=224, eval_image_size=224,
-                    target="Ascend", distribute=False, enable_cache=False, cache_session_id=None):
+                    target="Ascend", distribute=False, enable_cache=False, cache_session_id=None,
+                    decoded_cache=None):
     """
     create a train or eval imagenet2012 dataset for resnet50
 
@@ -96,18 +104,23 @@ def create_dataset2(dataset_path, do_train, batch_size=32, train_image_size=224,
         distribute(bool): data for distribute or not. Default: False
         enable_cache(bool): whether tensor caching service is used for eval. Default: False
         cache_session_id(int): If enable_cache, cache session_id need to be provided. Default: None
+        decoded_cache(DecodedImageCache): local cache the train images are read from decoded. Default: None
 
     Returns:
         dataset
     """
     device_num, rank_id = _get_rank_info(distribute)
 
-    ds.config.set_prefetch_size(64)
-    if device_num == 1:
-        data_set = ds.ImageFolderDataset(dataset_path, num_parallel_workers=get_num_parallel_workers(12), shuffle=True)
+    _set_prefetch_size(64)
+    if do_train and decoded_cache is not None:
+        data_set = decoded_cache.dataset(dataset_path, num_shards=device_num, shard_id=rank_id,
+                                         num_parallel_workers=get_num_parallel_workers(12, "read"))
+    elif device_num == 1:
+        data_set = ds.ImageFolderDataset(dataset_path, num_parallel_workers=get_num_parallel_workers(12, "read"),
+                                         shuffle=True)
     else:
-        data_set = ds.ImageFolderDataset(dataset_path, num_parallel_workers=get_num_parallel_workers(12), shuffle=True,
-                                         num_shards=device_num, shard_id=rank_id)
+        data_set = ds.ImageFolderDataset(dataset_path, num_parallel_workers=get_num_parallel_workers(12, "read"),
+                                         shuffle=True, num_shards=device_num, shard_id=rank_id)
 
     # Computed from random subset of ImageNet training images
     mean = [0.485 * 255, 0.456 * 255, 0.406 * 255]
@@ -116,7 +129,7 @@ def create_dataset2(dataset_path, do_train, batch_size=32, train_image_size=224,
     # define map operations
     if do_train:
         trans = [
-            ds.vision.RandomCropDecodeResize(train_image_size, scale=(0.08, 1.0), ratio=(0.75, 1.333)),
+            _random_crop_decode_resize(train_image_size, decoded_cache is not None),
             ds.vision.RandomHorizontalFlip(prob=0.5)
         ]
     else:
@@ -133,9 +146,9 @@ def create_dataset2(dataset_path, do_train, batch_size=32, train_image_size=224,
     else:
         trans_work_num = 12
     data_set = data_set.map(operations=trans, input_columns="image",
-                            num_parallel_workers=get_num_parallel_workers(trans_work_num))
+                            num_parallel_workers=get_num_parallel_workers(trans_work_num, "image"))
     data_set = data_set.map(operations=trans_norm, input_columns="image",
-                            num_parallel_workers=get_num_parallel_workers(12))
+                            num_parallel_workers=get_num_parallel_workers(12, "image_norm"))
     # only enable cache for eval
     if do_train:
         enable_cache = False
@@ -144,11 +157,11 @@ def create_dataset2(dataset_path, do_train, batch_size=32, train_image_size=224,
             raise ValueError("A cache session_id must be provided to use cache.")
         eval_cache = ds.DatasetCache(session_id=int(cache_session_id), size=0)
         data_set = data_set.map(operations=type_cast_op, input_columns="label",
-                                num_parallel_workers=get_num_parallel_workers(12),
+                                num_parallel_workers=get_num_parallel_workers(12, "label"),
                                 cache=eval_cache)
     else:
         data_set = data_set.map(operations=type_cast_op, input_columns="label",
-                                num_parallel_workers=get_num_parallel_workers(12))
+                                num_parallel_workers=get_num_parallel_workers(12, "label"))
 
     # apply batch operations
     data_set = data_set.batch(batch_size, drop_remainder=True)
@@ -157,7 +170,7 @@ def create_dataset2(dataset_path, do_train, batch_size=32, train_image_size=224,
 
 def create_dataset_pynative(dataset_path, do_train, batch_size=32, train_image_size=224,
                             eval_image_size=224, target="Ascend", distribute=False, enable_cache=False,
-                            cache_session_id=None):
+                            cache_session_id=None, decoded_cache=None):
     """
     create a train or eval imagenet2012 dataset for resnet50 benchmark
 
@@ -170,17 +183,23 @@ def create_dataset_pynative(dataset_path, do_train, batch_size=32, train_image_s
         distribute(bool): data for distribute or not. Default: False
         enable_cache(bool): whether tensor caching service is used for eval. Default: False
         cache_session_id(int): If enable_cache, cache session_id need to be provided. Default: None
+        decoded_cache(DecodedImageCache): local cache the train images are read from decoded. Default: None
 
     Returns:
         dataset
     """
     device_num, rank_id = _get_rank_info(distribute)
-
-    if device_num == 1:
-        data_set = ds.ImageFolderDataset(dataset_path, num_parallel_workers=get_num_parallel_workers(8), shuffle=True)
+    _set_prefetch_size()
+
+    if do_train and decoded_cache is not None:
+        data_set = decoded_cache.dataset(dataset_path, num_shards=device_num, shard_id=rank_id,
+                                         num_parallel_workers=get_num_parallel_workers(8, "read"))
+    elif device_num == 1:
+        data_set = ds.ImageFolderDataset(dataset_path, num_parallel_workers=get_num_parallel_workers(8, "read"),
+                                         shuffle=True)
     else:
-        data_set = ds.ImageFolderDataset(dataset_path, num_parallel_workers=get_num_parallel_workers(2), shuffle=True,
-                                         num_shards=device_num, shard_id=rank_id)
+        data_set = ds.ImageFolderDataset(dataset_path, num_parallel_workers=get_num_parallel_workers(2, "read"),
+                                         shuffle=True, num_shards=device_num, shard_id=rank_id)
 
     # Computed from random subset of ImageNet training images
     mean = [0.485 * 255, 0.456 * 255, 0.406 * 255]
@@ -189,7 +208,7 @@ def create_dataset_pynative(dataset_path, do_train, batch_size=32, train_image_s
     # define map operations
     if do_train:
         trans = [
-            ds.vision.RandomCropDecodeResize(train_image_size, scale=(0.08, 1.0), ratio=(0.75, 1.333)),
+            _random_crop_decode_resize(train_image_size, decoded_cache is not None),
             ds.vision.RandomHorizontalFlip(prob=0.5),
             ds.vision.Normalize(mean=mean, std=std),
             ds.vision.HWC2CHW()
@@ -205,7 +224,8 @@ def create_dataset_pynative(dataset_path, do_train, batch_size=32, train_image_s
 
     type_cast_op = ds.transforms.transforms.TypeCast(ms.int32)
 
-    data_set = data_set.map(operations=trans, input_columns="image", num_parallel_workers=4)
+    data_set = data_set.map(operations=trans, input_columns="image",
+                            num_parallel_workers=get_num_parallel_workers(4, "image"))
     # only enable cache for eval
     if do_train:
         enable_cache = False
@@ -214,11 +234,11 @@ def create_dataset_pynative(dataset_path, do_train, batch_size=32, train_image_s
             raise ValueError("A cache session_id must be provided to use cache.")
         eval_cache = ds.DatasetCache(session_id=int(cache_session_id), size=0)
         data_set = data_set.map(operations=type_cast_op, input_columns="label",
-                                num_parallel_workers=get_num_parallel_workers(2),
+                                num_parallel_workers=get_num_parallel_workers(2, "label"),
                                 cache=eval_cache)
     else:
         data_set = data_set.map(operations=type_cast_op, input_columns="label",
-                                num_parallel_workers=get_num_parallel_workers(2))
+                                num_parallel_workers=get_num_parallel_workers(2, "label"))
 
     # apply batch operations
     data_set = data_set.batch(batch_size, drop_remainder=True)
@@ -226,7 +246,8 @@ def create_dataset_pynative(dataset_path, do_train, batch_size=32, train_image_s
     return data_set
 
 def create_dataset3(dataset_path, do_train, batch_size=32, train_image_size=224, eval_image_size=224,
-                    target="Ascend", distribute=False, enable_cache=False, cache_session_id=None):
+                    target="Ascend", distribute=False, enable_cache=False, cache_session_id=None,
+                    decoded_cache=None):
     """
     create a train or eval imagenet2012 dataset for resnet101
     Args:
@@ -238,16 +259,22 @@ def create_dataset3(dataset_path, do_train, batch_size=32, train_image_size=224,
         distribute(bool): data for distribute or not. Default: False
         enable_cache(bool): whether tensor caching service is used for eval. Default: False
         cache_session_id(int): If enable_cache, cache session_id need to be provided. Default: None
+        decoded_cache(DecodedImageCache): local cache the train images are read from decoded. Default: None
 
     Returns:
         dataset
     """
     device_num, rank_id = _get_rank_info(distribute)
-    if device_num == 1:
-        data_set = ds.ImageFolderDataset(dataset_path, num_parallel_workers=get_num_parallel_workers(8), shuffle=True)
+    _set_prefetch_size()
+    if do_train and decoded_cache is not None:
+        data_set = decoded_cache.dataset(dataset_path, num_shards=device_num, shard_id=rank_id,
+                                         num_parallel_workers=get_num_parallel_workers(8, "read"))
+    elif device_num == 1:
+        data_set = ds.ImageFolderDataset(dataset_path, num_parallel_workers=get_num_parallel_workers(8, "read"),
+                                         shuffle=True)
     else:
-        data_set = ds.ImageFolderDataset(dataset_path, num_parallel_workers=get_num_parallel_workers(8), shuffle=True,
-                                         num_shards=device_num, shard_id=rank_id)
+        data_set = ds.ImageFolderDataset(dataset_path, num_parallel_workers=get_num_parallel_workers(8, "read"),
+                                         shuffle=True, num_shards=device_num, shard_id=rank_id)
 
     mean = [0.475 * 255, 0.451 * 255, 0.392 * 255]
     std = [0.275 * 255, 0.267 * 255, 0.278 * 255]
@@ -255,7 +282,7 @@ def create_dataset3(dataset_path, do_train, batch_size=32, train_image_size=224,
     # define map operations
     if do_train:
         trans = [
-            ds.vision.RandomCropDecodeResize(train_image_size, scale=(0.08, 1.0), ratio=(0.75, 1.333)),
+            _random_crop_decode_resize(train_image_size, decoded_cache is not None),
             ds.vision.RandomHorizontalFlip(rank_id / (rank_id + 1)),
             ds.vision.Normalize(mean=mean, std=std),
             ds.vision.HWC2CHW()
@@ -271,7 +298,8 @@ def create_dataset3(dataset_path, do_train, batch_size=32, train_image_size=224,
 
     type_cast_op = ds.transforms.transforms.TypeCast(ms.int32)
 
-    data_set = data_set.map(operations=trans, input_columns="image", num_parallel_workers=get_num_parallel_workers(8))
+    data_set = data_set.map(operations=trans, input_columns="image",
+                            num_parallel_workers=get_num_parallel_workers(8, "image"))
     # only enable cache for eval
     if do_train:
         enable_cache = False
@@ -280,11 +308,11 @@ def create_dataset3(dataset_path, do_train, batch_size=32, train_image_size=224,
             raise ValueError("A cache session_id must be provided to use cache.")
         eval_cache = ds.DatasetCache(session_id=int(cache_session_id), size=0)
         data_set = data_set.map(operations=type_cast_op, input_columns="label",
-                                num_parallel_workers=get_num_parallel_workers(8),
+                                num_parallel_workers=get_num_parallel_workers(8, "label"),
                                 cache=eval_cache)
     else:
         data_set = data_set.map(operations=type_cast_op, input_columns="label",
-                                num_parallel_workers=get_num_parallel_workers(8))
+                                num_parallel_workers=get_num_parallel_workers(8, "label"))
 
     # apply batch operations
     data_set = data_set.batch(batch_size, drop_remainder=True)
@@ -292,7 +320,8 @@ def create_dataset3(dataset_path, do_train, batch_size=32, train_image_size=224,
     return data_set
 
 def create_dataset4(dataset_path, do_train, batch_size=32, train_image_size=224, eval_image_size=224,
-                    target="Ascend", distribute=False, enable_cache=False, cache_session_id=None):
+                    target="Ascend", distribute=False, enable_cache=False, cache_session_id=None,
+                    decoded_cache=None):
     """
     create a train or eval imagenet2012 dataset for se-resnet50
 
@@ -305,17 +334,22 @@ def create_dataset4(dataset_path, do_train, batch_size=32, train_image_size=224,
         distribute(bool): data for distribute or not. Default: False
         enable_cache(bool): whether tensor caching service is used for eval. Default: False
         cache_session_id(int): If enable_cache, cache session_id need to be provided. Default: None
+        decoded_cache(DecodedImageCache): local cache the train images are read from decoded. Default: None
 
     Returns:
         dataset
     """
     device_num, rank_id = _get_rank_info(distribute)
-    ds.config.set_prefetch_size(64)
-    if device_num == 1:
-        data_set = ds.ImageFolderDataset(dataset_path, num_parallel_workers=get_num_parallel_workers(12), shuffle=True)
+    _set_prefetch_size(64)
+    if do_train and decoded_cache is not None:
+        data_set = decoded_cache.dataset(dataset_path, num_shards=device_num, shard_id=rank_id,
+                                         num_parallel_workers=get_num_parallel_workers(12, "read"))
+    elif device_num == 1:
+        data_set = ds.ImageFolderDataset(dataset_path, num_parallel_workers=get_num_parallel_workers(12, "read"),
+                                         shuffle=True)
     else:
-        data_set = ds.ImageFolderDataset(dataset_path, num_parallel_workers=get_num_parallel_workers(12), shuffle=True,
-                                         num_shards=device_num, shard_id=rank_id)
+        data_set = ds.ImageFolderDataset(dataset_path, num_parallel_workers=get_num_parallel_workers(12, "read"),
+                                         shuffle=True, num_shards=device_num, shard_id=rank_id)
 
     # Computed from random subset of ImageNet training images
     mean = [123.68, 116.78, 103.94]
@@ -324,7 +358,7 @@ def create_dataset4(dataset_path, do_train, batch_size=32, train_image_size=224,
     # define map operations
     if do_train:
         trans = [
-            ds.vision.RandomCropDecodeResize(train_image_size, scale=(0.08, 1.0), ratio=(0.75, 1.333)),
+            _random_crop_decode_resize(train_image_size, decoded_cache is not None),
             ds.vision.RandomHorizontalFlip(prob=0.5),
             ds.vision.Normalize(mean=mean, std=std),
             ds.vision.HWC2CHW()
@@ -339,7 +373,8 @@ def create_dataset4(dataset_path, do_train, batch_size=32, train_image_size=224,
         ]
 
     type_cast_op = ds.transforms.transforms.TypeCast(ms.int32)
-    data_set = data_set.map(operations=trans, input_columns="image", num_parallel_workers=get_num_parallel_workers(12))
+    data_set = data_set.map(operations=trans, input_columns="image",
+                            num_parallel_workers=get_num_parallel_workers(12, "image"))
     # only enable cache for eval
     if do_train:
         enable_cache = False
@@ -348,17 +383,23 @@ def create_dataset4(dataset_path, do_train, batch_size=32, train_image_size=224,
             raise ValueError("A cache session_id must be provided to use cache.")
         eval_cache = ds.DatasetCache(session_id=int(cache_session_id), size=0)
         data_set = data_set.map(operations=type_cast_op, input_columns="label",
-                                num_parallel_workers=get_num_parallel_workers(12),
+                                num_parallel_workers=get_num_parallel_workers(12, "label"),
                                 cache=eval_cache)
     else:
         data_set = data_set.map(operations=type_cast_op, input_columns="label",
-                                num_parallel_workers=get_num_parallel_workers(12))
+                                num_parallel_workers=get_num_parallel_workers(12, "label"))
 
     # apply batch operations
     data_set = data_set.batch(batch_size, drop_remainder=True)
 
     return data_set
 
+def _random_crop_decode_resize(train_image_size, decoded):
+    """random resized crop of the encoded image, or of the image read decoded from a decoded image cache"""
+    if decoded:
+        return ds.vision.RandomResizedCrop(train_image_size, scale=(0.08, 1.0), ratio=(0.75, 1.333))
+    return ds.vision.RandomCropDecodeResize(train_image_size, scale=(0.08, 1.0), ratio=(0.75, 1.333))
+
 def _get_rank_info(distribute):
     """
     get rank size and rank id
@@ -372,11 +413,41 @@ def _get_rank_info(distribute):
         device_num = 1
     return device_num, rank_id
 
-def get_num_parallel_workers(num_parallel_workers):
+def set_pipeline_plan(workers=None, prefetch_size=None):
+    """
+    Set the number of workers of the stages of the pipelines built afterwards and their prefetch size, e.g. to the
+    plan of src/dataset_autotune.py. Stages missing from workers keep the default of the create function, no
+    argument restores all defaults.
+
+    Args:
+        workers(dict): stage name, one of read, image, image_norm and label, to number of workers. Default: None
+        prefetch_size(int): prefetch size of the pipeline. Default: None
+    """
+    _pipeline_plan["workers"] = dict(workers or {})
+    _pipeline_plan["prefetch_size"] = prefetch_size
+
+def get_pipeline_stages():
+    """stages of the pipelines built since the last call, in pipeline order"""
+    stages = list(_pipeline_stages)
+    del _pipeline_stages[:]
+    return stages
+
+def _set_prefetch_size(default=None):
+    """set the prefetch size of the plan, else default if given"""
+    prefetch_size = _pipeline_plan["prefetch_size"] or default
+    if prefetch_size:
+        ds.config.set_prefetch_size(prefetch_size)
+
+def get_num_parallel_workers(num_parallel_workers, stage=None):
     """
     Get num_parallel_workers used in dataset operations.
+    If the pipeline plan has a number for stage, it replaces num_parallel_workers.
     If num_parallel_workers > the real CPU cores number, set num_parallel_workers = the real CPU cores number.
     """
+    if stage is not None:
+        if stage not in _pipeline_stages:
+            _pipeline_stages.append(stage)
+        num_parallel_workers = _pipeline_plan["workers"].get(stage, num_parallel_workers)
     cores = multiprocessing.cpu_count()
     if isinstance(num_parallel_workers, int):
         if cores < num_parallel_workers:
@@ -0,0 +1,155 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+Autotune the worker counts and the prefetch size of the pipelines of src/dataset.py for the host.
+
+Every stage of the pipeline is measured once with a single worker while the other stages have all the cores, which
+gives the images/s one worker of the stage delivers. The cores are then given one by one to the slowest stage, and
+the prefetch size is the deepest that keeps the queues of the pipeline within a share of the available memory.
+"""
+
+import multiprocessing
+import os
+import time
+
+import mindspore.dataset as ds
+
+from src.dataset import set_pipeline_plan, get_pipeline_stages
+
+
+def available_memory():
+    """available host memory in bytes, None if unknown"""
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def measure_pipeline(create_dataset, dataset_kwargs, num_batches, skip_batches=2):
+    """
+    Images/s of the pipeline over num_batches, after skip_batches that fill its queues.
+
+    Returns:
+        tuple, images/s and the bytes of one output image.
+    """
+    data_set = create_dataset(**dataset_kwargs)
+    iterator = data_set.create_tuple_iterator(num_epochs=1, output_numpy=True)
+    images_count, image_bytes = 0, 0
+    start = None
+    for step, (images, _) in enumerate(iterator):
+        if step == skip_batches:
+            start = time.perf_counter()
+        elif step > skip_batches:
+            images_count += images.shape[0]
+        image_bytes = images.nbytes // images.shape[0]
+        if step == skip_batches + num_batches:
+            break
+    if not images_count:
+        raise ValueError("the dataset has less than {} batches to autotune.".format(skip_batches + 2))
+    return images_count / (time.perf_counter() - start), image_bytes
+
+
+def allocate_workers(rates, num_cores):
+    """
+    Worker counts of the stages maximizing the throughput of the slowest one with num_cores workers in total.
+
+    Args:
+        rates (dict): stage to images/s of one worker.
+        num_cores (int): workers of all stages.
+
+    Returns:
+        dict, stage to number of workers, at least one per stage.
+    """
+    workers = {stage: 1 for stage in rates}
+    for _ in range(num_cores - len(workers)):
+        slowest = min(workers, key=lambda stage: workers[stage] * rates[stage])
+        workers[slowest] += 1
+    return workers
+
+
+def autotune_pipeline(create_dataset, dataset_path, do_train, batch_size=32, train_image_size=224,
+                      eval_image_size=224, target="Ascend", num_cores=None, memory_fraction=0.1, num_batches=20,
+                      max_prefetch_size=128, distribute=False, decoded_cache=None):
+    """
+    Measure the pipeline of create_dataset and set the plan of src/dataset.py the pipelines built afterwards use.
+    The plan is only kept if the tuned pipeline is faster than the default one.
+
+    Args:
+        create_dataset (function): one of the create functions of src/dataset.py.
+        num_cores (int): cores for the pipeline, e.g. the cores of the host divided by its devices. Default: all.
+        memory_fraction (float): share of the available memory for the queues of the pipeline. Default: 0.1.
+        num_batches (int): batches measured in every run. Default: 20.
+        max_prefetch_size (int): largest prefetch size. Default: 128.
+        distribute (bool): measure the shard of this device. Default: False.
+        decoded_cache (DecodedImageCache): decoded image cache of the pipeline. Default: None.
+
+    Returns:
+        dict, the plan, the images/s of one worker and of the planned workers of every stage, the bottleneck stage
+        and the images/s of the default and the tuned pipeline.
+    """
+    num_cores = max(num_cores or multiprocessing.cpu_count(), 1)
+    dataset_kwargs = dict(dataset_path=dataset_path, do_train=do_train, batch_size=batch_size,
+                          train_image_size=train_image_size, eval_image_size=eval_image_size, target=target,
+                          distribute=distribute, decoded_cache=decoded_cache)
+    # the measurement runs set the global prefetch size, which the pipelines without a default of their own keep
+    default_prefetch_size = ds.config.get_prefetch_size()
+    set_pipeline_plan()
+    get_pipeline_stages()
+    default_rate, image_bytes = measure_pipeline(create_dataset, dataset_kwargs, num_batches)
+    stages = get_pipeline_stages()
+
+    rates = {}
+    for stage in stages:
+        set_pipeline_plan({other: 1 if other == stage else num_cores for other in stages})
+        rates[stage], _ = measure_pipeline(create_dataset, dataset_kwargs, num_batches)
+    workers = allocate_workers(rates, max(num_cores, len(stages)))
+
+    # a stage queues up to prefetch_size rows per worker and one more queue ahead of it
+    num_queues = sum(workers.values()) + len(stages)
+    prefetch_size = max_prefetch_size
+    memory = available_memory()
+    if memory is not None:
+        prefetch_size = int(memory * memory_fraction) // (image_bytes * num_queues)
+        prefetch_size = max(min(prefetch_size, max_prefetch_size), 2)
+
+    set_pipeline_plan(workers, prefetch_size)
+    tuned_rate, _ = measure_pipeline(create_dataset, dataset_kwargs, num_batches)
+    applied = tuned_rate >= default_rate
+    if not applied:
+        set_pipeline_plan()
+        ds.config.set_prefetch_size(default_prefetch_size)
+    bottleneck = min(stages, key=lambda stage: workers[stage] * rates[stage])
+    return {"workers": workers,
+            "prefetch_size": prefetch_size,
+            "applied": applied,
+            "stages": {stage: {"images_per_sec_per_worker": rates[stage],
+                               "images_per_sec": workers[stage] * rates[stage]} for stage in stages},
+            "bottleneck": bottleneck,
+            "default_images_per_sec": default_rate,
+            "tuned_images_per_sec": tuned_rate}
+
+
+def print_report(report):
+    """print the result of autotune_pipeline"""
+    print("==============================================================")
+    print("dataset autotune, {} the plan".format("apply" if report["applied"] else "keep the defaults instead of"))
+    for stage, stats in report["stages"].items():
+        print("{:>10}: {:>3} workers, {:10.1f} images/s per worker, {:10.1f} images/s{}".format(
+            stage, report["workers"][stage], stats["images_per_sec_per_worker"], stats["images_per_sec"],
+            "  <- bottleneck" if stage == report["bottleneck"] else ""))
+    print("prefetch size: {}".format(report["prefetch_size"]))
+    print("pipeline: {:.1f} images/s with the defaults, {:.1f} images/s tuned".format(
+        report["default_images_per_sec"], report["tuned_images_per_sec"]))
+    print("==============================================================", flush=True)
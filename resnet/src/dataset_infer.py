@@ -15,7 +15,10 @@
 """
 create train or eval dataset.
 """
+import collections
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import mindspore as ms
 import mindspore.dataset as ds
@@ -23,70 +26,131 @@ from mindspore.communication.management import init, get_rank, get_group_size
 from src.model_utils.config import config
 
 
-class ImgDataset:
+def list_images(dataset_path, dir_label=None, img_format=(".bmp", ".png", ".jpg", ".jpeg")):
     """
-    create img dataset.
+    list the images of dataset_path once
 
     Args:
+        dataset_path(string): directory of images, or of one directory of images per class.
+        dir_label(dict): label of every class directory, by default the position of the directory in dataset_path.
+            Entries of dataset_path missing from it are skipped.
+        img_format(tuple): image file extensions.
+
     Returns:
-        de_dataset.
+        relative paths of the images, labels (-1 for images directly in dataset_path)
+    """
+    names, labels = [], []
+    file_exist = dir_exist = False
+    for index, data_name in enumerate(sorted(os.listdir(dataset_path))):
+        if dir_label and data_name not in dir_label:
+            continue
+        data_path = os.path.join(dataset_path, data_name)
+        if os.path.isdir(data_path):
+            dir_exist = True
+            label = dir_label[data_name] if dir_label else index
+            for file in sorted(os.listdir(data_path)):
+                if file.lower().endswith(img_format):
+                    names.append(data_name + "/" + file)
+                    labels.append(label)
+        elif os.path.isfile(data_path):
+            file_exist = True
+            if data_name.lower().endswith(img_format):
+                names.append(data_name)
+                labels.append(-1)
+        if dir_exist and file_exist:
+            raise ValueError(f"{dataset_path} can not concurrently have image file and directory")
+    return names, labels
+
+
+class ImgDataset:
+    """
+    Lazy image dataset, only the listing of the images is kept in memory and image bytes are read on demand.
+
+    The listing is the relative path and label of every image, paths are kept as one utf-8 buffer with offsets.
+    It can be saved to a manifest that later runs on the same directory load instead of listing it again.
+    Iterating reads the images of the shard with a pool of threads, read_ahead images ahead of the consumer.
+    The filename column is the index of the image, file_name maps it back to its path.
+
+    Args:
+        dataset_path(string): directory of images, or of one directory of images per class.
+        manifest(string): manifest file, loaded if it was written for dataset_path, else written. Default: "", none.
+        shuffle(bool): shuffle the images every epoch. Default: False
+        num_shards(int): number of shards. Default: 1
+        shard_id(int): shard of this process. Default: 0
+        num_readers(int): threads reading image files. Default: 8
+        read_ahead(int): images read ahead of the consumer. Default: 64
     """
 
-    def __init__(self, dataset_path):
+    def __init__(self, dataset_path, manifest="", shuffle=False, num_shards=1, shard_id=0, num_readers=8,
+                 read_ahead=64):
         super(ImgDataset, self).__init__()
-        self.data = []
-        self.dir_label_dict = {}
-        self.img_format = (".bmp", ".png", ".jpg", ".jpeg")
+        self.dataset_path = os.path.realpath(dataset_path)
         self.dir_label = config.infer_label
-        dataset_list = sorted(os.listdir(dataset_path))
-        file_exist = dir_exist = False
-        for index, data_name in enumerate(dataset_list):
-            data_path = os.path.join(dataset_path, data_name)
-            if os.path.isdir(data_path):
-                dir_exist = True
-                self.dir_label_dict = self.get_file_label(data_name, data_path, index)
-            if os.path.isfile(data_path):
-                file_exist = True
-                self.dir_label_dict = self.get_file_label(data_name, data_path, index=-1)
-            if dir_exist and file_exist:
-                raise ValueError(f"{dataset_path} can not concurrently have image file and directory")
-
-        for data_name, img_label in self.dir_label_dict.items():
-            if os.path.isfile(data_name):
-                if not data_name.lower().endswith(self.img_format):
-                    continue
-                img_data, file_name = self.read_image_data(data_name)
-                self.data.append((img_label, img_data, file_name))
-            else:
-                for file in os.listdir(data_name):
-                    if not file.lower().endswith(self.img_format):
-                        continue
-                    file_path = os.path.join(data_name, file)
-                    img_data, file_name = self.read_image_data(file_path)
-                    self.data.append((img_label, img_data, file_name))
-
-    def get_file_label(self, data_name, data_path, index):
-        if self.dir_label and data_name not in self.dir_label:
-            return self.dir_label_dict
-        if self.dir_label and os.path.isdir(data_name):
-            data_path_name = os.path.split(data_path)[-1]
-            self.dir_label_dict[data_path] = self.dir_label[data_path_name]
-        else:
-            self.dir_label_dict[data_path] = index
-        return self.dir_label_dict
+        self.shuffle = shuffle
+        self.num_shards = num_shards
+        self.shard_id = shard_id
+        self.num_readers = num_readers
+        self.read_ahead = max(read_ahead, 1)
+        self.epoch = 0
+        key = json.dumps([self.dataset_path, self.dir_label or None])
+        if manifest and os.path.exists(manifest):
+            with np.load(manifest) as data:
+                if str(data["key"]) == key:
+                    self.names, self.offsets, self.labels = data["names"], data["offsets"], data["labels"]
+                    return
+        names, labels = list_images(self.dataset_path, self.dir_label)
+        encoded = [name.encode("utf-8") for name in names]
+        self.names = np.frombuffer(b"".join(encoded), np.uint8)
+        self.offsets = np.zeros(len(encoded) + 1, np.int64)
+        np.cumsum([len(name) for name in encoded], out=self.offsets[1:])
+        self.labels = np.array(labels, np.int32)
+        if manifest:
+            # write to a temporary file first, the manifest only exists once complete
+            with open(manifest + ".tmp", "wb") as f:
+                np.savez(f, key=np.array(key), names=self.names, offsets=self.offsets, labels=self.labels)
+            os.replace(manifest + ".tmp", manifest)
+
+    def file_name(self, index):
+        """relative path of image index"""
+        return self.names[self.offsets[index]:self.offsets[index + 1]].tobytes().decode("utf-8")
+
+    def read_image(self, index):
+        return np.fromfile(os.path.join(self.dataset_path, self.file_name(index)), np.uint8)
+
+    def _shard_indices(self):
+        """images of this shard for the next epoch, every shard draws the same permutation"""
+        indices = np.arange(self.labels.shape[0])
+        if self.shuffle:
+            indices = np.random.RandomState(ds.config.get_seed() + self.epoch).permutation(indices)
+        self.epoch += 1
+        return indices[self.shard_id::self.num_shards]
+
+    def __iter__(self):
+        with ThreadPoolExecutor(self.num_readers) as pool:
+            pending = collections.deque()
+            for index in self._shard_indices():
+                pending.append((index, pool.submit(self.read_image, index)))
+                if len(pending) >= self.read_ahead:
+                    index, image = pending.popleft()
+                    yield self.labels[index], image.result(), np.int32(index)
+            while pending:
+                index, image = pending.popleft()
+                yield self.labels[index], image.result(), np.int32(index)
 
-    def read_image_data(self, file_path):
-        file_name = os.path.split(file_path)[-1]
-        img_data = np.fromfile(file_path, np.uint8)
-        file_name = np.fromstring(file_name, np.uint8)
-        file_name = np.pad(file_name, (0, 300 - file_name.shape[0]))
-        return img_data, file_name
+    def __len__(self):
+        return len(range(self.shard_id, self.labels.shape[0], self.num_shards))
 
-    def __getitem__(self, index):
-        return self.data[index]
 
-    def __len__(self):
-        return len(self.data)
+def _create_generator_dataset(dataset_path, device_num, rank_id):
+    """
+    GeneratorDataset of the images of dataset_path, shuffled and sharded by ImgDataset so it can read ahead.
+    The ImgDataset is returned too, for the file names of the filename column.
+    """
+    dataset_generator = ImgDataset(dataset_path, manifest=config.infer_manifest, shuffle=True,
+                                   num_shards=device_num, shard_id=rank_id if device_num > 1 else 0)
+    data_set = ds.GeneratorDataset(source=dataset_generator, column_names=["label", "image", "filename"],
+                                   shuffle=False)
+    return data_set, dataset_generator
 
 
 def create_dataset(dataset_path, do_train, repeat_num=1, batch_size=32, target="Ascend", distribute=False):
@@ -113,15 +177,9 @@ def create_dataset(dataset_path, do_train, repeat_num=1, batch_size=32, target="
             device_num = get_group_size()
         else:
             device_num = 1
+            rank_id = 0
 
-    dataset_generator = ImgDataset(dataset_path)
-    if device_num == 1:
-        data_set = ds.GeneratorDataset(source=dataset_generator, column_names=["label", "image", "filename"],
-                                       num_parallel_workers=8, shuffle=True)
-    else:
-        data_set = ds.GeneratorDataset(source=dataset_generator, column_names=["label", "image", "filename"],
-                                       num_parallel_workers=8, shuffle=True,
-                                       num_shards=device_num, shard_id=rank_id)
+    data_set, dataset_generator = _create_generator_dataset(dataset_path, device_num, rank_id)
 
     image_size = 224
     # Computed from random subset of ImageNet training images
@@ -160,6 +218,8 @@ def create_dataset(dataset_path, do_train, repeat_num=1, batch_size=32, target="
 
     # apply dataset repeat operation
     data_set = data_set.repeat(repeat_num)
+    # maps the filename column to file names
+    data_set.file_name = dataset_generator.file_name
 
     return data_set
 
@@ -188,14 +248,7 @@ def create_dataset2(dataset_path, do_train, repeat_num=1, batch_size=32, target=
         else:
             device_num = 1
             rank_id = 1
-    dataset_generator = ImgDataset(dataset_path)
-    if device_num == 1:
-        data_set = ds.GeneratorDataset(source=dataset_generator, column_names=["label", "image", "filename"],
-                                       num_parallel_workers=8, shuffle=True)
-    else:
-        data_set = ds.GeneratorDataset(source=dataset_generator, column_names=["label", "image", "filename"],
-                                       num_parallel_workers=8, shuffle=True,
-                                       num_shards=device_num, shard_id=rank_id)
+    data_set, dataset_generator = _create_generator_dataset(dataset_path, device_num, rank_id)
     image_size = 224
     mean = [0.475 * 255, 0.451 * 255, 0.392 * 255]
     std = [0.275 * 255, 0.267 * 255, 0.278 * 255]
@@ -229,6 +282,8 @@ def create_dataset2(dataset_path, do_train, repeat_num=1, batch_size=32, target=
     data_set = data_set.batch(batch_size, drop_remainder=True)
     # apply dataset repeat operation
     data_set = data_set.repeat(repeat_num)
+    # maps the filename column to file names
+    data_set.file_name = dataset_generator.file_name
 
     return data_set
 
@@ -257,14 +312,8 @@ def create_dataset3(dataset_path, do_train, repeat_num=1, batch_size=32, target=
             device_num = get_group_size()
         else:
             device_num = 1
-    dataset_generator = ImgDataset(dataset_path)
-    if device_num == 1:
-        data_set = ds.GeneratorDataset(source=dataset_generator, column_names=["label", "image", "filename"],
-                                       num_parallel_workers=8, shuffle=True)
-    else:
-        data_set = ds.GeneratorDataset(source=dataset_generator, column_names=["label", "image", "filename"],
-                                       num_parallel_workers=8, shuffle=True,
-                                       num_shards=device_num, shard_id=rank_id)
+            rank_id = 0
+    data_set, dataset_generator = _create_generator_dataset(dataset_path, device_num, rank_id)
     image_size = 224
     # Computed from random subset of ImageNet training images
     mean = [123.68, 116.78, 103.94]
@@ -299,6 +348,8 @@ def create_dataset3(dataset_path, do_train, repeat_num=1, batch_size=32, target=
 
     # apply dataset repeat operation
     data_set = data_set.repeat(repeat_num)
+    # maps the filename column to file names
+    data_set.file_name = dataset_generator.file_name
 
     return data_set
 
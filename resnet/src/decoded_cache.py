@@ -0,0 +1,183 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+Local cache of decoded training images.
+
+The images of a shard are decoded once, downscaled to a bounded short side and stored as uint8 HWC arrays one after
+the other in a single file, which later epochs and runs read through a memory map instead of decoding the JPEG again.
+The store of a shard is two files: the image data and an index of offsets, shapes and labels, written last so that
+a store only exists once complete. The index also holds the number and the latest modification time of the images,
+a store whose images changed since is built again.
+"""
+
+import collections
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import mindspore.dataset as ds
+
+
+def list_image_folder(dataset_path, img_format=(".bmp", ".png", ".jpg", ".jpeg")):
+    """
+    images of the class directories of dataset_path, labeled like ImageFolderDataset labels them
+
+    Returns:
+        paths of the images, labels
+    """
+    paths, labels = [], []
+    class_names = sorted(name for name in os.listdir(dataset_path)
+                         if os.path.isdir(os.path.join(dataset_path, name)))
+    for label, class_name in enumerate(class_names):
+        class_path = os.path.join(dataset_path, class_name)
+        for file in sorted(os.listdir(class_path)):
+            if file.lower().endswith(img_format):
+                paths.append(os.path.join(class_path, file))
+                labels.append(label)
+    return paths, labels
+
+
+def image_fingerprint(paths):
+    """number of the images and their latest modification time in ns"""
+    return np.array([len(paths), max(os.stat(path).st_mtime_ns for path in paths)], np.int64)
+
+
+class DecodedImageSource:
+    """
+    Random access source of GeneratorDataset over the store of one shard, yields image and label.
+
+    Args:
+        prefix(string): path of the store without extension.
+    """
+
+    def __init__(self, prefix):
+        with np.load(prefix + ".npz") as index:
+            self.offsets = index["offsets"]
+            self.shapes = index["shapes"]
+            self.labels = index["labels"]
+        self.data_file = prefix + ".u8"
+        self.data = None
+
+    def __getitem__(self, index):
+        # mapped on first use, in the process that reads
+        if self.data is None:
+            self.data = np.memmap(self.data_file, np.uint8, mode="r")
+        shape = self.shapes[index]
+        start = self.offsets[index]
+        image = np.array(self.data[start:start + int(np.prod(shape))]).reshape(shape)
+        return image, self.labels[index]
+
+    def __len__(self):
+        return self.labels.shape[0]
+
+
+class DecodedImageCache:
+    """
+    Store of the decoded training images on a local disk, built for a shard the first time the shard is used.
+
+    Args:
+        cache_dir(string): directory of the stores, on a local SSD.
+        short_side(int): images are downscaled to this short side, smaller images are kept as they are. Default: 256
+        num_decoders(int): threads decoding images while a store is built. Default: 8
+        read_ahead(int): images decoded ahead of the writer while a store is built. Default: 256
+    """
+
+    def __init__(self, cache_dir, short_side=256, num_decoders=8, read_ahead=256):
+        self.cache_dir = cache_dir
+        self.short_side = short_side
+        self.num_decoders = max(num_decoders, 1)
+        self.read_ahead = max(read_ahead, 1)
+
+    def store_prefix(self, dataset_path, num_shards=1, shard_id=0):
+        """path without extension of the store of a shard of dataset_path"""
+        digest = hashlib.md5(os.path.realpath(dataset_path).encode("utf-8")).hexdigest()[:12]
+        return os.path.join(self.cache_dir, "decoded_{}_{}_{}_of_{}".format(digest, self.short_side, shard_id,
+                                                                            num_shards))
+
+    def decode(self, path):
+        """decoded RGB image of path, downscaled to short_side"""
+        image = ds.vision.Decode()(np.fromfile(path, np.uint8))
+        if min(image.shape[0], image.shape[1]) > self.short_side:
+            image = ds.vision.Resize(self.short_side, ds.vision.Inter.AREA)(image)
+        return np.ascontiguousarray(image, np.uint8)
+
+    def build(self, dataset_path, num_shards=1, shard_id=0):
+        """
+        build the store of a shard unless it exists for the same images
+
+        Returns:
+            the path without extension of the store
+        """
+        prefix = self.store_prefix(dataset_path, num_shards, shard_id)
+        paths, labels = list_image_folder(dataset_path)
+        paths, labels = paths[shard_id::num_shards], labels[shard_id::num_shards]
+        if not paths:
+            raise ValueError("{} has no image for shard {} of {}.".format(dataset_path, shard_id, num_shards))
+        fingerprint = image_fingerprint(paths)
+        if os.path.exists(prefix + ".npz"):
+            with np.load(prefix + ".npz") as index:
+                if "fingerprint" in index.files and np.array_equal(index["fingerprint"], fingerprint):
+                    return prefix
+            print("the images of {} changed since the decoded image cache was built".format(dataset_path), flush=True)
+            # the stale index goes first, the store then only exists again once the new index is in place
+            os.remove(prefix + ".npz")
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+        offsets = np.zeros(len(paths), np.int64)
+        shapes = np.zeros((len(paths), 3), np.int32)
+        start = time.time()
+        print("building the decoded image cache of {} images at {}".format(len(paths), prefix), flush=True)
+        with open(prefix + ".u8.tmp", "wb") as f, ThreadPoolExecutor(self.num_decoders) as pool:
+            pending = collections.deque()
+            written = 0
+
+            def write():
+                index, image = pending.popleft()
+                image = image.result()
+                if image.ndim == 2:
+                    image = np.repeat(image[:, :, None], 3, axis=2)
+                offsets[index] = f.tell()
+                shapes[index] = image.shape
+                f.write(image.tobytes())
+                return index + 1
+
+            for index, path in enumerate(paths):
+                pending.append((index, pool.submit(self.decode, path)))
+                if len(pending) >= self.read_ahead:
+                    written = write()
+                    if written % 10000 == 0:
+                        print("decoded {} of {} images, {:.0f} s".format(written, len(paths), time.time() - start),
+                              flush=True)
+            while pending:
+                write()
+        # the index is the last file in place, a store with an index is complete
+        os.replace(prefix + ".u8.tmp", prefix + ".u8")
+        with open(prefix + ".npz.tmp", "wb") as f:
+            np.savez(f, offsets=offsets, shapes=shapes, labels=np.array(labels, np.int32), fingerprint=fingerprint)
+        os.replace(prefix + ".npz.tmp", prefix + ".npz")
+        print("built the decoded image cache in {:.0f} s".format(time.time() - start), flush=True)
+        return prefix
+
+    def dataset(self, dataset_path, num_shards=1, shard_id=0, num_parallel_workers=8, shuffle=True):
+        """
+        dataset of image and label columns of the decoded images of a shard, built first if needed
+
+        The shard is fixed: it is the same images every epoch, shuffled within the shard.
+        """
+        source = DecodedImageSource(self.build(dataset_path, num_shards, shard_id))
+        return ds.GeneratorDataset(source, column_names=["image", "label"], num_parallel_workers=num_parallel_workers,
+                                   shuffle=shuffle, python_multiprocessing=False)
@@ -14,10 +14,13 @@
 # ============================================================================
 """Evaluation callback when training"""
 
+import multiprocessing
 import os
+import queue
 import stat
 import time
-from mindspore import save_checkpoint
+import traceback
+from mindspore import Tensor, save_checkpoint
 from mindspore import log as logger
 from mindspore.train.callback import Callback
 
@@ -93,3 +96,158 @@ class EvalCallBack(Callback):
         print("End training, the best {0} is: {1}, the best {0} epoch is {2}".format(self.metrics_name,
                                                                                      self.best_res,
                                                                                      self.best_epoch), flush=True)
+
+
+def _async_eval_worker(build_eval_function, tasks, results, save_best_ckpt, best_ckpt_path, best_res=None):
+    """
+    Evaluate the weight snapshots of tasks in order and put (epoch, result, eval_cost, saved, error) to results.
+    The best checkpoint is written to a temporary file that replaces best_ckpt_path once complete, best_res is the
+    result of the checkpoint already there, None if there is none.
+    """
+    eval_function = build_eval_function()
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        epoch, param_dict = task
+        eval_start = time.time()
+        try:
+            res = eval_function(param_dict)
+        except Exception:  # pylint: disable=broad-except
+            results.put((epoch, None, time.time() - eval_start, False, traceback.format_exc()))
+            continue
+        saved = False
+        if save_best_ckpt and (best_res is None or res >= best_res):
+            best_res = res
+            # save_checkpoint appends .ckpt to other names
+            tmp_path = best_ckpt_path + ".tmp.ckpt"
+            save_checkpoint([{"name": name, "data": Tensor(value)} for name, value in param_dict.items()], tmp_path)
+            os.replace(tmp_path, best_ckpt_path)
+            saved = True
+        results.put((epoch, res, time.time() - eval_start, saved, None))
+
+
+class AsyncEvalCallBack(Callback):
+    """
+    Evaluation callback that does not stop training.
+
+    At an evaluation epoch the weights of network are copied to host memory and sent to a worker process, which
+    evaluates them on its own device or the CPU and writes the best checkpoint. Results are printed as they come
+    back, at the following epoch ends, and all of them are waited for at the end of training.
+
+    Args:
+        network (Cell): network whose weights are evaluated.
+        build_eval_function (function): picklable function, e.g. defined at module level, called once in the worker
+            process. It sets the context of the worker and returns an evaluation function of a dict of parameter
+            name to numpy array.
+        interval (int): run evaluation interval, default is 1.
+        eval_start_epoch (int): evaluation start epoch, default is 1.
+        save_best_ckpt (bool): Whether to save best checkpoint, default is True.
+        best_ckpt_name (str): best checkpoint name, default is `best.ckpt`.
+        metrics_name (str): evaluation metrics name, default is `acc`.
+        max_pending (int): snapshots waiting for the worker at most, evaluations beyond are skipped, default is 1.
+
+    Returns:
+        None
+
+    Examples:
+        >>> AsyncEvalCallBack(net, build_eval_function)
+    """
+
+    def __init__(self, network, build_eval_function, interval=1, eval_start_epoch=1, save_best_ckpt=True,
+                 ckpt_directory="./", best_ckpt_name="best.ckpt", metrics_name="acc", max_pending=1):
+        super(AsyncEvalCallBack, self).__init__()
+        if interval < 1:
+            raise ValueError("interval should >= 1.")
+        self.network = network
+        self.build_eval_function = build_eval_function
+        self.interval = interval
+        self.eval_start_epoch = eval_start_epoch
+        self.save_best_ckpt = save_best_ckpt
+        if not os.path.isdir(ckpt_directory):
+            os.makedirs(ckpt_directory)
+        self.best_ckpt_path = os.path.join(ckpt_directory, best_ckpt_name)
+        self.metrics_name = metrics_name
+        self.max_pending = max(max_pending, 1)
+        self.best_res = 0
+        self.best_epoch = 0
+        self.history = []
+        self.pending = 0
+        self.worker = None
+        self.tasks = None
+        self.results = None
+
+    def _start_worker(self):
+        # spawn, the worker initializes its own device. A restarted worker only replaces the best checkpoint of the
+        # previous one with a better result
+        ctx = multiprocessing.get_context("spawn")
+        self.tasks = ctx.Queue()
+        self.results = ctx.Queue()
+        self.worker = ctx.Process(target=_async_eval_worker,
+                                  args=(self.build_eval_function, self.tasks, self.results, self.save_best_ckpt,
+                                        self.best_ckpt_path, self.best_res if self.history else None),
+                                  daemon=True)
+        self.worker.start()
+
+    def _check_worker(self):
+        """forget the evaluations of a worker that died, the next evaluation starts a new one"""
+        if self.worker is None or self.worker.is_alive():
+            return
+        self.poll()
+        if self.pending > 0:
+            logger.warning("evaluation worker exited with code %s, %s evaluations are lost, restart it.",
+                           self.worker.exitcode, self.pending)
+        self.pending = 0
+        self.worker = None
+
+    def poll(self, block=False):
+        """print and record the results that came back"""
+        while self.pending > 0:
+            try:
+                epoch, res, eval_cost, saved, error = self.results.get(block=block, timeout=10 if block else None)
+            except queue.Empty:
+                if block and self.worker.is_alive():
+                    continue
+                if block:
+                    logger.warning("evaluation worker exited with %s evaluations pending.", self.pending)
+                    self.pending = 0
+                return
+            self.pending -= 1
+            if error is not None:
+                logger.warning("evaluation of epoch %s failed:\n%s", epoch, error)
+                continue
+            self.history.append((epoch, res))
+            print("epoch: {}, {}: {}, eval_cost:{:.2f}".format(epoch, self.metrics_name, res, eval_cost), flush=True)
+            if res >= self.best_res:
+                self.best_res = res
+                self.best_epoch = epoch
+                print("update best result: {}".format(res), flush=True)
+            if saved:
+                print("update best checkpoint at: {}".format(self.best_ckpt_path), flush=True)
+
+    def epoch_end(self, run_context):
+        """Callback when epoch end."""
+        self.poll()
+        cb_params = run_context.original_args()
+        cur_epoch = cb_params.cur_epoch_num
+        if cur_epoch < self.eval_start_epoch or (cur_epoch - self.eval_start_epoch) % self.interval != 0:
+            return
+        self._check_worker()
+        if self.pending >= self.max_pending:
+            logger.warning("evaluation worker is busy, skip the evaluation of epoch %s.", cur_epoch)
+            return
+        if self.worker is None:
+            self._start_worker()
+        snapshot = {param.name: param.asnumpy() for param in self.network.get_parameters()}
+        self.tasks.put((cur_epoch, snapshot))
+        self.pending += 1
+
+    def end(self, run_context):
+        if self.worker is not None:
+            self.poll(block=True)
+            self.tasks.put(None)
+            self.worker.join()
+            self.worker = None
+        print("End training, the best {0} is: {1}, the best {0} epoch is {2}".format(self.metrics_name,
+                                                                                     self.best_res,
+                                                                                     self.best_epoch), flush=True)
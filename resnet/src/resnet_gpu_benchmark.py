@@ -42,35 +42,40 @@ def _weight_variable(shape, factor=0.01):
     return Tensor(init_value)
 
 
-def _conv3x3(in_channel, out_channel, stride=1):
+def _conv3x3(in_channel, out_channel, stride=1, data_format=None):
+    data_format = data_format or format_
     weight_shape = (out_channel, 3, 3, in_channel)
-    weight_shape = _trans_shape(weight_shape, format_)
+    weight_shape = _trans_shape(weight_shape, data_format)
     weight = _weight_variable(weight_shape)
     return nn.Conv2d(in_channel, out_channel, kernel_size=3, stride=stride,
-                     padding=1, pad_mode='pad', weight_init=weight, data_format=format_)
+                     padding=1, pad_mode='pad', weight_init=weight, data_format=data_format)
 
-def _conv1x1(in_channel, out_channel, stride=1):
+def _conv1x1(in_channel, out_channel, stride=1, data_format=None):
+    data_format = data_format or format_
     weight_shape = (out_channel, 1, 1, in_channel)
-    weight_shape = _trans_shape(weight_shape, format_)
+    weight_shape = _trans_shape(weight_shape, data_format)
     weight = _weight_variable(weight_shape)
     return nn.Conv2d(in_channel, out_channel, kernel_size=1, stride=stride,
-                     padding=0, pad_mode='pad', weight_init=weight, data_format=format_)
+                     padding=0, pad_mode='pad', weight_init=weight, data_format=data_format)
 
-def _conv7x7(in_channel, out_channel, stride=1):
+def _conv7x7(in_channel, out_channel, stride=1, data_format=None):
+    data_format = data_format or format_
     weight_shape = (out_channel, 7, 7, in_channel)
-    weight_shape = _trans_shape(weight_shape, format_)
+    weight_shape = _trans_shape(weight_shape, data_format)
     weight = _weight_variable(weight_shape)
     return nn.Conv2d(in_channel, out_channel, kernel_size=7, stride=stride,
-                     padding=3, pad_mode='pad', weight_init=weight, data_format=format_)
+                     padding=3, pad_mode='pad', weight_init=weight, data_format=data_format)
 
 
-def _bn(channel):
+def _bn(channel, data_format=None):
     return nn.BatchNorm2d(channel, eps=1e-4, momentum=0.9, gamma_init=1, beta_init=0,
-                          moving_mean_init=0, moving_var_init=1, data_format=format_)
+                          moving_mean_init=0, moving_var_init=1,
+                          data_format=data_format or format_)
 
-def _bn_last(channel):
+def _bn_last(channel, data_format=None):
     return nn.BatchNorm2d(channel, eps=1e-4, momentum=0.9, gamma_init=0, beta_init=0,
-                          moving_mean_init=0, moving_var_init=1, data_format=format_)
+                          moving_mean_init=0, moving_var_init=1,
+                          data_format=data_format or format_)
 
 def _fc(in_channel, out_channel):
     weight_shape = (out_channel, in_channel)
@@ -86,6 +91,7 @@ class ResidualBlock(nn.Cell):
         in_channel (int): Input channel.
         out_channel (int): Output channel.
         stride (int): Stride size for the first convolutional layer. Default: 1.
+        data_format (str): NHWC or NCHW. Default: None, the module format.
 
     Returns:
         Tensor, output tensor.
@@ -98,17 +104,18 @@ class ResidualBlock(nn.Cell):
     def __init__(self,
                  in_channel,
                  out_channel,
-                 stride=1):
+                 stride=1,
+                 data_format=None):
         super(ResidualBlock, self).__init__()
         self.stride = stride
         channel = out_channel // self.expansion
-        self.conv1 = _conv1x1(in_channel, channel, stride=1)
-        self.bn1 = _bn(channel)
-        self.conv2 = _conv3x3(channel, channel, stride=stride)
-        self.bn2 = _bn(channel)
+        self.conv1 = _conv1x1(in_channel, channel, stride=1, data_format=data_format)
+        self.bn1 = _bn(channel, data_format)
+        self.conv2 = _conv3x3(channel, channel, stride=stride, data_format=data_format)
+        self.bn2 = _bn(channel, data_format)
 
-        self.conv3 = _conv1x1(channel, out_channel, stride=1)
-        self.bn3 = _bn_last(out_channel)
+        self.conv3 = _conv1x1(channel, out_channel, stride=1, data_format=data_format)
+        self.bn3 = _bn_last(out_channel, data_format)
         self.relu = nn.ReLU()
 
         self.down_sample = False
@@ -118,7 +125,8 @@ class ResidualBlock(nn.Cell):
         self.down_sample_layer = None
 
         if self.down_sample:
-            self.down_sample_layer = nn.SequentialCell([_conv1x1(in_channel, out_channel, stride), _bn(out_channel)])
+            self.down_sample_layer = nn.SequentialCell([_conv1x1(in_channel, out_channel, stride, data_format),
+                                                    _bn(out_channel, data_format)])
         self.add = P.Add()
 
     def construct(self, x):
@@ -152,6 +160,7 @@ class ResNet(nn.Cell):
         out_channels (list): Output channel in each layer.
         strides (list):  Stride size in each layer.
         num_classes (int): The number of classes that the training images are belonging to.
+        data_format (str): NHWC or NCHW. Default: None, the module format.
     Returns:
         Tensor, output tensor.
 
@@ -170,18 +179,20 @@ class ResNet(nn.Cell):
                  in_channels,
                  out_channels,
                  strides,
-                 num_classes):
+                 num_classes,
+                 data_format=None):
         super(ResNet, self).__init__()
 
         if not len(layer_nums) == len(in_channels) == len(out_channels) == 4:
             raise ValueError("the length of layer_num, in_channels, out_channels list must be 4!")
+        self.data_format = data_format or format_
         input_data_channel = 4
-        if format_ == "NCHW":
+        if self.data_format == "NCHW":
             input_data_channel = 3
-        self.conv1 = _conv7x7(input_data_channel, 64, stride=2)
-        self.bn1 = _bn(64)
+        self.conv1 = _conv7x7(input_data_channel, 64, stride=2, data_format=self.data_format)
+        self.bn1 = _bn(64, self.data_format)
         self.relu = P.ReLU()
-        self.maxpool = nn.MaxPool2d(kernel_size=3, stride=2, pad_mode="same", data_format=format_)
+        self.maxpool = nn.MaxPool2d(kernel_size=3, stride=2, pad_mode="same", data_format=self.data_format)
         self.layer1 = self._make_layer(block,
                                        layer_nums[0],
                                        in_channel=in_channels[0],
@@ -203,7 +214,7 @@ class ResNet(nn.Cell):
                                        out_channel=out_channels[3],
                                        stride=strides[3])
 
-        self.avg_pool = P.AvgPool(7, 1, data_format=format_)
+        self.avg_pool = P.AvgPool(7, 1, data_format=self.data_format)
         self.flatten = nn.Flatten()
         self.end_point = _fc(out_channels[3], num_classes)
 
@@ -225,10 +236,10 @@ class ResNet(nn.Cell):
         """
         layers = []
 
-        resnet_block = block(in_channel, out_channel, stride=stride)
+        resnet_block = block(in_channel, out_channel, stride=stride, data_format=self.data_format)
         layers.append(resnet_block)
         for _ in range(1, layer_num):
-            resnet_block = block(out_channel, out_channel, stride=1)
+            resnet_block = block(out_channel, out_channel, stride=1, data_format=self.data_format)
             layers.append(resnet_block)
         return nn.SequentialCell(layers)
 
@@ -250,12 +261,14 @@ class ResNet(nn.Cell):
         return out
 
 
-def resnet50(class_num=1001, dtype="fp16"):
+def resnet50(class_num=1001, dtype="fp16", data_format=None):
     """
     Get ResNet50 neural network.
 
     Args:
         class_num (int): Class number.
+        dtype (str): fp16 or fp32, fp32 switches the module format to NCHW.
+        data_format (str): NHWC or NCHW of this network only, the module format is left as is. Default: None.
 
     Returns:
         Cell, cell instance of ResNet50 neural network.
@@ -264,11 +277,12 @@ def resnet50(class_num=1001, dtype="fp16"):
         >>> net = resnet50(1001)
     """
     global format_
-    if dtype == "fp32":
+    if data_format is None and dtype == "fp32":
         format_ = "NCHW"
     return ResNet(ResidualBlock,
                   [3, 4, 6, 3],
                   [64, 256, 512, 1024],
                   [256, 512, 1024, 2048],
                   [1, 2, 2, 2],
-                  class_num)
+                  class_num,
+                  data_format=data_format)
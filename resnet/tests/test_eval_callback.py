@@ -0,0 +1,84 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""worker restarts of AsyncEvalCallBack"""
+
+import os
+import types
+
+import numpy as np
+import pytest
+
+ms = pytest.importorskip("mindspore")
+
+from src.eval_callback import AsyncEvalCallBack  # pylint: disable=wrong-import-position
+
+
+def _evaluate(param_dict):
+    """the result is the weight, a negative weight kills the worker"""
+    res = float(param_dict["w"][0])
+    if res < 0:
+        os._exit(1)
+    return res
+
+
+def build_evaluate():
+    return _evaluate
+
+
+class _Param:
+    def __init__(self, network):
+        self.name = "w"
+        self.network = network
+
+    def asnumpy(self):
+        return np.array([self.network.weight], np.float32)
+
+
+class _Network:
+    def __init__(self):
+        self.weight = 0.0
+
+    def get_parameters(self):
+        return [_Param(self)]
+
+
+def _run_context(epoch):
+    return types.SimpleNamespace(original_args=lambda: types.SimpleNamespace(cur_epoch_num=epoch))
+
+
+def test_restarted_worker_keeps_best_checkpoint(tmp_path):
+    """a worse result of the restarted worker does not replace the best checkpoint of the dead one"""
+    network = _Network()
+    callback = AsyncEvalCallBack(network, build_evaluate, ckpt_directory=str(tmp_path),
+                                 best_ckpt_name="best_acc.ckpt")
+    best_ckpt_path = os.path.join(str(tmp_path), "best_acc.ckpt")
+
+    network.weight = 0.9
+    callback.epoch_end(_run_context(1))
+    callback.poll(block=True)
+    assert os.path.exists(best_ckpt_path)
+
+    network.weight = -1.0
+    callback.epoch_end(_run_context(2))
+    callback.worker.join(timeout=120)
+    assert not callback.worker.is_alive()
+
+    network.weight = 0.5
+    callback.epoch_end(_run_context(3))
+    callback.end(_run_context(3))
+
+    assert callback.history == [(1, pytest.approx(0.9)), (3, pytest.approx(0.5))]
+    assert callback.best_res == pytest.approx(0.9)
+    assert float(ms.load_checkpoint(best_ckpt_path)["w"].asnumpy()[0]) == pytest.approx(0.9)
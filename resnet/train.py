@@ -15,6 +15,7 @@
 """train resnet."""
 import datetime
 import glob
+import multiprocessing
 import os
 import numpy as np
 
@@ -35,7 +36,9 @@ import mindspore.log as logger
 
 from src.lr_generator import get_lr, warmup_cosine_annealing_lr
 from src.CrossEntropySmooth import CrossEntropySmooth
-from src.eval_callback import EvalCallBack
+from src.eval_callback import EvalCallBack, AsyncEvalCallBack
+from src.dataset_autotune import autotune_pipeline, print_report
+from src.decoded_cache import DecodedImageCache
 from src.metric import DistAccuracy, ClassifyCorrectCell
 from src.model_utils.config import config
 from src.model_utils.moxing_adapter import moxing_wrapper
@@ -119,6 +122,24 @@ def apply_eval(eval_param):
     return res[metrics_name]
 
 
+def build_async_eval():
+    """evaluation function of the AsyncEvalCallBack worker process, on eval_device_target"""
+    # the worker is a single device process, also in distributed training
+    os.environ["RANK_SIZE"] = "1"
+    ms.set_context(mode=ms.GRAPH_MODE, device_target=config.eval_device_target, device_id=config.eval_device_id)
+    eval_dataset = create_dataset(dataset_path=config.eval_dataset_path, do_train=False,
+                                  batch_size=config.batch_size, train_image_size=config.train_image_size,
+                                  eval_image_size=config.eval_image_size, target=config.eval_device_target)
+    net = resnet(class_num=config.class_num)
+    model = Model(net, loss_fn=init_loss_scale(), metrics={"acc"})
+
+    def eval_function(param_dict):
+        params = {name: ms.Parameter(Tensor(value), name=name) for name, value in param_dict.items()}
+        ms.load_param_into_net(net, params)
+        return model.eval(eval_dataset)["acc"]
+    return eval_function
+
+
 def set_graph_kernel_context(run_platform, net_name):
     if run_platform == "GPU" and net_name == "resnet101":
         ms.set_context(enable_graph_kernel=True)
@@ -277,11 +298,19 @@ def init_group_params(net):
     return group_params
 
 
-def run_eval(target, model, ckpt_save_dir, cb):
+def run_eval(target, model, ckpt_save_dir, cb, net=None):
     """run_eval"""
     if config.run_eval:
         if config.eval_dataset_path is None or (not os.path.isdir(config.eval_dataset_path)):
             raise ValueError("{} is not a existing path.".format(config.eval_dataset_path))
+        if config.eval_async:
+            # one worker evaluates the weights of rank 0, the ranks hold the same weights
+            if not config.run_distribute or get_rank() == 0:
+                cb += [AsyncEvalCallBack(net, build_async_eval, interval=config.eval_interval,
+                                         eval_start_epoch=config.eval_start_epoch,
+                                         save_best_ckpt=config.save_best_ckpt, ckpt_directory=ckpt_save_dir,
+                                         best_ckpt_name="best_acc.ckpt", metrics_name="acc")]
+            return
         eval_dataset = create_dataset(dataset_path=config.eval_dataset_path, do_train=False,
                                       batch_size=config.batch_size, train_image_size=config.train_image_size,
                                       eval_image_size=config.eval_image_size,
@@ -306,16 +335,42 @@ def set_save_ckpt_dir():
     return ckpt_save_dir
 
 
+def get_host_cores():
+    """cores of the host for the pipeline of this device, the devices of a host, at most 8, share its cores"""
+    return max(multiprocessing.cpu_count() // min(get_device_num(), 8), 1)
+
+
+def create_decoded_cache():
+    """decoded image cache of the training images, None if not enabled"""
+    if not config.decoded_cache_dir:
+        return None
+    return DecodedImageCache(config.decoded_cache_dir, short_side=config.decoded_cache_short_side,
+                             num_decoders=get_host_cores())
+
+
+def autotune_dataset(target, decoded_cache):
+    """tune the worker counts and prefetch size of the training pipeline for this host"""
+    report = autotune_pipeline(create_dataset, dataset_path=config.data_path, do_train=True,
+                               batch_size=config.batch_size, train_image_size=config.train_image_size,
+                               eval_image_size=config.eval_image_size, target=target, num_cores=get_host_cores(),
+                               num_batches=config.dataset_autotune_batches, distribute=config.run_distribute,
+                               decoded_cache=decoded_cache)
+    print_report(report)
+
+
 @moxing_wrapper()
 def train_net():
     """train net"""
     target = config.device_target
     set_parameter()
     ckpt_param_dict = load_pre_trained_checkpoint()
+    decoded_cache = create_decoded_cache()
+    if config.dataset_autotune:
+        autotune_dataset(target, decoded_cache)
     dataset = create_dataset(dataset_path=config.data_path, do_train=True,
                              batch_size=config.batch_size, train_image_size=config.train_image_size,
                              eval_image_size=config.eval_image_size, target=target,
-                             distribute=config.run_distribute)
+                             distribute=config.run_distribute, decoded_cache=decoded_cache)
     step_size = dataset.get_dataset_size()
     net = resnet(class_num=config.class_num)
     if config.parameter_server:
@@ -368,7 +423,7 @@ def train_net():
                                      append_info=ckpt_append_info)
         ckpt_cb = ModelCheckpoint(prefix="resnet", directory=ckpt_save_dir, config=config_ck)
         cb += [ckpt_cb]
-    run_eval(target, model, ckpt_save_dir, cb)
+    run_eval(target, model, ckpt_save_dir, cb, net)
     # train model
     if config.net_name == "se-resnet50":
         config.epoch_size = config.train_epoch_size